@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+
+Measures the throughput of the backup listing over a synthetic catalog. By default the listing
+path of the /api/backup endpoint (loading the Backupset objects from the database documents and
+serialising the pages to JSON) is run in-process over the generated documents, which measures
+the listing without a database. The memory held by the loaded Backupset objects is reported as
+well. With --url the pages are requested from a running node instead, its catalog is used as is.
+
+Usage: python3 benchmarks/catalog_listing.py [--backups 100000] [--partitions 4] [--page-size 1000]
+           [--fields id,status,backup_size] [--url http://node:5000]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from time import monotonic
+from urllib.parse import urlencode, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+
+def synthetic_documents(count, partitions):
+    created = datetime(2016, 4, 10)
+    for index in range(count):
+        yield {
+            'id': 'backup-' + str(index).zfill(7),
+            'node': 'node' + str(index % 4),
+            'backup_path': '/backup/backup-' + str(index).zfill(7) + '/',
+            'disk_layout': 'GPT',
+            'status': 'finished' if index % 10 else 'error',
+            'deleted': index % 7 == 0,
+            'purged': False,
+            'compressed': bool(index % 2),
+            'backup_size': 1000000 * index,
+            'disk_size': 500107862016,
+            'deletion_date': '',
+            'creation_date': created - timedelta(seconds=index),
+            'purge_date': '',
+            'partitions': [{'partition': str(number), 'fs': 'ext4', 'size': 1 << 30,
+                            'resources': {'cpu_percent': 12.5, 'read_bytes': 1 << 30},
+                            'throughput': 104857600} for number in range(1, partitions + 1)],
+        }
+
+
+def list_in_process(args, fields):
+    from api.resources.backup import _serialise_value
+    from core.backupset import Backupset
+    documents = list(synthetic_documents(args.backups, args.partitions))
+    start = monotonic()
+    size = 0
+    for offset in range(0, len(documents), args.page_size):
+        backupsets = [Backupset._from_json(document) for document in documents[offset:offset + args.page_size]]
+        payload = {'backups': [backupset.to_dict(fields) for backupset in backupsets]}
+        size += len(json.dumps(payload, separators=(',', ':'), default=_serialise_value))
+    elapsed = monotonic() - start
+    tracemalloc.start()
+    backupsets = [Backupset._from_json(document) for document in documents]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('Loaded objects: {:.0f} bytes per backup'.format(memory / len(backupsets)))
+    return len(documents), size, elapsed
+
+
+def list_over_http(args, fields):
+    url = urlparse(args.url)
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80)
+    query = {'limit': args.page_size}
+    if fields:
+        query['fields'] = ','.join(fields)
+    count = 0
+    size = 0
+    start = monotonic()
+    while True:
+        connection.request('GET', '/api/backup?' + urlencode(query))
+        body = connection.getresponse().read()
+        page = json.loads(body.decode('utf-8'))
+        count += len(page['backups'])
+        size += len(body)
+        if not page['next_cursor'] or count >= args.backups:
+            break
+        query['cursor'] = page['next_cursor']
+    elapsed = monotonic() - start
+    connection.close()
+    print('Source: ' + page['source'])
+    return count, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the throughput of the backup listing.')
+    parser.add_argument('--backups', type=int, default=100000, help='number of the backups to be listed')
+    parser.add_argument('--partitions', type=int, default=4, help='number of the partitions per synthetic backup')
+    parser.add_argument('--page-size', type=int, default=1000, help='number of the backups per page')
+    parser.add_argument('--fields', default='', help='comma separated list of the fields to be listed')
+    parser.add_argument('--url', help='base URL of the node to be queried instead of the in-process listing')
+    args = parser.parse_args()
+    fields = [field for field in args.fields.split(',') if field] or None
+    count, size, elapsed = list_over_http(args, fields) if args.url else list_in_process(args, fields)
+    print('Listed {} backups ({:.1f} MB of JSON) in {:.2f} s: {:.0f} backups/s'.format(
+        count, size / 1048576, elapsed, count / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+
+Measures the latency of the status endpoints polled by the dashboards. Each simulated client
+polls the selected endpoints over its own keep-alive connection, the latencies of all requests
+are reported as percentiles per endpoint.
+
+Usage: python3 benchmarks/load_test.py http://node:5000 [--clients 300] [--interval 1]
+           [--duration 60] [--endpoint /api/job --endpoint /api/metric]
+"""
+
+import argparse
+import http.client
+import random
+import threading
+from time import monotonic, sleep
+from urllib.parse import urlparse
+
+DEFAULT_ENDPOINTS = ['/api/job', '/api/metric']
+
+
+class Poller(threading.Thread):
+
+    def __init__(self, url, endpoints, interval, deadline, results, lock):
+        super().__init__(daemon=True)
+        self.url = url
+        self.endpoints = endpoints
+        self.interval = interval
+        self.deadline = deadline
+        self.results = results
+        self.lock = lock
+        self.connection = None
+
+    def run(self):
+        sleep(random.uniform(0, self.interval))  # Spread the clients over the interval
+        next_poll = monotonic()
+        while monotonic() < self.deadline:
+            for endpoint in self.endpoints:
+                latency = self.request(endpoint)
+                with self.lock:
+                    self.results[endpoint].append(latency)
+            next_poll += self.interval
+            sleep(max(next_poll - monotonic(), 0))
+        if self.connection:
+            self.connection.close()
+
+    def request(self, endpoint):
+        start = monotonic()
+        try:
+            if not self.connection:
+                self.connection = http.client.HTTPConnection(self.url.hostname, self.url.port or 80,
+                                                             timeout=30)
+            self.connection.request('GET', endpoint)
+            response = self.connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                return None
+            return monotonic() - start
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return None
+
+
+def percentile(values, fraction):
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def report(endpoint, latencies, duration):
+    succeeded = sorted(latency for latency in latencies if latency is not None)
+    errors = len(latencies) - len(succeeded)
+    if not succeeded:
+        print('{:<16}{:>10}{:>10} requests failed'.format(endpoint, 0, errors))
+        return
+    print('{:<16}{:>10}{:>10}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+        endpoint, len(succeeded), errors, len(succeeded) / duration,
+        percentile(succeeded, 0.5) * 1000, percentile(succeeded, 0.9) * 1000,
+        percentile(succeeded, 0.99) * 1000, succeeded[-1] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the latency of the Imaging Node API '
+                                                 'under many concurrent pollers.')
+    parser.add_argument('url', help='base URL of the node, e.g. http://localhost:5000')
+    parser.add_argument('--clients', type=int, default=300, help='number of concurrent pollers')
+    parser.add_argument('--interval', type=float, default=1, help='seconds between polls of a client')
+    parser.add_argument('--duration', type=float, default=60, help='test duration in seconds')
+    parser.add_argument('--endpoint', action='append', help='endpoint to poll, may be repeated')
+    args = parser.parse_args()
+    url = urlparse(args.url)
+    endpoints = args.endpoint or DEFAULT_ENDPOINTS
+    results = {endpoint: [] for endpoint in endpoints}
+    lock = threading.Lock()
+    deadline = monotonic() + args.duration
+    pollers = [Poller(url, endpoints, args.interval, deadline, results, lock)
+               for _ in range(args.clients)]
+    for poller in pollers:
+        poller.start()
+    for poller in pollers:
+        poller.join()
+    print('{:<16}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}'.format(
+        'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    for endpoint in endpoints:
+        report(endpoint, results[endpoint], args.duration)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+
+Compares the throughput of the two restoration paths available for compressed backups:
+    mount  - the squashfs image is loop mounted and the partclone image is read through it,
+    stream - the partclone image is decompressed with the multithreaded unsquashfs -cat.
+By default the partclone images are only read and discarded, which measures the decompression
+path without touching any disk. With --target the images are restored with partclone instead.
+Warning: --target destroys all data on the selected partition.
+
+Usage: sudo python3 benchmarks/restore_throughput.py /backup/<backup_id>/ [--partition 1]
+           [--target /dev/sdb1 --fs ext4] [--drop-caches]
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+from time import time
+
+CHUNK_SIZE = 1048576
+PARTITION_FILE_PREFIX = 'part'
+
+
+def drop_caches():
+    subprocess.check_call(['sync'])
+    with open('/proc/sys/vm/drop_caches', 'w') as fd:
+        fd.write('3\n')
+
+
+def partclone_restore(fs, target):
+    return ['partclone.' + fs, '-s', '-', '-O', target, '-r']
+
+
+def mount_path(sqfs_file, image_name, args):
+    mnt_dir = tempfile.mkdtemp(prefix='sqfs_bench_')
+    subprocess.check_call(['mount', sqfs_file, mnt_dir])
+    try:
+        start = time()
+        image_file = os.path.join(mnt_dir, image_name)
+        if args.target:
+            command = partclone_restore(args.fs, args.target)
+            command[2] = image_file
+            subprocess.check_call(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            size = os.path.getsize(image_file)
+        else:
+            size = 0
+            with open(image_file, 'rb') as fd:
+                for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+                    size += len(chunk)
+        return size, time() - start
+    finally:
+        subprocess.check_call(['umount', mnt_dir])
+        os.rmdir(mnt_dir)
+
+
+def stream_path(sqfs_file, image_name, args):
+    command = ['unsquashfs', '-cat', '-processors', str(os.cpu_count() or 1), sqfs_file, image_name]
+    start = time()
+    source = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    size = 0
+    if args.target:
+        sink = subprocess.Popen(partclone_restore(args.fs, args.target), stdin=subprocess.PIPE,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for chunk in iter(lambda: source.stdout.read(CHUNK_SIZE), b''):
+            size += len(chunk)
+            sink.stdin.write(chunk)
+        sink.stdin.close()
+        sink.wait()
+    else:
+        for chunk in iter(lambda: source.stdout.read(CHUNK_SIZE), b''):
+            size += len(chunk)
+    source.wait()
+    return size, time() - start
+
+
+def report(name, partition, size, elapsed):
+    rate = size / 1048576 / elapsed if elapsed else 0
+    print('{:<8}{:<12}{:>12.1f} MB{:>10.2f} s{:>12.1f} MB/s'.format(
+        name, partition, size / 1048576, elapsed, rate))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare mount based and streaming restoration '
+                                                 'throughput for a compressed backup.')
+    parser.add_argument('backup_dir')
+    parser.add_argument('--partition', action='append', help='partition id, may be repeated')
+    parser.add_argument('--target', help='partition to restore to (destructive)')
+    parser.add_argument('--fs', default='dd', help='partclone variant used with --target')
+    parser.add_argument('--drop-caches', action='store_true', help='drop page cache before each run')
+    args = parser.parse_args()
+    partitions = args.partition or sorted(
+        name[len(PARTITION_FILE_PREFIX):-len('.sqfs')] for name in os.listdir(args.backup_dir)
+        if name.startswith(PARTITION_FILE_PREFIX) and name.endswith('.sqfs'))
+    print('{:<8}{:<12}{:>15}{:>12}{:>17}'.format('path', 'partition', 'size', 'time', 'throughput'))
+    for partition in partitions:
+        image_name = PARTITION_FILE_PREFIX + partition + '.img'
+        sqfs_file = os.path.join(args.backup_dir, PARTITION_FILE_PREFIX + partition + '.sqfs')
+        for name, method in (('mount', mount_path), ('stream', stream_path)):
+            if args.drop_caches:
+                drop_caches()
+            report(name, partition, *method(sqfs_file, image_name, args))
+
+
+if __name__ == '__main__':
+    main()
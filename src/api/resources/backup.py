@@ -0,0 +1,122 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from flask import Response
+from flask_restful import Resource, reqparse
+
+import constants
+from core.backupset import Backupset
+from core.scrubber import check_backup
+from lib.exceptions import BackupsetException
+from services import catalog
+from services.config import ConfigHelper
+
+
+class BackupList(Resource):
+    """ Defines the Web API for listing the backups stored in the catalog. """
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+    _CURSOR_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+    _parser = reqparse.RequestParser()
+    _parser.add_argument('limit', type=int, default=DEFAULT_PAGE_SIZE, location='args')
+    _parser.add_argument('cursor', type=str, location='args')
+    _parser.add_argument('fields', type=str, location='args')
+    _parser.add_argument('node', type=str, location='args')
+    _parser.add_argument('status', type=str, location='args')
+    _parser.add_argument('since', type=str, location='args')
+    _parser.add_argument('until', type=str, location='args')
+
+    def get(self):
+        """
+        Provides a page of the backups, ordered from the newest to the oldest. The following
+        pages are requested with the cursor returned with the previous page. The fields argument
+        limits the returned fields to the comma separated list, while the node and status
+        arguments, as well as the since and until creation dates (in the ISO 8601 format),
+        filter the listed backups.
+        :return: JSON object with the backups, the next_cursor, which is None on the last page,
+            and the source of the listing (database or manifest if the database is unreachable),
+            with 200 HTTP status, an error message with 400 HTTP status if the arguments are invalid.
+        """
+        args = self._parser.parse_args()
+        limit = min(max(args['limit'], 1), self.MAX_PAGE_SIZE)
+        try:
+            fields = self._parse_fields(args['fields'])
+            after = self._decode_cursor(args['cursor']) if args['cursor'] else None
+            filters = {
+                'node': args['node'],
+                'status': args['status'],
+                'since': datetime.fromisoformat(args['since']) if args['since'] else None,
+                'until': datetime.fromisoformat(args['until']) if args['until'] else None,
+            }
+        except ValueError as e:
+            return str(e), 400
+        try:
+            backupsets, source = catalog.find_backups(filters, fields, after, limit)
+        except Exception as e:
+            return 'Cannot list the backups, cause: ' + str(e), 500
+        payload = {
+            'backups': [backupset.to_dict(fields) for backupset in backupsets],
+            'next_cursor': self._encode_cursor(backupsets[-1]) if len(backupsets) == limit else None,
+            'source': source,
+        }
+        return Response(json.dumps(payload, separators=(',', ':'), default=_serialise_value),
+                        mimetype='application/json')
+
+    def _parse_fields(self, fields):
+        if not fields:
+            return None
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = set(fields) - set(Backupset.__slots__)
+        if unknown:
+            raise ValueError('Unknown fields requested: ' + ', '.join(sorted(unknown)) + '.')
+        return fields
+
+    def _encode_cursor(self, backupset):
+        created = backupset.creation_date
+        created = created.strftime(self._CURSOR_DATE_FORMAT) if isinstance(created, datetime) else ''
+        return urlsafe_b64encode(json.dumps([created, backupset.id]).encode('utf-8')).decode('ascii')
+
+    def _decode_cursor(self, cursor):
+        try:
+            created, backup_id = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            return datetime.strptime(created, self._CURSOR_DATE_FORMAT) if created else datetime.min, backup_id
+        except (TypeError, ValueError, UnicodeError):
+            raise ValueError('Invalid cursor.')
+
+
+class BackupVerify(Resource):
+    """ Defines the Web API for verifying the images of the backups stored on this node against
+    the checksums calculated while the backups were created. """
+
+    def post(self, backup_id):
+        """
+        Hashes the segments of the partition images again and compares them with the checksums
+        stored with the partitions, the verification stops at the first mismatching segment.
+        The compressed images are verified as they are decompressed, the images created without
+        the checksums are verified by the crc32 of their headers, bitmaps and groups of blocks.
+        :param backup_id: string identifier of the backup.
+        :return: JSON object with the result of the backup (ok, mismatch or error) and the result
+            of each partition, which includes the first mismatching segment, with 200 HTTP status,
+            an error message with an appropriate HTTP status otherwise.
+        """
+        try:
+            backupset = Backupset.load(backup_id)
+        except BackupsetException as e:
+            return str(e), 404
+        if not backupset.is_stored_on(ConfigHelper.config['node']['name']):
+            return 'This backup resides on another node.', 400
+        return check_backup(backupset, ConfigHelper.config['node']['backup_path'] + backupset.id + '/'), 200
+
+
+def _serialise_value(value):
+    if isinstance(value, datetime):
+        return value.strftime(constants.DATE_FORMAT)
+    return str(value)
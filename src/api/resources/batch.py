@@ -0,0 +1,262 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from time import time
+from uuid import uuid4
+
+from flask import request
+from flask_restful import Resource
+
+import constants
+from api.resources.job import Job
+from core.backupset import Backupset
+from core.diskdetect import DiskDetect
+from core.remote import get_node_url
+from core.supervisor import JobSupervisor
+from services.database import DB
+from services.registry import StatusRegistry
+
+
+class JobBatch(Resource):
+    """ Defines the Web API for creating a number of jobs at once as a single group. """
+    MAX_BATCH_SIZE = 256
+
+    def post(self):
+        """
+        Facilitates creation of a group of jobs by sending HTTP POST request with JSON body.
+        The JSON is expected to provide a jobs list, where each entry defines the job_id, disk,
+        operation and optionally the options accepted by the job endpoint, and may provide the
+        group_id. The disks are detected and the backups are retrieved once for the whole batch,
+        either all of the jobs are scheduled or none of them.
+        :return: JSON object with the group_id and 200 HTTP status if the jobs were scheduled,
+            the errors found per job_id with 400 HTTP status otherwise.
+        """
+        data = request.get_json(force=True)
+        entries = data.get('jobs') if isinstance(data, dict) else None
+        if not entries or not isinstance(entries, list):
+            return 'Invalid request format, the required jobs list was not provided.', 400
+        if len(entries) > self.MAX_BATCH_SIZE:
+            return 'A batch cannot contain more than ' + str(self.MAX_BATCH_SIZE) + ' jobs.', 400
+        errors = self._validate_entries(entries)
+        if errors:
+            return {'errors': errors}, 400
+        disks, backups, rates = self._prefetch(entries)
+        errors = self._validate_resources(entries, disks, backups)
+        if errors:
+            return {'errors': errors}, 400
+        group_id = str(data.get('group_id') or uuid4().hex)
+        if not JobGroup.register(group_id, [entry['job_id'] for entry in entries]):
+            return "A group with id '" + group_id + "' already exists on this node.", 400
+        errors = self._submit(entries, disks, backups, rates)
+        if errors:
+            StatusRegistry.remove(JobGroup.STATUS_KIND, group_id)
+            return {'errors': errors}, 400
+        return {'group_id': group_id}, 200
+
+    def _validate_entries(self, entries):
+        errors = {}
+        options = set(Job()._build_config_with_defaults().keys())
+        job_ids = set()
+        disks = set()
+        for index, entry in enumerate(entries):
+            if not isinstance(entry, dict) or not entry.get('job_id') or not entry.get('disk'):
+                errors[str(index)] = 'The job_id and disk fields are required.'
+                continue
+            job_id = str(entry['job_id'])
+            if entry.get('operation') not in (Job.BACKUP_OPERATION, Job.RESTORATION_OPERATION):
+                error = "Unknown operation '" + str(entry.get('operation')) + "'."
+            elif not isinstance(entry.get('options', {}), dict) or \
+                    set(entry.get('options', {}).keys()) - options:
+                error = 'The options can only contain: ' + ', '.join(sorted(options)) + '.'
+            elif job_id in job_ids:
+                error = 'The job id is used more than once in the batch.'
+            elif disks.intersection(self._get_disks(entry)):
+                error = "The disk '" + sorted(disks.intersection(self._get_disks(entry)))[0] + \
+                        "' is used more than once in the batch."
+            else:
+                error = None
+            if error:
+                errors.setdefault(job_id, error)
+            job_ids.add(job_id)
+            disks.update(self._get_disks(entry))
+        return errors
+
+    @staticmethod
+    def _get_disks(entry):
+        """Lists the disk of the job with the target disks of a restoration to a number of disks."""
+        options = entry.get('options')
+        targets = options.get('targets') if isinstance(options, dict) else None
+        return {entry['disk']}.union(targets if isinstance(targets, list) else [])
+
+    def _prefetch(self, entries):
+        disks = {disk['name']: disk for disk in DiskDetect.get_disk_list()}
+        backups = Backupset.load_many([str(entry['job_id']) for entry in entries])
+        try:
+            rates = DB.get_filesystem_rates()
+        except Exception:
+            rates = {}
+        return disks, backups, rates
+
+    def _validate_resources(self, entries, disks, backups):
+        errors = {}
+        busy_disks = set()
+        for record in StatusRegistry.items(Job.STATUS_KIND).values():
+            if not record['finished']:
+                busy_disks.add(record['status'].get('disk'))
+                busy_disks.update(record['status'].get('targets', {}))
+        for entry in entries:
+            job_id = str(entry['job_id'])
+            backupset = backups.get(job_id)
+            options = entry.get('options', {})
+            if StatusRegistry.get(Job.STATUS_KIND, job_id):
+                errors[job_id] = "A job with id '" + job_id + "' is already running on this node."
+            elif self._get_disks(entry) - set(disks):
+                errors[job_id] = "Disk " + sorted(self._get_disks(entry) - set(disks))[0] + \
+                                 " was not detected by the system."
+            elif self._get_disks(entry) & busy_disks:
+                errors[job_id] = "The disk '" + sorted(self._get_disks(entry) & busy_disks)[0] + \
+                                 "' is used by another job."
+            elif entry['operation'] == Job.BACKUP_OPERATION:
+                if backupset and not backupset.deleted and not options.get('overwrite', False):
+                    errors[job_id] = "Backup with the id '" + job_id + "' already exists and is not marked for deletion."
+            elif not backupset:
+                errors[job_id] = 'Could not retrieve backup information.'
+            elif not backupset.is_stored_on(Backupset(job_id).node) and not get_node_url(backupset.node):
+                errors[job_id] = "This backup resides on the node '" + str(backupset.node) + \
+                                 "', which is not listed in the nodes section of the configuration."
+        return errors
+
+    def _submit(self, entries, disks, backups, rates):
+        registered = []
+        controllers = []
+        try:
+            for entry in entries:
+                job_id = str(entry['job_id'])
+                if not Job._register_job(job_id, entry['disk']):
+                    raise Exception("A job with id '" + job_id + "' is already running on this node.")
+                registered.append(job_id)
+                config = Job()._build_config_with_defaults()
+                config.update(entry.get('options', {}))
+                prefetched = {'disk_details': disks[entry['disk']], 'backupset': backups.get(job_id),
+                              'rates': rates}
+                controllers.append(Job()._get_controller(entry['operation'], entry['disk'], job_id,
+                                                         config, prefetched))
+        except Exception as e:
+            for controller in controllers:
+                controller.discard()
+            for job_id in registered:
+                StatusRegistry.remove(Job.STATUS_KIND, job_id)
+            return {str(entries[len(controllers)]['job_id']): str(e)}
+        workers = JobSupervisor.submit_all(controllers)
+        for entry, worker in zip(entries, workers):
+            Job._add_job(str(entry['job_id']), entry['disk'], worker)
+        return None
+
+
+class JobGroup(Resource):
+    """ Defines the Web API for retrieving and cancelling the groups of jobs created in batches. """
+    STATUS_KIND = 'job_group'
+
+    @classmethod
+    def register(cls, group_id, job_ids):
+        """
+        Adds a new group of jobs to the registry.
+        :param group_id: string identifier of the group.
+        :param job_ids: list of the ids of the member jobs.
+        :return: True if the group was added, False if it already exists.
+        """
+        return StatusRegistry.add(cls.STATUS_KIND, group_id, {
+            'members': job_ids,
+            'created': time(),
+            'finished': None,
+        })
+
+    @classmethod
+    def synchronise(cls):
+        """
+        Marks the groups with all member jobs finished and evicts the old finished groups.
+        It is expected to be called periodically by every process serving the API.
+        :return: None
+        """
+        for group_id, group in StatusRegistry.items(cls.STATUS_KIND).items():
+            if not group['finished'] and cls._aggregate(group)['status'] in (constants.STATUS_FINISHED,
+                                                                             constants.STATUS_ERROR):
+                StatusRegistry.update(cls.STATUS_KIND, group_id, {'finished': time()})
+        StatusRegistry.evict(cls.STATUS_KIND, constants.FINISHED_JOB_TTL, float('inf'))
+
+    def get(self, group_id):
+        """
+        Provides the aggregated status of the jobs in the group.
+        :param group_id: string identifier of the group.
+        :return: a JSON object with the number of jobs per status, the completed percentage
+            weighted by the size of the jobs, the total throughput in bytes per second, the
+            estimated time remaining until all jobs finish and the failed jobs, with 200 HTTP status.
+        """
+        group = StatusRegistry.get(self.STATUS_KIND, group_id)
+        if not group:
+            return 'The requested group does not exist.', 404
+        payload = self._aggregate(group)
+        payload['id'] = group_id
+        payload['created'] = group['created']
+        return payload, 200
+
+    def delete(self, group_id):
+        """
+        Cancels the running jobs of the group and removes the group with its finished jobs.
+        :param group_id: string identifier of the group.
+        :return: OK with 200 status code if the group was removed, 202 if some of the jobs are
+            being cancelled, an error with appropriate HTTP status code otherwise.
+        """
+        group = StatusRegistry.get(self.STATUS_KIND, group_id)
+        if not group:
+            return 'The requested group does not exist.', 404
+        pending = False
+        for job_id in group['members']:
+            result = Job().delete(job_id)
+            pending = pending or result[1] == 202
+        if pending:
+            return 'Please wait, while the jobs are being cancelled.', 202
+        StatusRegistry.remove(self.STATUS_KIND, group_id)
+        return 'OK', 200
+
+    @classmethod
+    def _aggregate(cls, group):
+        statuses = []
+        for job_id in group['members']:
+            details = Job._get_job_details(job_id)
+            if isinstance(details, dict):
+                statuses.append(details)
+        counts = {}
+        for status in statuses:
+            counts[status['status']] = counts.get(status['status'], 0) + 1
+        size = sum(status.get('size', 0) for status in statuses)
+        if size:
+            completed = sum(status.get('completed', 0) * status.get('size', 0) for status in statuses) / size
+        else:
+            completed = sum(status.get('completed', 0) for status in statuses) / max(len(statuses), 1)
+        unfinished = [status for status in statuses
+                      if status['status'] not in (constants.STATUS_FINISHED, constants.STATUS_ERROR)]
+        remaining = [status.get('remaining_seconds') for status in unfinished]
+        return {
+            'status': _group_status(counts, unfinished),
+            'jobs': counts,
+            'members': group['members'],
+            'completed': round(completed, 2),
+            'throughput': sum(status.get('throughput', 0) for status in unfinished),
+            'remaining_seconds': None if None in remaining else max(remaining, default=0),
+            'failures': [{'id': status['id'], 'error_msg': status.get('error_msg', '')}
+                         for status in statuses if status['status'] == constants.STATUS_ERROR],
+        }
+
+
+def _group_status(counts, unfinished):
+    if unfinished:
+        if counts.get(constants.STATUS_PENDING, 0) == len(unfinished) and len(unfinished) == sum(counts.values()):
+            return constants.STATUS_PENDING
+        return constants.STATUS_RUNNING
+    if counts.get(constants.STATUS_ERROR):
+        return constants.STATUS_ERROR
+    return constants.STATUS_FINISHED
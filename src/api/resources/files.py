@@ -0,0 +1,88 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from datetime import datetime
+from os import path, scandir
+
+from flask import send_file
+from flask_restful import Resource, reqparse
+
+import constants
+from api.resources.mount import Mount
+
+
+class BackupFiles(Resource):
+    """ Defines the Web API for browsing and retrieving single files from the backups without
+    the need to manage the mount life cycle manually. """
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+
+    _parser = reqparse.RequestParser()
+    _parser.add_argument('offset', type=int, default=0, location='args')
+    _parser.add_argument('limit', type=int, default=DEFAULT_PAGE_SIZE, location='args')
+
+    def get(self, backup_id, file_path=''):
+        """
+        Provides the contents of a file or a directory stored in the backup. The backup is
+        mounted on the first request and kept mounted, so that the following requests can
+        reuse the existing mount.
+        :param backup_id: string identifier of the backup to be browsed.
+        :param file_path: path relative to the backup root, where the first directory is the
+            partition (e.g. part1/etc/hosts).
+        :return: the file contents with support for HTTP Range requests if the path points to
+            a file, a page of directory entries if the path points to a directory, error message
+            with an appropriate HTTP status otherwise.
+        """
+        try:
+            mount_path = Mount.get_mount_path(backup_id)
+        except Exception as e:
+            return "Cannot mount backup '" + str(backup_id) + "', Cause: " + str(e), 400
+        target = self._resolve_path(mount_path, file_path)
+        if not target:
+            return 'The requested path is outside of the backup.', 400
+        if path.isdir(target):
+            return self._list_directory(target, file_path)
+        elif path.isfile(target):
+            return send_file(target, conditional=True)
+        else:
+            return 'The requested file does not exist in the backup.', 404
+
+    def _resolve_path(self, mount_path, file_path):
+        root = path.realpath(mount_path)
+        target = path.realpath(path.join(root, file_path))
+        if target == root or target.startswith(root + '/'):
+            return target
+        return None
+
+    def _list_directory(self, target, file_path):
+        args = self._parser.parse_args()
+        offset = max(args['offset'], 0)
+        limit = min(max(args['limit'], 1), self.MAX_PAGE_SIZE)
+        with scandir(target) as iterator:
+            entries = sorted(iterator, key=lambda entry: entry.name)
+        payload = {
+            'path': file_path,
+            'offset': offset,
+            'limit': limit,
+            'total': len(entries),
+            'entries': [self._describe_entry(entry) for entry in entries[offset:offset + limit]],
+        }
+        return payload, 200
+
+    def _describe_entry(self, entry):
+        stat = entry.stat(follow_symlinks=False)
+        if entry.is_symlink():
+            entry_type = 'link'
+        elif entry.is_dir(follow_symlinks=False):
+            entry_type = 'dir'
+        else:
+            entry_type = 'file'
+        return {
+            'name': entry.name,
+            'type': entry_type,
+            'size': stat.st_size,
+            'modified': datetime.fromtimestamp(stat.st_mtime).strftime(constants.DATE_FORMAT),
+        }
@@ -4,19 +4,29 @@ Date:       10/04/2016
 License:    GPL
 """
 
+import logging
+from os import getpid
 from threading import Thread
+from time import time
 
 from flask_restful import Resource, reqparse
 
 import constants
-from core.controller import BackupController, RestorationController
+from core.checkpoint import JobCheckpoint
+from core.controller import BackupController, FanOutRestorationController, RestorationController
+from core.supervisor import JobSupervisor
+from services.database import DB
+from services.events import StatusBroker
+from services.registry import StatusRegistry
 
 
 class Job(Resource):
     """ Defines the Web API for creating, retrieving and deleting jobs on the Imaging Node. """
     BACKUP_OPERATION = 'Backup'
     RESTORATION_OPERATION = 'Restoration'
+    STATUS_KIND = 'job'
 
+    # Jobs run by this process, the jobs of all processes are kept in the StatusRegistry
     _jobs = {}
 
     _parser = reqparse.RequestParser()
@@ -30,6 +40,13 @@ class Job(Resource):
     _parser.add_argument('crc_check', type=bool, location='json')
     _parser.add_argument('force', type=bool, location='json')
     _parser.add_argument('compress', type=bool, location='json')
+    _parser.add_argument('stream', type=bool, location='json')
+    _parser.add_argument('remote_compression', type=bool, location='json')
+    _parser.add_argument('discard', type=bool, location='json')
+    _parser.add_argument('verify', type=str, location='json')
+    _parser.add_argument('verify_confidence', type=float, location='json')
+    _parser.add_argument('targets', type=str, action='append', location='json')
+    _parser.add_argument('trace', type=bool, location='json')
 
     def get(self, job_id=None):
         """
@@ -44,22 +61,66 @@ class Job(Resource):
 
     def _get_job_list(self):
         payload = []
-        if self._jobs:
-            for key in self._jobs.keys():
-                payload.append(self._get_job_details(key))
+        for job_id, record in StatusRegistry.items(self.STATUS_KIND).items():
+            if job_id in self._jobs:
+                payload.append(self._get_local_job_details(job_id))
+            else:
+                payload.append(record['status'])
         return payload
 
-    def _get_job_details(self, job_id):
-        if job_id in self._jobs:
-            payload = {
-                'id': job_id,
-                'disk': self._jobs[job_id]['disk']
-            }
-            payload.update(self._jobs[job_id]['controller'].get_status())
-            return payload
+    @classmethod
+    def _get_job_details(cls, job_id):
+        if job_id in cls._jobs:
+            return cls._get_local_job_details(job_id)
+        record = StatusRegistry.get(cls.STATUS_KIND, job_id)
+        if record:
+            return record['status']
         else:
             return "The requested job does not exist.", 404
 
+    @classmethod
+    def _get_local_job_details(cls, job_id):
+        payload = {
+            'id': job_id,
+            'disk': cls._jobs[job_id]['disk']
+        }
+        payload.update(cls._jobs[job_id]['controller'].get_status())
+        return payload
+
+    @classmethod
+    def synchronise(cls):
+        """
+        Publishes the statuses of the jobs run by this process into the registry, cancels the
+        jobs which were cancelled through other processes and evicts the old finished jobs.
+        It is expected to be called periodically by every process serving the API.
+        :return: None
+        """
+        for job_id in list(cls._jobs.keys()):
+            cls._publish(job_id)
+        StatusRegistry.evict(cls.STATUS_KIND, constants.FINISHED_JOB_TTL,
+                             constants.REGISTRY_STALE_TIMEOUT)
+        StatusBroker.synchronise(cls.STATUS_KIND, StatusRegistry.items(cls.STATUS_KIND).keys(),
+                                 lambda job_id: lambda: cls._get_job_details(job_id))
+
+    @classmethod
+    def _publish(cls, job_id):
+        job = cls._jobs.get(job_id)
+        if not job:
+            return
+        payload = {'id': job_id, 'disk': job['disk']}
+        payload.update(job['controller'].get_status())
+        if not job['finished'] and payload['status'] in (constants.STATUS_FINISHED,
+                                                         constants.STATUS_ERROR):
+            job['finished'] = time()
+        record = StatusRegistry.update(cls.STATUS_KIND, job_id,
+                                       {'status': payload, 'finished': job['finished']})
+        if record is None:
+            cls._jobs.pop(job_id, None)
+            StatusBroker.unregister(cls.STATUS_KIND, job_id)
+        elif record['cancel'] and not job['finished'] and not job['cancelled']:
+            job['cancelled'] = True
+            Thread(target=job['controller'].kill, daemon=True).start()
+
     def post(self):
         """
         Facilitates creation of new jobs by sending HTTP POST request with JSON body.
@@ -71,24 +132,82 @@ class Job(Resource):
         args = self._parser.parse_args(strict=True)
         config = self._build_config_from_request_args(args)
         if args['job_id'] and args['disk'] and args['operation']:
-            try:
-                if args['job_id'] not in self._jobs.keys():
+            if self._register_job(args['job_id'], args['disk']):
+                try:
                     controller = self._get_controller(args['operation'], args['disk'], args['job_id'], config)
-                    controller.run()
-                    self._jobs[args['job_id']] = {'disk': args['disk'], 'controller': controller}
-                    return "OK", 200
-                else:
-                    return "A job with id '" + args['job_id'] + "' is already running on this node.", 400
-            except Exception as e:
-                return str(e), 400
+                    controller = JobSupervisor.submit(controller)
+                except Exception as e:
+                    StatusRegistry.remove(self.STATUS_KIND, args['job_id'])
+                    return str(e), 400
+                self._add_job(args['job_id'], args['disk'], controller)
+                return "OK", 200
+            else:
+                return "A job with id '" + args['job_id'] + "' is already running on this node.", 400
         else:
             return "Error: Invalid input detected.", 400
 
-    def _get_controller(self, operation, disk, job_id, config):
+    @classmethod
+    def _add_job(cls, job_id, disk, controller):
+        cls._jobs[job_id] = {'disk': disk, 'controller': controller, 'finished': None, 'cancelled': False}
+        cls._publish(job_id)
+        StatusBroker.register(cls.STATUS_KIND, job_id, lambda: cls._get_job_details(job_id))
+
+    @classmethod
+    def _register_job(cls, job_id, disk):
+        return StatusRegistry.add(cls.STATUS_KIND, job_id, {
+            'owner': getpid(),
+            'status': {'id': job_id, 'disk': disk, 'status': constants.STATUS_PENDING},
+            'finished': None,
+            'cancel': False,
+        })
+
+    @classmethod
+    def resume_interrupted(cls):
+        """
+        Resumes the jobs interrupted by a restart of the node from their checkpoints, each job
+        keeps its original id and continues from the first partition which was not imaged yet.
+        It is expected to be called on startup by every process serving the API, each job is
+        resumed by the process which registers it first.
+        :return: list of the ids of the jobs resumed by this process.
+        """
+        resumed = []
+        for checkpoint in JobCheckpoint.load_interrupted():
+            if not cls._register_job(checkpoint.id, checkpoint.disk):
+                continue
+            checkpoint.resumed += 1
+            try:
+                controller = cls()._get_controller(checkpoint.operation, checkpoint.disk, checkpoint.id,
+                                                   checkpoint.config, checkpoint=checkpoint)
+                controller = JobSupervisor.submit(controller)
+            except Exception as e:
+                logging.getLogger(__name__).error('Cannot resume the job ' + str(checkpoint.id) +
+                                                  ', cause: ' + str(e))
+                StatusRegistry.remove(cls.STATUS_KIND, checkpoint.id)
+                cls._abandon(checkpoint)
+                continue
+            cls._add_job(checkpoint.id, checkpoint.disk, controller)
+            resumed.append(checkpoint.id)
+        return resumed
+
+    @classmethod
+    def _abandon(cls, checkpoint):
+        """Marks the backup of a job which cannot be resumed as failed, the way the zombie backups
+        are marked on startup, before its checkpoint is removed. The checkpoint is kept if the
+        backup cannot be marked, so the job is tried again on the next start of the node."""
+        try:
+            if checkpoint.operation == cls.BACKUP_OPERATION:
+                DB.remove_zombie_backups(checkpoint.id)
+            checkpoint.remove()
+        except Exception as e:
+            logging.getLogger(__name__).error('Cannot abandon the job ' + str(checkpoint.id) + ', cause: ' + str(e))
+
+    def _get_controller(self, operation, disk, job_id, config, prefetched=None, checkpoint=None):
         if operation == self.BACKUP_OPERATION:
-            return BackupController(disk, job_id, config)
+            return BackupController(disk, job_id, config, prefetched, checkpoint)
+        elif operation == self.RESTORATION_OPERATION and config.get('targets'):
+            return FanOutRestorationController(disk, job_id, config, prefetched, checkpoint)
         elif operation == self.RESTORATION_OPERATION:
-            return RestorationController(disk, job_id, config)
+            return RestorationController(disk, job_id, config, prefetched, checkpoint)
 
     def _build_config_from_request_args(self, args):
         config = self._build_config_with_defaults()
@@ -106,6 +225,20 @@ class Job(Resource):
             config['force'] = args['force']
         if 'compress' in args:
             config['compress'] = args['compress']
+        if 'stream' in args:
+            config['stream'] = args['stream']
+        if 'remote_compression' in args:
+            config['remote_compression'] = args['remote_compression']
+        if 'discard' in args:
+            config['discard'] = args['discard']
+        if 'verify' in args:
+            config['verify'] = args['verify']
+        if 'verify_confidence' in args:
+            config['verify_confidence'] = args['verify_confidence']
+        if 'targets' in args:
+            config['targets'] = args['targets'] or []
+        if 'trace' in args:
+            config['trace'] = args['trace']
         return config
 
     def _build_config_with_defaults(self):
@@ -118,6 +251,13 @@ class Job(Resource):
             'force': False,
             'refresh_delay': constants.REFRESH_DELAY,
             'compress': False,
+            'stream': False,
+            'remote_compression': False,
+            'discard': False,
+            'verify': None,
+            'verify_confidence': constants.VERIFY_CONFIDENCE,
+            'targets': [],
+            'trace': False,
         }
         return config
 
@@ -128,7 +268,7 @@ class Job(Resource):
         :return: OK with 200 status code if successful, an error with appropriate
             HTTP status code otherwise.
         """
-        if job_id in self._jobs:
+        if job_id in self._jobs or StatusRegistry.get(self.STATUS_KIND, job_id):
             return self._finish_job(job_id)
         else:
             return "Error: Invalid resource requested.", 404
@@ -136,13 +276,19 @@ class Job(Resource):
     def _finish_job(self, job_id):
         status = self.get(job_id)['status']
         if status == constants.STATUS_FINISHED or status == constants.STATUS_ERROR:
-            self._jobs.pop(job_id)
+            StatusRegistry.remove(self.STATUS_KIND, job_id)
+            self._jobs.pop(job_id, None)
+            StatusBroker.unregister(self.STATUS_KIND, job_id)
             return 'OK', 200
         else:
             try:
-                ctrl = self._jobs[job_id]['controller']
-                t = Thread(target=ctrl.kill, daemon=True)
-                t.start()
+                if job_id in self._jobs:
+                    ctrl = self._jobs[job_id]['controller']
+                    t = Thread(target=ctrl.kill, daemon=True)
+                    t.start()
+                else:
+                    # The job is run by another process, which cancels it on its next synchronisation
+                    StatusRegistry.update(self.STATUS_KIND, job_id, {'cancel': True})
                 return 'Please wait, while the job is being cancelled.', 202
             except:
                 return 'Cannot abort job at this moment.', 400
@@ -4,24 +4,51 @@ Date:       10/04/2016
 License:    GPL
 """
 
-from flask_restful import Resource
+from time import time
 
-import constants
-from monitoring.plugins import DiskSpacePlugin, RAMUtilisationPlugin, CpuUtilisationPlugin, DiskIOUtilisationPlugin
-from monitoring.sysmon import SystemMonitor
+from flask_restful import Resource, inputs, reqparse
+
+from monitoring.plugins import create_node_monitor
+from services.registry import SharedRegistry, StatusRegistry
 
 
 class Monitor(Resource):
     """ Defines the Web API for retrieving utilisation metrics from the Imaging Node. """
-    MONITOR = SystemMonitor()
-    MONITOR.add_plugin(DiskSpacePlugin())
-    MONITOR.add_plugin(RAMUtilisationPlugin())
-    MONITOR.add_plugin(CpuUtilisationPlugin(constants.METRIC_INTERVAL))
-    MONITOR.add_plugin(DiskIOUtilisationPlugin(constants.DISK_IO_INTERVAL))
+    MONITOR = None
+
+    _parser = reqparse.RequestParser()
+    _parser.add_argument('since', type=float, location='args')
+    _parser.add_argument('step', type=float, location='args')
+    _parser.add_argument('stats', type=inputs.boolean, default=False, location='args')
+
+    @classmethod
+    def setup(cls):
+        """
+        Creates the plugins and starts collecting the metrics, it has to be called on startup
+        before any requests are handled. With the shared registry the metrics are collected once
+        by the registry server and every worker process reads them from there.
+        :return: None
+        """
+        if isinstance(StatusRegistry, SharedRegistry):
+            cls.MONITOR = StatusRegistry.get_monitor()
+        else:
+            cls.MONITOR = create_node_monitor()
+            cls.MONITOR.start()
 
     def get(self):
         """
         Provides information regarding utilisation of the Imaging Nodes.
+        If the since parameter is provided in the query string, the history of the metrics
+        recorded after the given timestamp is returned instead, the optional step parameter
+        selects the time between the points in seconds. The stats parameter allows retrieving
+        the time spent collecting each of the metrics instead.
         :return: a JSON object containing metrics collected and 200 HTTP status.
         """
+        args = self._parser.parse_args()
+        if args['stats']:
+            return self.MONITOR.get_collection_stats(), 200
+        if args['since'] is not None:
+            payload = self.MONITOR.get_history(args['since'], args['step'])
+            payload['timestamp'] = time()
+            return payload, 200
         return self.MONITOR.get_metrics(), 200
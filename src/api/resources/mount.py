@@ -4,17 +4,81 @@ Date:       10/04/2016
 License:    GPL
 """
 
+from os import getpid
+from threading import RLock
+
 from flask import request
 from flask_restful import Resource
 
 import constants
 from core.controller import MountController
+from lib.exceptions import MountException
+from services.events import StatusBroker
+from services.registry import StatusRegistry
 
 
 class Mount(Resource):
     """ Defines the Web API for mounting, unmounting and retrieving information about mounted
     backups on the Imaging Node. """
+    STATUS_KIND = 'mount'
+
+    # Backups mounted by this process, the mounts of all processes are kept in the StatusRegistry
     _mounts = {}
+    _lock = RLock()
+
+    @classmethod
+    def get_mount_path(cls, backup_id):
+        """
+        Returns the path of a mounted backup, mounting the backup first if it is not mounted yet
+        by any process. The new mount is registered, so that it stays available to the following
+        requests until it is explicitly unmounted.
+        :param backup_id: string identifier of the backup.
+        :return: path of the directory the backup is mounted in.
+        :exception: MountException is raised if the backup cannot be mounted.
+        """
+        with cls._lock:
+            if backup_id in cls._mounts:
+                return cls._mounts[backup_id]['controller'].mount_path
+            record = StatusRegistry.get(cls.STATUS_KIND, backup_id)
+            if record:
+                return cls._get_registered_mount_path(record)
+            controller = MountController(backup_id)
+            if not cls._register_mount(backup_id):
+                return cls._get_registered_mount_path(StatusRegistry.get(cls.STATUS_KIND, backup_id))
+            try:
+                controller.mount()
+            except Exception:
+                StatusRegistry.remove(cls.STATUS_KIND, backup_id)
+                raise
+            if controller.has_error_status():
+                StatusRegistry.remove(cls.STATUS_KIND, backup_id)
+                raise MountException(controller.get_status()['error_msg'])
+            cls._add_mount(backup_id, controller)
+            return controller.mount_path
+
+    @staticmethod
+    def _get_registered_mount_path(record):
+        if not record or not record['mount_path']:
+            raise MountException('The backup is being mounted by another process, try again later.')
+        return record['mount_path']
+
+    @classmethod
+    def synchronise(cls):
+        """
+        Publishes the statuses of the backups mounted by this process into the registry and
+        unmounts the backups which were unmounted through other processes. It is expected to be
+        called periodically by every process serving the API.
+        :return: None
+        """
+        with cls._lock:
+            for backup_id in list(cls._mounts.keys()):
+                record = cls._publish(backup_id)
+                if record and record['unmount']:
+                    cls._unmount_backup(backup_id)
+        StatusRegistry.evict(cls.STATUS_KIND, constants.FINISHED_JOB_TTL,
+                             constants.REGISTRY_STALE_TIMEOUT)
+        StatusBroker.synchronise(cls.STATUS_KIND, StatusRegistry.items(cls.STATUS_KIND).keys(),
+                                 lambda backup_id: lambda: cls._get_status(backup_id))
 
     def get(self, backup_id=None):
         """
@@ -29,45 +93,82 @@ class Mount(Resource):
             return self._get_mount_list()
 
     def _get_mount_details(self, backup_id):
-        for id in self._mounts.keys():
-            if id == backup_id:
-                return self._mounts[id]['controller'].get_status(), 200
+        status = self._get_status(backup_id)
+        if status:
+            return status, 200
         return 'Requested backup is not mounted on this node.', 404
 
     def _get_mount_list(self):
         payload = []
-        for mount in self._mounts.values():
-            payload.append(mount['controller'].get_status())
+        for backup_id, record in StatusRegistry.items(self.STATUS_KIND).items():
+            if backup_id in self._mounts:
+                payload.append(self._mounts[backup_id]['controller'].get_status())
+            else:
+                payload.append(record['status'])
         return payload, 200
 
+    @classmethod
+    def _get_status(cls, backup_id):
+        mount = cls._mounts.get(backup_id)
+        if mount:
+            return mount['controller'].get_status()
+        record = StatusRegistry.get(cls.STATUS_KIND, backup_id)
+        return record['status'] if record else None
+
     def post(self):
         """
         Facilitates mounting of existing backups by sending HTTP POST request with JSON body.
-        The JSON is expected to provide a backup_id for the backup to be mounted.
+        The JSON is expected to provide a backup_id for the backup to be mounted, and may enable
+        tracing of the mount operations with the trace field.
         :return: OK with 200 status code if backup was mounted properly,
             Error message with an appropriate HTTP status if backup cannot be mounted.
         """
         data = request.get_json(force=True)
         if 'backup_id' in data:
-            if data['backup_id'] not in self._mounts.keys():
-                return self._mount_backup(data['backup_id'])
-            else:
-                return 'The requested backup is already mounted.', 400
+            with self._lock:
+                if self._register_mount(data['backup_id']):
+                    return self._mount_backup(data['backup_id'], bool(data.get('trace', False)))
+                else:
+                    return 'The requested backup is already mounted.', 400
         else:
             return 'Invalid request format, the required backup_id field was not provided.', 400
 
-    def _mount_backup(self, backup_id):
+    @classmethod
+    def _register_mount(cls, backup_id):
+        return StatusRegistry.add(cls.STATUS_KIND, backup_id, {
+            'owner': getpid(),
+            'mount_path': None,
+            'status': {'id': str(backup_id), 'status': constants.STATUS_PENDING},
+            'finished': None,
+            'unmount': False,
+        })
+
+    def _mount_backup(self, backup_id, trace=False):
         try:
-            controller = MountController(backup_id)
+            controller = MountController(backup_id, trace)
             controller.mount()
             if controller.get_status()['status'] != constants.STATUS_ERROR:
-                self._mounts[backup_id] = {'controller': controller}
+                self._add_mount(backup_id, controller)
                 return 'OK', 200
             else:
+                StatusRegistry.remove(self.STATUS_KIND, backup_id)
                 return controller.get_status()['error_msg'], 500
         except Exception as e:
+            StatusRegistry.remove(self.STATUS_KIND, backup_id)
             return "Cannot mount backup '" + str(backup_id) + "', Cause: " + str(e), 400
 
+    @classmethod
+    def _add_mount(cls, backup_id, controller):
+        cls._mounts[backup_id] = {'controller': controller}
+        StatusRegistry.update(cls.STATUS_KIND, backup_id, {'mount_path': controller.mount_path})
+        cls._publish(backup_id)
+        StatusBroker.register(cls.STATUS_KIND, backup_id, lambda: cls._get_status(backup_id))
+
+    @classmethod
+    def _publish(cls, backup_id):
+        return StatusRegistry.update(cls.STATUS_KIND, backup_id,
+                                     {'status': cls._mounts[backup_id]['controller'].get_status()})
+
     def delete(self, backup_id):
         """
         Unmounts previously mounted backup with the provided backup_id.
@@ -75,15 +176,23 @@ class Mount(Resource):
         :return: OK with 200 status code if successful, an error message with appropriate
             HTTP status code otherwise.
         """
-        if backup_id in self._mounts.keys():
-            return self._unmount_backup(backup_id)
-        else:
-            return 'The specified backup is not mounted.', 400
+        with self._lock:
+            if backup_id in self._mounts.keys():
+                return self._unmount_backup(backup_id)
+            elif StatusRegistry.update(self.STATUS_KIND, backup_id, {'unmount': True}):
+                # The backup is mounted by another process, which unmounts it on its next synchronisation
+                return 'Please wait, while the backup is being unmounted.', 202
+            else:
+                return 'The specified backup is not mounted.', 400
 
-    def _unmount_backup(self, backup_id):
+    @classmethod
+    def _unmount_backup(cls, backup_id):
         try:
-            self._mounts[backup_id]['controller'].unmount()
-            self._mounts.pop(backup_id)
+            cls._mounts[backup_id]['controller'].unmount()
+            cls._mounts.pop(backup_id)
+            StatusRegistry.remove(cls.STATUS_KIND, backup_id)
+            StatusBroker.unregister(cls.STATUS_KIND, backup_id)
             return 'OK', 200
         except Exception as e:
+            StatusRegistry.update(cls.STATUS_KIND, backup_id, {'unmount': False})
             return 'Cannot unmount the backup, cause: ' + str(e), 400
@@ -0,0 +1,114 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from hashlib import blake2b
+from os import fdopen, fsync, path, remove, replace
+from tempfile import mkstemp
+
+from flask import request
+from flask_restful import Resource
+
+import constants
+from core.backupset import Backupset
+from core.checksum import CHECKSUM_ALGORITHM
+from lib.exceptions import BackupsetException
+from services.config import ConfigHelper
+from services.database import DB
+from services.usage import NodeUsage
+from services.utils import create_dir
+
+
+class Replica(Resource):
+    """ Defines the Web API for committing the replicas of the backups created by other nodes
+    and for retrieving the progress of the replications of a backup. """
+
+    def get(self, backup_id):
+        """
+        Provides the progress of the replications of the backup to the peer nodes.
+        :param backup_id: string identifier of the backup.
+        :return: JSON object with the nodes holding the backup and the progress of each
+            replication with 200 HTTP status, an error message with 404 HTTP status if the
+            backup does not exist.
+        """
+        try:
+            backupset = Backupset.load(backup_id)
+        except BackupsetException as e:
+            return str(e), 404
+        return {
+            'node': backupset.node,
+            'replicas': backupset.replicas,
+            'replications': DB.get_replications(backup_id),
+        }, 200
+
+    def post(self, backup_id):
+        """
+        Commits the replica once all of its files were received, this node is recorded in the
+        catalog as a holder of the backup.
+        :param backup_id: string identifier of the backup.
+        :return: OK with 200 HTTP status, an error message with an appropriate HTTP status otherwise.
+        """
+        try:
+            backupset = Backupset.load(backup_id)
+        except BackupsetException as e:
+            return str(e), 404
+        node = ConfigHelper.config['node']['name']
+        backup_dir = _get_replica_dir(backup_id)
+        if not backup_dir or not path.isdir(backup_dir):
+            return 'No files of the replica were received.', 400
+        if not backupset.is_stored_on(node):
+            DB.add_backup_replica(backup_id, node)
+            NodeUsage.add(backupset.backup_size or 0)
+        return 'OK', 200
+
+
+class ReplicaFile(Resource):
+    """ Defines the Web API for receiving the files of the replicas of the backups created by
+    other nodes. """
+
+    def put(self, backup_id, file_name):
+        """
+        Receives a file of a replicated backup. The body is written to a temporary file, which
+        replaces the file of the replica only if its checksum matches the X-Checksum header,
+        in the blake2b:<hexadecimal digest> format.
+        :param backup_id: string identifier of the backup.
+        :param file_name: the name of the file in the backup directory.
+        :return: the checksum of the stored file with 200 HTTP status, an error message with 422
+            HTTP status if the checksum does not match, or another appropriate HTTP status.
+        """
+        algorithm, _, expected = request.headers.get('X-Checksum', '').partition(':')
+        if algorithm != CHECKSUM_ALGORITHM or not expected:
+            return 'The ' + CHECKSUM_ALGORITHM + ' checksum of the file is required.', 400
+        if '/' in file_name or file_name.startswith('.') or backup_id.startswith('.'):
+            return 'Invalid backup id or file name.', 400
+        backup_dir = _get_replica_dir(backup_id)
+        if not backup_dir:
+            return 'This node holds the original backup.', 409
+        create_dir(backup_dir)
+        descriptor, temp_path = mkstemp(prefix='.' + file_name, dir=backup_dir)
+        digest = blake2b()
+        try:
+            with fdopen(descriptor, 'wb') as file:
+                for chunk in iter(lambda: request.stream.read(constants.REMOTE_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    file.write(chunk)
+                file.flush()
+                fsync(file.fileno())
+            if digest.hexdigest() != expected:
+                remove(temp_path)
+                return 'The checksum of ' + file_name + ' does not match, the file was corrupted in transfer.', 422
+            replace(temp_path, backup_dir + file_name)
+        except:
+            if path.exists(temp_path):
+                remove(temp_path)
+            raise
+        return {'checksum': CHECKSUM_ALGORITHM + ':' + expected}, 200
+
+
+def _get_replica_dir(backup_id):
+    data = DB.get_backup(backup_id)
+    if data and data.get('node') == ConfigHelper.config['node']['name']:
+        return None
+    return ConfigHelper.config['node']['backup_path'] + backup_id + '/'
@@ -0,0 +1,34 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from datetime import datetime
+
+from flask_restful import Resource
+
+import constants
+from services.config import ConfigHelper
+from services.database import DB
+
+
+class Scrub(Resource):
+    """ Defines the Web API for retrieving the alert state of the scrubbing of the backups
+    held by the Imaging Node. """
+
+    def get(self):
+        """
+        Provides the backups held by this node whose images did not pass their last scrub.
+        :return: JSON object with the alert flag, which is set if any backup is corrupted, and
+            the results of the failed scrubs with 200 HTTP status.
+        """
+        node = ConfigHelper.config['node']['name']
+        failures = []
+        for backup in DB.get_scrub_failures(node):
+            result = next(dict(scrub) for scrub in backup['scrubs'] if scrub['node'] == node)
+            del result['node']
+            if isinstance(result.get('date'), datetime):
+                result['date'] = result['date'].strftime(constants.DATE_FORMAT)
+            failures.append({'id': backup['id'], 'scrub': result})
+        return {'alert': bool(failures), 'failures': failures}, 200
@@ -0,0 +1,64 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from flask import Response, request
+from flask_restful import Resource
+from werkzeug.datastructures import ContentRange
+
+from core.backupset import Backupset
+from core.remote import GZIP_COMPRESSION, ImageSource
+from lib.exceptions import BackupsetException, ImageException
+from services.config import ConfigHelper
+
+
+class BackupSource(Resource):
+    """ Defines the Web API for streaming the files of the backups stored on this node to the
+    other nodes, which restore the backups directly from the stream. """
+
+    def get(self, backup_id, file_name=None):
+        """
+        Provides the list of the files of the backup or the contents of one of them. The file is
+        sent with the chunked transfer encoding, a single HTTP Range allows resuming a broken
+        transfer and the compression=gzip argument compresses the requested range on the fly,
+        the Range always refers to the uncompressed file.
+        :param backup_id: string identifier of the backup.
+        :param file_name: the name of the file in the backup directory, the partition images of
+            the compressed backups are provided decompressed under the name of the image.
+        :return: the requested range of the file with 200 or 206 HTTP status, the list of the
+            files if no file_name is provided, an error message with an appropriate HTTP status
+            otherwise.
+        """
+        try:
+            backupset = Backupset.load(backup_id)
+        except BackupsetException as e:
+            return str(e), 404
+        if not backupset.is_stored_on(ConfigHelper.config['node']['name']):
+            return 'This backup resides on another node.', 400
+        source = ImageSource(ConfigHelper.config['node']['backup_path'] + backupset.id + '/')
+        if file_name is None:
+            return {'files': source.list_files()}, 200
+        compression = request.args.get('compression')
+        if compression not in (None, GZIP_COMPRESSION):
+            return "Unsupported compression '" + compression + "'.", 400
+        try:
+            size = source.get_size(file_name)
+        except ImageException as e:
+            return str(e), 404
+        start, end = 0, size
+        headers = {'Accept-Ranges': 'bytes'}
+        status = 200
+        if request.range:
+            if request.range.units != 'bytes' or len(request.range.ranges) != 1 or \
+                    not request.range.range_for_length(size):
+                return Response(status=416,
+                                headers={'Content-Range': ContentRange('bytes', None, None, size).to_header()})
+            start, end = request.range.range_for_length(size)
+            headers['Content-Range'] = ContentRange('bytes', start, end, size).to_header()
+            status = 206
+        if compression:
+            headers['X-Compression'] = compression
+        return Response(source.read(file_name, start, end, compression), status, headers,
+                        mimetype='application/octet-stream', direct_passthrough=True)
@@ -0,0 +1,71 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import json
+
+from flask import Response, stream_with_context
+from flask_restful import Resource
+
+from api.resources.job import Job
+from api.resources.mount import Mount
+from services.events import StatusBroker
+from services.registry import StatusRegistry
+
+
+class JobStream(Resource):
+    """ Defines the Web API for following the changes of the job statuses as Server-Sent Events. """
+
+    def get(self, job_id=None):
+        """
+        Opens a stream of the job status changes. The first event contains the complete statuses,
+        each following event contains only the fields which changed, keyed by the job id. A job
+        set to null has been removed from the node.
+        :param job_id: string defining the name of a single job to be followed.
+        :return: text/event-stream response, or an error message with 404 status if the job
+            does not exist.
+        """
+        if job_id and not StatusRegistry.get(Job.STATUS_KIND, job_id):
+            return "The requested job does not exist.", 404
+        return _event_stream(Job.STATUS_KIND, job_id)
+
+
+class MountStream(Resource):
+    """ Defines the Web API for following the changes of the mount statuses as Server-Sent Events. """
+
+    def get(self, backup_id=None):
+        """
+        Opens a stream of the mount status changes, the events use the same format as the
+        job stream, keyed by the backup id.
+        :param backup_id: string identifier of a single mounted backup to be followed.
+        :return: text/event-stream response, or an error message with 404 status if the backup
+            is not mounted.
+        """
+        if backup_id and not StatusRegistry.get(Mount.STATUS_KIND, backup_id):
+            return 'Requested backup is not mounted on this node.', 404
+        return _event_stream(Mount.STATUS_KIND, backup_id)
+
+
+def _event_stream(kind, key):
+    subscription = StatusBroker.subscribe(kind, key)
+
+    def generate():
+        try:
+            yield 'retry: ' + str(StatusBroker.heartbeat * 1000) + '\n\n'
+            while True:
+                changes = subscription.get(StatusBroker.heartbeat)
+                if changes is None:
+                    yield ': heartbeat\n\n'
+                else:
+                    yield 'data: ' + json.dumps(changes) + '\n\n'
+                    if key is not None and changes.get(key, {}) is None:
+                        return
+        finally:
+            StatusBroker.unsubscribe(subscription)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
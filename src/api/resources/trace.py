@@ -0,0 +1,56 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from flask_restful import Resource
+
+from api.resources.job import Job
+from api.resources.mount import Mount
+from services.registry import StatusRegistry
+
+
+class JobTrace(Resource):
+    """ Defines the Web API for retrieving the phase level traces of the jobs. """
+
+    def get(self, job_id):
+        """
+        Provides the trace of the operations executed by the job, the tracing has to be enabled
+        with the trace option when the job is created.
+        :param job_id: string defining the name of the job.
+        :return: a JSON object in the Chrome trace event format with 200 HTTP status, or an error
+            message with an appropriate HTTP status.
+        """
+        if job_id in Job._jobs:
+            return _trace_response(Job._jobs[job_id]['controller'])
+        if StatusRegistry.get(Job.STATUS_KIND, job_id):
+            return _TRACE_ELSEWHERE_MESSAGE, 404
+        return "The requested job does not exist.", 404
+
+
+class MountTrace(Resource):
+    """ Defines the Web API for retrieving the phase level traces of the mounted backups. """
+
+    def get(self, backup_id):
+        """
+        Provides the trace of the mount operations, the tracing has to be enabled with the
+        trace field when the backup is mounted.
+        :param backup_id: string identifier of the mounted backup.
+        :return: a JSON object in the Chrome trace event format with 200 HTTP status, or an error
+            message with an appropriate HTTP status.
+        """
+        if backup_id in Mount._mounts:
+            return _trace_response(Mount._mounts[backup_id]['controller'])
+        if StatusRegistry.get(Mount.STATUS_KIND, backup_id):
+            return _TRACE_ELSEWHERE_MESSAGE, 404
+        return 'Requested backup is not mounted on this node.', 404
+
+_TRACE_ELSEWHERE_MESSAGE = 'The trace is kept by another process serving the API, please retry the request.'
+
+
+def _trace_response(controller):
+    trace = controller.get_trace()
+    if trace is None:
+        return 'Tracing was not enabled for the requested operation.', 404
+    return trace, 200
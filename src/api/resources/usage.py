@@ -0,0 +1,34 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import psutil
+from flask_restful import Resource
+
+from services.config import ConfigHelper
+from services.usage import NodeUsage
+
+
+class Usage(Resource):
+    """ Defines the Web API for retrieving the space used by the backups stored on the Imaging Node. """
+
+    def get(self):
+        """
+        Provides the number of bytes used by the backups of the node, which is read from the usage
+        counter rather than calculated from the backup files, as well as the capacity and the free
+        space of the backup path.
+        :return: a JSON object with the used_bytes, capacity_bytes and free_bytes fields with 200
+            HTTP status, an error message with 500 HTTP status if the counter cannot be read.
+        """
+        try:
+            used_bytes = NodeUsage.get_used_bytes()
+        except Exception as e:
+            return 'Cannot read the usage of the node, cause: ' + str(e), 500
+        disk_usage = psutil.disk_usage(ConfigHelper.config['node']['backup_path'])
+        return {
+            'used_bytes': used_bytes,
+            'capacity_bytes': disk_usage.total,
+            'free_bytes': disk_usage.free,
+        }, 200
@@ -12,17 +12,119 @@ STATUS_RUNNING = 'running'
 STATUS_ERROR = 'error'
 STATUS_FINISHED = 'finished'
 
+# Scrub results
+SCRUB_OK = 'ok'
+SCRUB_MISMATCH = 'mismatch'
+SCRUB_ERROR = 'error'
+
 # File Constants
 DEVICE_PATH = '/dev/'
+SYSFS_BLOCK_PATH = '/sys/block/'
 CONFIG_FILE = '/etc/diskimage/node/server.conf'
 BACKUPSET_FILE = 'backupset.cfg'
 PARTITION_TABLE_FILE = 'ptable.bak'
 BOOT_RECORD_FILE = 'boot.img'
 PARTITION_FILE_PREFIX = 'part'
 PARTITION_FILE_SUFFIX = '.img'
+COMPRESSED_FILE_SUFFIX = '.sqfs'
+# Size of the blocks counted by st_blocks in bytes
+STAT_BLOCK_SIZE = 512
+REGISTRY_SOCKET = '/run/diskimage/registry.sock'
+REPLICATION_LOCK_FILE = '/run/diskimage/replication.lock'
+SCRUB_LOCK_FILE = '/run/diskimage/scrub.lock'
 
 # Interval Constants in seconds
 REFRESH_DELAY = 5
 METRIC_INTERVAL = 5
 DISK_IO_INTERVAL = 1
-BUSY_WAIT_INTERVAL = 0.01
\ No newline at end of file
+BUSY_WAIT_INTERVAL = 0.01
+RESOURCE_SAMPLE_INTERVAL = 1
+METRIC_HISTORY_INTERVAL = 1
+PROGRESS_SMOOTHING_TIME = 30
+STATUS_STREAM_INTERVAL = 1
+STATUS_STREAM_HEARTBEAT = 15
+REGISTRY_SYNC_INTERVAL = 1
+REGISTRY_STALE_TIMEOUT = 30
+FINISHED_JOB_TTL = 86400
+JOB_STATUS_INTERVAL = 1
+JOB_KILL_TIMEOUT = 10
+PROCESS_EXIT_TIMEOUT = 1
+
+# Default number of the jobs running at the same time, the further jobs are queued
+MAX_CONCURRENT_JOBS = 8
+
+# Number of the records written to the database with a single bulk operation
+DB_BULK_SIZE = 1000
+
+# Number of the most recent backups used to estimate the imaging throughput per file system
+HISTORICAL_RATE_BACKUPS = 50
+
+# Metric history resolutions as (seconds per point, number of points) pairs,
+# 1 s for 10 minutes, 10 s for 6 hours and 1 min for 7 days.
+METRIC_HISTORY_RESOLUTIONS = [(1, 600), (10, 2160), (60, 10080)]
+# The history of a metric which is not reported for METRIC_HISTORY_IDLE_TIMEOUT seconds is removed,
+# e.g. of a detached loop or nbd device, and at most METRIC_HISTORY_MAX_KEYS metrics are kept.
+# A metric takes 16 bytes per point, i.e. about 205 KB for the 12840 points of the resolutions
+# above, so the history of 64 metrics is bounded by about 13 MB.
+METRIC_HISTORY_IDLE_TIMEOUT = 600
+METRIC_HISTORY_MAX_KEYS = 64
+
+# Transfers of the backup files between the nodes: size of the chunks in bytes, zlib compression
+# level used when the compression is requested, number of retries of a broken transfer, delay
+# between the retries and the socket timeout in seconds
+REMOTE_CHUNK_SIZE = 1048576
+REMOTE_COMPRESSION_LEVEL = 1
+REMOTE_RETRIES = 5
+REMOTE_RETRY_DELAY = 2
+REMOTE_TIMEOUT = 60
+
+# Replication of the backups to the peer nodes: delay between the checks for the backups to be
+# replicated and between the progress updates in seconds, the default number of the parallel
+# streams per peer and the burst allowed by the bandwidth budget in seconds of the bandwidth
+REPLICATION_INTERVAL = 60
+REPLICATION_PROGRESS_INTERVAL = 5
+REPLICATION_STREAMS = 4
+REPLICATION_BURST_SECONDS = 1
+
+# Maximum number of bytes zeroed with a single BLKZEROOUT request, when the disk does not
+# report its discard limit
+ZEROOUT_REQUEST_SIZE = 1073741824
+
+# Verification of the restored partitions: the default confidence of finding a corruption of
+# VERIFY_DEFECT_RATE of the used blocks with the sampled verification, the number of the parallel
+# reads, the maximum size of a read in bytes, the number of the reads per batch and the number of
+# the mismatching blocks listed in the job status
+VERIFY_CONFIDENCE = 0.99
+VERIFY_DEFECT_RATE = 0.001
+VERIFY_WORKERS = 16
+VERIFY_READ_SIZE = 1048576
+VERIFY_BATCH_SIZE = 64
+VERIFY_MAX_MISMATCHES = 100
+
+# Checksums of the partition images: size of the segments hashed separately in bytes and the
+# number of the segments hashed in parallel by the verification
+CHECKSUM_SEGMENT_SIZE = 67108864
+CHECKSUM_WORKERS = 4
+
+# Restoration of a backup to a number of disks at once: the number of bytes of the image buffered
+# in memory per target disk, the number of bytes spilled into a temporary file per target disk
+# falling behind the others, the number of bytes of free space the spill files always leave on
+# their file system, the longest time a target disk may not take any data before it is
+# dropped and the delay between the checks of the buffers in seconds
+FANOUT_BUFFER_SIZE = 67108864
+FANOUT_SPILL_SIZE = 4294967296
+FANOUT_SPILL_RESERVE = 1073741824
+FANOUT_STALL_TIMEOUT = 60
+FANOUT_POLL_INTERVAL = 0.1
+
+# Scrubbing of the stored backups: delay between the checks for the backups to be scrubbed in
+# seconds, the number of days after which a backup is scrubbed again, the default read limit in
+# MB/s, the CPU and backup disk utilisation in percents below which the node is idle, the delay
+# between the checks of the utilisation and the longest wait for the node to become idle in seconds
+SCRUB_INTERVAL = 600
+SCRUB_PERIOD_DAYS = 7
+SCRUB_BANDWIDTH = 20
+SCRUB_IDLE_CPU = 30
+SCRUB_IDLE_DISK = 50
+SCRUB_IDLE_CHECK_INTERVAL = 5
+SCRUB_MAX_IDLE_WAIT = 3600
@@ -4,12 +4,16 @@ Date:       10/04/2016
 License:    GPL
 """
 
+import json
 from datetime import datetime
+from os import O_RDONLY, close, fdopen, fsync, open as open_fd, path, remove, replace
+from tempfile import mkstemp
 
 import constants as constants
 from lib.exceptions import BackupsetException, IllegalOperationException
 from services.config import ConfigHelper
 from services.database import DB
+from services.usage import NodeUsage
 
 
 class Backupset:
@@ -17,7 +21,14 @@ class Backupset:
     This class provides a structure required to represent information regarding
     the physical backups. It is used to provide an encapsulation of the data stored
     in the database and to provide a consistent way of operating on the backup records.
+    The attributes are declared as slots, which keeps large listings of backups compact.
     """
+    __slots__ = ('id', 'node', 'backup_path', 'disk_layout', 'status', 'deleted', 'purged', 'compressed',
+                 'backup_size', 'disk_size', 'deletion_date', 'creation_date', 'purge_date', 'replicas',
+                 'scrubs', 'partitions')
+    # Members written to the datastore by the save method
+    STORED_FIELDS = tuple(field for field in __slots__ if field not in ('replicas', 'scrubs'))
+
     def __init__(self, backup_id):
         self.id = backup_id
         self.node = ConfigHelper.config['node']['name']
@@ -32,6 +43,8 @@ class Backupset:
         self.deletion_date = ''
         self.creation_date = datetime.today()
         self.purge_date = ''
+        self.replicas = []
+        self.scrubs = []
         self.partitions = []
 
     @classmethod
@@ -47,6 +60,34 @@ class Backupset:
             return backupset
         raise BackupsetException('Could not retrieve backup information.')
 
+    @classmethod
+    def load_many(cls, backup_ids):
+        """
+        Loads the information of a number of backups from the datastore with a single query.
+        :param backup_ids: list of string identifiers of the backups to be loaded.
+        :return: dictionary of Backupset objects with the ids as keys, the backups which do not
+            exist are omitted.
+        """
+        return {data['id']: cls._from_json(data) for data in DB.get_backups(backup_ids)}
+
+    @classmethod
+    def from_manifest(cls, manifest_path):
+        """
+        Loads the backup information from the manifest file stored in the backup directory.
+        :param manifest_path: path of the manifest file.
+        :return: a fully initialised Backupset object with information loaded from the manifest.
+        :exception: BackupsetException is raised if the manifest cannot be read.
+        """
+        try:
+            with open(manifest_path, 'rb') as manifest:
+                data = json.loads(manifest.read().decode('utf-8'))
+            for key in ('creation_date', 'deletion_date', 'purge_date'):
+                if data.get(key):
+                    data[key] = datetime.strptime(data[key], constants.DATE_FORMAT)
+            return cls._from_json(data)
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            raise BackupsetException('Cannot read the backup manifest ' + manifest_path + ', cause: ' + str(e))
+
     @classmethod
     def _from_json(cls, json):
         backupset = cls(json.get('id'))
@@ -62,7 +103,9 @@ class Backupset:
         backupset.deletion_date = json.get('deletion_date')
         backupset.creation_date = json.get('creation_date')
         backupset.purge_date = json.get('purge_date')
-        for partition in json.get('partitions'):
+        backupset.replicas = json.get('replicas') or []
+        backupset.scrubs = json.get('scrubs') or []
+        for partition in json.get('partitions') or []:
             backupset.partitions.append(Partition.from_json(partition))
         return backupset
 
@@ -74,6 +117,8 @@ class Backupset:
             marked for deletion.
         """
         if self.deleted:
+            if not self.purged:
+                NodeUsage.add(-(self.backup_size or 0))
             self.purged = True
             self.purge_date = datetime.today()
             self.save()
@@ -83,10 +128,75 @@ class Backupset:
     def save(self):
         """
         Updates the information regarding backup in the datastore. If the backup did not exist
-        prior this call it will be automatically created.
+        prior this call it will be automatically created. The manifest in the backup directory is
+        updated first, once the directory exists, so it stays up to date even if the datastore
+        cannot be reached. The replicas are only added by the nodes receiving them, see
+        Database.add_backup_replica, and the scrubs by the nodes scrubbing their copies, see
+        Database.set_backup_scrub, so they are not overwritten here.
+        :return: None
+        """
+        try:
+            self.write_manifest()
+        finally:
+            DB.upsert_backup(self.id, self.to_dict(self.STORED_FIELDS))
+
+    def is_stored_on(self, node):
+        """
+        Checks whether the files of the backup are stored on the node, either as the original
+        backup or as a replica.
+        :param node: the name of the node.
+        :return: True if the node holds the backup files, False otherwise.
+        """
+        return node == self.node or node in self.replicas
+
+    def update_backup_size(self, backup_size):
+        """
+        Sets the number of bytes allocated by the backup files, the usage counter of the node is
+        changed by the difference. The backup information has to be saved afterwards.
+        :param backup_size: number of bytes allocated by the backup files.
+        :return: None
+        """
+        if not self.purged:
+            NodeUsage.add(backup_size - (self.backup_size or 0))
+        self.backup_size = backup_size
+
+    def write_manifest(self):
+        """
+        Writes the backup information into the manifest file in the backup directory, so that the
+        catalog can be rebuilt from the backup directories. The manifest is replaced atomically,
+        a reader finds either the previous or the new version of the file.
         :return: None
         """
-        DB.upsert_backup(self.id, self.to_dict())
+        if not path.isdir(self.backup_path):
+            return
+        data = self.to_dict()
+        for key in ('creation_date', 'deletion_date', 'purge_date'):
+            if isinstance(data[key], datetime):
+                data[key] = data[key].strftime(constants.DATE_FORMAT)
+        content = json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+        descriptor, temp_path = mkstemp(prefix='.' + constants.BACKUPSET_FILE, dir=self.backup_path)
+        try:
+            with fdopen(descriptor, 'wb') as manifest:
+                manifest.write(content)
+                manifest.flush()
+                fsync(manifest.fileno())
+            replace(temp_path, self.get_manifest_path())
+        except:
+            if path.exists(temp_path):
+                remove(temp_path)
+            raise
+        directory = open_fd(self.backup_path, O_RDONLY)
+        try:
+            fsync(directory)  # Persists the replacement, not only the content of the manifest
+        finally:
+            close(directory)
+
+    def get_manifest_path(self):
+        """
+        Returns the path of the manifest file of the backup.
+        :return: path of the manifest in the backup directory.
+        """
+        return self.backup_path + constants.BACKUPSET_FILE
 
     def add_partitions(self, partitions):
         """
@@ -102,29 +212,15 @@ class Backupset:
             partition_number = partition['name'][-1]
             self.partitions.append(Partition(partition_number, partition['fs'], partition['size']))
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         """
         Creates a dictionary representation of the data stored by the Backupset object.
+        :param fields: optional list of the members to be included, all members if None.
         :return: dictionary object with keys matching all public members of the Backupset class.
         """
-        data = {
-            'id': self.id,
-            'node': self.node,
-            'backup_path': self.backup_path,
-            'disk_layout': self.disk_layout,
-            'status': self.status,
-            'deleted': self.deleted,
-            'purged': self.purged,
-            'compressed': self.compressed,
-            'backup_size': self.backup_size,
-            'disk_size': self.disk_size,
-            'deletion_date': self.deletion_date,
-            'creation_date': self.creation_date,
-            'purge_date': self.purge_date,
-            'partitions': [],
-        }
-        for partition in self.partitions:
-            data['partitions'].append(partition.to_dict())
+        data = {field: getattr(self, field) for field in fields or self.__slots__ if field != 'partitions'}
+        if not fields or 'partitions' in fields:
+            data['partitions'] = [partition.to_dict() for partition in self.partitions]
         return data
 
 
@@ -132,10 +228,16 @@ class Partition:
     """
     This class provides a structure for representing the partition information in backupsets.
     """
+    __slots__ = ('id', 'file_system', 'size', 'resources', 'throughput', 'image_size', 'checksum')
+
     def __init__(self, partition_id, file_system, size):
         self.id = partition_id
         self.file_system = file_system
-        self.size = size
+        self.size = int(size or 0)  # Reported by lsblk and stored by the older versions as a string
+        self.resources = {}
+        self.throughput = 0
+        self.image_size = 0
+        self.checksum = None
 
     @classmethod
     def from_json(cls, json):
@@ -144,7 +246,12 @@ class Partition:
         :param json: Data required to build object.
         :return: a fully initialised Partition object.
         """
-        return cls(json.get('partition'), json.get('fs'), json.get('size'))
+        partition = cls(json.get('partition'), json.get('fs'), json.get('size'))
+        partition.resources = json.get('resources', {})
+        partition.throughput = json.get('throughput', 0)
+        partition.image_size = json.get('image_size', 0)
+        partition.checksum = json.get('checksum')
+        return partition
 
     def to_dict(self):
         """
@@ -155,4 +262,8 @@ class Partition:
             'partition': self.id,
             'fs': self.file_system,
             'size': self.size,
+            'resources': self.resources,
+            'throughput': self.throughput,
+            'image_size': self.image_size,
+            'checksum': self.checksum,
         }
@@ -0,0 +1,83 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from services.config import ConfigHelper
+from services.database import DB
+
+
+class JobCheckpoint:
+    """
+    This class represents the progress of a backup or restoration job persisted in the datastore.
+    The checkpoint is updated at each partition boundary and removed once the job ends, so the
+    checkpoints left in the datastore after a restart of the node belong to the interrupted jobs,
+    which can be resumed from the first partition that was not imaged yet.
+    """
+    def __init__(self, job_id, operation, disk, config):
+        self.id = job_id
+        self.node = ConfigHelper.config['node']['name']
+        self.operation = operation
+        self.disk = disk
+        self.config = config
+        self.completed_partitions = []
+        self.start_time = ''
+        self.resumed = 0
+
+    @classmethod
+    def load_interrupted(cls):
+        """
+        Loads the checkpoints of the jobs interrupted on this node.
+        :return: list of JobCheckpoint objects.
+        """
+        return [cls._from_json(data) for data in DB.get_job_checkpoints()]
+
+    @classmethod
+    def _from_json(cls, json):
+        checkpoint = cls(json.get('id'), json.get('operation'), json.get('disk'), json.get('config', {}))
+        checkpoint.node = json.get('node', checkpoint.node)
+        checkpoint.completed_partitions = json.get('completed_partitions', [])
+        checkpoint.start_time = json.get('start_time', '')
+        checkpoint.resumed = json.get('resumed', 0)
+        return checkpoint
+
+    def complete_partition(self, partition_id):
+        """
+        Records the partition as imaged and persists the checkpoint.
+        :param partition_id: the identifier of the partition in the backupset.
+        :return: None
+        """
+        if partition_id not in self.completed_partitions:
+            self.completed_partitions.append(partition_id)
+        self.save()
+
+    def save(self):
+        """
+        Creates or updates the checkpoint in the datastore.
+        :return: None
+        """
+        DB.upsert_job_checkpoint(self.id, self.to_dict())
+
+    def remove(self):
+        """
+        Removes the checkpoint from the datastore, once the job does not need to be resumed.
+        :return: None
+        """
+        DB.remove_job_checkpoint(self.id)
+
+    def to_dict(self):
+        """
+        Creates a dictionary representation of the data stored by the JobCheckpoint object.
+        :return: dictionary object with keys matching all public members of the JobCheckpoint class.
+        """
+        return {
+            'id': self.id,
+            'node': self.node,
+            'operation': self.operation,
+            'disk': self.disk,
+            'config': self.config,
+            'completed_partitions': self.completed_partitions,
+            'start_time': self.start_time,
+            'resumed': self.resumed,
+        }
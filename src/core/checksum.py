@@ -0,0 +1,285 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from hashlib import blake2b
+from os import O_NONBLOCK, O_RDONLY, O_WRONLY, close, mkfifo, open as open_fifo, path, pread, remove
+from threading import Event, Thread
+
+import constants
+from lib.exceptions import ImageException
+
+CHECKSUM_ALGORITHM = 'blake2b'
+# Size of the digests of the segments in bytes, the digest of the whole file has the full size
+SEGMENT_DIGEST_SIZE = 16
+
+
+def file_checksum(file_path):
+    """
+    Calculates the checksum of a file, which is verified by the node receiving the file.
+    :param file_path: path of the file.
+    :return: hexadecimal BLAKE2b digest of the file.
+    """
+    digest = blake2b()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(constants.REMOTE_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SegmentHasher:
+    """
+    This class calculates the checksums of the fixed size segments of a stream. The checksum of
+    the whole stream is the digest of the size of the stream and the checksums of its segments,
+    so each byte is hashed only once.
+    """
+    def __init__(self, segment_size=constants.CHECKSUM_SEGMENT_SIZE):
+        """
+        :param segment_size: size of the segments in bytes.
+        :return: initialised SegmentHasher object.
+        """
+        self.segment_size = segment_size
+        self.size = 0
+        self.segments = []
+        self._segment = blake2b(digest_size=SEGMENT_DIGEST_SIZE)
+        self._segment_size = 0
+
+    def update(self, data):
+        """
+        Hashes the next bytes of the stream.
+        :param data: bytes-like object.
+        :return: None
+        """
+        view = memoryview(data)
+        while view:
+            chunk = view[:self.segment_size - self._segment_size]
+            self._segment.update(chunk)
+            self._segment_size += len(chunk)
+            self.size += len(chunk)
+            view = view[len(chunk):]
+            if self._segment_size == self.segment_size:
+                self._complete_segment()
+
+    def result(self):
+        """
+        Completes the last segment and provides the checksums.
+        :return: dictionary with the algorithm, the size of the stream, the checksum of the
+            whole stream, the size of the segments and the list of the checksums of the segments.
+        """
+        if self._segment_size:
+            self._complete_segment()
+        return {
+            'algorithm': CHECKSUM_ALGORITHM,
+            'size': self.size,
+            'checksum': whole_checksum(self.size, self.segments),
+            'segment_size': self.segment_size,
+            'segments': list(self.segments),
+        }
+
+    def _complete_segment(self):
+        self.segments.append(self._segment.hexdigest())
+        self._segment = blake2b(digest_size=SEGMENT_DIGEST_SIZE)
+        self._segment_size = 0
+
+
+def whole_checksum(size, segments):
+    """
+    Calculates the checksum of a whole stream from the checksums of its segments.
+    :param size: size of the stream in bytes.
+    :param segments: list of the hexadecimal checksums of the segments.
+    :return: hexadecimal BLAKE2b digest.
+    """
+    digest = blake2b(str(size).encode('ascii'))
+    for segment in segments:
+        digest.update(bytes.fromhex(segment))
+    return digest.hexdigest()
+
+
+class StreamHasher:
+    """
+    This class hashes an image on a worker thread while it is being written, so the checksums are
+    available without reading the image again. The image is either followed as the file grows,
+    which leaves the writing to partclone, or read from a FIFO the image stream is teed into,
+    for the images which are not stored as plain files, e.g. the compressed images.
+    """
+    def __init__(self, file_path, fifo=False, segment_size=constants.CHECKSUM_SEGMENT_SIZE):
+        """
+        :param file_path: path of the image file or of the FIFO to be created.
+        :param fifo: the flag to create a FIFO at file_path and read the stream from it.
+        :param segment_size: size of the segments in bytes.
+        :return: initialised StreamHasher object.
+        """
+        self.path = file_path
+        self.fifo = fifo
+        self.hasher = SegmentHasher(segment_size)
+        self.error = None
+        self._draining = False
+        self._finished = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        if fifo:
+            if path.exists(file_path):
+                remove(file_path)
+            mkfifo(file_path, 0o600)
+
+    def start(self):
+        """
+        Starts hashing the image.
+        :return: None
+        """
+        self._thread.start()
+
+    def finish(self, timeout=None):
+        """
+        Waits until the rest of the image is hashed, the image has to be completely written. The
+        writer of the FIFO is never left blocked on it, the FIFO is drained until the writer
+        closes it even when the hashing fails or takes longer than the timeout.
+        :param timeout: maximum number of seconds to wait.
+        :return: the checksums as provided by SegmentHasher.result, None if the image could not
+            be hashed.
+        """
+        self._finished.set()
+        if self.fifo and self._thread.is_alive():
+            self._unblock_fifo()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self._draining = True
+        elif self.fifo:
+            self._release_writer()
+        if self.fifo and path.exists(self.path):
+            remove(self.path)
+        if self.error or self._thread.is_alive():
+            return None
+        return self.hasher.result()
+
+    def _run(self):
+        try:
+            while not self.fifo and not path.exists(self.path):
+                if self._finished.is_set():
+                    raise ImageException('The image ' + self.path + ' was not created.')
+                self._finished.wait(constants.BUSY_WAIT_INTERVAL)
+            with open(self.path, 'rb', buffering=0) as image:
+                while True:
+                    finished = self._finished.is_set()
+                    chunk = image.read(constants.REMOTE_CHUNK_SIZE)
+                    if chunk:
+                        self._update(chunk)
+                    elif self.fifo or finished:
+                        break
+                    else:
+                        self._finished.wait(constants.BUSY_WAIT_INTERVAL)
+        except Exception as e:
+            self.error = e
+
+    def _update(self, chunk):
+        if self.error or self._draining:
+            return  # The rest of the stream is only drained, so the writer does not block on the FIFO
+        try:
+            self.hasher.update(chunk)
+        except Exception as e:
+            if not self.fifo:
+                raise
+            self.error = e
+
+    def _unblock_fifo(self):
+        """Opens the FIFO for writing, so the reader waiting for a writer which never came sees
+        the end of the stream."""
+        try:
+            close(open_fifo(self.path, O_WRONLY | O_NONBLOCK))
+        except OSError:
+            pass  # The writer has already opened the FIFO
+
+    def _release_writer(self):
+        """Opens the FIFO for reading once the reader is gone, so the writer waiting for a reader
+        which never came fails on the closed pipe rather than waiting forever."""
+        try:
+            close(open_fifo(self.path, O_RDONLY | O_NONBLOCK))
+        except OSError:
+            pass  # The FIFO has already been removed
+
+
+def find_first_mismatch(image, checksum, workers=constants.CHECKSUM_WORKERS, budget=None):
+    """
+    Hashes the segments of an image again and compares them with the recorded checksums. The
+    segments of a file are hashed in parallel, while a stream, e.g. an image decompressed on the
+    fly, is hashed as it is read. The verification stops at the first mismatching segment.
+    :param image: path of the image file or an iterable of the chunks of the image stream.
+    :param checksum: the checksums as provided by SegmentHasher.result.
+    :param workers: number of the segments of a file hashed in parallel.
+    :param budget: optional TokenBucket limiting the number of bytes read per second.
+    :return: None if the image matches, otherwise a dictionary with the index and the offset of
+        the first mismatching segment, or with the size if the size of the image differs.
+    """
+    if not isinstance(image, str):
+        return _find_first_mismatch_in_stream(image, checksum, budget)
+    size = path.getsize(image)
+    if size != checksum['size']:
+        return {'size': size, 'expected_size': checksum['size']}
+    with open(image, 'rb') as file, ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        mismatches = []
+        for index in range(len(checksum['segments'])):
+            pending[executor.submit(_hash_file_segment, file.fileno(), index, checksum['segment_size'],
+                                    budget)] = index
+            if len(pending) >= 2 * workers:
+                mismatches = _collect(pending, checksum, wait(pending, return_when=FIRST_COMPLETED).done)
+                if mismatches:
+                    break
+        if not mismatches:
+            mismatches = _collect(pending, checksum, list(pending))
+        for future in pending:
+            future.cancel()
+    if mismatches:
+        return _mismatch(min(mismatches), checksum)
+    return None
+
+
+def _find_first_mismatch_in_stream(chunks, checksum, budget):
+    hasher = SegmentHasher(checksum['segment_size'])
+    checked = 0
+    for chunk in chunks:
+        if budget:
+            budget.consume(len(chunk))
+        hasher.update(chunk)
+        for index in range(checked, len(hasher.segments)):
+            if index >= len(checksum['segments']):
+                return {'size': hasher.size, 'expected_size': checksum['size']}
+            if hasher.segments[index] != checksum['segments'][index]:
+                return _mismatch(index, checksum)
+        checked = len(hasher.segments)
+    result = hasher.result()
+    if result['size'] != checksum['size']:
+        return {'size': result['size'], 'expected_size': checksum['size']}
+    if result['segments'] != checksum['segments']:
+        return _mismatch(len(result['segments']) - 1, checksum)
+    return None
+
+
+def _hash_file_segment(descriptor, index, segment_size, budget):
+    digest = blake2b(digest_size=SEGMENT_DIGEST_SIZE)
+    offset = index * segment_size
+    end = offset + segment_size
+    while offset < end:
+        if budget:
+            budget.consume(min(constants.REMOTE_CHUNK_SIZE, end - offset))
+        chunk = pread(descriptor, min(constants.REMOTE_CHUNK_SIZE, end - offset), offset)
+        if not chunk:
+            break
+        digest.update(chunk)
+        offset += len(chunk)
+    return digest.hexdigest()
+
+
+def _collect(pending, checksum, done):
+    mismatches = []
+    for future in done:
+        index = pending.pop(future)
+        if future.result() != checksum['segments'][index]:
+            mismatches.append(index)
+    return mismatches
+
+
+def _mismatch(index, checksum):
+    return {'segment': index, 'offset': index * checksum['segment_size']}
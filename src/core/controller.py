@@ -8,29 +8,39 @@ import logging
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
 from logging import getLogger
-from os import path, makedirs, listdir
+from os import path, makedirs
+from tempfile import gettempdir
 from threading import Thread
 
 import constants as constants
 from core.backupset import Backupset
+from core.checkpoint import JobCheckpoint
 from core.diskdetect import DiskDetect
+from core.fanout import PipeFanOut
 from core.image import PartitionImage
 from core.nbdpool import NBDPool
 from core.parttable import DiskLayout
+from core.progress import JobProgress
+from core.remote import ImageSource, RemoteBackup
 from core.sqfs import SquashfsWrapper
+from core.verify import VERIFY_MODES
+from lib import tracing
 from lib.exceptions import DiskImageException, BackupsetException
 from services.config import ConfigHelper
-from services.utils import delete_backup, delete_dir, create_dir
+from services.database import DB
+from services.utils import check_backup_removable, delete_backup, delete_dir, create_dir, \
+    get_directory_allocated_size
 
 
 class BasicController:
     """ This class defines the common structure of all Controllers. """
     __metaclass__ = ABCMeta
 
-    def __init__(self, backup_id):
+    def __init__(self, backup_id, trace=False):
         self._logger = getLogger(__name__)
         self.backup_id = backup_id
         self.backupset = None
+        self.trace = tracing.Trace(backup_id) if trace else None
         self._status = {
             'id': str(backup_id),
             'status': constants.STATUS_PENDING,
@@ -50,6 +60,15 @@ class BasicController:
         """
         return self._status['status'] == constants.STATUS_ERROR
 
+    def get_trace(self):
+        """
+        Returns the phases of the operations executed by the controller.
+        :return: dictionary in the Chrome trace event format, None if tracing is disabled.
+        """
+        if self.trace:
+            return self.trace.to_chrome_trace()
+        return None
+
     def _set_error(self, msg):
         self._status['status'] = constants.STATUS_ERROR
         self._status['error_msg'] = str(msg)
@@ -61,23 +80,43 @@ class ProcessController(BasicController):
     which need to be executed on threads separate from the standard server response thread pool.
     """
     __metaclass__ = ABCMeta
+    OPERATION = ''
 
-    def __init__(self, disk, backup_id, config):
-        super(ProcessController, self).__init__(backup_id)
+    def __init__(self, disk, backup_id, config, prefetched=None, checkpoint=None):
+        """
+        :param disk: string identifier of the disk to be imaged.
+        :param backup_id: string identifier of the backup.
+        :param config: dictionary with the job options.
+        :param prefetched: optional dictionary with the information already retrieved for a number
+            of jobs at once, with the disk_details (as returned by DiskDetect.get_disk_details),
+            backupset (Backupset object or None if it does not exist) and rates (as returned by
+            Database.get_filesystem_rates) keys, the missing keys are retrieved by the controller.
+        :param checkpoint: JobCheckpoint of an interrupted job to be resumed, None for a new job.
+        """
+        super(ProcessController, self).__init__(backup_id, config.get('trace', False))
         self.disk = disk
         self.config = config
+        self.prefetched = prefetched or {}
+        self.resuming = checkpoint is not None
+        self.checkpoint = checkpoint or JobCheckpoint(backup_id, self.OPERATION, disk, config)
         self.backup_dir = ConfigHelper.config['node']['backup_path'] + str(backup_id) + '/'
         self._thread = None
         self._imager = None
         self._disk_layout = None
+        self._progress = None
+        self._interrupted = False
         self._status.update({
             'status': '',
             'path': '',
             'layout': '',
             'partitions': [],
+            'size': 0,
+            'completed': 0.0,
+            'remaining_seconds': None,
             'start_time': '',
             'end_time': '',
             'operation': '',
+            'resumed': self.checkpoint.resumed,
         })
 
     def get_status(self):
@@ -94,10 +133,19 @@ class ProcessController(BasicController):
         Allows killing of the job in progress.
         :return: None
         """
-        if self._imager:
-            self._imager.kill()
+        self._kill_imagers()
         self._set_error("Job cancelled by the user.")
 
+    def interrupt(self):
+        """
+        Stops the job in progress without discarding its checkpoint, e.g. when the node shuts down,
+        so that the job is resumed once the node restarts.
+        :return: None
+        """
+        self._interrupted = True
+        self._kill_imagers()
+        self._set_error("Job interrupted, it will be resumed when the node restarts.")
+
     @abstractmethod
     def run(self):
         """
@@ -106,23 +154,100 @@ class ProcessController(BasicController):
         """
         pass
 
+    def discard(self):
+        """
+        Reverts the changes made while preparing the job, when the job is not going to be run.
+        :return: None
+        """
+        pass
+
+    def wait(self, timeout=None):
+        """
+        Waits for the imaging procedures started with the run method to finish.
+        :param timeout: maximum time to wait in seconds, None to wait until they finish.
+        :return: True if the procedures have finished, False otherwise.
+        """
+        if self._thread:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def _kill_imagers(self):
+        if self._imager:
+            self._imager.kill()
+
     def _update_status(self):
         if self._imager:
             self._status['partitions'] = self._imager.get_status()
+            if self._progress:
+                self._status.update(self._progress.update(self._status['partitions']))
+
+    def _init_checkpoint(self):
+        self._imager.completed_partitions = set(self.checkpoint.completed_partitions)
+        self._imager.partition_callback = self._checkpoint_partition
+
+    def _save_checkpoint(self):
+        if not self.checkpoint.start_time:
+            self.checkpoint.start_time = self._status['start_time']
+        self._status['start_time'] = self.checkpoint.start_time
+        self.checkpoint.save()
+
+    def _checkpoint_partition(self, partition):
+        self.checkpoint.complete_partition(partition.id)
+
+    def _release_checkpoint(self):
+        if not self._interrupted:
+            self.checkpoint.remove()
+
+    def _init_progress(self):
+        partitions = self._get_progress_partitions(self.disk)
+        self._status['size'] = sum(size for _, size, _ in partitions)
+        self._progress = JobProgress(partitions, self._load_rates())
+
+    def _get_progress_partitions(self, disk):
+        return [(disk + partition.id, partition.size, partition.file_system)
+                for partition in self.backupset.partitions]
+
+    def _load_rates(self):
+        rates = self.prefetched.get('rates')
+        if rates is None:
+            try:
+                rates = DB.get_filesystem_rates()
+            except Exception as e:
+                self._logger.warning('Cannot load historical imaging throughput, cause: ' + str(e))
+                rates = {}
+        return rates
+
+    def _load_existing_backupset(self):
+        if 'backupset' in self.prefetched:
+            if self.prefetched['backupset'] is None:
+                raise BackupsetException('Could not retrieve backup information.')
+            return self.prefetched['backupset']
+        return Backupset.load(self.backup_id)
 
 
 class BackupController(ProcessController):
     """ The controller used to manage a complete Backup procedure """
-    def __init__(self, disk, backup_id, config):
-        super(BackupController, self).__init__(disk, backup_id, config)
-        try:
-            self._disk_layout = DiskLayout.with_config(self.disk, self.backup_dir, config)
-        except Exception as e:
-            self._set_error(str(e))
-            raise DiskImageException(str(e))
-        self._handle_overwrite(self.config['overwrite'])
-        self._create_backupset()
-        self._imager = PartitionImage.with_config(self.disk, self.backup_dir, self.backupset, config)
+    OPERATION = 'Backup'
+
+    def __init__(self, disk, backup_id, config, prefetched=None, checkpoint=None):
+        super(BackupController, self).__init__(disk, backup_id, config, prefetched, checkpoint)
+        with tracing.activate(self.trace), tracing.span('prepare', 'controller', disk=disk):
+            try:
+                self._disk_layout = DiskLayout.with_config(self.disk, self.backup_dir, config)
+            except Exception as e:
+                self._set_error(str(e))
+                raise DiskImageException(str(e))
+            if self.resuming:
+                self._load_interrupted_backupset()
+            else:
+                self._check_overwrite(self.config['overwrite'])
+                self._create_backupset()
+            self._imager = PartitionImage.with_config(self.disk, self.backup_dir, self.backupset, config)
+            self._init_checkpoint()
+            if self.resuming:
+                self._imager.remove_incomplete_images()
+            self._init_progress()
 
     def run(self):
         """
@@ -132,18 +257,39 @@ class BackupController(ProcessController):
         self._thread = Thread(target=self._backup)
         self._thread.start()
 
-    def _handle_overwrite(self, overwrite):
+    def _check_overwrite(self, overwrite):
         if overwrite:
-            self._remove_previous_backup()
+            self._check_previous_backup()
         if not overwrite and path.exists(self.backup_dir):
             error_msg = "Some files for the backup with id '" + self.backup_id + "' already exist "\
                             "and the overwrite option was not selected."
             self._set_error(error_msg)
             raise DiskImageException(error_msg)
 
+    def _check_previous_backup(self):
+        try:
+            check_backup_removable(self._load_existing_backupset())
+        except BackupsetException:
+            pass
+        except DiskImageException as e:
+            self._set_error(str(e))
+            raise e
+
+    def _load_interrupted_backupset(self):
+        self.backupset = Backupset.load(self.backup_id)
+        disk_details = DiskDetect.get_disk_details(self.disk)
+        if self.backupset.disk_layout != self._disk_layout.get_layout() or \
+                self.backupset.disk_size != disk_details['size']:
+            error_msg = "The disk " + self.disk + " has changed since the backup with the id '" + \
+                        self.backup_id + "' was interrupted, the backup cannot be resumed."
+            self._set_error(error_msg)
+            raise DiskImageException(error_msg)
+        self.backupset.status = constants.STATUS_RUNNING
+        self.backupset.save()
+
     def _remove_previous_backup(self):
         try:
-            backupset = Backupset.load(self.backup_id)
+            backupset = self._load_existing_backupset()
             delete_backup(backupset)
         except BackupsetException as e:
             pass
@@ -152,25 +298,45 @@ class BackupController(ProcessController):
             raise e
 
     def _init_status(self):
-        self._status['operation'] = 'Backup'
+        self._status['operation'] = self.OPERATION
         self._status['status'] = constants.STATUS_RUNNING
         self._status['start_time'] = datetime.today().strftime(constants.DATE_FORMAT)
         self._status['path'] = self.backup_dir
         self._status['layout'] = self.backupset.disk_layout
 
     def _backup(self):
-        if not self.has_error_status():
-            try:
+        with tracing.activate(self.trace), tracing.span('backup', 'controller', disk=self.disk):
+            if not self.has_error_status():
                 self._init_status()
-                self._create_backup_directory()
-                self._disk_layout.backup_layout()
-                self._imager.backup()
-                self._status['status'] = constants.STATUS_FINISHED
-            except Exception as e:
-                self._set_error(e)
-            finally:
-                self._status['end_time'] = datetime.today().strftime(constants.DATE_FORMAT)
-                self._complete_backupset()
+                if not self.resuming and not self._store_backupset():
+                    self._status['end_time'] = datetime.today().strftime(constants.DATE_FORMAT)
+                    return
+                try:
+                    self._create_backup_directory()
+                    self.backupset.write_manifest()
+                    if not self.resuming:
+                        self._disk_layout.backup_layout()
+                    self._save_checkpoint()
+                    self._imager.backup()
+                    self._status['status'] = constants.STATUS_FINISHED
+                except Exception as e:
+                    self._set_error(e)
+                finally:
+                    self._status['end_time'] = datetime.today().strftime(constants.DATE_FORMAT)
+                    self._complete_backupset()
+                    self._release_checkpoint()
+
+    def _store_backupset(self):
+        """Replaces the previous backup with the new backupset, nothing is changed before the job
+        is run, so that a job which is not run leaves the previous backup untouched."""
+        try:
+            if self.config['overwrite']:
+                self._remove_previous_backup()
+            self.backupset.save()
+            return True
+        except Exception as e:
+            self._set_error(e)
+            return False
 
     def _create_backup_directory(self):
         if not path.exists(self.backup_dir):
@@ -183,17 +349,16 @@ class BackupController(ProcessController):
 
     def _create_backupset(self):
         self._raise_if_backupset_exists()
-        disk_details = DiskDetect.get_disk_details(self.disk)
+        disk_details = self.prefetched.get('disk_details') or DiskDetect.get_disk_details(self.disk)
         self.backupset = Backupset(self.backup_id)
         self.backupset.disk_layout = self._disk_layout.get_layout()
         self.backupset.disk_size = disk_details['size']
         self.backupset.compressed = self.config['compress']
         self.backupset.add_partitions(disk_details['partitions'])
-        self.backupset.save()
 
     def _raise_if_backupset_exists(self):
         try:
-            backupset = Backupset.load(self.backup_id)
+            backupset = self._load_existing_backupset()
             if not backupset.deleted:
                 error_msg = "Backup with the id '" + self.backup_id + \
                             "' already exists and is not marked for deletion."
@@ -202,29 +367,94 @@ class BackupController(ProcessController):
         except BackupsetException:
             pass
 
+    @tracing.traced('complete_backupset', 'controller')
     def _complete_backupset(self):
         self.backupset.status = self._status['status']
-        self.backupset.backup_size = sum(path.getsize(self.backup_dir + file)
-                                         for file in listdir(self.backup_dir))
+        self._store_partition_resources()
+        if path.isdir(self.backup_dir):
+            self.backupset.update_backup_size(get_directory_allocated_size(self.backup_dir))
         self.backupset.save()
 
+    def _checkpoint_partition(self, partition):
+        self._store_partition_resources()
+        self.backupset.update_backup_size(self._get_images_size())
+        self.backupset.save()
+        super(BackupController, self)._checkpoint_partition(partition)
+
+    def _store_partition_resources(self):
+        self._update_status()
+        rates = self._progress.get_rates() if self._progress else {}
+        for partition_status in self._status['partitions']:
+            for partition in self.backupset.partitions:
+                if partition.id in self.checkpoint.completed_partitions:
+                    continue  # Stored when the partition was completed
+                if self.disk + partition.id == partition_status['name']:
+                    partition.resources = partition_status.get('resources', {})
+                    partition.image_size = partition_status.get('written', 0)
+                    if partition_status['status'] == constants.STATUS_FINISHED:
+                        partition.throughput = round(rates.get(partition_status['name'], 0))
+
+    def _update_status(self):
+        super(BackupController, self)._update_status()
+        if self._imager:
+            self._status['backup_size'] = self._get_images_size()
+
+    def _get_images_size(self):
+        written = {status['name']: status.get('written', 0) for status in self._status['partitions']}
+        return sum(partition.image_size if partition.id in self.checkpoint.completed_partitions
+                   else written.get(self.disk + partition.id, 0) for partition in self.backupset.partitions)
+
 
 class RestorationController(ProcessController):
-    """ The controller used to manage a complete Restoration procedure """
-    def __init__(self, disk, backup_id, config):
-        super(RestorationController, self).__init__(disk, backup_id, config)
-        self.backupset = self._load_backupset()
-        self._disk_layout = DiskLayout.with_config(self.disk, self.backup_dir, config,
+    """
+    The controller used to manage a complete Restoration procedure. The backups stored on
+    another node are restored by streaming their images from the node storing them. With the
+    verify option the restored partitions are compared with the images afterwards.
+    """
+    OPERATION = 'Restoration'
+
+    def __init__(self, disk, backup_id, config, prefetched=None, checkpoint=None):
+        super(RestorationController, self).__init__(disk, backup_id, config, prefetched, checkpoint)
+        self.squash_wrapper = None
+        self.remote = None
+        self.disks = self._get_target_disks()
+        self._check_verify_config()
+        with tracing.activate(self.trace), tracing.span('prepare', 'controller', disk=', '.join(self.disks)):
+            self.backupset = self._load_backupset()
+            self.layout_dir = self.backup_dir
+            if self.remote:
+                self.layout_dir = path.join(gettempdir(), 'diskimage-' + str(backup_id)) + '/'
+            self._prepare_targets()
+            self._init_progress()
+
+    def _get_target_disks(self):
+        return [self.disk]
+
+    def _prepare_targets(self):
+        """Creates the layout and the imager restoring the backup to the disk, once the backupset
+        is loaded."""
+        self._disk_layout = DiskLayout.with_config(self.disk, self.layout_dir, self.config,
                                                    self.backupset.disk_layout)
         self._imager = PartitionImage.with_config(self.disk, self.backup_dir,
-                                                  self.backupset, config)
+                                                  self.backupset, self.config)
+        self._imager.remote = self.remote
+        self._init_checkpoint()
+
+    def _check_verify_config(self):
+        verify = self.config.get('verify')
+        if verify and verify not in VERIFY_MODES:
+            raise DiskImageException("Unknown verification mode '" + str(verify) + "', expected one of: " +
+                                     ', '.join(VERIFY_MODES) + '.')
+        confidence = self.config.get('verify_confidence') or constants.VERIFY_CONFIDENCE
+        if not 0 < confidence <= 1:
+            raise DiskImageException('The verification confidence has to be greater than 0 and at most 1.')
 
     def _load_backupset(self):
-        self.backupset = Backupset.load(self.backup_id)
-        if self.backupset.node == ConfigHelper.config['node']['name']:
-            return self.backupset
-        else:
-            raise Exception('This backup resides on another node, terminating.')
+        self.backupset = self._load_existing_backupset()
+        if not self.backupset.is_stored_on(ConfigHelper.config['node']['name']):
+            self.remote = RemoteBackup.for_node(self.backupset.node, self.backup_id,
+                                                self.config.get('remote_compression', False))
+        return self.backupset
 
     def run(self):
         """
@@ -236,46 +466,298 @@ class RestorationController(ProcessController):
 
     def _init_status(self):
         self._status['status'] = constants.STATUS_RUNNING
-        self._status['operation'] = 'Restoration'
+        self._status['operation'] = self.OPERATION
         self._status['start_time'] = datetime.today().strftime(constants.DATE_FORMAT)
-        self._status['path'] = self.backupset.backup_path
+        self._status['path'] = self.remote.url if self.remote else self.backupset.backup_path
         self._status['layout'] = self.backupset.disk_layout
 
     def _restore(self):
-        try:
-            self._init_status()
-            if self.backupset.compressed:
-                self._mount_sqfs()
-            self._disk_layout.restore_layout()
-            self._imager.restore()
-            self._status['status'] = constants.STATUS_FINISHED
-        except Exception as e:
-            self._set_error(e)
-            if self.backupset.compressed:
-                self._imager.kill()
-        finally:
-            self._status['end_time'] = datetime.today().strftime(constants.DATE_FORMAT)
-            if self.backupset.compressed:
-                self._umount_sqfs()
+        with tracing.activate(self.trace), tracing.span('restore', 'controller', disk=self.disk):
+            try:
+                self._init_status()
+                if self.backupset.compressed and not self.remote and not self._imager.streams_compressed_images():
+                    self._mount_sqfs()
+                if not self.resuming:
+                    self._download_layout()
+                    self._disk_layout.restore_layout()
+                self._save_checkpoint()
+                self._imager.restore()
+                if self.config.get('verify') and not self._imager.killed:
+                    self._verify()
+                self._status['status'] = constants.STATUS_FINISHED
+            except Exception as e:
+                self._set_error(e)
+                if self.backupset.compressed:
+                    self._imager.kill()
+            finally:
+                self._status['end_time'] = datetime.today().strftime(constants.DATE_FORMAT)
+                if self.backupset.compressed:
+                    self._umount_sqfs()
+                if self.remote:
+                    delete_dir(self.layout_dir)
+                self._release_checkpoint()
+
+    def _update_status(self):
+        super(RestorationController, self)._update_status()
+        if self._imager:
+            self._update_restoration_status(self._status, self._imager)
+
+    def _update_restoration_status(self, status, imager):
+        if self.config.get('discard'):
+            status['bytes_written'] = sum(partition.get('written', 0) for partition in status['partitions'])
+            status['bytes_discarded'] = sum(partition.get('discarded', 0) for partition in status['partitions'])
+        if self.config.get('verify'):
+            status['verification'] = self._summarise_verification(imager)
+
+    @tracing.traced('verify', 'controller')
+    def _verify(self):
+        """Compares the restored partitions with the images, the job fails if any of the blocks
+        differ, while a partition which cannot be verified is only reported."""
+        self._imager.verify(self.config['verify'],
+                            self.config.get('verify_confidence') or constants.VERIFY_CONFIDENCE)
+        mismatched = self._summarise_verification()['mismatched_blocks']
+        if mismatched:
+            raise DiskImageException('The verification found ' + str(mismatched) +
+                                     ' blocks of the restored partitions differing from the backup.')
+
+    def _summarise_verification(self, imager=None):
+        summary = {
+            'mode': self.config['verify'],
+            'used_blocks': 0,
+            'checked_blocks': 0,
+            'mismatched_blocks': 0,
+            'mismatches': [],
+            'confidence': None,
+            'errors': [],
+        }
+        for partition in (imager or self._imager).get_status():
+            report = partition.get('verification')
+            if not report:
+                continue
+            if 'error' in report:
+                summary['errors'].append({'partition': partition['name'], 'error': report['error']})
+                continue
+            for key in ('used_blocks', 'checked_blocks', 'mismatched_blocks'):
+                summary[key] += report.get(key, 0)
+            summary['mismatches'] += [dict(mismatch, partition=partition['name'])
+                                      for mismatch in report.get('mismatches', [])]
+            if summary['confidence'] is None or report.get('confidence', 0) < summary['confidence']:
+                summary['confidence'] = report.get('confidence', 0)
+        summary['mismatches'] = summary['mismatches'][:constants.VERIFY_MAX_MISMATCHES]
+        return summary
+
+    @tracing.traced('download_layout', 'controller')
+    def _download_layout(self):
+        """Copies the partition table and boot record backups of a remote backup into the local
+        layout directory, the partition images are streamed while they are restored instead."""
+        if self.remote:
+            create_dir(self.layout_dir)
+            for file in self.remote.list_files():
+                if not file['name'].startswith(constants.PARTITION_FILE_PREFIX) and \
+                        file['name'] != constants.BACKUPSET_FILE:
+                    self.remote.download(file['name'], self.layout_dir + file['name'])
 
     def _mount_sqfs(self):
         self.squash_wrapper = SquashfsWrapper(self.backupset)
-        self.squash_wrapper.mount()
+        self._imager.squash_wrapper = self.squash_wrapper
 
+    @tracing.traced('sqfs.umount', 'sqfs')
     def _umount_sqfs(self):
         if self.squash_wrapper:
             if self.squash_wrapper.mounted:
                 self.squash_wrapper.umount()
 
 
+class FanOutRestorationController(RestorationController):
+    """
+    The controller used to restore a backup to a number of disks at once, e.g. to roll out the
+    same system to the disks attached to a node. The layout is restored to each of the target
+    disks, while every partition image is read only once and its stream is fanned out to a
+    partclone process per target. A target which fails or falls behind the others is left out
+    of the following partitions and the other targets continue, the job fails if any of the
+    targets failed. The progress of each target is reported under the targets key.
+    """
+
+    def __init__(self, disk, backup_id, config, prefetched=None, checkpoint=None):
+        super(FanOutRestorationController, self).__init__(disk, backup_id, config, prefetched, checkpoint)
+        self._fanout = None
+        self._killed = False
+        self._status['targets'] = {target: {'status': constants.STATUS_PENDING, 'partitions': []}
+                                   for target in self.disks}
+        for target in self.config.get('failed_targets', []):
+            if target in self._status['targets']:
+                self._fail_target(target, 'The restoration failed before the job was interrupted.')
+
+    def _get_target_disks(self):
+        targets = self.config.get('targets') or []
+        if not isinstance(targets, list) or not all(isinstance(target, str) and target for target in targets):
+            raise DiskImageException('The targets option has to be a list of the names of the disks.')
+        disks = []
+        for target in [self.disk] + targets:
+            if target not in disks:
+                disks.append(target)
+        return disks
+
+    def _prepare_targets(self):
+        """Creates the layout and the imager of each of the target disks."""
+        self._layouts = {}
+        self._imagers = {}
+        for target in self.disks:
+            self._layouts[target] = DiskLayout.with_config(target, self.layout_dir, self.config,
+                                                           self.backupset.disk_layout)
+            self._imagers[target] = PartitionImage.with_config(target, self.backup_dir,
+                                                               self.backupset, self.config)
+            self._imagers[target].remote = self.remote
+            self._imagers[target].completed_partitions = set(self.checkpoint.completed_partitions)
+
+    def _init_progress(self):
+        rates = self._load_rates()
+        self._target_progress = {target: JobProgress(self._get_progress_partitions(target), rates)
+                                 for target in self.disks}
+        self._status['size'] = sum(size for _, size, _ in self._get_progress_partitions(self.disk)) * len(self.disks)
+
+    def _init_status(self):
+        super(FanOutRestorationController, self)._init_status()
+        for target in self._live_targets():
+            self._status['targets'][target]['status'] = constants.STATUS_RUNNING
+
+    def _restore(self):
+        with tracing.activate(self.trace), tracing.span('restore', 'controller', disk=', '.join(self.disks)):
+            try:
+                self._init_status()
+                if not self.resuming:
+                    self._download_layout()
+                    self._run_on_targets(lambda target: self._layouts[target].restore_layout())
+                self._save_checkpoint()
+                for partition in self.backupset.partitions:
+                    if self._killed or not self._live_targets():
+                        break
+                    self._restore_partition(partition)
+                if self.config.get('verify') and not self._killed:
+                    self._run_on_targets(self._verify_target)
+                self._finish_targets()
+                self._status['status'] = constants.STATUS_FINISHED
+            except Exception as e:
+                self._set_error(e)
+                self._kill_imagers()
+            finally:
+                self._status['end_time'] = datetime.today().strftime(constants.DATE_FORMAT)
+                if self.remote:
+                    delete_dir(self.layout_dir)
+                self._release_checkpoint()
+
+    def _restore_partition(self, partition):
+        """Streams the image of the partition to all live targets at once, the partitions
+        completed before the job was interrupted are only marked as finished."""
+        if partition.id in self.checkpoint.completed_partitions:
+            self._run_on_targets(lambda target: self._imagers[target].restore_partition(partition))
+            return
+        targets = self._live_targets()
+        name = constants.PARTITION_FILE_PREFIX + partition.id + constants.PARTITION_FILE_SUFFIX
+        # The backlog of the lagging targets is spilled to the backup volume rather than to /tmp,
+        # which may be a small tmpfs
+        self._fanout = PipeFanOut(self._read_image(name), targets,
+                                  spill_dir=ConfigHelper.config['node']['backup_path'])
+        try:
+            self._fanout.start()
+            self._run_on_targets(lambda target: self._imagers[target].restore_partition(
+                partition, self._fanout.branches[target]), targets)
+        finally:
+            self._fanout.close()
+            self._fanout.join(constants.JOB_KILL_TIMEOUT)
+            self._fanout = None
+        if self._live_targets() and not self._killed:
+            self.checkpoint.complete_partition(partition.id)
+
+    def _read_image(self, name):
+        if self.remote:
+            return self.remote.iter_content(name)
+        return ImageSource(self.backup_dir).read(name)
+
+    def _verify_target(self, target):
+        imager = self._imagers[target]
+        imager.verify(self.config['verify'], self.config.get('verify_confidence') or constants.VERIFY_CONFIDENCE)
+        mismatched = self._summarise_verification(imager)['mismatched_blocks']
+        if mismatched:
+            raise DiskImageException('The verification found ' + str(mismatched) +
+                                     ' blocks of the restored partitions differing from the backup.')
+
+    def _run_on_targets(self, function, targets=None):
+        """Calls the function with each of the live targets on a thread of its own, a target for
+        which the function fails is marked as failed without affecting the other targets."""
+        threads = [Thread(target=tracing.bind(self._run_on_target), args=(function, target), daemon=True)
+                   for target in (targets or self._live_targets())]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _run_on_target(self, function, target):
+        try:
+            function(target)
+        except Exception as e:
+            self._fail_target(target, e)
+
+    def _live_targets(self):
+        return [target for target in self.disks
+                if self._status['targets'][target]['status'] != constants.STATUS_ERROR]
+
+    def _fail_target(self, target, error):
+        status = self._status['targets'][target]
+        status['status'] = constants.STATUS_ERROR
+        status['error_msg'] = str(error)
+        if self._killed:
+            return  # The targets are restored again when an interrupted job is resumed
+        failed = self.config.setdefault('failed_targets', [])
+        if target not in failed:
+            failed.append(target)
+        self._logger.error('The restoration of the backup ' + str(self.backup_id) + ' to the disk ' + target +
+                           ' failed, the other targets continue. Cause: ' + str(error))
+
+    def _finish_targets(self):
+        for target in self._live_targets():
+            self._status['targets'][target]['status'] = constants.STATUS_FINISHED
+        failed = [target for target in self.disks if target not in self._live_targets()]
+        if failed:
+            raise DiskImageException('The restoration failed on ' + str(len(failed)) + ' of ' +
+                                     str(len(self.disks)) + ' target disks: ' + ', '.join(failed) + '.')
+
+    def _kill_imagers(self):
+        self._killed = True
+        for imager in self._imagers.values():
+            imager.kill()
+        fanout = self._fanout
+        if fanout:
+            fanout.close()
+
+    def _update_status(self):
+        partitions = []
+        live = []
+        for target, imager in self._imagers.items():
+            status = self._status['targets'][target]
+            status['partitions'] = imager.get_status()
+            status.update(self._target_progress[target].update(status['partitions']))
+            self._update_restoration_status(status, imager)
+            partitions += status['partitions']
+            if status['status'] != constants.STATUS_ERROR:
+                live.append(status)
+        self._status['partitions'] = partitions
+        live = live or list(self._status['targets'].values())
+        remaining = [status['remaining_seconds'] for status in live]
+        self._status['completed'] = round(sum(status['completed'] for status in live) / len(live), 2)
+        self._status['remaining_seconds'] = None if None in remaining else max(remaining)
+        self._status['throughput'] = sum(status['throughput'] for status in live)
+
+
 class MountController(BasicController):
     """ The controller used to manage mounting and unmounting procedures """
     NODE_POOL = NBDPool
 
-    def __init__(self, backup_id):
-        super(MountController, self).__init__(backup_id)
+    def __init__(self, backup_id, trace=False):
+        super(MountController, self).__init__(backup_id, trace)
         self.nodes = []
-        self.backupset = Backupset.load(backup_id)
+        with tracing.activate(self.trace):
+            self.backupset = Backupset.load(backup_id)
         self.squash_wrapper = None
         self.mount_path = ConfigHelper.config['node']['mount_path'] + self.backupset.id + '/'
 
@@ -285,18 +767,21 @@ class MountController(BasicController):
         followed by mounting of the backup.
         :return: None
         """
-        try:
-            self._squashfs_mount()
-            create_dir(self.mount_path)
-            self._mount_partitions()
-            self._status['status'] = constants.STATUS_RUNNING
-            if not self._is_mounted_correctly():
-                self._release_nodes()
-                delete_dir(self.mount_path)
+        with tracing.activate(self.trace), tracing.span('mount', 'controller'):
+            try:
+                self._squashfs_mount()
+                create_dir(self.mount_path)
+                self._mount_partitions()
+                self._status['status'] = constants.STATUS_RUNNING
+                if self.squash_wrapper:
+                    self._status['mount_latency'] = self.squash_wrapper.mount_latency
+                if not self._is_mounted_correctly():
+                    self._release_nodes()
+                    delete_dir(self.mount_path)
+                    self._squashfs_umount()
+            except:
                 self._squashfs_umount()
-        except:
-            self._squashfs_umount()
-            raise
+                raise
 
     def unmount(self):
         """
@@ -304,19 +789,22 @@ class MountController(BasicController):
         and system links created by backup function.
         :return: None
         """
-        try:
-            self._release_nodes()
-            delete_dir(self.mount_path)
-        except:
-            raise
-        finally:
-            self._squashfs_umount()
+        with tracing.activate(self.trace), tracing.span('unmount', 'controller'):
+            try:
+                self._release_nodes()
+                delete_dir(self.mount_path)
+            except:
+                raise
+            finally:
+                self._squashfs_umount()
 
+    @tracing.traced('sqfs.mount', 'sqfs')
     def _squashfs_mount(self):
         if not self.squash_wrapper and self.backupset.compressed:
             self.squash_wrapper = SquashfsWrapper(self.backupset)
             self.squash_wrapper.mount()
 
+    @tracing.traced('sqfs.umount', 'sqfs')
     def _squashfs_umount(self):
         if self.backupset.compressed and self.squash_wrapper and self.squash_wrapper.mounted:
             self.squash_wrapper.umount()
@@ -327,7 +815,8 @@ class MountController(BasicController):
             image_path = self._get_image_path(partition)
             image_mount_path = self._get_image_mount_path(partition)
             create_dir(image_mount_path)
-            node.mount(image_path, partition.file_system, image_mount_path)
+            with tracing.span('nbd.mount', 'mount', partition=partition.id, device=node.device):
+                node.mount(image_path, partition.file_system, image_mount_path)
             self.nodes.append(node)
 
     def _get_image_path(self, partition):
@@ -0,0 +1,268 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import fcntl
+import re
+import struct
+import zlib
+from os import O_WRONLY, close, open as open_device
+
+import constants
+from lib.exceptions import ImageException
+
+# ioctl requests from linux/fs.h: _IO(0x12, 119) and _IO(0x12, 127)
+BLKDISCARD = 0x1277
+BLKZEROOUT = 0x127f
+
+DISCARD_MODE = 'discard'
+ZEROOUT_MODE = 'zeroout'
+
+
+def get_discard_max_bytes(disk):
+    """
+    Reads the maximum number of bytes the disk discards with a single request from sysfs.
+    :param disk: the name of the disk, e.g. sda, the partitions share the queue of their disk.
+    :return: number of bytes, 0 if the disk does not support discard.
+    """
+    try:
+        with open(constants.SYSFS_BLOCK_PATH + disk + '/queue/discard_max_bytes') as value:
+            return int(value.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+
+def _partclone_crc32(data):
+    """partclone seeds its crc32 with 0xffffffff and does not invert the result, unlike zlib."""
+    return zlib.crc32(data) ^ 0xFFFFFFFF
+
+
+class PartcloneBitmap:
+    """
+    This class reads the header and the bitmap of the used blocks of a partclone image in the
+    version 2 format, which allows finding the blocks partclone does not write on restore.
+    """
+    # image_head_v2, file_system_info_v1 and image_options_v1 structures followed by the crc32
+    _HEADER = struct.Struct('<16s14s4sH16sQQQQIIHHHHIBBI')
+    _MAGIC = b'partclone-image'
+    _ENDIANNESS = 0xC0DE
+    _BITMAP_BIT = 1
+    _BITMAP_BYTE = 8
+    _BITMAP_CRC_SIZE = 4
+    _CHECKSUM_CRC32 = 0x20
+    HEADER_SIZE = _HEADER.size
+
+    def __init__(self, header):
+        """
+        :param header: the first HEADER_SIZE bytes of the image.
+        :return: initialised PartcloneBitmap object.
+        :exception: ImageException if the image is not in a supported format.
+        """
+        if len(header) < self.HEADER_SIZE:
+            raise ImageException('The partclone image header is truncated.')
+        fields = self._HEADER.unpack(header[:self.HEADER_SIZE])
+        magic, version, endianness = fields[0], fields[2], fields[3]
+        if not magic.startswith(self._MAGIC) or version != b'0002' or endianness != self._ENDIANNESS:
+            raise ImageException('Only the little endian partclone images in the version 2 format are supported.')
+        self.device_size, self.total_blocks, self.used_blocks = fields[5], fields[6], fields[7]
+        self.block_size = fields[9]
+        self.checksum_mode, self.checksum_size, self.blocks_per_checksum = fields[13], fields[14], fields[15]
+        self.reseed_checksum = bool(fields[16])
+        self.bitmap_mode = fields[17]
+        self.crc = fields[18]
+        self._header = header[:self.HEADER_SIZE]
+        if self.bitmap_mode not in (self._BITMAP_BIT, self._BITMAP_BYTE):
+            raise ImageException('The partclone image does not contain the bitmap of the used blocks.')
+
+    @property
+    def bitmap_size(self):
+        """ Number of bytes of the bitmap following the header. """
+        if self.bitmap_mode == self._BITMAP_BIT:
+            return (self.total_blocks + 7) // 8
+        return self.total_blocks
+
+    @property
+    def data_offset(self):
+        """ Offset of the first used block in the image, the bitmap is followed by its crc32. """
+        return self.HEADER_SIZE + self.bitmap_size + self._BITMAP_CRC_SIZE
+
+    @property
+    def min_image_size(self):
+        """ The smallest size of a complete image in bytes, excluding the checksums of the blocks. """
+        return self.data_offset + self.used_blocks * self.block_size
+
+    @property
+    def image_size(self):
+        """ The size of a complete image in bytes, the last group of blocks has its checksum too. """
+        size = self.image_offset(self.used_blocks)
+        if self.checksum_size and self.blocks_per_checksum and self.used_blocks % self.blocks_per_checksum:
+            size += self.checksum_size
+        return size
+
+    def header_is_valid(self):
+        """
+        Checks the header against the crc32 stored at its end.
+        :return: True if the header is intact, False otherwise.
+        """
+        return _partclone_crc32(self._header[:-self._BITMAP_CRC_SIZE]) == self.crc
+
+    def bitmap_is_valid(self, data):
+        """
+        Checks the bitmap against the crc32 following it.
+        :param data: the bitmap_size bytes following the header of the image and the crc32.
+        :return: True if the bitmap is intact, False otherwise.
+        """
+        if len(data) < self.bitmap_size + self._BITMAP_CRC_SIZE:
+            return False
+        crc, = struct.unpack('<I', data[self.bitmap_size:self.bitmap_size + self._BITMAP_CRC_SIZE])
+        return _partclone_crc32(data[:self.bitmap_size]) == crc
+
+    def image_offset(self, rank):
+        """
+        Finds the position of a used block in the image, the used blocks are stored in order and
+        each group of blocks_per_checksum blocks is followed by its checksum.
+        :param rank: the number of the used blocks preceding the block on the partition.
+        :return: offset of the block in the image in bytes.
+        """
+        offset = self.data_offset + rank * self.block_size
+        if self.checksum_size and self.blocks_per_checksum:
+            offset += rank // self.blocks_per_checksum * self.checksum_size
+        return offset
+
+    def find_corrupted_group(self, chunks):
+        """
+        Reads the used blocks of the image and checks each group of blocks_per_checksum blocks
+        against the crc32 following it, the blocks of the images without the crc32 are only read.
+        :param chunks: iterable of the chunks of the image starting at data_offset.
+        :return: the index of the first group of blocks which does not match its crc32 or which
+            is truncated, None if all the groups match.
+        """
+        verified = self.checksum_mode == self._CHECKSUM_CRC32 and self.checksum_size == self._BITMAP_CRC_SIZE \
+            and self.blocks_per_checksum
+        group, crc, stored = 0, 0, b''
+        remaining = self.used_blocks
+        left = min(self.blocks_per_checksum, remaining) * self.block_size if verified else 0
+        for chunk in chunks:
+            view = memoryview(chunk)
+            while verified and remaining and view:
+                if left:
+                    data = view[:left]
+                    crc = zlib.crc32(data, crc)
+                    left -= len(data)
+                    view = view[len(data):]
+                    continue
+                missing = self.checksum_size - len(stored)
+                stored += bytes(view[:missing])
+                view = view[missing:]
+                if len(stored) < self.checksum_size:
+                    continue
+                if struct.unpack('<I', stored)[0] != crc ^ 0xFFFFFFFF:  # See _partclone_crc32
+                    return group
+                remaining -= min(self.blocks_per_checksum, remaining)
+                group, stored = group + 1, b''
+                if self.reseed_checksum:
+                    crc = 0
+                left = min(self.blocks_per_checksum, remaining) * self.block_size
+        return group if verified and remaining else None
+
+    def used_extents(self, bitmap):
+        """
+        Finds the ranges of the blocks which are used by the file system.
+        :param bitmap: the bitmap_size bytes following the header of the image.
+        :return: generator of (block, count) tuples in blocks.
+        """
+        block = 0
+        for offset, length in self.free_ranges(bitmap):
+            start = offset // self.block_size
+            if start > block:
+                yield block, start - block
+            block = start + length // self.block_size
+        if block < self.total_blocks:
+            yield block, self.total_blocks - block
+
+    def free_ranges(self, bitmap):
+        """
+        Finds the ranges of the blocks which are not used by the file system.
+        :param bitmap: the bitmap_size bytes following the header of the image.
+        :return: generator of (offset, length) tuples in bytes, relative to the partition start.
+        """
+        if len(bitmap) < self.bitmap_size:
+            raise ImageException('The bitmap of the partclone image is truncated.')
+        start = end = None
+        for block, count in self._free_blocks(bitmap[:self.bitmap_size]):
+            if block == end:
+                end += count
+                continue
+            if start is not None:
+                yield start * self.block_size, (end - start) * self.block_size
+            start, end = block, block + count
+        if start is not None:
+            end = min(end, self.total_blocks)
+            yield start * self.block_size, (end - start) * self.block_size
+
+    def _free_blocks(self, bitmap):
+        if self.bitmap_mode == self._BITMAP_BYTE:
+            for match in re.finditer(b'\x00+', bitmap):
+                yield match.start(), match.end() - match.start()
+            return
+        # Whole bytes of free blocks are matched at once, only the bytes mixing used and free
+        # blocks are inspected bit by bit (the lowest bit is the first block).
+        for match in re.finditer(b'\x00+|[^\x00\xff]', bitmap):
+            if bitmap[match.start()] == 0:
+                yield match.start() * 8, (match.end() - match.start()) * 8
+            else:
+                byte = bitmap[match.start()]
+                for bit in range(8):
+                    if not byte & (1 << bit):
+                        yield match.start() * 8 + bit, 1
+
+
+class BlockDevice:
+    """
+    This class releases the ranges of a block device without writing them, either by discarding
+    them (BLKDISCARD) if the disk supports it, or by zeroing them (BLKZEROOUT), which lets the
+    disk use its write zeroes command when available. The ranges are split into requests no
+    larger than the discard_max_bytes limit of the disk, so a long operation can be stopped.
+    """
+    def __init__(self, device, disk, mode=None):
+        """
+        :param device: path of the block device, e.g. /dev/sda1.
+        :param disk: the name of the disk the device belongs to, e.g. sda.
+        :param mode: discard or zeroout, detected from the discard support of the disk if None.
+        :return: initialised BlockDevice object.
+        """
+        self.device = device
+        self.discard_max_bytes = get_discard_max_bytes(disk)
+        self.mode = mode or (DISCARD_MODE if self.discard_max_bytes else ZEROOUT_MODE)
+        self.released = 0
+        self.stopped = False
+
+    def release(self, ranges):
+        """
+        Discards or zeroes the ranges of the device.
+        :param ranges: iterable of (offset, length) tuples in bytes.
+        :return: number of bytes released.
+        """
+        request = BLKDISCARD if self.mode == DISCARD_MODE else BLKZEROOUT
+        max_bytes = self.discard_max_bytes or constants.ZEROOUT_REQUEST_SIZE
+        descriptor = open_device(self.device, O_WRONLY)
+        try:
+            for offset, length in ranges:
+                while length > 0 and not self.stopped:
+                    size = min(length, max_bytes)
+                    fcntl.ioctl(descriptor, request, struct.pack('QQ', offset, size))
+                    self.released += size
+                    offset += size
+                    length -= size
+        finally:
+            close(descriptor)
+        return self.released
+
+    def stop(self):
+        """
+        Stops releasing the ranges after the current request.
+        :return: None
+        """
+        self.stopped = True
@@ -8,6 +8,7 @@ import logging
 import re
 from threading import Lock
 
+from lib.tracing import traced
 from .runcommand import Execute, OutputParser
 
 _LSBLK_COLUMNS = ['KNAME', 'TYPE', 'FSTYPE', 'SIZE']
@@ -125,6 +126,7 @@ class _DiskDetect:
                 return disk
         raise ValueError("Disk " + disk_id + " was not detected by the system.")
 
+    @traced('lsblk', 'diskdetect')
     def _detect_disks(self):
         with self._lock:
             try:
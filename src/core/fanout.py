@@ -0,0 +1,298 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import logging
+from os import close, fdopen, pipe, pread, pwrite, set_blocking, write
+from queue import Empty, Full, Queue
+from select import select
+from tempfile import TemporaryFile, gettempdir
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from psutil import disk_usage
+
+import constants
+from lib.exceptions import ImageException
+
+_logger = logging.getLogger(__name__)
+
+
+class FanOutBranch:
+    """
+    This class streams the chunks handed over by PipeFanOut into the pipe of a single target,
+    it provides the reader, transferred and error attributes and the close and join methods of
+    the PipeFeeder, so it can be used as the standard input of partclone in its place. The writes
+    to the pipe never block, so a branch can be dropped while its reading process is stuck. The
+    chunks which do not fit into the buffer are spilled into a temporary file, which the branch
+    reads back once its buffer is written, so a slow target does not hold back the others. The
+    spill file never takes the last FANOUT_SPILL_RESERVE bytes of free space of its file system.
+    """
+    def __init__(self, name, buffer_chunks, stall_timeout, spill_size, spill_dir=None, taken=None):
+        """
+        :param name: the name of the target, used in the messages.
+        :param buffer_chunks: the number of the chunks buffered for the target.
+        :param stall_timeout: the longest time the target may not take any data in seconds.
+        :param spill_size: the number of bytes spilled at most before the target catches up.
+        :param spill_dir: the directory of the spill file, the default temporary directory if None.
+        :param taken: optional Event set whenever a chunk is taken from the buffer.
+        :return: initialised FanOutBranch object.
+        """
+        reader, self._writer = pipe()
+        set_blocking(self._writer, False)
+        self.reader = fdopen(reader, 'rb', buffering=0)
+        self.name = name
+        self.stall_timeout = stall_timeout
+        self.spill_size = spill_size
+        self.spill_dir = spill_dir or gettempdir()
+        self.transferred = 0
+        self.error = None
+        self.closed = Event()
+        self._queue = Queue(buffer_chunks)
+        self._lock = Lock()
+        self._spill = None
+        self._spilling = False
+        self._spilled = 0
+        self._unspilled = 0
+        self._ended = False
+        self._taken = taken or Event()
+        self._thread = Thread(target=self._write, daemon=True)
+
+    def start(self):
+        """
+        Starts writing the chunks into the pipe.
+        :return: None
+        """
+        self._thread.start()
+
+    def has_room(self):
+        """
+        Checks whether the next chunk would be buffered rather than spilled.
+        :return: True if the branch is not spilling and its buffer is not full, False otherwise.
+        """
+        with self._lock:
+            return not self._spilling and not self._queue.full()
+
+    def put(self, chunk):
+        """
+        Hands over the next chunk of the stream without waiting for the target, the chunks which
+        do not fit into the buffer are spilled, a closed branch accepts the chunks without keeping
+        them. The branch is dropped if its spill file would outgrow the spill size or the free space
+        of its file system.
+        :param chunk: bytes-like object, None to end the stream.
+        :return: None
+        """
+        with self._lock:
+            if self.closed.is_set():
+                return
+            if not self._spilling:
+                try:
+                    self._queue.put_nowait(chunk)
+                    return
+                except Full:
+                    self._spilling = True
+            if chunk is None:
+                self._ended = True
+            elif self._spilled + len(chunk) > self.spill_size:
+                self._fall_behind(', its backlog would exceed the spill size of ' + str(self.spill_size) + ' bytes')
+            else:
+                try:
+                    if disk_usage(self.spill_dir).free - len(chunk) < constants.FANOUT_SPILL_RESERVE:
+                        self._fall_behind(', the free space of ' + self.spill_dir + ' is too low to spill its backlog')
+                    else:
+                        self._spill_chunk(chunk)
+                except OSError as e:
+                    self._fall_behind(', its backlog cannot be spilled, cause: ' + str(e))
+
+    def drop(self, error):
+        """
+        Stops streaming into the pipe with the error, the reading process sees the stream end.
+        :param error: the exception describing why the branch was dropped.
+        :return: None
+        """
+        if not self.closed.is_set():
+            self.error = error
+            self.closed.set()
+
+    def close(self):
+        """
+        Stops streaming and closes the reading end of the pipe held by this process.
+        :return: None
+        """
+        self.closed.set()
+        self.reader.close()
+
+    def join(self, timeout=None):
+        """
+        Waits for the streaming thread to finish.
+        :param timeout: maximum time to wait in seconds, None to wait until it finishes.
+        :return: None
+        """
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _write(self):
+        try:
+            while not self.closed.is_set():
+                try:
+                    chunk = self._get()
+                except Empty:
+                    continue
+                if chunk is None:
+                    break
+                view = memoryview(chunk)
+                progressed = monotonic()
+                while view and not self.closed.is_set():
+                    if select((), (self._writer,), (), constants.FANOUT_POLL_INTERVAL)[1]:
+                        try:
+                            view = view[write(self._writer, view):]
+                            progressed = monotonic()
+                        except BlockingIOError:
+                            continue
+                    elif monotonic() - progressed > self.stall_timeout:
+                        self._fall_behind(', it did not take any data for ' + str(self.stall_timeout) + ' seconds')
+                self.transferred += len(chunk) - len(view)
+        except BrokenPipeError:
+            pass  # The reading process has exited, its exit code tells whether it failed
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._lock:
+                self.closed.set()
+                close(self._writer)
+                if self._spill:
+                    self._spill.close()
+
+    def _get(self):
+        """Takes the next chunk from the buffer, or from the spill file once the chunks buffered
+        before the spilling started are written."""
+        with self._lock:
+            spilling = self._spilling
+        try:
+            chunk = self._queue.get(block=not spilling, timeout=constants.FANOUT_POLL_INTERVAL)
+            self._taken.set()
+            return chunk
+        except Empty:
+            with self._lock:
+                if not self._spilling:
+                    raise
+                if self._unspilled < self._spilled:
+                    chunk = pread(self._spill.fileno(), constants.REMOTE_CHUNK_SIZE, self._unspilled)
+                    self._unspilled += len(chunk)
+                    return chunk
+                if self._ended:
+                    return None
+                # The target caught up, the following chunks are buffered again
+                self._spill.truncate(0)
+                self._spilled = self._unspilled = 0
+                self._spilling = False
+                raise
+
+    def _spill_chunk(self, chunk):
+        if not self._spill:
+            self._spill = TemporaryFile(prefix='.fanout-', dir=self.spill_dir)
+        view = memoryview(chunk)
+        while view:
+            written = pwrite(self._spill.fileno(), view, self._spilled)
+            self._spilled += written
+            view = view[written:]
+
+    def _fall_behind(self, reason):
+        _logger.warning('The target ' + self.name + ' is dropped, it fell behind the other targets' + reason + '.')
+        self.drop(ImageException('The target fell behind the other targets' + reason + '.'))
+
+
+class PipeFanOut:
+    """
+    This class reads a stream once, e.g. a partition image, and fans it out into the pipes of a
+    number of targets, each with a buffer and a spill file of its own, so the targets proceed at
+    their own pace and a slow target reads its backlog from the spill file rather than holding
+    back the others. The stream is read at the pace of the fastest target, so only the targets
+    falling behind it spill. A target which exits stops receiving the stream, while a target
+    which does not take any data for stall_timeout seconds or whose backlog outgrows the spill
+    size is dropped.
+    """
+    def __init__(self, chunks, names, buffer_size=constants.FANOUT_BUFFER_SIZE,
+                 stall_timeout=constants.FANOUT_STALL_TIMEOUT, spill_size=constants.FANOUT_SPILL_SIZE,
+                 spill_dir=None):
+        """
+        :param chunks: iterable of the chunks of the stream.
+        :param names: list of the names of the targets.
+        :param buffer_size: the number of bytes buffered per target.
+        :param stall_timeout: the longest time a target may not take any data in seconds.
+        :param spill_size: the number of bytes spilled per target at most before it catches up.
+        :param spill_dir: the directory of the spill files, the default temporary directory if None.
+        :return: initialised PipeFanOut object.
+        """
+        self.chunks = chunks
+        self._taken = Event()
+        self.branches = {name: FanOutBranch(name, max(1, buffer_size // constants.REMOTE_CHUNK_SIZE),
+                                            stall_timeout, spill_size, spill_dir, self._taken)
+                         for name in names}
+        self.read = 0
+        self.error = None
+        self._stopped = False
+        self._thread = Thread(target=self._feed, daemon=True)
+
+    def start(self):
+        """
+        Starts reading the stream and writing it into the pipes.
+        :return: None
+        """
+        for branch in self.branches.values():
+            branch.start()
+        self._thread.start()
+
+    def close(self):
+        """
+        Stops reading the stream and closes the pipes of all targets.
+        :return: None
+        """
+        self._stopped = True
+        for branch in self.branches.values():
+            branch.close()
+
+    def join(self, timeout=None):
+        """
+        Waits for the reading and the streaming threads to finish.
+        :param timeout: maximum time to wait for each of the threads in seconds, None to wait
+            until they finish.
+        :return: None
+        """
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        for branch in self.branches.values():
+            branch.join(timeout)
+
+    def _feed(self):
+        try:
+            for chunk in self.chunks:
+                branches = self._wait_for_room()
+                if self._stopped or not branches:
+                    break
+                self.read += len(chunk)
+                for branch in branches:
+                    branch.put(chunk)
+        except Exception as e:
+            _logger.error('Cannot read the stream fanned out to ' + ', '.join(self.branches) + ', cause: ' + str(e))
+            self.error = e
+            for branch in self.branches.values():
+                branch.drop(e)  # The image stopped arriving before partclone failed
+        finally:
+            for branch in self.branches.values():
+                branch.put(None)
+            if hasattr(self.chunks, 'close'):
+                self.chunks.close()
+
+    def _wait_for_room(self):
+        """Waits until the buffer of the leading target has room for the next chunk, the targets
+        falling behind it spill the chunk instead."""
+        while not self._stopped:
+            self._taken.clear()
+            branches = [branch for branch in self.branches.values() if not branch.closed.is_set()]
+            if not branches or any(branch.has_room() for branch in branches):
+                return branches
+            self._taken.wait(constants.FANOUT_POLL_INTERVAL)
+        return []
@@ -5,15 +5,43 @@ License:    GPL
 """
 
 import logging
-from os import path, remove
+from os import cpu_count, path, remove
+from shlex import quote
 
 import constants
-from lib.exceptions import ImageException, DiskSpaceException
-from services.utils import BackupRemover
+from lib import tracing
+from lib.exceptions import DiskImageException, ImageException, DiskSpaceException
+from services.utils import BackupRemover, get_allocated_size
 from .backupset import Backupset
+from .checksum import StreamHasher
+from .discard import BlockDevice, PartcloneBitmap
+from .remote import ImageSource, PipeFeeder
+from .verify import BlockVerifier, FileImage, RemoteImage, SequentialImage, UsedBlocks
 from .runcommand import OutputParser, Execute
 
 
+def get_compressed_file(image_file):
+    """
+    Finds the squashfs file holding the compressed partition image.
+    :param image_file: path of the partition image eg. /tmp/img1/part1.img
+    :return: path of the squashfs file eg. /tmp/img1/part1.sqfs
+    """
+    if image_file.endswith(constants.PARTITION_FILE_SUFFIX):
+        image_file = image_file[:-len(constants.PARTITION_FILE_SUFFIX)]
+    return image_file + constants.COMPRESSED_FILE_SUFFIX
+
+
+def shell_pipeline(*commands):
+    """
+    Joins the commands into a pipeline run by bash with the pipefail option, so the pipeline
+    fails when any of its commands fails rather than only when the last one does.
+    :param commands: lists of the arguments of the commands, the arguments are quoted.
+    :return: command ready to be used with the Execute class.
+    """
+    return ['bash', '-o', 'pipefail', '-c',
+            ' | '.join(' '.join(quote(str(argument)) for argument in command) for command in commands)]
+
+
 class PartitionImage:
     """A wrapper class for the Open Source partition imaging tool partclone
     (http://partclone.org/) and read only compressed file system squashfs.
@@ -42,7 +70,8 @@ class PartitionImage:
 
     def __init__(self, disk: str, path: str, backupset: 'Backupset', overwrite: bool = False, rescue: bool = False,
                  space_check: bool = True, fs_check: bool = True, crc_check: bool = True,
-                 force: bool = False, refresh_delay: int = 5, compress: bool = False):
+                 force: bool = False, refresh_delay: int = 5, compress: bool = False,
+                 stream: bool = False, discard: bool = False):
         self.disk = disk
         self.backupset = backupset
         self.path = path
@@ -55,11 +84,22 @@ class PartitionImage:
             'crc_check': crc_check,
             'force': force,
             'refresh_delay': refresh_delay,
-            'compress': compress
+            'compress': compress,
+            'stream': stream,
+            'discard': discard,
         }
+        self.squash_wrapper = None
+        self.remote = None
+        self.completed_partitions = set()
+        self.partition_callback = None
         self._status = []
         self._current_partition = ""
+        self._current_output_file = None
         self._runner = None
+        self._feeder = None
+        self._block_device = None
+        self._verifier = None
+        self._hasher = None
         self._logger = logging.getLogger(__name__)
         self._init_status()
 
@@ -72,14 +112,15 @@ class PartitionImage:
         :param path: backup path to be used.
         :param backupset: a valid and initialised backupset object.
         :param config: a dictionary containing all the fields specified in the PartitionImage
-            constructor.
+            constructor, the stream and discard fields are optional.
         :return: initialised PartitionImage object.
         """
         try:
             return cls(disk, path, backupset, config['overwrite'], config['rescue'],
                        config['space_check'], config['fs_check'],
                        config['crc_check'], config['force'],
-                       config['refresh_delay'], config['compress'])
+                       config['refresh_delay'], config['compress'],
+                       config.get('stream', False), config.get('discard', False))
         except BaseException as e:
             logging.getLogger(__name__).error('Cannot build imager with config ' + str(config) + ', reason: ' + str(e))
             raise e
@@ -94,24 +135,84 @@ class PartitionImage:
 
     def backup(self):
         """
-        Creates image backup for each of the partitions on the designated drive
+        Creates image backup for each of the partitions on the designated drive, the checksums
+        of each image are calculated while it is being written and stored with the partition.
         :return: None
         """
         for partition in self.backupset.partitions:
-            if not self.killed:
+            if not self.killed and not self._skip_completed(partition):
                 self._prepare_partition_info(partition)
                 self._runner = self._get_backup_runner()
-                self._run_process()
+                try:
+                    self._run_process()
+                    partition.checksum = self._finish_hasher()
+                finally:
+                    self._release_hasher()
+                self._complete_partition(partition)
 
     def restore(self):
         """
-        Restores image backups to the designated drive
+        Restores image backups to the designated drive, the images are streamed from another
+        node if the remote source is set. With the discard option the blocks unused by the
+        file systems are discarded rather than left with their previous contents.
         :return: None
         """
         for partition in self.backupset.partitions:
-            self._prepare_partition_info(partition)
-            self._runner = self._get_restoration_runner()
+            self.restore_partition(partition)
+
+    def restore_partition(self, partition, feeder=None):
+        """
+        Restores the image backup of a single partition, unless it was completed by an earlier run.
+        :param partition: Partition object from the backupset.
+        :param feeder: optional object providing the image through the reader pipe, like the
+            PipeFeeder, e.g. a branch of the PipeFanOut streaming the image to a number of disks.
+        :return: None
+        """
+        if self._skip_completed(partition):
+            return
+        self._prepare_partition_info(partition)
+        if not feeder:
+            self._mount_compressed_image(partition)
+        self._release_unused_blocks()
+        self._runner = self._get_restoration_runner(feeder)
+        try:
             self._run_process()
+        finally:
+            self._release_feeder()
+        self._complete_partition(partition)
+
+    def verify(self, mode, confidence=constants.VERIFY_CONFIDENCE):
+        """
+        Compares the restored partitions with their images, the report of each partition is
+        included with its status under the verification key.
+        :param mode: sample to check a random sample of the used blocks, full to check all of them.
+        :param confidence: the requested confidence of the sampled verification.
+        :return: list of the verification reports of the partitions.
+        """
+        reports = []
+        for partition in self.backupset.partitions:
+            if self.killed:
+                break
+            self._prepare_partition_info(partition)
+            self._mount_compressed_image(partition)
+            with tracing.span('verify ' + self._current_partition, 'imaging', mode=mode):
+                reports.append(self._verify_partition(mode, confidence))
+        self._current_partition = ""
+        return reports
+
+    def remove_incomplete_images(self):
+        """
+        Removes the image files of the partitions which are not completed, e.g. the partially
+        written image of a backup interrupted by a restart of the node.
+        :return: None
+        """
+        for partition in self.backupset.partitions:
+            if partition.id not in self.completed_partitions:
+                self._prepare_partition_info(partition)
+                for image_file in (self._current_image_file, get_compressed_file(self._current_image_file)):
+                    if path.exists(image_file):
+                        remove(image_file)
+        self._current_partition = ""
 
     def kill(self):
         """
@@ -120,6 +221,10 @@ class PartitionImage:
         :return: None
         """
         self.killed = True
+        if self._block_device:
+            self._block_device.stop()
+        if self._verifier:
+            self._verifier.stop()
         if self._runner:
             self._runner.kill()
 
@@ -130,13 +235,105 @@ class PartitionImage:
                                    constants.PARTITION_FILE_SUFFIX
         self._current_fs = partition.file_system
 
+    def _skip_completed(self, partition):
+        """Marks the partition imaged by an earlier run of the job as finished, such partitions
+        are listed in completed_partitions and are not imaged again."""
+        if partition.id not in self.completed_partitions:
+            return False
+        partition_status = self._get_partition_status(self.disk + partition.id)
+        partition_status['status'] = constants.STATUS_FINISHED
+        partition_status['completed'] = '100'
+        return True
+
+    def _complete_partition(self, partition):
+        """Records the partition as completed and notifies the partition_callback, which allows
+        the job to be checkpointed at each partition boundary."""
+        self.completed_partitions.add(partition.id)
+        if self.partition_callback:
+            self.partition_callback(partition)
+
+    def _mount_compressed_image(self, partition):
+        """Mounts the squashfs image of the partition on first access, if the backup is
+        compressed, and reports the time it took to mount it."""
+        if self.squash_wrapper and not self.streams_compressed_images():
+            self.squash_wrapper.mount_partition(partition)
+            self._get_partition_status(self._current_partition)['mount_latency'] = \
+                self.squash_wrapper.mount_latency.get(partition.id, 0)
+
+    def _release_unused_blocks(self):
+        """Discards the blocks which are not used by the file system according to the bitmap of
+        the image, as partclone only writes the used blocks. The blocks are zeroed instead if the
+        disk does not support discard. A failure leaves the blocks as they are."""
+        if not self.config['discard'] or self.killed or not path.exists(self._current_device):
+            return
+        partition_status = self._get_partition_status(self._current_partition)
+        try:
+            bitmap, data = self._read_bitmap()
+            ranges = bitmap.free_ranges(data)
+            self._block_device = BlockDevice(self._current_device, self.disk)
+            partition_status['written'] = bitmap.used_blocks * bitmap.block_size
+            partition_status['discard_mode'] = self._block_device.mode
+            with tracing.span('release ' + self._current_partition, 'imaging', mode=self._block_device.mode):
+                self._block_device.release(ranges)
+        except (OSError, DiskImageException) as e:
+            self._logger.warning('Cannot release the unused blocks of ' + self._current_device +
+                                 ', they are left as they are. Cause: ' + str(e))
+        finally:
+            if self._block_device:
+                partition_status['discarded'] = self._block_device.released
+            self._block_device = None
+
+    def _verify_partition(self, mode, confidence):
+        """Verifies the current partition, a partition which cannot be verified is reported with
+        the cause rather than failing the job."""
+        partition_status = self._get_partition_status(self._current_partition)
+        image = None
+        try:
+            bitmap, data = self._read_bitmap()
+            image = self._open_image()
+            self._verifier = BlockVerifier(self._current_device, UsedBlocks(bitmap, data), image)
+            partition_status['verification'] = self._verifier.report
+            self._verifier.verify(mode, confidence)
+        except (OSError, DiskImageException) as e:
+            self._logger.warning('Cannot verify ' + self._current_device + ', cause: ' + str(e))
+            partition_status['verification'] = {'mode': mode, 'error': str(e)}
+        finally:
+            self._verifier = None
+            if image:
+                image.close()
+        return partition_status['verification']
+
+    def _open_image(self):
+        name = path.basename(self._current_image_file)
+        if self.remote:
+            return RemoteImage(self.remote, name)
+        if path.isfile(self._current_image_file):
+            return FileImage(self._current_image_file)
+        return SequentialImage(ImageSource(self.path).read(name))
+
+    def _read_bitmap(self):
+        bitmap = PartcloneBitmap(self._read_image(0, PartcloneBitmap.HEADER_SIZE))
+        return bitmap, self._read_image(PartcloneBitmap.HEADER_SIZE, PartcloneBitmap.HEADER_SIZE + bitmap.bitmap_size)
+
+    def _read_image(self, start, end):
+        name = path.basename(self._current_image_file)
+        if self.remote:
+            return b''.join(self.remote.iter_content(name, start, end))
+        return b''.join(ImageSource(self.path).read(name, start, end))
+
     def _run_process(self):
+        with tracing.span('partition ' + self._current_partition, 'imaging',
+                          fs=self._current_fs, image=self._current_image_file):
+            self._run_partition_process()
+
+    def _run_partition_process(self):
         self._get_partition_status(self._current_partition)['status'] = constants.STATUS_RUNNING
         retry = True
         while retry:
             retry = False
             try:
                 if path.exists(self._current_device):
+                    self._start_hasher()
                     self._runner.run()
                     self._handle_exit_code(self._runner.poll())
                 else:
@@ -148,6 +345,8 @@ class PartitionImage:
                 retry = True
             except Exception as e:
                 self._get_partition_status(self._current_partition)['status'] = constants.STATUS_ERROR
+                if self._feeder and self._feeder.error:
+                    e = self._feeder.error  # The image stopped arriving before partclone failed
                 if self.killed:
                     raise Exception('Operation interrupted by the user.')
                 raise Exception('Error detected during imaging partition: ' +
@@ -167,11 +366,53 @@ class PartitionImage:
 
     def _update_status(self):
         """Retrieves newest output from output parser and includes it with the
-        status information."""
+        status information. The bytes allocated by the image written by a backup are
+        included as well."""
+        if self._current_partition and self._current_output_file:
+            self._get_partition_status(self._current_partition)['written'] = \
+                get_allocated_size(self._current_output_file)
+        if self._current_partition and self._feeder:
+            self._get_partition_status(self._current_partition)['transferred'] = self._feeder.transferred
         if self._current_partition and self._runner and self._runner.output():
             partition_status = self._get_partition_status(self._current_partition)
             partition_status.update(self._runner.output())
             partition_status['name'] = self._current_partition
+        if self._current_partition and self._runner and self._runner.resources():
+            self._get_partition_status(self._current_partition)['resources'] = self._runner.resources()
+
+    def _start_hasher(self):
+        """Starts hashing the image written by a backup, the compressed images are teed into a
+        FIFO by the backup command, the plain images are followed as they are written."""
+        if not self._current_output_file:
+            return
+        self._release_hasher()
+        if self.config['overwrite'] and not self.config['compress'] and path.exists(self._current_output_file):
+            remove(self._current_output_file)  # The stale image would be hashed before partclone truncates it
+        self._hasher = StreamHasher(self._get_hasher_path(), fifo=self.config['compress'])
+        self._hasher.start()
+
+    def _finish_hasher(self):
+        if not self._hasher:
+            return None
+        checksum = self._hasher.finish(constants.JOB_KILL_TIMEOUT)
+        if checksum:
+            self._get_partition_status(self._current_partition)['checksum'] = checksum['checksum']
+        else:
+            self._logger.warning('Cannot calculate the checksums of ' + self._current_image_file +
+                                 ', cause: ' + str(self._hasher.error or 'timeout'))
+        self._hasher = None
+        return checksum
+
+    def _release_hasher(self):
+        if self._hasher:
+            self._hasher.finish(constants.JOB_KILL_TIMEOUT)
+            self._hasher = None
+
+    def _get_hasher_path(self):
+        if self.config['compress']:
+            return path.join(path.dirname(self._current_image_file),
+                             '.' + path.basename(self._current_image_file) + '.fifo')
+        return self._current_image_file
 
     def _get_partition_status(self, target):
         for partition in self._status:
@@ -180,21 +421,60 @@ class PartitionImage:
         raise Exception
 
     def _get_backup_runner(self):
+        self._current_output_file = self._current_image_file
         if self.config['compress']:
+            self._current_output_file = get_compressed_file(self._current_image_file)
             command = self._command_with_compression(self._current_device,
                                                      self._current_image_file,
                                                      self._current_fs)
-            return Execute(' '.join(command), _PartcloneOutputParser(),
-                           shell=True, use_pty=True)
+            return Execute(command, _PartcloneOutputParser(), use_pty=True,
+                           track_resources=True)
         else:
             command = self._backup_command(self._current_device,
                                            self._current_image_file, self._current_fs)
-            return Execute(command, _PartcloneOutputParser(), use_pty=True)
+            return Execute(command, _PartcloneOutputParser(), use_pty=True,
+                           track_resources=True)
+
+    def _get_restoration_runner(self, feeder=None):
+        if feeder:
+            self._feeder = feeder
+            command = self._restore_command('-', self._current_device, self._current_fs)
+            return Execute(command, _PartcloneOutputParser(), use_pty=True,
+                           track_resources=True, stdin=feeder.reader)
+        elif self.remote:
+            self._feeder = PipeFeeder(self.remote, path.basename(self._current_image_file))
+            command = self._restore_command('-', self._current_device, self._current_fs)
+            runner = Execute(command, _PartcloneOutputParser(), use_pty=True,
+                             track_resources=True, stdin=self._feeder.reader)
+            self._feeder.start()
+            return runner
+        elif self.streams_compressed_images():
+            command = self._command_with_decompression(self._current_image_file,
+                                                       self._current_device,
+                                                       self._current_fs)
+            return Execute(command, _PartcloneOutputParser(), use_pty=True, track_resources=True)
+        else:
+            command = self._restore_command(self._current_image_file,
+                                            self._current_device, self._current_fs)
+            return Execute(command, _PartcloneOutputParser(), use_pty=True,
+                           track_resources=True)
+
+    def _release_feeder(self):
+        """Stops streaming the image from the remote source, the transferred bytes are kept in
+        the status of the partition."""
+        if self._feeder:
+            self._update_status()
+            self._feeder.close()
+            self._feeder.join(constants.JOB_KILL_TIMEOUT)
+            self._feeder = None
 
-    def _get_restoration_runner(self):
-        command = self._restore_command(self._current_image_file,
-                                        self._current_device, self._current_fs)
-        return Execute(command, _PartcloneOutputParser(), use_pty=True)
+    def streams_compressed_images(self):
+        """
+        Checks whether compressed images are restored by streaming them through the userspace
+        decompressor, rather than by mounting the squashfs images.
+        :return: True if the images are streamed, False otherwise.
+        """
+        return bool(self.backupset.compressed and self.config['stream'])
 
     def _backup_command(self, source: str, target: str, fs: str):
         """
@@ -210,12 +490,42 @@ class PartitionImage:
         return command
 
     def _command_with_compression(self, source: str, target: str, fs: str):
+        """
+        Creates a backup command which writes the partition image straight into the squashfs
+        file, the image is produced by a pseudo file command which also tees it into the FIFO
+        of the hasher. The pseudo file command runs with the pipefail option, so a failure of
+        partclone fails mksquashfs rather than being hidden by the exit status of tee.
+        :param source: the partition to be imaged eg. /dev/sdb1
+        :param target: file for partition image eg. /tmp/part1.img, the squashfs file is stored
+            next to it eg. /tmp/part1.sqfs
+        :param fs: filesystem to be imaged, this is used to select appropriate
+             partclone version.
+        :return: command ready to be used with the Execute class
+        """
         TEMP_DIR = '/dev/null'
         image_name = target[target.rindex('/'):]
-        return ['mksquashfs', TEMP_DIR, target.replace('img', 'sqfs'),
-                '-noappend', '-no-progress', '-p \'' + image_name +
-                ' f 444 root root ' +
-                ' '.join(self._backup_command(source, '-', fs)) + '\'']
+        pseudo_command = shell_pipeline(self._backup_command(source, '-', fs),
+                                        ['tee', self._get_hasher_path()])
+        return ['mksquashfs', TEMP_DIR, get_compressed_file(target),
+                '-noappend', '-no-progress', '-p', image_name + ' f 444 root root ' +
+                ' '.join(quote(argument) for argument in pseudo_command)]
+
+    def _command_with_decompression(self, source: str, target: str, fs: str):
+        """
+        Creates a restore command which decompresses the partition image from the squashfs
+        file with the multithreaded unsquashfs and pipes it directly into partclone, a failure
+        of unsquashfs fails the whole command. The commands are run as a pipeline by the
+        Execute class rather than by a shell, so killing the runner kills both of them.
+        :param source: the partition image eg. /tmp/part1.img, the squashfs file is expected to be
+            stored next to it eg. /tmp/part1.sqfs
+        :param target: the partition for the image to be applied to eg. /dev/sdb1
+        :param fs: filesystem to be imaged, this is used to select appropriate
+             partclone version.
+        :return: pipeline of the restoration commands ready to be used with the Execute class.
+        """
+        return [['unsquashfs', '-cat', '-processors', str(cpu_count() or 1),
+                 get_compressed_file(source), path.basename(source)],
+                self._restore_command('-', target, fs)]
 
     def _restore_command(self, source: str, target: str, fs: str):
         """
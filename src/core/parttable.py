@@ -10,17 +10,19 @@ from os import path
 
 import constants
 from lib.exceptions import DetectionException
+from lib.tracing import traced
+from .discard import BlockDevice, ZEROOUT_MODE
 from .runcommand import Execute, OutputToFileConverter
 
 
 class DiskLayout:
     """ This class encapsulates the disk layout detection, backup and restoration procedures. """
-    def __init__(self, disk, target_dir, layout=None, overwrite=False):
+    def __init__(self, disk, target_dir, layout=None, overwrite=False, discard=False):
         self.disk = disk
         self.target_dir = target_dir
         self.overwrite = overwrite
         self._layout_factory = LayoutManagerFactory()
-        self._layout_manager = self._layout_factory.get_layout_manager(disk, target_dir, layout, overwrite)
+        self._layout_manager = self._layout_factory.get_layout_manager(disk, target_dir, layout, overwrite, discard)
 
     @classmethod
     def with_config(cls, disk, target_dir, config, layout=None):
@@ -33,7 +35,8 @@ class DiskLayout:
         :return: inistalised DiskLayout object.
         """
         try:
-            return cls(disk, target_dir, layout=layout, overwrite=config['overwrite'])
+            return cls(disk, target_dir, layout=layout, overwrite=config['overwrite'],
+                       discard=config.get('discard', False))
         except BaseException as e:
             logging.getLogger(__name__).error('Cannot build DiskLayout with config ' + str(config) + ', reason: ' + str(e))
             raise e
@@ -45,6 +48,7 @@ class DiskLayout:
         """
         return self._layout_manager.layout
 
+    @traced('layout.backup', 'layout')
     def backup_layout(self):
         """
         Creates a backup of the boot record and the partition layout.
@@ -53,6 +57,7 @@ class DiskLayout:
         self._check_if_disk_exists_with_raise()
         self._layout_manager.backup_layout()
 
+    @traced('layout.restore', 'layout')
     def restore_layout(self):
         """
         Restores an existing backup of disk layout and boot record to the disk.
@@ -72,24 +77,28 @@ class LayoutManagerFactory:
     def __init__(self):
         self._logger = logging.getLogger(__name__)
 
-    def get_layout_manager(self, disk, target_dir, layout, overwrite):
+    @traced('layout.get_layout_manager', 'layout')
+    def get_layout_manager(self, disk, target_dir, layout, overwrite, discard=False):
         """
         Prepares and returns ready LayoutManager to be used by the DiskLayout wrapper.
         :param disk: disk to be managed.
         :param target_dir: directory to be used for storing and loading backups.
         :param layout: disk layout, if None is provided, the layout will be detected.
         :param overwrite: whether the existing layout backup should be overwritten
+        :param discard: whether the previous partition tables should be zeroed with BLKZEROOUT
+            rather than overwritten with dd.
         :return: initialised LayoutManager.
         """
         if not layout:
             layout = self._detect_layout(disk)
         if 'MBR' in layout:
-            return MBRLayoutManager(disk, target_dir, overwrite)
+            return MBRLayoutManager(disk, target_dir, overwrite, discard)
         elif 'GPT' in layout:
-            return GPTLayoutManager(disk, target_dir, overwrite)
+            return GPTLayoutManager(disk, target_dir, overwrite, discard)
         else:
             raise ValueError("Unsupported or invalid disk layout requested.")
 
+    @traced('layout.detect', 'layout')
     def _detect_layout(self, disk):
         command = 'parted /dev/' + disk + ' p | grep "Partition Table\|Error"'
         parted = Execute(command, shell=True)
@@ -115,11 +124,12 @@ class LayoutManager:
     MAX_GPT_BACKUP_SIZE = 17408  # Formula: (128 * n) + 1024, where n is a max number of partitions in GPT (128)
     PARTITION_TABLE_TARGET_FILE = 'ptable.bak'
 
-    def __init__(self, disk, target_dir, overwrite):
+    def __init__(self, disk, target_dir, overwrite, discard=False):
         self.layout = None
         self.disk = disk
         self.target_dir = target_dir
         self.overwrite = overwrite
+        self.discard = discard
         self._logger = logging.getLogger(__name__)
 
     @abstractmethod
@@ -139,6 +149,8 @@ class LayoutManager:
         pass
 
     def _remove_previous_partition_tables(self):
+        if self.discard and self.__zero_partition_tables():
+            return
         self.__remove_primary_partition_table()
         self.__remove_backup_partition_table()
 
@@ -153,6 +165,21 @@ class LayoutManager:
             self._logger.error(error_message)
             raise Exception(error_message)
 
+    def __zero_partition_tables(self):
+        """Zeroes the areas of the primary and backup partition tables with BLKZEROOUT, which
+        the disk can serve without transferring the zeros."""
+        try:
+            with open(constants.SYSFS_BLOCK_PATH + self.disk + '/size') as sectors:
+                size = int(sectors.read()) * 512  # sysfs counts 512 byte sectors
+            end_size = 1024 * 512
+            BlockDevice('/dev/' + self.disk, self.disk, ZEROOUT_MODE).release(
+                [(0, self.MAX_GPT_BACKUP_SIZE), (size - end_size, end_size)])
+            return True
+        except (OSError, ValueError) as e:
+            self._logger.warning('Cannot zero the partition tables of the disk /dev/' + self.disk +
+                                 ', overwriting them instead. Cause: ' + str(e))
+            return False
+
     def __remove_primary_partition_table(self):
         dd_command = ['dd', 'if=/dev/zero', 'of=/dev/' + self.disk, 'bs=' + str(self.MAX_GPT_BACKUP_SIZE), 'count=1']
         runner = Execute(dd_command)
@@ -176,8 +203,8 @@ class MBRLayoutManager(LayoutManager):
     """
     This class provides implementation of backup and restore functions for the MS-DOS layout (MBR).
     """
-    def __init__(self, disk, target_dir, overwrite):
-        super(MBRLayoutManager, self).__init__(disk, target_dir, overwrite)
+    def __init__(self, disk, target_dir, overwrite, discard=False):
+        super(MBRLayoutManager, self).__init__(disk, target_dir, overwrite, discard)
         self.layout = 'MBR'
 
     def backup_layout(self):
@@ -242,8 +269,8 @@ class GPTLayoutManager(LayoutManager):
     """
     This class provides implementation of backup and restoration procedures for GPT layout.
     """
-    def __init__(self, disk, target_dir, overwrite):
-        super(GPTLayoutManager, self).__init__(disk, target_dir, overwrite)
+    def __init__(self, disk, target_dir, overwrite, discard=False):
+        super(GPTLayoutManager, self).__init__(disk, target_dir, overwrite, discard)
         self.layout = 'GPT'
 
     def backup_layout(self):
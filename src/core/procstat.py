@@ -0,0 +1,165 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import logging
+from os import listdir, sysconf
+from threading import Event, Lock, Thread
+
+
+class ProcessTreeMonitor:
+    """
+    This class samples the /proc file system for a process and all of its descendants, to account
+    for the disk I/O, CPU time and memory used by the whole process tree. The counters of the
+    processes which exit between the samples are kept at their last sampled values, as the counters
+    only grow, the highest sampled value is kept for every process.
+    """
+    PROC_PATH = '/proc/'
+    CLOCK_TICKS = sysconf('SC_CLK_TCK')
+    PAGE_SIZE = sysconf('SC_PAGE_SIZE')
+
+    def __init__(self, pid, interval):
+        """
+        :param pid: the process id, or a list of the process ids of the commands of a pipeline.
+        :param interval: the delay between the samples in seconds.
+        :return: initialised ProcessTreeMonitor object.
+        """
+        self.pid = pid
+        self._roots = pid if isinstance(pid, list) else [pid]
+        self.interval = interval
+        self._processes = {}
+        self._peak_rss = 0
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+        self._logger = logging.getLogger(__name__)
+
+    def start(self):
+        """
+        Starts sampling the process tree in the background.
+        :return: None
+        """
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background sampling and takes the final sample of the process tree.
+        :return: None
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.sample()
+
+    def get_resources(self):
+        """
+        Returns the resources used by the process tree so far.
+        :return: dictionary containing bytes read from and written to the storage, CPU time
+            in seconds, the peak resident set size of the tree in bytes and the number of
+            processes seen.
+        """
+        with self._lock:
+            resources = {'read_bytes': 0, 'write_bytes': 0, 'cpu_seconds': 0.0,
+                         'peak_rss': self._peak_rss, 'processes': len(self._processes)}
+            for process in self._processes.values():
+                resources['read_bytes'] += process['read_bytes']
+                resources['write_bytes'] += process['write_bytes']
+                resources['cpu_seconds'] += process['cpu_seconds']
+            resources['cpu_seconds'] = round(resources['cpu_seconds'], 2)
+            return resources
+
+    def sample(self):
+        """
+        Reads the current counters of the monitored process and all of its descendants.
+        :return: None
+        """
+        rss = 0
+        peak_rss = 0
+        samples = {}
+        for pid in self._find_process_tree():
+            try:
+                stat = _read_stat(self.PROC_PATH + str(pid) + '/stat')
+                process = {'cpu_seconds': (stat['utime'] + stat['stime']) / self.CLOCK_TICKS}
+                process.update(_read_io(self.PROC_PATH + str(pid) + '/io'))
+                rss += stat['rss'] * self.PAGE_SIZE
+                peak_rss = max(peak_rss, _read_peak_rss(self.PROC_PATH + str(pid) + '/status'))
+                samples[(pid, stat['starttime'])] = process
+            except (IOError, ValueError, IndexError):
+                pass  # The process exited while being sampled
+        with self._lock:
+            for key, process in samples.items():
+                previous = self._processes.get(key, process)
+                self._processes[key] = {name: max(value, previous[name])
+                                        for name, value in process.items()}
+            self._peak_rss = max(self._peak_rss, rss, peak_rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                self._logger.warning('Cannot sample resources of process ' + str(self.pid) +
+                                     ', cause: ' + str(e))
+            self._stop.wait(self.interval)
+
+    def _find_process_tree(self):
+        children = {}
+        for entry in listdir(self.PROC_PATH):
+            if entry.isdigit():
+                try:
+                    parent = _read_stat(self.PROC_PATH + entry + '/stat')['ppid']
+                    children.setdefault(parent, []).append(int(entry))
+                except (IOError, ValueError, IndexError):
+                    pass
+        tree = list(self._roots)
+        for pid in tree:
+            tree.extend(children.get(pid, []))
+        return tree
+
+
+def _read_stat(file):
+    """
+    Reads the fields used for the accounting from the /proc/<pid>/stat file.
+    :param file: path to the stat file.
+    :return: dictionary with ppid, utime, stime, starttime and rss (in pages) fields.
+    """
+    with open(file) as fd:
+        data = fd.read()
+    fields = data[data.rindex(')') + 2:].split()
+    return {
+        'ppid': int(fields[1]),
+        'utime': int(fields[11]),
+        'stime': int(fields[12]),
+        'starttime': int(fields[19]),
+        'rss': int(fields[21]),
+    }
+
+
+def _read_io(file):
+    """
+    Reads the storage I/O counters from the /proc/<pid>/io file.
+    :param file: path to the io file.
+    :return: dictionary with read_bytes and write_bytes fields.
+    """
+    counters = {}
+    with open(file) as fd:
+        for line in fd:
+            key, value = line.split(':', 1)
+            counters[key] = int(value)
+    return {'read_bytes': counters.get('read_bytes', 0), 'write_bytes': counters.get('write_bytes', 0)}
+
+
+def _read_peak_rss(file):
+    """
+    Reads the peak resident set size of a single process from the /proc/<pid>/status file.
+    :param file: path to the status file.
+    :return: the peak resident set size in bytes, 0 if it is not reported (e.g. zombie process).
+    """
+    with open(file) as fd:
+        for line in fd:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
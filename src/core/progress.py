@@ -0,0 +1,122 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from math import exp
+
+import constants
+
+
+class JobProgress:
+    """
+    This class estimates the progress of a whole imaging job from the statuses of its partitions.
+    Each partition is weighted by its size, the throughput of the running partition is smoothed
+    with an exponentially weighted moving average over the time reported by partclone, while the
+    partitions which have not started yet are estimated with the historical throughput of their
+    file system.
+    """
+    def __init__(self, partitions, historical_rates=None,
+                 smoothing_time=constants.PROGRESS_SMOOTHING_TIME):
+        """
+        :param partitions: list of (name, size in bytes, file system) tuples in the imaging order,
+            the sizes can be provided as strings, as reported by lsblk.
+        :param historical_rates: dictionary of the average throughput in bytes per second per
+            file system, as returned by the Database.get_filesystem_rates.
+        :param smoothing_time: time constant of the moving average in seconds.
+        """
+        self.partitions = [(name, int(size or 0), fs) for name, size, fs in partitions]
+        self.historical_rates = historical_rates or {}
+        self.smoothing_time = smoothing_time
+        self._rates = {}
+        self._samples = {}
+        self._finished = set()
+
+    def update(self, statuses):
+        """
+        Updates the throughput estimates with the current statuses of the partitions.
+        :param statuses: list of partition statuses as returned by the PartitionImage.get_status.
+        :return: dictionary with the completed percentage of the job, the estimated number of
+            seconds remaining, which is None until any throughput is known, and the current
+            throughput in bytes per second.
+        """
+        statuses = {status['name']: status for status in statuses}
+        total = sum(size for _, size, _ in self.partitions)
+        done = 0.0
+        remaining_seconds = 0.0
+        throughput = 0.0
+        for name, size, fs in self.partitions:
+            status = statuses.get(name, {})
+            fraction = _completed_fraction(status)
+            if status.get('status') == constants.STATUS_RUNNING:
+                self._add_sample(name, size * fraction, _to_seconds(status.get('elapsed')))
+                throughput += self._rates.get(name, 0.0)
+            elif status.get('status') == constants.STATUS_FINISHED:
+                self._finish(name, size, _to_seconds(status.get('elapsed')))
+            done += size * fraction if total else fraction
+            if remaining_seconds is not None and fraction < 1:
+                rate = self._estimate_rate(name, fs, status.get('status'))
+                remaining_seconds = remaining_seconds + size * (1 - fraction) / rate if rate else None
+        completed = done / total if total else done / max(len(self.partitions), 1)
+        return {
+            'completed': round(completed * 100, 2),
+            'remaining_seconds': round(remaining_seconds) if remaining_seconds is not None else None,
+            'throughput': round(throughput),
+        }
+
+    def get_rates(self):
+        """
+        Returns the throughput measured for the partitions of this job.
+        :return: dictionary of the throughput in bytes per second with partition names as keys.
+        """
+        return dict(self._rates)
+
+    def _add_sample(self, name, done, elapsed):
+        previous_done, previous_elapsed = self._samples.get(name, (0.0, 0))
+        if elapsed <= previous_elapsed or done <= previous_done:
+            return
+        rate = (done - previous_done) / (elapsed - previous_elapsed)
+        if name in self._rates:
+            weight = 1 - exp(-(elapsed - previous_elapsed) / self.smoothing_time)
+            rate = self._rates[name] + weight * (rate - self._rates[name])
+        self._rates[name] = rate
+        self._samples[name] = (done, elapsed)
+
+    def _finish(self, name, size, elapsed):
+        if elapsed and name not in self._finished:
+            self._rates[name] = size / elapsed
+            self._finished.add(name)
+
+    def _estimate_rate(self, name, fs, status):
+        if status == constants.STATUS_RUNNING and name in self._rates:
+            return self._rates[name]
+        if fs in self.historical_rates:
+            return self.historical_rates[fs]
+        if self._rates:
+            return sum(self._rates.values()) / len(self._rates)
+        return None
+
+
+def _completed_fraction(status):
+    if status.get('status') == constants.STATUS_FINISHED:
+        return 1.0
+    try:
+        return min(max(float(status.get('completed', 0)) / 100, 0.0), 1.0)
+    except ValueError:
+        return 0.0
+
+
+def _to_seconds(elapsed):
+    """
+    Converts the time reported by partclone into seconds.
+    :param elapsed: string in the hh:mm:ss format.
+    :return: number of seconds, 0 if the value cannot be parsed.
+    """
+    try:
+        seconds = 0
+        for part in str(elapsed).split(':'):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return 0
@@ -0,0 +1,349 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import http.client
+import json
+import logging
+import subprocess
+import zlib
+from os import close, cpu_count, fdopen, path, pipe, scandir, write
+from threading import Thread
+from time import sleep
+from urllib.parse import quote, urlparse
+
+import constants
+from lib.exceptions import BackupsetException, ImageException
+from services.config import ConfigHelper
+from .runcommand import Execute, OutputParser
+
+_logger = logging.getLogger(__name__)
+
+GZIP_COMPRESSION = 'gzip'
+
+_CONNECTION_CLASSES = {'http': http.client.HTTPConnection, 'https': http.client.HTTPSConnection}
+
+
+def get_node_url(node):
+    """
+    Looks up the base URL of the API of another node in the nodes section of the config file,
+    where each option maps the name of a node to its URL, e.g. node2 = http://10.0.0.2:5000
+    :param node: the name of the node.
+    :return: the base URL of the node, None if the node is not configured.
+    """
+    if not node or not ConfigHelper.config.has_section('nodes'):
+        return None
+    return ConfigHelper.config['nodes'].get(node)
+
+
+def parse_node_url(url):
+    """
+    Parses the URL of another node, only the http and https URLs are accepted.
+    :param url: the URL to be parsed.
+    :return: the URL parsed with urlparse.
+    :exception: ImageException if the URL does not use the http or https scheme.
+    """
+    address = urlparse(url)
+    if address.scheme not in _CONNECTION_CLASSES or not address.hostname:
+        raise ImageException("The node URL '" + url + "' is not a valid http or https URL.")
+    return address
+
+
+def connect_to_node(address, timeout):
+    """
+    Opens a new connection to another node, HTTPS is used for the https URLs.
+    :param address: the URL of the node parsed with parse_node_url.
+    :param timeout: the timeout of the blocking operations in seconds.
+    :return: HTTPConnection or HTTPSConnection object.
+    """
+    return _CONNECTION_CLASSES[address.scheme](address.hostname, address.port, timeout=timeout)
+
+
+class ImageSource:
+    """
+    This class provides the files of a backup stored on this node to the other nodes. The
+    partition images of the compressed backups are decompressed from their squashfs files on the
+    fly, so the images are always provided in the format expected by partclone.
+    """
+    def __init__(self, backup_path):
+        self.backup_path = backup_path
+
+    def list_files(self):
+        """
+        Lists the files of the backup, the squashfs files are listed as the images they contain.
+        :return: list of dictionaries with the name and size of each file.
+        """
+        files = []
+        with scandir(self.backup_path) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False) or entry.name.startswith('.'):
+                    continue
+                if entry.name.endswith(constants.COMPRESSED_FILE_SUFFIX):
+                    name = entry.name[:-len(constants.COMPRESSED_FILE_SUFFIX)] + constants.PARTITION_FILE_SUFFIX
+                    files.append({'name': name, 'size': self._get_compressed_size(entry.path, name)})
+                else:
+                    files.append({'name': entry.name, 'size': entry.stat().st_size})
+        return sorted(files, key=lambda file: file['name'])
+
+    def get_size(self, name):
+        """
+        Provides the size of a file of the backup.
+        :param name: the name of the file, as listed by the list_files method.
+        :return: size of the file in bytes.
+        :exception: ImageException if the file does not exist in the backup.
+        """
+        file_path = self._get_file_path(name)
+        if path.isfile(file_path):
+            return path.getsize(file_path)
+        return self._get_compressed_size(self._get_sqfs_path(name), name)
+
+    def read(self, name, start=0, end=None, compression=None):
+        """
+        Reads the range of a file of the backup in chunks, optionally compressing them.
+        :param name: the name of the file, as listed by the list_files method.
+        :param start: offset of the first byte to be read.
+        :param end: offset of the byte following the last byte to be read, None to read the
+            whole file.
+        :param compression: gzip to compress the range on the fly, None to read it as it is.
+        :return: generator of the chunks of the range.
+        """
+        file_path = self._get_file_path(name)
+        if path.isfile(file_path):
+            chunks = self._read_file(file_path, start, end)
+        else:
+            chunks = self._read_compressed_file(self._get_sqfs_path(name), name, start, end)
+        if compression == GZIP_COMPRESSION:
+            return self._compress(chunks)
+        return chunks
+
+    def _get_file_path(self, name):
+        if not name or '/' in name or name.startswith('.'):
+            raise ImageException("Invalid file name '" + str(name) + "'.")
+        return self.backup_path + name
+
+    def _get_sqfs_path(self, name):
+        sqfs_path = self._get_file_path(name)[:-len(constants.PARTITION_FILE_SUFFIX)] + constants.COMPRESSED_FILE_SUFFIX
+        if not name.startswith(constants.PARTITION_FILE_PREFIX) or not name.endswith(constants.PARTITION_FILE_SUFFIX) \
+                or not path.isfile(sqfs_path):
+            raise ImageException("The file '" + name + "' does not exist in the backup.")
+        return sqfs_path
+
+    def _get_compressed_size(self, sqfs_path, name):
+        runner = Execute(['unsquashfs', '-lls', sqfs_path, name], OutputParser())
+        if runner.run() != 0:
+            raise ImageException('Cannot list the contents of ' + sqfs_path + '.')
+        for line in runner.output().splitlines():
+            fields = line.split()
+            if len(fields) > 2 and fields[-1].endswith('/' + name):
+                return int(fields[2])
+        raise ImageException("The file '" + name + "' does not exist in " + sqfs_path + '.')
+
+    def _read_file(self, file_path, start, end):
+        with open(file_path, 'rb') as file:
+            file.seek(start)
+            remaining = end - start if end is not None else None
+            while remaining is None or remaining > 0:
+                size = constants.REMOTE_CHUNK_SIZE if remaining is None else \
+                    min(constants.REMOTE_CHUNK_SIZE, remaining)
+                chunk = file.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def _read_compressed_file(self, sqfs_path, name, start, end):
+        command = ['unsquashfs', '-cat', '-processors', str(cpu_count() or 1), sqfs_path, name]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            offset = 0
+            while end is None or offset < end:
+                chunk = process.stdout.read(constants.REMOTE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunk_start = offset
+                offset += len(chunk)
+                if offset <= start:
+                    continue  # The stream is not seekable, the bytes before the range are skipped
+                yield chunk[max(start - chunk_start, 0):len(chunk) if end is None else end - chunk_start]
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stdout.close()
+
+    def _compress(self, chunks):
+        compressor = zlib.compressobj(constants.REMOTE_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+
+class RemoteBackup:
+    """
+    This class provides access to the files of a backup stored on another node, which are
+    requested from the source endpoint of that node. Broken transfers are resumed with Range
+    requests from the last byte received.
+    """
+    def __init__(self, node_url, backup_id, compression=False, retries=constants.REMOTE_RETRIES,
+                 timeout=constants.REMOTE_TIMEOUT):
+        self.url = node_url.rstrip('/') + '/api/backup/' + quote(str(backup_id), safe='') + '/source'
+        self.compression = GZIP_COMPRESSION if compression else None
+        self.retries = retries
+        self.timeout = timeout
+        self._address = parse_node_url(self.url)
+
+    @classmethod
+    def for_node(cls, node, backup_id, compression=False):
+        """
+        Creates an instance of RemoteBackup class for a backup stored on the given node.
+        :param node: the name of the node storing the backup.
+        :param backup_id: string identifier of the backup.
+        :param compression: the flag to compress the transferred images.
+        :return: initialised RemoteBackup object.
+        :exception: BackupsetException if the URL of the node is not configured.
+        """
+        node_url = get_node_url(node)
+        if not node_url:
+            raise BackupsetException("This backup resides on the node '" + str(node) + "', which is not "
+                                     "listed in the nodes section of the configuration, terminating.")
+        return cls(node_url, backup_id, compression)
+
+    def list_files(self):
+        """
+        Lists the files of the backup.
+        :return: list of dictionaries with the name and size of each file.
+        """
+        connection, response = self._request(self._address.path)
+        try:
+            return json.loads(response.read().decode('utf-8'))['files']
+        finally:
+            connection.close()
+
+    def download(self, name, target_file):
+        """
+        Stores a file of the backup locally.
+        :param name: the name of the file in the backup.
+        :param target_file: the path of the local file to be written.
+        :return: None
+        """
+        with open(target_file, 'wb') as file:
+            for chunk in self.iter_content(name):
+                file.write(chunk)
+
+    def iter_content(self, name, offset=0, end=None):
+        """
+        Reads a file of the backup, the transfer is resumed from the last byte received whenever
+        the connection breaks, until the number of retries is exhausted.
+        :param name: the name of the file in the backup.
+        :param offset: offset of the first byte to be read.
+        :param end: offset of the byte following the last byte to be read, None to read the
+            rest of the file.
+        :return: generator of the chunks of the file.
+        :exception: ImageException if the file cannot be read.
+        """
+        attempt = 0
+        while True:
+            connection = None
+            try:
+                connection, response = self._request(self._address.path + '/' + quote(name, safe=''), offset, end)
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if self.compression else None
+                while True:
+                    chunk = response.read(constants.REMOTE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    attempt = 0
+                    if decompressor:
+                        chunk = decompressor.decompress(chunk)
+                    if chunk:
+                        offset += len(chunk)
+                        yield chunk
+                if decompressor and not decompressor.eof:
+                    raise http.client.IncompleteRead(b'')
+                return
+            except (OSError, http.client.HTTPException, zlib.error) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise ImageException('Cannot read ' + name + ' from ' + self.url + ', cause: ' + str(e))
+                _logger.warning('Transfer of ' + name + ' from ' + self.url + ' broke at byte ' + str(offset) +
+                                ', resuming. Cause: ' + str(e))
+                sleep(constants.REMOTE_RETRY_DELAY)
+            finally:
+                if connection:
+                    connection.close()
+
+    def _request(self, request_path, offset=0, end=None):
+        connection = connect_to_node(self._address, self.timeout)
+        ranged = offset or end is not None
+        headers = {'Range': 'bytes=' + str(offset) + '-' + (str(end - 1) if end is not None else '')} if ranged else {}
+        if self.compression:
+            request_path += '?compression=' + self.compression
+        connection.request('GET', request_path, headers=headers)
+        response = connection.getresponse()
+        if response.status not in (200, 206) or (ranged and response.status != 206):
+            message = response.read().decode('utf-8', 'replace').strip()
+            connection.close()
+            raise ImageException('The node refused to provide ' + request_path + ' (HTTP ' +
+                                 str(response.status) + '): ' + message)
+        return connection, response
+
+
+class PipeFeeder:
+    """
+    This class streams a file of a remote backup into a pipe on a separate thread, so that it
+    can be used as the standard input of a command, e.g. partclone restoring the partition image.
+    """
+    def __init__(self, remote, name):
+        reader, self._writer = pipe()
+        self.reader = fdopen(reader, 'rb', buffering=0)
+        self.remote = remote
+        self.name = name
+        self.transferred = 0
+        self.error = None
+        self._stopped = False
+        self._thread = Thread(target=self._feed, daemon=True)
+
+    def start(self):
+        """
+        Starts streaming the file into the pipe.
+        :return: None
+        """
+        self._thread.start()
+
+    def close(self):
+        """
+        Stops streaming the file and closes the reading end of the pipe held by this process.
+        :return: None
+        """
+        self._stopped = True
+        self.reader.close()
+
+    def join(self, timeout=None):
+        """
+        Waits for the streaming thread to finish.
+        :param timeout: maximum time to wait in seconds, None to wait until it finishes.
+        :return: None
+        """
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _feed(self):
+        try:
+            for chunk in self.remote.iter_content(self.name):
+                if self._stopped:
+                    break
+                view = memoryview(chunk)
+                while view:
+                    view = view[write(self._writer, view):]
+                self.transferred += len(chunk)
+        except BrokenPipeError:
+            pass  # The reading process has exited, its exit code tells whether it failed
+        except Exception as e:
+            _logger.error('Cannot stream ' + self.name + ' from ' + self.remote.url + ', cause: ' + str(e))
+            self.error = e
+        finally:
+            close(self._writer)
@@ -0,0 +1,282 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import fcntl
+import http.client
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import path, scandir
+from threading import Lock, Thread
+from time import monotonic, sleep
+from urllib.parse import quote
+
+import constants
+from lib.exceptions import ImageException
+from lib.throttle import TokenBucket
+from services.config import ConfigHelper
+from services.database import DB
+from .backupset import Backupset
+from .checksum import CHECKSUM_ALGORITHM, file_checksum
+from .remote import connect_to_node, get_node_url, parse_node_url
+
+
+class ReplicationLink:
+    """
+    This class represents the connection to a peer node the backups are replicated to, the
+    bandwidth budget of the link is shared by all transfers to the peer.
+    """
+    def __init__(self, node, url, bandwidth=0, streams=constants.REPLICATION_STREAMS):
+        """
+        :param node: the name of the peer node.
+        :param url: the base URL of the API of the peer node.
+        :param bandwidth: maximum number of bytes sent to the peer per second, 0 for no limit.
+        :param streams: number of the files of a backup transferred at the same time.
+        :return: initialised ReplicationLink object.
+        """
+        self.node = node
+        self.url = url.rstrip('/')
+        self.streams = streams
+        self.budget = TokenBucket(bandwidth, bandwidth * constants.REPLICATION_BURST_SECONDS)
+        self._address = parse_node_url(self.url)
+
+    def connect(self):
+        """
+        Opens a new connection to the peer node.
+        :return: HTTPConnection object, or HTTPSConnection object for an https URL.
+        """
+        return connect_to_node(self._address, constants.REMOTE_TIMEOUT)
+
+
+class ReplicationProgress:
+    """
+    This class aggregates the progress of the parallel transfers of a backup and records it in
+    the catalog, at most once per the progress interval unless forced.
+    """
+    def __init__(self, backup_id, source, target, size):
+        self.backup_id = backup_id
+        self.data = {
+            'backup_id': backup_id,
+            'source': source,
+            'target': target,
+            'status': constants.STATUS_RUNNING,
+            'size': size,
+            'transferred': 0,
+            'files': [],
+            'start_time': datetime.today().strftime(constants.DATE_FORMAT),
+            'end_time': '',
+            'error_msg': '',
+        }
+        self._saved = 0
+        self._lock = Lock()
+
+    def add(self, transferred):
+        """
+        Adds the bytes transferred since the last call.
+        :param transferred: number of bytes, negative if a broken transfer is retried.
+        :return: None
+        """
+        with self._lock:
+            self.data['transferred'] += transferred
+        if monotonic() - self._saved >= constants.REPLICATION_PROGRESS_INTERVAL:
+            self.save()
+
+    def complete_file(self, name):
+        """
+        Records the file as transferred and verified by the peer node.
+        :param name: the name of the file in the backup directory.
+        :return: None
+        """
+        with self._lock:
+            self.data['files'].append(name)
+        self.save()
+
+    def finish(self, error=None):
+        """
+        Records the end of the replication.
+        :param error: the error which stopped the replication, None if it succeeded.
+        :return: None
+        """
+        self.data['status'] = constants.STATUS_ERROR if error else constants.STATUS_FINISHED
+        self.data['error_msg'] = str(error) if error else ''
+        self.data['end_time'] = datetime.today().strftime(constants.DATE_FORMAT)
+        self.save()
+
+    def save(self):
+        """
+        Records the progress in the catalog.
+        :return: None
+        """
+        with self._lock:
+            self._saved = monotonic()
+            data = dict(self.data, files=list(self.data['files']))
+        DB.upsert_replication(self.backup_id, data['target'], data)
+
+
+class _Replicator:
+    """
+    This class copies the finished backups of this node to the peer nodes listed in the
+    replication section of the config file in the background. Each peer is served by its own
+    thread, which sends the partition images of a backup over parallel streams within the
+    bandwidth budget of the link. The peer verifies the checksum of each file before storing it
+    and records itself as a holder of the backup once all files are received.
+    """
+    def __init__(self):
+        self.links = []
+        self._lock_file = None
+        self._logger = logging.getLogger(__name__)
+
+    def start(self):
+        """
+        Starts replicating the backups to the configured peers, if this is the only process of
+        the node doing so.
+        :return: None
+        """
+        self.links = self._load_links()
+        if not self.links or not self._acquire_lock():
+            return
+        for link in self.links:
+            Thread(target=self._run, args=(link,), daemon=True).start()
+        self._logger.info('Replicating the backups to: ' + ', '.join(link.node for link in self.links) + '.')
+
+    def replicate_pending(self, link):
+        """
+        Replicates all finished backups of this node which are not held by the peer yet.
+        :param link: ReplicationLink of the peer.
+        :return: number of the replicated backups.
+        """
+        replicated = 0
+        for data in DB.get_backups_to_replicate(link.node):
+            backupset = Backupset._from_json(data)
+            try:
+                self.replicate(backupset, link)
+                replicated += 1
+            except Exception as e:
+                self._logger.warning('Cannot replicate the backup ' + backupset.id + ' to ' + link.node +
+                                     ', cause: ' + str(e))
+        return replicated
+
+    def replicate(self, backupset, link):
+        """
+        Copies the files of the backup to the peer, the partition images are sent in parallel
+        and the manifest is sent last, followed by the commit of the replica.
+        :param backupset: Backupset object of a finished backup stored on this node.
+        :param link: ReplicationLink of the peer.
+        :return: None
+        """
+        files = self._list_files(backupset.backup_path)
+        progress = ReplicationProgress(backupset.id, backupset.node, link.node, sum(size for _, size in files))
+        progress.save()
+        try:
+            data_files = [name for name, _ in files if name != constants.BACKUPSET_FILE]
+            with ThreadPoolExecutor(max_workers=link.streams) as executor:
+                for name in executor.map(lambda name: self._send_file(backupset, link, name, progress), data_files):
+                    progress.complete_file(name)
+            if path.exists(backupset.get_manifest_path()):
+                progress.complete_file(self._send_file(backupset, link, constants.BACKUPSET_FILE, progress))
+            self._commit(backupset, link)
+        except Exception as e:
+            progress.finish(e)
+            raise
+        progress.finish()
+
+    def _run(self, link):
+        while True:
+            try:
+                self.replicate_pending(link)
+            except Exception as e:
+                self._logger.warning('Cannot find the backups to be replicated to ' + link.node + ', cause: ' + str(e))
+            sleep(constants.REPLICATION_INTERVAL)
+
+    def _load_links(self):
+        if not ConfigHelper.config.has_section('replication'):
+            return []
+        section = ConfigHelper.config['replication']
+        bandwidth = int(float(section.get('bandwidth', '0')) * 1048576)
+        streams = section.getint('streams', constants.REPLICATION_STREAMS)
+        links = []
+        for node in [node.strip() for node in section.get('peers', '').split(',') if node.strip()]:
+            url = get_node_url(node)
+            if not url:
+                self._logger.error("The replication peer '" + node + "' is not listed in the nodes section.")
+                continue
+            try:
+                links.append(ReplicationLink(node, url, bandwidth, streams))
+            except ImageException as e:
+                self._logger.error("The replication peer '" + node + "' is skipped, cause: " + str(e))
+        return links
+
+    def _acquire_lock(self):
+        try:
+            self._lock_file = open(constants.REPLICATION_LOCK_FILE, 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            if self._lock_file:
+                self._lock_file.close()
+            self._lock_file = None
+            return False  # Another process of the node replicates the backups
+
+    def _list_files(self, backup_path):
+        with scandir(backup_path) as entries:
+            return sorted(((entry.name, entry.stat().st_size) for entry in entries
+                           if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.')),
+                          key=lambda file: (file[0] == constants.BACKUPSET_FILE, -file[1]))
+
+    def _send_file(self, backupset, link, name, progress):
+        file_path = backupset.backup_path + name
+        checksum = file_checksum(file_path)
+        request_path = '/api/replica/' + quote(backupset.id, safe='') + '/' + quote(name, safe='')
+        attempt = 0
+        while True:
+            sent = [0]
+            connection = link.connect()
+            try:
+                connection.request('PUT', request_path, body=self._read_file(file_path, link, progress, sent),
+                                   headers={'Content-Length': str(path.getsize(file_path)),
+                                            'X-Checksum': CHECKSUM_ALGORITHM + ':' + checksum})
+                response = connection.getresponse()
+                message = response.read().decode('utf-8', 'replace').strip()
+                if response.status == 200:
+                    return name
+                if response.status != 422:  # Only the files corrupted in the transfer are sent again
+                    raise ImageException('The node ' + link.node + ' refused ' + name + ' (HTTP ' +
+                                         str(response.status) + '): ' + message)
+                error = ImageException(message)
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+            finally:
+                connection.close()
+            progress.add(-sent[0])
+            attempt += 1
+            if attempt > constants.REMOTE_RETRIES:
+                raise ImageException('Cannot send ' + name + ' to ' + link.node + ', cause: ' + str(error))
+            self._logger.warning('Transfer of ' + name + ' to ' + link.node + ' failed, retrying. Cause: ' + str(error))
+            sleep(constants.REMOTE_RETRY_DELAY)
+
+    def _read_file(self, file_path, link, progress, sent):
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(constants.REMOTE_CHUNK_SIZE), b''):
+                link.budget.consume(len(chunk))
+                sent[0] += len(chunk)
+                progress.add(len(chunk))
+                yield chunk
+
+    def _commit(self, backupset, link):
+        connection = link.connect()
+        try:
+            connection.request('POST', '/api/replica/' + quote(backupset.id, safe=''))
+            response = connection.getresponse()
+            message = response.read().decode('utf-8', 'replace').strip()
+            if response.status != 200:
+                raise ImageException('The node ' + link.node + ' cannot commit the replica (HTTP ' +
+                                     str(response.status) + '): ' + message)
+        finally:
+            connection.close()
+
+
+# Export as Singleton
+Replicator = _Replicator()
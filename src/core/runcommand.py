@@ -11,6 +11,10 @@ import errno
 import os
 import pty
 import subprocess
+from time import monotonic
+
+import constants
+from .procstat import ProcessTreeMonitor
 
 
 class OutputParser:
@@ -47,7 +51,10 @@ class OutputToFileConverter(OutputParser):
 
 class Execute:
     """Command execution wrapper that provides support for both, line-buffering
-    through tty emulation and blocking modes.
+    through tty emulation and blocking modes. A pipeline is given as a list of
+    commands, which are started without a shell, each reading the standard
+    output of the previous one, so that all of them are killed with the
+    pipeline and its return code is the one of the last failed command.
     """
 
     PROCESS_KILLED = -9
@@ -55,16 +62,21 @@ class Execute:
     PROCESS_RUNNING = None
 
     def __init__(self, command:list, output_parser:'OutputParser'=OutputParser(),
-                 use_pty:bool=False, shell:bool=False, buffer_size:int=1024):
+                 use_pty:bool=False, shell:bool=False, buffer_size:int=1024,
+                 track_resources:bool=False, stdin=None):
         """
         Add the command execution parameters to the object.
-        :param command: the command to be executed.
+        :param command: the command to be executed, or a list of the commands of a pipeline.
         :param output_parser: the output parsing module to use.
         :param use_pty: the flag to force line-buffering for the command.
         :param shell: the flag to allow command in a string format.
             Warning: Executing commands from user input with shell enabled
             is considered as high security risk.
         :param buffer_size: the number of bytes to read at once from pty.
+        :param track_resources: the flag to sample resources used by the command and
+            all of its child processes while it is running.
+        :param stdin: optional file object to be used as the standard input of the command,
+            it is closed in this process once the command is started.
         :return: initialised Execute object.
         """
         self.command = command
@@ -72,7 +84,11 @@ class Execute:
         self.use_pty = use_pty
         self.shell = shell
         self.buffer_size = buffer_size
+        self.track_resources = track_resources
+        self.stdin = stdin
         self.process = None
+        self.processes = []
+        self._resource_monitor = None
 
     def run(self):
         """
@@ -86,14 +102,16 @@ class Execute:
 
     def kill(self):
         """
-        Force stop execution of the command.
+        Force stop execution of the command, all the commands of a pipeline are killed.
         :return: return code of the killed command or None if process did not exist.
         """
         if self.process:
-            if self.process.poll() is None:
-                self.process.kill()
-            self.process.wait()
-            return self.process.poll()
+            for process in self._pipeline():
+                if process.poll() is None:
+                    process.kill()
+            for process in self._pipeline():
+                process.wait()
+            return self.poll()
         else:
             return None
 
@@ -105,7 +123,10 @@ class Execute:
             -1 - if process was not started yet.
         """
         if self.process:
-            return self.process.poll()
+            codes = [process.poll() for process in self._pipeline()]
+            if None in codes:
+                return None
+            return next((code for code in reversed(codes) if code), 0)
         else:
             return -1
 
@@ -116,6 +137,66 @@ class Execute:
         """
         return self.output_parser.output
 
+    def resources(self):
+        """
+        Return resources used by the command and its child processes.
+        :return: dictionary as returned by ProcessTreeMonitor.get_resources, or None if the
+            resources are not tracked or the command was not started yet.
+        """
+        if self._resource_monitor:
+            return self._resource_monitor.get_resources()
+        return None
+
+    def _start_resource_monitor(self):
+        if self.track_resources:
+            pids = [process.pid for process in self.processes]
+            self._resource_monitor = ProcessTreeMonitor(pids if len(pids) > 1 else self.process.pid,
+                                                        constants.RESOURCE_SAMPLE_INTERVAL)
+            self._resource_monitor.start()
+
+    def _stop_resource_monitor(self):
+        if self._resource_monitor:
+            self._resource_monitor.stop()
+
+    def _finish(self):
+        """Waits for the commands which closed their output to exit, e.g. the first commands of
+        a pipeline which are not reaped yet, the commands still running after PROCESS_EXIT_TIMEOUT
+        seconds are killed."""
+        deadline = monotonic() + constants.PROCESS_EXIT_TIMEOUT
+        for process in self._pipeline():
+            try:
+                process.wait(max(0, deadline - monotonic()))
+            except subprocess.TimeoutExpired:
+                break
+        return self.kill()
+
+    def _pipeline(self):
+        return self.processes or [self.process]
+
+    def _is_pipeline(self):
+        return bool(self.command) and isinstance(self.command[0], list)
+
+    def _start(self, stdin, stdout, stderr, close_fds=True):
+        """Starts the command, the commands of a pipeline are connected by pipes, the parent
+        ends of the pipes are closed, so a command sees the pipe broken once its reader exits."""
+        commands = self.command if self._is_pipeline() else [self.command]
+        for index, command in enumerate(commands):
+            last = index == len(commands) - 1
+            process = subprocess.Popen(command, stdin=stdin, stdout=stdout if last else subprocess.PIPE,
+                                       stderr=stderr if last or stderr != subprocess.PIPE else None,
+                                       close_fds=close_fds, shell=self.shell)
+            if self.processes:
+                self.processes[-1].stdout.close()
+            self.processes.append(process)
+            stdin = process.stdout
+        self.process = self.processes[-1]
+
+    def _close_stdin(self):
+        """Closes the standard input handed over to the command, so that the command is the
+        only reader of a pipe and its writer gets an error once the command exits."""
+        if self.stdin is not None:
+            self.stdin.close()
+
     def _run_with_pty(self):
         """
         Executes Unix command forcing the line-buffering behaviour
@@ -125,31 +206,42 @@ class Execute:
         :return: return code of the executed command
         """
         master_fd, slave_fd = pty.openpty()
-        self.process = subprocess.Popen(self.command, stdin=slave_fd,
-                                        stdout=slave_fd, stderr=subprocess.STDOUT,
-                                        close_fds=False, shell=self.shell)
+        stdin = self.stdin if self.stdin is not None else slave_fd
+        self._start(stdin, slave_fd, slave_fd, close_fds=False)
         os.close(slave_fd)
-        while True:
-            try:
-                data = os.read(master_fd, self.buffer_size)
-            except OSError as e:
-                if e.errno == errno.EIO:
-                    break  # EIO == EOF on some systems
-                raise e
-            else:
-                if not data:  # EOF
-                    break
-                self.output_parser.parse(data.decode("utf-8"))
-        os.close(master_fd)
-        return self.kill()
+        self._close_stdin()
+        self._start_resource_monitor()
+        try:
+            while True:
+                try:
+                    data = os.read(master_fd, self.buffer_size)
+                except OSError as e:
+                    if e.errno == errno.EIO:
+                        break  # EIO == EOF on some systems
+                    raise e
+                else:
+                    if not data:  # EOF
+                        break
+                    self.output_parser.parse(data.decode("utf-8"))
+        except BaseException:
+            self.kill()  # The parser found an error, the command is not waited for
+            raise
+        finally:
+            os.close(master_fd)
+            self._stop_resource_monitor()
+        return self._finish()
 
     def _run_without_pty(self):
         """
         Executes command and passes standard output to the output_parser.
         :return: return code of the executed command
         """
-        self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                        shell=self.shell)
-        out, err = self.process.communicate()
+        self._start(self.stdin, subprocess.PIPE, subprocess.PIPE)
+        self._close_stdin()
+        self._start_resource_monitor()
+        try:
+            out, err = self.process.communicate()
+        finally:
+            self._stop_resource_monitor()
         self.output_parser.parse(out.decode("utf-8"))
-        return self.kill()
+        return self._finish()
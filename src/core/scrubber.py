@@ -0,0 +1,256 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import fcntl
+import logging
+from datetime import datetime, timedelta
+from os import path
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+import constants
+from lib.exceptions import DiskImageException
+from lib.throttle import TokenBucket
+from services.config import ConfigHelper
+from services.database import DB
+from .backupset import Backupset
+from .checksum import find_first_mismatch
+from .discard import PartcloneBitmap
+from .remote import ImageSource
+
+CHECKSUM_METHOD = 'checksum'
+HEADER_METHOD = 'header'
+
+
+def check_backup(backupset, backup_path, budget=None):
+    """
+    Checks the partition images of a backup stored on this node. The images with the checksums
+    recorded by the backup are hashed again, the headers, the bitmaps and the groups of blocks of
+    the older images are checked against their crc32 instead. The check stops at the first
+    mismatching image.
+    :param backupset: Backupset object of the backup.
+    :param backup_path: the directory holding the backup files on this node.
+    :param budget: optional object with the consume method limiting the bytes read per second.
+    :return: dictionary with the status (ok, mismatch or error) and the result of each partition.
+    """
+    source = ImageSource(backup_path)
+    status = constants.SCRUB_OK
+    partitions = []
+    for partition in backupset.partitions:
+        result = check_partition(source, partition, budget)
+        partitions.append(result)
+        if result['status'] == constants.SCRUB_MISMATCH:
+            status = constants.SCRUB_MISMATCH
+            break
+        if result['status'] == constants.SCRUB_ERROR:
+            status = constants.SCRUB_ERROR
+    return {'status': status, 'partitions': partitions}
+
+
+def check_partition(source, partition, budget=None):
+    """
+    Checks the image of a single partition, see check_backup.
+    :param source: ImageSource object of the backup.
+    :param partition: Partition object from the backupset.
+    :param budget: optional object with the consume method limiting the bytes read per second.
+    :return: dictionary with the status, the method used and the first mismatch found if any.
+    """
+    name = constants.PARTITION_FILE_PREFIX + partition.id + constants.PARTITION_FILE_SUFFIX
+    file_path = source.backup_path + name
+    result = {'partition': partition.id, 'method': CHECKSUM_METHOD if partition.checksum else HEADER_METHOD}
+    try:
+        if not path.isfile(file_path) and not path.isfile(file_path[:-len(constants.PARTITION_FILE_SUFFIX)] + constants.COMPRESSED_FILE_SUFFIX):
+            mismatch = {'reason': 'The image is missing.'}
+        elif partition.checksum:
+            image = file_path if path.isfile(file_path) else source.read(name)
+            mismatch = find_first_mismatch(image, partition.checksum, budget=budget)
+        else:
+            mismatch = _check_image_structure(source, name, budget)
+    except (OSError, DiskImageException) as e:
+        result.update(status=constants.SCRUB_ERROR, error=str(e))
+        return result
+    result['status'] = constants.SCRUB_MISMATCH if mismatch else constants.SCRUB_OK
+    if mismatch:
+        result['mismatch'] = mismatch
+    return result
+
+
+def _check_image_structure(source, name, budget):
+    try:
+        bitmap = PartcloneBitmap(b''.join(source.read(name, 0, PartcloneBitmap.HEADER_SIZE)))
+    except DiskImageException as e:
+        return {'reason': str(e)}
+    if not bitmap.header_is_valid():
+        return {'reason': 'The crc32 of the image header does not match.'}
+    if budget:
+        budget.consume(bitmap.data_offset)
+    if not bitmap.bitmap_is_valid(b''.join(source.read(name, PartcloneBitmap.HEADER_SIZE, bitmap.data_offset))):
+        return {'reason': 'The crc32 of the image bitmap does not match.'}
+    size = source.get_size(name)
+    if size < bitmap.image_size:
+        return {'size': size, 'expected_size': bitmap.image_size}
+    group = bitmap.find_corrupted_group(_consume(source.read(name, bitmap.data_offset), budget))
+    if group is not None:
+        return {'offset': bitmap.image_offset(group * bitmap.blocks_per_checksum),
+                'reason': 'The crc32 of the image blocks does not match.'}
+    return None
+
+
+def _consume(chunks, budget):
+    for chunk in chunks:
+        if budget:
+            budget.consume(len(chunk))
+        yield chunk
+
+
+class ScrubBudget:
+    """
+    This class limits the rate of the reads of the scrubber and holds them while the node is
+    busy, so the scrubbing runs preferentially when the node is idle. The reads are held at most
+    for the given time, so the backups are scrubbed even on a node which is never idle.
+    """
+    def __init__(self, rate, is_idle, max_wait=constants.SCRUB_MAX_IDLE_WAIT):
+        """
+        :param rate: maximum number of bytes read per second, 0 for no limit.
+        :param is_idle: function returning True if the node is idle.
+        :param max_wait: the longest wait for the node to become idle in seconds.
+        :return: initialised ScrubBudget object.
+        """
+        self.bucket = TokenBucket(rate)
+        self.is_idle = is_idle
+        self.max_wait = max_wait
+        self._checked = None
+        self._lock = Lock()
+
+    def consume(self, amount):
+        """
+        Waits until the bytes can be read.
+        :param amount: number of bytes to be read.
+        :return: None
+        """
+        self._wait_for_idle()
+        self.bucket.consume(amount)
+
+    def _wait_for_idle(self):
+        with self._lock:
+            if self._checked is not None and monotonic() - self._checked < constants.SCRUB_IDLE_CHECK_INTERVAL:
+                return
+            start = monotonic()
+            while not self.is_idle() and monotonic() - start < self.max_wait:
+                sleep(constants.SCRUB_IDLE_CHECK_INTERVAL)
+            self._checked = monotonic()
+
+
+class _Scrubber:
+    """
+    This class walks the backups held by this node in the background and reads their images
+    again to find the corrupted ones before they are restored, each backup is scrubbed again
+    after the configured number of days. The result of the last scrub is recorded per node with
+    the backup, a mismatch is logged and reported by the scrub endpoint until the backup passes
+    a later scrub or is deleted.
+    """
+    def __init__(self):
+        self.monitor = None
+        self.budget = None
+        self.period = constants.SCRUB_PERIOD_DAYS
+        self.idle_cpu = constants.SCRUB_IDLE_CPU
+        self.idle_disk = constants.SCRUB_IDLE_DISK
+        self._lock_file = None
+        self._logger = logging.getLogger(__name__)
+
+    def start(self, monitor=None):
+        """
+        Starts scrubbing the backups if it is enabled in the scrub section of the config file and
+        this is the only process of the node doing so.
+        :param monitor: SystemMonitor object providing the utilisation of the node.
+        :return: None
+        """
+        if not self._load_config() or not self._acquire_lock():
+            return
+        self.monitor = monitor
+        Thread(target=self._run, daemon=True).start()
+        self._logger.info('Scrubbing the backups every ' + str(self.period) + ' days.')
+
+    def is_idle(self):
+        """
+        Checks whether the CPU and the backup disk utilisation of the node are low.
+        :return: True if the node is idle or its utilisation is unknown, False otherwise.
+        """
+        if not self.monitor:
+            return True
+        metrics = self.monitor.get_metrics()
+        return metrics.get('CPU_Utilisation', 0) < self.idle_cpu and \
+            metrics.get('Disk_IO_Utilisation', 0) < self.idle_disk
+
+    def scrub_pending(self):
+        """
+        Scrubs the backups held by this node which were not scrubbed in the configured period.
+        :return: number of the scrubbed backups.
+        """
+        node = ConfigHelper.config['node']['name']
+        scrubbed = 0
+        for data in DB.get_backups_to_scrub(node, datetime.today() - timedelta(days=self.period)):
+            self.scrub(Backupset._from_json(data))
+            scrubbed += 1
+        return scrubbed
+
+    def scrub(self, backupset):
+        """
+        Checks the images of the backup and records the result.
+        :param backupset: Backupset object of a backup held by this node.
+        :return: dictionary with the date, the duration and the result of the scrub.
+        """
+        start = monotonic()
+        try:
+            result = check_backup(backupset, ConfigHelper.config['node']['backup_path'] + backupset.id + '/',
+                                  self.budget)
+        except Exception as e:
+            result = {'status': constants.SCRUB_ERROR, 'partitions': [], 'error': str(e)}
+        result['date'] = datetime.today()
+        result['duration'] = round(monotonic() - start, 3)
+        DB.set_backup_scrub(backupset.id, ConfigHelper.config['node']['name'], result)
+        if result['status'] == constants.SCRUB_MISMATCH:
+            self._logger.error('The backup ' + backupset.id + ' is corrupted: ' + str(result['partitions']))
+        elif result['status'] == constants.SCRUB_ERROR:
+            self._logger.warning('Cannot scrub the backup ' + backupset.id + ': ' +
+                                 str(result.get('error') or result['partitions']))
+        return result
+
+    def _run(self):
+        while True:
+            try:
+                self.scrub_pending()
+            except Exception as e:
+                self._logger.warning('Cannot find the backups to be scrubbed, cause: ' + str(e))
+            sleep(constants.SCRUB_INTERVAL)
+
+    def _load_config(self):
+        if not ConfigHelper.config.has_section('scrub'):
+            return False
+        section = ConfigHelper.config['scrub']
+        if not section.getboolean('enabled', False):
+            return False
+        self.period = section.getfloat('period', constants.SCRUB_PERIOD_DAYS)
+        self.idle_cpu = section.getfloat('idle_cpu', constants.SCRUB_IDLE_CPU)
+        self.idle_disk = section.getfloat('idle_disk', constants.SCRUB_IDLE_DISK)
+        bandwidth = int(section.getfloat('bandwidth', constants.SCRUB_BANDWIDTH) * 1048576)
+        self.budget = ScrubBudget(bandwidth, self.is_idle)
+        return True
+
+    def _acquire_lock(self):
+        try:
+            self._lock_file = open(constants.SCRUB_LOCK_FILE, 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            if self._lock_file:
+                self._lock_file.close()
+            self._lock_file = None
+            return False  # Another process of the node scrubs the backups
+
+
+# Export as Singleton
+Scrubber = _Scrubber()
@@ -4,10 +4,18 @@ Date:       10/04/2016
 License:    GPL
 """
 
-from os import path, mkdir, remove
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from os import path, remove, rmdir, symlink
 from shutil import rmtree
+from threading import Lock
+from time import time
 
+import constants
+from lib import tracing
+from lib.exceptions import MountException
 from services.config import ConfigHelper
+from services.utils import create_dir
 from .runcommand import Execute
 
 
@@ -15,77 +23,143 @@ class SquashfsWrapper:
     """
     This class provides logic required to mount squashfs compressed images and create symlinks,
     so that the generic code that handles partclone image mounting can be used.
+    The partition images are mounted lazily, each of them only when it is requested for the first
+    time, and every mount is tracked separately so that it can be released precisely.
     """
     SQFS_MNT_DIR = 'sqfs_mnt'
 
     def __init__(self, backupset):
         self.backupset = backupset
-        self.mounted = False
+        self.mount_latency = {}
         self._backup_dir = ConfigHelper.config['node']['backup_path'] + self.backupset.id + '/'
         self._mnt_dir = self._backup_dir + self.SQFS_MNT_DIR + '/'
+        self._mounts = {}
+        self._lock = Lock()
+        self._partition_locks = {}
+        self._logger = logging.getLogger(__name__)
 
-    def mount(self):
+    @property
+    def mounted(self):
         """
-        Creates directory structure necessary for mounting of the squashfs images, mounts the image
-        and creates symlinks.
+        Checks whether any of the partition images is currently mounted.
+        :return: True if at least one image is mounted, False otherwise.
+        """
+        return bool(self._mounts)
+
+    def is_mounted(self, partition):
+        """
+        Checks whether the image of the given partition is currently mounted.
+        :param partition: Partition object from the backupset.
+        :return: True if the image is mounted, False otherwise.
+        """
+        return partition.id in self._mounts
+
+    def mount(self, partitions=None):
+        """
+        Mounts the squashfs images of the requested partitions and creates symlinks to the
+        partclone images stored inside. Images which are not mounted yet are mounted in parallel.
+        :param partitions: list of Partition objects to be mounted, all partitions of the
+            backupset are mounted if None is provided.
+        :return: None
+        :exception: MountException is raised if the backup directory does not exist or any of
+            the images cannot be mounted.
+        """
+        if partitions is None:
+            partitions = self.backupset.partitions
+        pending = [partition for partition in partitions if not self.is_mounted(partition)]
+        if len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                mount_partition = tracing.bind(self.mount_partition)
+                for future in [executor.submit(mount_partition, p) for p in pending]:
+                    future.result()
+        elif pending:
+            self.mount_partition(pending[0])
+
+    def mount_partition(self, partition):
+        """
+        Mounts the squashfs image of a single partition and creates the symlink to the partclone
+        image, unless the image is already mounted.
+        :param partition: Partition object from the backupset.
         :return: None
-        :exception: Exception is raised if the backup directory does not exist.
+        :exception: MountException is raised if the image cannot be mounted.
         """
-        if path.exists(self._backup_dir):
-            try:
-                mkdir(self._mnt_dir)
-            except FileExistsError:
-                pass
-            for partition in self.backupset.partitions:
-                self._image_prefix = 'part' + str(partition.id)
-                self._create_mnt_dir(partition)
-                self._mount_image(partition)
-                self._create_symlink(partition)
-            self.mounted = True
-        else:
-            Exception('Cannot open backup directory.')
+        with self._get_partition_lock(partition):
+            if self.is_mounted(partition):
+                return
+            self._check_backup_dir_with_raise()
+            with tracing.span('sqfs.mount ' + str(partition.id), 'sqfs'):
+                self._mount_partition(partition)
+
+    def _mount_partition(self, partition):
+        start = time()
+        image_prefix = self._get_image_prefix(partition.id)
+        mnt_path = self._mnt_dir + image_prefix
+        create_dir(self._mnt_dir)
+        create_dir(mnt_path)
+        self._mount_image(image_prefix, mnt_path)
+        with self._lock:
+            self._mounts[partition.id] = mnt_path
+        self._create_symlink(image_prefix)
+        self.mount_latency[partition.id] = time() - start
+        self._logger.info('Mounted ' + image_prefix + '.sqfs of backup ' + str(self.backupset.id) +
+                          ' in ' + '{:.3f}'.format(self.mount_latency[partition.id]) + 's.')
 
     def umount(self):
         """
-        Unmounts squashfs image, and removes symlinks and directory structure created by
-        the mount method.
+        Unmounts squashfs images, and removes symlinks and directory structure created by
+        the mount methods.
         :return: None
         """
-        for partition in self.backupset.partitions:
-            self._image_prefix = 'part' + str(partition.id)
-            self._remove_symlink(partition)
-        self._umount_images()
+        with self._lock:
+            mounts = list(self._mounts.items())
+        for partition_id, mnt_path in mounts:
+            self._remove_symlink(self._get_image_prefix(partition_id))
+            if self._umount_image(mnt_path):
+                with self._lock:
+                    self._mounts.pop(partition_id, None)
         self._remove_mnt_dir()
-        self.mounted = False
 
-    def _create_mnt_dir(self, partition):
-        try:
-            mkdir(self._mnt_dir + self._image_prefix)
-        except FileExistsError:
-            pass
+    def _get_partition_lock(self, partition):
+        with self._lock:
+            if partition.id not in self._partition_locks:
+                self._partition_locks[partition.id] = Lock()
+            return self._partition_locks[partition.id]
+
+    def _check_backup_dir_with_raise(self):
+        if not path.exists(self._backup_dir):
+            raise MountException('Cannot open backup directory.')
 
-    def _mount_image(self, partition):
-        sqfs_file = self._backup_dir + self._image_prefix + '.sqfs'
-        mnt_path = self._mnt_dir + self._image_prefix
+    def _get_image_prefix(self, partition_id):
+        return constants.PARTITION_FILE_PREFIX + str(partition_id)
+
+    def _mount_image(self, image_prefix, mnt_path):
+        sqfs_file = self._backup_dir + image_prefix + constants.COMPRESSED_FILE_SUFFIX
         command = ['mount', sqfs_file, mnt_path]
-        Execute(command).run()
+        if Execute(command).run() != 0:
+            raise MountException('Cannot mount compressed image: ' + sqfs_file)
 
-    def _create_symlink(self, partition):
-            symlink_file = self._backup_dir + self._image_prefix + '.img'
-            image_file = self._mnt_dir + self._image_prefix + '/' + self._image_prefix + '.img'
-            command = ['ln', '-s', image_file, symlink_file]
-            Execute(command).run()
+    def _create_symlink(self, image_prefix):
+        symlink_file = self._backup_dir + image_prefix + '.img'
+        image_file = self._mnt_dir + image_prefix + '/' + image_prefix + '.img'
+        if path.islink(symlink_file):
+            remove(symlink_file)
+        symlink(image_file, symlink_file)
 
-    def _remove_symlink(self, partition):
-        symlink_file = self._backup_dir + self._image_prefix + '.img'
-        if path.exists(symlink_file) and path.islink(symlink_file):
+    def _remove_symlink(self, image_prefix):
+        symlink_file = self._backup_dir + image_prefix + '.img'
+        if path.islink(symlink_file):
             remove(symlink_file)
 
-    def _umount_images(self):
-        path = self._mnt_dir + '*'
-        command = 'umount ' + path
-        Execute(command, shell=True).run()
+    def _umount_image(self, mnt_path):
+        if Execute(['umount', mnt_path]).run() != 0:
+            self._logger.warning('Cannot unmount compressed image at: ' + mnt_path)
+            return False
+        try:
+            rmdir(mnt_path)
+        except OSError:
+            pass
+        return True
 
     def _remove_mnt_dir(self):
-        if path.exists(self._mnt_dir):
+        if path.exists(self._mnt_dir) and not self.mounted:
             rmtree(self._mnt_dir)
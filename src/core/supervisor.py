@@ -0,0 +1,264 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+from collections import deque
+from multiprocessing.connection import wait
+from threading import Lock, Thread, Timer
+
+import constants
+from services.config import ConfigHelper
+
+# Sent to the worker process to cancel its job, SIGTERM interrupts the job to be resumed instead
+_CANCEL_SIGNAL = signal.SIGUSR1
+
+
+class WorkerController:
+    """
+    This class represents a job controller running in a worker process, it provides the same
+    interface as the ProcessController, while the status is the last one received from the
+    worker process, so reading it never blocks on the job.
+    """
+    def __init__(self, controller, supervisor):
+        self.backup_id = controller.backup_id
+        self.process = None
+        self._controller = controller
+        self._supervisor = supervisor
+        self._status = dict(controller.get_status(), status=constants.STATUS_PENDING)
+        self._trace = None
+        self._cancelled = False
+        self._lock = Lock()
+
+    def get_status(self):
+        """
+        Returns the status of the job most recently reported by the worker process.
+        :return: dictionary describing the status.
+        """
+        with self._lock:
+            return self._status
+
+    def has_error_status(self):
+        """
+        Allows checking whether an error is detected by the controller.
+        :return: True if error was detected, False otherwise.
+        """
+        return self.get_status()['status'] == constants.STATUS_ERROR
+
+    def get_trace(self):
+        """
+        Returns the trace of the job, it is available once the worker process finishes.
+        :return: dictionary in the Chrome trace event format, None if not available.
+        """
+        return self._trace
+
+    def kill(self):
+        """
+        Cancels the job, a queued job is never started, while a running worker is asked to cancel
+        the job, followed by a forced kill of its process group if it does not exit in time.
+        :return: None
+        """
+        self._cancelled = True
+        if not self._supervisor.cancel(self):
+            self._signal(_CANCEL_SIGNAL, group=False)
+            timer = Timer(constants.JOB_KILL_TIMEOUT, self._signal, [signal.SIGKILL])
+            timer.daemon = True
+            timer.start()
+
+    def start(self, context):
+        """
+        Starts the worker process running the job.
+        :param context: multiprocessing context used to create the process.
+        :return: the connection receiving the status updates from the worker process.
+        """
+        receiver, sender = context.Pipe(duplex=False)
+        self.process = context.Process(target=_run_worker, daemon=True,
+                                       args=(self._controller, sender, constants.JOB_STATUS_INTERVAL))
+        self.process.start()
+        sender.close()
+        self._controller = None  # The state of the job is kept by the worker process from now on
+        try:
+            os.setpgid(self.process.pid, self.process.pid)
+        except OSError:
+            pass  # The worker has already done it, or it has already exited
+        if self._cancelled:
+            self._signal(_CANCEL_SIGNAL, group=False)
+        return receiver
+
+    def receive(self, message):
+        """
+        Stores the status update sent by the worker process.
+        :param message: dictionary with the status and optionally the trace of the job.
+        :return: None
+        """
+        with self._lock:
+            self._status = message['status']
+            if 'trace' in message:
+                self._trace = message['trace']
+
+    def finish(self):
+        """
+        Collects the exit code of the worker process and reports an error if the worker exited
+        without finishing the job.
+        :return: None
+        """
+        self.process.join()
+        with self._lock:
+            if self._cancelled and self._status['status'] != constants.STATUS_FINISHED:
+                self._set_error('Job cancelled by the user.')
+            elif self._status['status'] not in (constants.STATUS_FINISHED, constants.STATUS_ERROR):
+                self._set_error('The job worker process exited unexpectedly (code: ' +
+                                str(self.process.exitcode) + ').')
+
+    def cancel_queued(self):
+        with self._lock:
+            self._set_error('Job cancelled by the user.')
+
+    def _set_error(self, msg):
+        self._status = dict(self._status, status=constants.STATUS_ERROR, error_msg=msg)
+
+    def _signal(self, signal_number, group=True):
+        if self.process and self.process.exitcode is None:
+            try:
+                if group:
+                    os.killpg(self.process.pid, signal_number)
+                else:
+                    os.kill(self.process.pid, signal_number)
+            except OSError:
+                pass
+
+
+class _JobSupervisor:
+    """
+    The JobSupervisor runs each job in a separate worker process, so that the imaging does not
+    compete with the API for the interpreter and a stuck or crashed job cannot affect the API.
+    The number of the concurrently running workers is limited, the jobs above the limit are
+    queued. A single thread receives the status updates of all workers.
+    The workers are started by the forkserver rather than forked from the multithreaded API process,
+    which could leave them holding a lock taken by another thread at the time of the fork, as well
+    as the sockets and signal handlers of the server. The controllers are pickled into the workers.
+    """
+    def __init__(self, max_workers, context=None):
+        self.max_workers = max_workers
+        self._context = context or self._create_context()
+        self._queue = deque()
+        self._workers = {}
+        self._lock = Lock()
+        self._wakeup_receiver, self._wakeup_sender = self._context.Pipe(duplex=False)
+        self._thread = None
+        self._logger = logging.getLogger(__name__)
+
+    def submit(self, controller):
+        """
+        Queues the job to be run by a worker process.
+        :param controller: initialised BackupController or RestorationController.
+        :return: WorkerController representing the job.
+        """
+        return self.submit_all([controller])[0]
+
+    def submit_all(self, controllers):
+        """
+        Queues a number of jobs at once, so that no other job can be queued in between them.
+        :param controllers: list of initialised BackupController or RestorationController objects.
+        :return: list of WorkerController objects representing the jobs in the same order.
+        """
+        workers = [WorkerController(controller, self) for controller in controllers]
+        with self._lock:
+            self._queue.extend(workers)
+            if not self._thread:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._wakeup_sender.send(None)
+        return workers
+
+    def cancel(self, worker):
+        """
+        Removes the job from the queue, if it was not started yet.
+        :param worker: WorkerController returned by the submit method.
+        :return: True if the job was removed from the queue, False if it is already running.
+        """
+        with self._lock:
+            if worker in self._queue:
+                self._queue.remove(worker)
+                worker.cancel_queued()
+                return True
+            return False
+
+    def get_worker_count(self):
+        """
+        Returns the number of the running and queued jobs.
+        :return: tuple with the number of running and queued jobs.
+        """
+        with self._lock:
+            return len(self._workers), len(self._queue)
+
+    @staticmethod
+    def _create_context():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['core.controller'])  # Imported once rather than by every worker
+        return context
+
+    def _run(self):
+        while True:
+            self._start_queued()
+            ready = wait(list(self._workers.keys()) + [self._wakeup_receiver])
+            for connection in ready:
+                if connection is self._wakeup_receiver:
+                    self._wakeup_receiver.recv()
+                else:
+                    self._receive(connection)
+
+    def _start_queued(self):
+        with self._lock:
+            while self._queue and len(self._workers) < self.max_workers:
+                worker = self._queue.popleft()
+                try:
+                    self._workers[worker.start(self._context)] = worker
+                except Exception as e:
+                    self._logger.error('Cannot start the worker for job ' + str(worker.backup_id) +
+                                       ', cause: ' + str(e))
+                    worker.cancel_queued()
+
+    def _receive(self, connection):
+        worker = self._workers[connection]
+        try:
+            worker.receive(connection.recv())
+        except (EOFError, OSError):
+            connection.close()
+            with self._lock:
+                del self._workers[connection]
+            worker.finish()
+
+
+def _run_worker(controller, connection, interval):
+    """
+    The main function of the worker process, it runs the job and sends its status to the
+    supervisor at the given interval. The worker leads its own process group, so that the
+    imaging processes it starts are signalled together with it. The job is cancelled on the
+    cancel signal (SIGUSR1), while SIGTERM, e.g. sent on shutdown, interrupts it to be resumed later.
+    :param controller: initialised BackupController or RestorationController.
+    :param connection: the connection used to send the status updates.
+    :param interval: time between the status updates in seconds.
+    :return: None
+    """
+    try:
+        os.setpgid(0, 0)
+    except OSError:
+        pass  # Already done by the supervisor
+    signal.signal(_CANCEL_SIGNAL, lambda signal_number, frame: controller.kill())
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: controller.interrupt())
+    controller.run()
+    while not controller.wait(interval):
+        connection.send({'status': controller.get_status()})
+    connection.send({'status': controller.get_status(), 'trace': controller.get_trace()})
+    connection.close()
+
+
+# Export a ready JobSupervisor as a singleton.
+JobSupervisor = _JobSupervisor(ConfigHelper.config.getint('node', 'max_jobs',
+                                                          fallback=constants.MAX_CONCURRENT_JOBS))
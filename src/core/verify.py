@@ -0,0 +1,284 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import random
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil, log
+from os import O_RDONLY, POSIX_FADV_DONTNEED, close, fsync, open as open_device, posix_fadvise, pread
+
+import constants
+from lib.exceptions import ImageException
+
+SAMPLE_MODE = 'sample'
+FULL_MODE = 'full'
+VERIFY_MODES = (SAMPLE_MODE, FULL_MODE)
+
+
+def get_sample_size(population, confidence, defect_rate=constants.VERIFY_DEFECT_RATE):
+    """
+    Calculates the number of the randomly sampled blocks needed to find a corruption of the
+    given share of the blocks with the given confidence, i.e. the smallest n for which
+    (1 - defect_rate) ^ n <= 1 - confidence.
+    :param population: number of the used blocks of the partition.
+    :param confidence: probability of finding the corruption, between 0 and 1.
+    :param defect_rate: the smallest share of the corrupted blocks to be found.
+    :return: number of the blocks to be sampled, at most the population.
+    """
+    if population <= 0:
+        return 0
+    if confidence >= 1:
+        return population
+    return min(population, ceil(log(1 - confidence) / log(1 - defect_rate)))
+
+
+def get_confidence(checked, population, defect_rate=constants.VERIFY_DEFECT_RATE):
+    """
+    Calculates the probability that the checked random sample of the blocks contains a corrupted
+    block, if at least the given share of the blocks is corrupted.
+    :param checked: number of the sampled blocks which were checked.
+    :param population: number of the used blocks of the partition.
+    :param defect_rate: the share of the corrupted blocks.
+    :return: confidence between 0 and 1, 1 if all blocks were checked.
+    """
+    if checked >= population:
+        return 1.0
+    return 1 - (1 - defect_rate) ** checked
+
+
+class UsedBlocks:
+    """
+    This class maps the used blocks of a partition to their positions in the partclone image,
+    each used block is identified by its rank, the number of the used blocks preceding it.
+    """
+    def __init__(self, bitmap, data):
+        """
+        :param bitmap: PartcloneBitmap object of the image.
+        :param data: the bitmap_size bytes following the header of the image.
+        :return: initialised UsedBlocks object.
+        """
+        self.bitmap = bitmap
+        self.extents = []
+        self._ranks = []
+        rank = 0
+        for block, count in bitmap.used_extents(data):
+            self.extents.append((rank, block, count))
+            self._ranks.append(rank)
+            rank += count
+        self.count = rank
+
+    def block(self, rank):
+        """
+        Finds the used block with the given rank.
+        :param rank: the number of the used blocks preceding the block.
+        :return: the number of the block on the partition.
+        """
+        first_rank, first_block, _ = self.extents[bisect_right(self._ranks, rank) - 1]
+        return first_block + rank - first_rank
+
+    def sample(self, size):
+        """
+        Picks a random sample of the used blocks.
+        :param size: number of the blocks to be picked.
+        :return: list of (rank, block, 1) tuples ordered by the position of the blocks.
+        """
+        return [(rank, self.block(rank), 1) for rank in sorted(random.sample(range(self.count), size))]
+
+    def segments(self, max_blocks):
+        """
+        Splits all used blocks into the segments contiguous both on the partition and in the
+        image, i.e. the segments do not cross the checksums stored in the image.
+        :param max_blocks: maximum number of the blocks in a segment.
+        :return: generator of (rank, block, count) tuples ordered by the position of the blocks.
+        """
+        group = self.bitmap.blocks_per_checksum if self.bitmap.checksum_size else 0
+        for rank, block, count in self.extents:
+            while count:
+                size = min(count, max_blocks, group - rank % group) if group else min(count, max_blocks)
+                yield rank, block, size
+                rank, block, count = rank + size, block + size, count - size
+
+
+class FileImage:
+    """ Provides the blocks of an image file which is accessible on this node. """
+    seekable = True
+
+    def __init__(self, file_path):
+        self._file = open(file_path, 'rb')
+
+    def read(self, offset, size):
+        return pread(self._file.fileno(), size, offset)
+
+    def close(self):
+        self._file.close()
+
+
+class RemoteImage:
+    """ Provides the blocks of an image stored on another node with the Range requests. """
+    seekable = True
+
+    def __init__(self, remote, name):
+        self.remote = remote
+        self.name = name
+
+    def read(self, offset, size):
+        return b''.join(self.remote.iter_content(self.name, offset, offset + size))
+
+    def close(self):
+        pass
+
+
+class SequentialImage:
+    """ Provides the blocks of an image which can only be read as a stream, e.g. decompressed
+    from its squashfs file on the fly. The blocks have to be requested in the order of their
+    offsets, the data between them is skipped. """
+    seekable = False
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b''
+        self._offset = 0
+
+    def read(self, offset, size):
+        if offset < self._offset:
+            raise ImageException('The image can only be read in the order of the offsets.')
+        while self._offset + len(self._buffer) < offset + size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            if self._offset + len(self._buffer) <= offset:
+                self._offset += len(self._buffer)
+                self._buffer = chunk
+            else:
+                self._buffer += chunk
+        start = offset - self._offset
+        data = self._buffer[start:start + size]
+        self._buffer = self._buffer[start:]
+        self._offset = offset
+        return data
+
+    def close(self):
+        self._chunks.close()
+
+
+class BlockVerifier:
+    """
+    This class compares the used blocks restored to a partition with the blocks of its image,
+    either all of them or a random sample large enough to find a corruption of a share of the
+    blocks with the requested confidence. The blocks are read back from the partition with
+    parallel reads, bypassing the blocks cached by the restoration, and their hashes are compared
+    with the hashes of the blocks of the image.
+    """
+    def __init__(self, device, used_blocks, image, workers=constants.VERIFY_WORKERS):
+        """
+        :param device: path of the restored partition, e.g. /dev/sda1.
+        :param used_blocks: UsedBlocks object of the image of the partition.
+        :param image: FileImage, RemoteImage or SequentialImage object of the image.
+        :param workers: number of the parallel reads.
+        :return: initialised BlockVerifier object.
+        """
+        self.device = device
+        self.used_blocks = used_blocks
+        self.image = image
+        self.workers = workers
+        self.report = {}
+        self.stopped = False
+
+    def verify(self, mode=SAMPLE_MODE, confidence=constants.VERIFY_CONFIDENCE):
+        """
+        Verifies the partition, the report attribute is updated as the blocks are checked.
+        :param mode: sample to check a random sample of the used blocks, full to check all of them.
+        :param confidence: the requested probability of finding a corruption of VERIFY_DEFECT_RATE
+            of the used blocks with the sampled verification.
+        :return: the report, a dictionary with the number of the checked and mismatching blocks,
+            the first of the mismatching blocks and the confidence reached.
+        """
+        block_size = self.used_blocks.bitmap.block_size
+        if mode == FULL_MODE:
+            planned = self.used_blocks.count
+            segments = self.used_blocks.segments(max(1, constants.VERIFY_READ_SIZE // block_size))
+        else:
+            planned = get_sample_size(self.used_blocks.count, confidence)
+            segments = self.used_blocks.sample(planned)
+        self.report.update({
+            'mode': mode,
+            'used_blocks': self.used_blocks.count,
+            'planned_blocks': planned,
+            'checked_blocks': 0,
+            'mismatched_blocks': 0,
+            'mismatches': [],
+            'defect_rate': constants.VERIFY_DEFECT_RATE,
+            'confidence': 0.0,
+        })
+        descriptor = open_device(self.device, O_RDONLY)
+        try:
+            self._drop_cache(descriptor)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for batch in self._batches(segments):
+                    if self.stopped:
+                        break
+                    # A stream is read in order here, the seekable images are read by the workers
+                    images = [None] * len(batch) if self.image.seekable else \
+                        [self._read_image(segment) for segment in batch]
+                    results = executor.map(lambda segment, image: self._compare(descriptor, segment, image),
+                                           batch, images)
+                    for segment, mismatches in zip(batch, results):
+                        self._record(segment, mismatches, block_size)
+        finally:
+            close(descriptor)
+        checked = self.report['checked_blocks']
+        self.report['confidence'] = (1.0 if checked >= self.used_blocks.count else 0.0) if mode == FULL_MODE \
+            else get_confidence(checked, self.used_blocks.count)
+        return self.report
+
+    def stop(self):
+        """
+        Stops the verification after the current batch of the reads.
+        :return: None
+        """
+        self.stopped = True
+
+    def _batches(self, segments):
+        batch = []
+        for segment in segments:
+            batch.append(segment)
+            if len(batch) == constants.VERIFY_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _drop_cache(self, descriptor):
+        try:
+            fsync(descriptor)
+            posix_fadvise(descriptor, 0, 0, POSIX_FADV_DONTNEED)
+        except OSError:
+            pass  # The blocks may be read from the page cache
+
+    def _read_image(self, segment):
+        rank, _, count = segment
+        size = count * self.used_blocks.bitmap.block_size
+        data = self.image.read(self.used_blocks.bitmap.image_offset(rank), size)
+        if len(data) != size:
+            raise ImageException('The image is truncated, the used block ' + str(rank) + ' is missing.')
+        return data
+
+    def _compare(self, descriptor, segment, image):
+        _, block, count = segment
+        block_size = self.used_blocks.bitmap.block_size
+        image = image if image is not None else self._read_image(segment)
+        target = pread(descriptor, count * block_size, block * block_size)
+        if target == image:
+            return []
+        return [block + index for index in range(count)
+                if target[index * block_size:(index + 1) * block_size] !=
+                image[index * block_size:(index + 1) * block_size]]
+
+    def _record(self, segment, mismatches, block_size):
+        self.report['checked_blocks'] += segment[2]
+        self.report['mismatched_blocks'] += len(mismatches)
+        for block in mismatches[:constants.VERIFY_MAX_MISMATCHES - len(self.report['mismatches'])]:
+            self.report['mismatches'].append({'block': block, 'offset': block * block_size})
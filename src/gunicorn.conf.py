@@ -0,0 +1,52 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+
+Gunicorn settings of the Imaging Node, the values are read from the [server] section of the
+node configuration file.
+
+The jobs and mounts are run by the worker process which received the request, more than one worker
+can only be used with the shared registry (registry = shared), so that every worker can serve the
+statuses of the jobs run by the others. Each open status stream
+occupies a thread for as long as the client stays connected.
+
+The tasks done once per node on startup run in the master process before the workers are started,
+the shared registry server also collects the system metrics for all workers.
+"""
+
+import sys
+from os import path
+
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+from server import prepare_node
+from services.config import ConfigHelper
+from services.registry import SharedRegistry, StatusRegistry, get_registry_address, start_registry_server
+
+_config = ConfigHelper.config
+
+chdir = path.dirname(path.abspath(__file__))
+bind = _config.get('server', 'bind', fallback='0.0.0.0:5000')
+workers = _config.getint('server', 'workers', fallback=1)
+worker_class = 'gthread'
+threads = _config.getint('server', 'threads', fallback=64)
+backlog = _config.getint('server', 'backlog', fallback=2048)
+keepalive = _config.getint('server', 'keepalive', fallback=75)
+timeout = _config.getint('server', 'timeout', fallback=120)
+graceful_timeout = _config.getint('server', 'graceful_timeout', fallback=30)
+max_requests = 0  # Restarting the worker would lose the running jobs
+
+_registry_server = None
+
+
+def on_starting(server):
+    global _registry_server
+    prepare_node()
+    if isinstance(StatusRegistry, SharedRegistry):
+        _registry_server = start_registry_server(get_registry_address(_config))
+
+
+def on_exit(server):
+    if _registry_server:
+        _registry_server.shutdown()
@@ -0,0 +1,46 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from threading import Lock
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """
+    This class limits the rate of a resource shared by a number of threads, e.g. the bandwidth
+    of a network link used by parallel transfers. The tokens are refilled at the given rate up to
+    the capacity, which allows short bursts. A consumer taking more tokens than available waits
+    until the debt is refilled, so the waiting consumers are served in the order of their calls.
+    """
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: number of tokens refilled per second, 0 for an unlimited rate.
+        :param capacity: maximum number of tokens stored, the rate (one second of tokens) if None.
+        :return: initialised TokenBucket object.
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = Lock()
+
+    def consume(self, amount):
+        """
+        Takes the tokens from the bucket, waiting until they are refilled if needed.
+        :param amount: number of tokens to be taken, e.g. the number of bytes to be sent.
+        :return: number of seconds spent waiting.
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0
+        if delay:
+            sleep(delay)
+        return delay
@@ -0,0 +1,209 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from functools import wraps
+from os import getpid
+from threading import Lock, get_ident, local
+from time import perf_counter, time
+
+_local = local()
+
+
+class Trace:
+    """
+    This class collects the timed spans of a single operation, so that they can be exported in
+    the Chrome trace event format (chrome://tracing, Perfetto). A trace only records spans on the
+    threads it has been activated on.
+    """
+    MAX_EVENTS = 100000
+
+    def __init__(self, name):
+        self.name = name
+        self.dropped_events = 0
+        self._events = []
+        self._lock = Lock()
+        self._origin = perf_counter()
+        self._start_time = time()
+        self._pid = getpid()
+
+    def add_span(self, name, category, start, end, args):
+        """
+        Records a completed span.
+        :param name: name of the span.
+        :param category: category of the span (e.g. db, imaging).
+        :param start: perf_counter value at the beginning of the span.
+        :param end: perf_counter value at the end of the span.
+        :param args: dictionary of additional details to be stored with the span.
+        :return: None
+        """
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start - self._origin) * 1000000, 1),
+            'dur': round((end - start) * 1000000, 1),
+            'pid': self._pid,
+            'tid': get_ident(),
+            'args': args,
+        }
+        with self._lock:
+            if len(self._events) < self.MAX_EVENTS:
+                self._events.append(event)
+            else:
+                self.dropped_events += 1
+
+    def __getstate__(self):
+        # The trace is sent to the job worker process along with its controller
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def to_chrome_trace(self):
+        """
+        Exports the recorded spans in the Chrome trace event format.
+        :return: dictionary ready to be serialised to JSON.
+        """
+        with self._lock:
+            events = list(self._events)
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'name': str(self.name),
+                'start_time': self._start_time,
+                'dropped_events': self.dropped_events,
+            },
+        }
+
+
+class _Span:
+    """ Context manager recording a single span into the trace. """
+    __slots__ = ('_trace', '_name', '_category', '_args', '_start')
+
+    def __init__(self, trace, name, category, args):
+        self._trace = trace
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type:
+            self._args['error'] = str(exc_value)
+        self._trace.add_span(self._name, self._category, self._start, perf_counter(), self._args)
+        return False
+
+
+class _NullContext:
+    """ Context manager doing nothing, used when tracing is disabled. """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class _Activation:
+    """ Context manager making the trace active on the current thread. """
+    __slots__ = ('_trace', '_previous')
+
+    def __init__(self, trace):
+        self._trace = trace
+
+    def __enter__(self):
+        self._previous = getattr(_local, 'trace', None)
+        _local.trace = self._trace
+        return self._trace
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        _local.trace = self._previous
+        return False
+
+
+def current_trace():
+    """
+    Returns the trace active on the current thread.
+    :return: Trace object or None if no trace is active.
+    """
+    return getattr(_local, 'trace', None)
+
+
+def activate(trace):
+    """
+    Makes the trace active on the current thread for the duration of the with block, so that
+    all spans started on the thread are recorded into it.
+    :param trace: Trace object, None disables tracing for the block.
+    :return: context manager.
+    """
+    if trace is None and current_trace() is None:
+        return _NULL_CONTEXT
+    return _Activation(trace)
+
+
+def span(name, category='', **args):
+    """
+    Times the with block and records it into the trace active on the current thread.
+    :param name: name of the span.
+    :param category: category of the span.
+    :param args: additional details to be stored with the span.
+    :return: context manager, which does nothing when no trace is active.
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NULL_CONTEXT
+    return _Span(trace, name, category, args)
+
+
+def traced(name=None, category=''):
+    """
+    Decorator recording every call of the function as a span of the trace active on the
+    calling thread.
+    :param name: name of the span, the qualified name of the function is used by default.
+    :param category: category of the span.
+    :return: decorator.
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            trace = getattr(_local, 'trace', None)
+            if trace is None:
+                return function(*args, **kwargs)
+            with _Span(trace, span_name, category, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(function):
+    """
+    Binds the function to the trace active on the current thread, so that the spans are
+    recorded into the same trace when the function is executed on another thread.
+    :param function: function to be bound.
+    :return: function which activates the trace for the time of its execution.
+    """
+    trace = current_trace()
+    if trace is None:
+        return function
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with _Activation(trace):
+            return function(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,173 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import logging
+from math import floor
+from threading import Lock
+
+import numpy
+
+import constants
+
+
+class _RingBuffer:
+    """
+    This class stores a fixed number of the most recent points of a single metric at a single
+    resolution. Samples received within the same step are averaged into a single point.
+    """
+    def __init__(self, step, capacity):
+        self.step = step
+        self.capacity = capacity
+        self._timestamps = numpy.zeros(capacity, dtype=numpy.float64)
+        self._values = numpy.zeros(capacity, dtype=numpy.float64)
+        self._next = 0
+        self._count = 0
+        self._bucket = None
+        self._sum = 0.0
+        self._samples = 0
+
+    def add(self, timestamp, value):
+        """
+        Adds a sample to the point of the step the timestamp belongs to. The previous point is
+        stored in the buffer once a sample from a later step is received.
+        :param timestamp: the time of the sample in seconds since the epoch.
+        :param value: numerical value of the sample.
+        :return: None
+        """
+        bucket = floor(timestamp / self.step) * self.step
+        if self._bucket is not None and bucket != self._bucket:
+            self._store(self._bucket, self._sum / self._samples)
+            self._sum = 0.0
+            self._samples = 0
+        self._bucket = bucket
+        self._sum += value
+        self._samples += 1
+
+    def covers(self, since):
+        """
+        Checks whether the buffer still holds all of its points newer than the timestamp.
+        :param since: timestamp in seconds since the epoch.
+        :return: True if no point newer than the timestamp was overwritten, False otherwise.
+        """
+        if self._count < self.capacity:
+            return True
+        return float(self._timestamps[self._next]) <= since
+
+    def query(self, since):
+        """
+        Returns the stored points newer than the provided timestamp in the chronological order.
+        :param since: timestamp in seconds since the epoch.
+        :return: list of [timestamp, value] pairs.
+        """
+        order = numpy.arange(self._next - self._count, self._next) % self.capacity
+        timestamps = self._timestamps[order]
+        values = self._values[order]
+        selected = timestamps > since
+        return numpy.column_stack((timestamps[selected], values[selected])).tolist()
+
+    def _store(self, timestamp, value):
+        self._timestamps[self._next] = timestamp
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+
+class MetricHistory:
+    """
+    This class keeps the history of the numerical metrics in fixed size ring buffers, each metric
+    is stored in a number of resolutions, so that the memory used does not grow with the uptime.
+    Nested metrics are flattened into keys separated with dots (e.g. Disk_IO.sda.utilisation).
+    The metrics which are not reported any more, e.g. of the loop and nbd devices which were
+    detached, are evicted once idle for idle_timeout seconds, and at most max_keys metrics are
+    kept, so the memory used does not grow with the number of the devices seen either.
+    """
+    def __init__(self, resolutions, idle_timeout=constants.METRIC_HISTORY_IDLE_TIMEOUT,
+                 max_keys=constants.METRIC_HISTORY_MAX_KEYS):
+        """
+        :param resolutions: list of (step, capacity) tuples, where step is the time covered by a
+            single point in seconds and capacity is the number of points to be kept.
+        :param idle_timeout: time in seconds after which the history of a metric which is not
+            reported is removed.
+        :param max_keys: maximum number of the metrics kept, the new metrics over the limit are
+            not recorded.
+        """
+        self.resolutions = sorted(resolutions)
+        self.idle_timeout = idle_timeout
+        self.max_keys = max_keys
+        self._buffers = {}
+        self._updated = {}
+        self._evicted = None
+        self._limit_reached = False
+        self._lock = Lock()
+        self._logger = logging.getLogger(__name__)
+
+    def record(self, timestamp, metrics):
+        """
+        Adds the current values of the metrics to the history.
+        :param timestamp: the time of the measurement in seconds since the epoch.
+        :param metrics: dictionary of metrics as returned by the SystemMonitor.
+        :return: None
+        """
+        with self._lock:
+            if self._evicted is None or timestamp - self._evicted >= self.resolutions[0][0]:
+                self._evict_idle(timestamp)
+            for key, value in _flatten(metrics):
+                if key not in self._buffers and not self._add_key(key):
+                    continue
+                for buffer in self._buffers[key]:
+                    buffer.add(timestamp, value)
+                self._updated[key] = timestamp
+
+    def query(self, since, step=None):
+        """
+        Returns the points of all metrics newer than the provided timestamp. The finest
+        resolution which is not finer than the requested step and still holds the requested
+        period of every metric is used for all of them.
+        :param since: timestamp in seconds since the epoch.
+        :param step: the requested time between the points in seconds.
+        :return: dictionary with the step used and lists of [timestamp, value] pairs per metric.
+        """
+        with self._lock:
+            if not self._buffers:
+                return {'step': None, 'metrics': {}}
+            index = self._select_resolution(since, step or 0)
+            metrics = {key: buffers[index].query(since) for key, buffers in self._buffers.items()}
+            return {'step': self.resolutions[index][0], 'metrics': metrics}
+
+    def _select_resolution(self, since, step):
+        """Selects a single resolution for all metrics, so the step returned holds for each of them."""
+        candidates = [index for index, (resolution, _) in enumerate(self.resolutions)
+                      if resolution >= step] or [len(self.resolutions) - 1]
+        for index in candidates:
+            if all(buffers[index].covers(since) for buffers in self._buffers.values()):
+                return index
+        return candidates[-1]
+
+    def _add_key(self, key):
+        if len(self._buffers) >= self.max_keys:
+            if not self._limit_reached:
+                self._limit_reached = True
+                self._logger.warning('The history of the metric ' + key + ' and of the following new metrics is '
+                                     'not recorded, the limit of ' + str(self.max_keys) + ' metrics was reached.')
+            return False
+        self._buffers[key] = [_RingBuffer(step, capacity) for step, capacity in self.resolutions]
+        return True
+
+    def _evict_idle(self, timestamp):
+        for key, updated in list(self._updated.items()):
+            if timestamp - updated > self.idle_timeout:
+                del self._buffers[key]
+                del self._updated[key]
+                self._limit_reached = False
+        self._evicted = timestamp
+
+
+def _flatten(metrics, prefix=''):
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, prefix + str(key) + '.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield prefix + str(key), float(value)
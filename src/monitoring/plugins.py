@@ -4,13 +4,15 @@ Date:       10/04/2016
 License:    GPL
 """
 
-from threading import Thread
+from time import monotonic
 
+import numpy
 import psutil
 
-from core.runcommand import Execute, OutputParser
+import constants
 from services.config import ConfigHelper
-from .sysmon import MetricPlugin, ThreadedMetricPlugin
+from .history import MetricHistory
+from .sysmon import MetricPlugin, SystemMonitor
 
 
 class DiskSpacePlugin(MetricPlugin):
@@ -37,74 +39,147 @@ class RAMUtilisationPlugin(MetricPlugin):
         return psutil.virtual_memory()[self.INDEX]
 
 
-class CpuUtilisationPlugin(ThreadedMetricPlugin):
+class CpuUtilisationPlugin(MetricPlugin):
     """
     This plugin collects CPU utilisation, it does represent the average processor usage over the
     interval period in percents.
     """
     NAME = 'CPU_Utilisation'
 
-    def _run(self):
-        self._thread = Thread(target=self._set_cpu_value, daemon=True)
-        self._thread.start()
-
     def _collect_metric(self):
-        return psutil.cpu_percent(self.interval)
-
-    def _set_cpu_value(self):
-        while not self._stop:
-            value = self._collect_metric()
-            with self._lock:
-                self._value = value
+        return psutil.cpu_percent(None)
 
 
-class DiskIOUtilisationPlugin(ThreadedMetricPlugin):
+class DiskIOStatsPlugin(MetricPlugin):
     """
-    This plugin collects the disk I/O utilisation, it does represent the average I/O
-    usage of the backup disk over the interval period in percents.
+    This plugin samples /proc/diskstats for all block devices, it does represent the
+    utilisation in percents, read and write throughput in MB/s, IOPS and the average
+    I/O latency in milliseconds of every device over the interval period.
     """
-    NAME = 'Disk_IO_Utilisation'
-    COMMAND = ['iostat', '-x', '-d', str(ConfigHelper.config['node']['backup_disk'])]
+    NAME = 'Disk_IO'
+    DISKSTATS_FILE = '/proc/diskstats'
+    SECTOR_SIZE = 512
+    MEGABYTE = 1048576
 
-    def _run(self):
-        self._thread = Thread(target=self._collect_metric, daemon=True)
-        self._thread.start()
+    def __init__(self, interval=constants.DISK_IO_INTERVAL):
+        MetricPlugin.__init__(self, interval)
+        self._value = {}
+        self._previous = None
+        self._previous_time = None
 
-    @property
-    def value(self):
+    def _collect_metric(self):
+        with open(self.DISKSTATS_FILE) as fd:
+            current = _parse_diskstats(fd.read())
+        current_time = monotonic()
+        value = {}
+        if self._previous:
+            value = self._compute_rates(self._previous, current, current_time - self._previous_time)
+        self._previous, self._previous_time = current, current_time
+        return value
+
+    def _compute_rates(self, previous, current, elapsed):
         """
-        Checks whether a new value is available and returns the up to date value of the metric.
-        :return: numerical value representing the percentage of the I/O utilisation.
+        Calculates the metrics for all devices present in both samples from the counter deltas.
+        The devices with any counter lower than in the earlier sample, e.g. a device removed and
+        added again, are skipped until the next sample.
+        :param previous: tuple of device names and counter array from the earlier sample.
+        :param current: tuple of device names and counter array from the later sample.
+        :param elapsed: time between both samples in seconds.
+        :return: dictionary with device names as keys and dictionaries of metrics as values.
         """
-        with self._lock:
-            output = self._runner.output()
-            if output:
-                self._value = output
-            return float(self._value)
+        names, counters = current
+        previous_names, previous_counters = previous
+        if names != previous_names:
+            index = {name: i for i, name in enumerate(previous_names)}
+            common = [i for i, name in enumerate(names) if name in index]
+            names = [names[i] for i in common]
+            counters = counters[common]
+            previous_counters = previous_counters[[index[name] for name in names]]
+        delta = counters - previous_counters
+        valid = (delta >= 0).all(axis=1)
+        if not valid.all():
+            names = [name for name, is_valid in zip(names, valid) if is_valid]
+            delta = delta[valid]
+        delta = delta.astype(numpy.float64)
+        elapsed = max(elapsed, 1e-6)
+        operations = delta[:, _READS] + delta[:, _WRITES]
+        busy_time = delta[:, _READ_TIME] + delta[:, _WRITE_TIME]
+        utilisation = numpy.minimum(delta[:, _IO_TIME] / (elapsed * 10), 100.0)
+        read_rate = delta[:, _SECTORS_READ] * self.SECTOR_SIZE / self.MEGABYTE / elapsed
+        write_rate = delta[:, _SECTORS_WRITTEN] * self.SECTOR_SIZE / self.MEGABYTE / elapsed
+        iops = operations / elapsed
+        latency = numpy.divide(busy_time, operations, out=numpy.zeros_like(busy_time),
+                               where=operations > 0)
+        metrics = {}
+        for i, name in enumerate(names):
+            metrics[name] = {
+                'utilisation': round(float(utilisation[i]), 2),
+                'read_mbps': round(float(read_rate[i]), 2),
+                'write_mbps': round(float(write_rate[i]), 2),
+                'iops': round(float(iops[i]), 2),
+                'latency': round(float(latency[i]), 2),
+            }
+        return metrics
+
+
+class DiskIOUtilisationPlugin(MetricPlugin):
+    """
+    This plugin provides the disk I/O utilisation of the backup disk in percents, as sampled
+    by the DiskIOStatsPlugin.
+    """
+    NAME = 'Disk_IO_Utilisation'
+
+    def __init__(self, stats_plugin):
+        MetricPlugin.__init__(self, stats_plugin.interval)
+        self.disk = ConfigHelper.config['node']['backup_disk']
+        self._stats_plugin = stats_plugin
 
     def _collect_metric(self):
-        self.COMMAND.append(str(self.interval))
-        self._runner = Execute(self.COMMAND, output_parser=_IOStatParser(), use_pty=True)
-        self._runner.run()
+        return self._stats_plugin.value.get(self.disk, {}).get('utilisation', 0.0)
 
-    def stop(self):
-        """
-        Stops the command that is executed in the background to collect the metric.
-        :return: None
-        """
-        self._stop = True
-        self._runner.kill()
-        self._thread.join()
 
-class _IOStatParser(OutputParser):
-    """ The output parser class for extracting I/O utilisation from the iostat command """
-    def __init__(self):
-        self.output = None
+# Indexes of the /proc/diskstats counters used by DiskIOStatsPlugin, relative to the
+# first column after the device name.
+_READS = 0
+_SECTORS_READ = 1
+_READ_TIME = 2
+_WRITES = 3
+_SECTORS_WRITTEN = 4
+_WRITE_TIME = 5
+_IO_TIME = 6
+_DISKSTATS_COLUMNS = [0, 2, 3, 4, 6, 7, 9]
 
-    def parse(self, data):
-        """Processes data from the command output and saves the result as output."""
-        self.metrics = data.strip().split('\n')
-        self.metrics = self.metrics[-1].split(' ')
-        self.output = self.metrics[-1]
 
+def _parse_diskstats(data):
+    """
+    Parses the contents of /proc/diskstats into the list of device names and an array of
+    the counters used by the DiskIOStatsPlugin, with a single row per device.
+    :param data: string with the contents of /proc/diskstats.
+    :return: tuple of the device names list and the numpy array of counters.
+    """
+    names = []
+    rows = []
+    for line in data.splitlines():
+        fields = line.split()
+        if len(fields) >= 14:
+            names.append(fields[2])
+            rows.append([int(fields[3 + column]) for column in _DISKSTATS_COLUMNS])
+    return names, numpy.array(rows, dtype=numpy.int64).reshape(len(rows), len(_DISKSTATS_COLUMNS))
 
+
+def create_node_monitor():
+    """
+    Builds the SystemMonitor collecting all metrics of the node and recording their history,
+    the plugins sample the system when they are created, so it is called on startup rather than
+    on import.
+    :return: SystemMonitor object, which has to be started.
+    """
+    monitor = SystemMonitor()
+    monitor.add_plugin(DiskSpacePlugin())
+    monitor.add_plugin(RAMUtilisationPlugin())
+    monitor.add_plugin(CpuUtilisationPlugin())
+    disk_io_stats = DiskIOStatsPlugin(constants.DISK_IO_INTERVAL)
+    monitor.add_plugin(disk_io_stats)
+    monitor.add_plugin(DiskIOUtilisationPlugin(disk_io_stats))
+    monitor.enable_history(MetricHistory(constants.METRIC_HISTORY_RESOLUTIONS), constants.METRIC_HISTORY_INTERVAL)
+    return monitor
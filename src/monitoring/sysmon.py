@@ -4,25 +4,41 @@ Date:       10/04/2016
 License:    GPL
 """
 
+import logging
 from abc import ABCMeta, abstractmethod
-from threading import Lock
+from math import ceil
+from threading import Lock, Thread
+from time import monotonic, perf_counter, sleep, time
+from types import MappingProxyType
+
+import constants
 
 
 class MetricPlugin:
     """
-    This class provides a basic structure for all metric plugins
+    This class provides a basic structure for all metric plugins. The metric is collected by the
+    SystemMonitor scheduler at the interval defined by the plugin, so the collection must not
+    block waiting for the data.
     """
     __metaclass__ = ABCMeta
     NAME = ''
 
-    def __init__(self):
+    def __init__(self, interval=constants.METRIC_INTERVAL):
         self.name = self.NAME
+        self.interval = interval
         self._value = 0
 
     @property
     def value(self):
         """
-        This property is used to execute the logic required to collect the data and to apply
+        Returns the most recently collected value of the metric.
+        :return: ready metric value
+        """
+        return self._value
+
+    def collect(self):
+        """
+        This method is used to execute the logic required to collect the data and to apply
         additional processing if necessary.
         :return: ready metric value
         """
@@ -34,57 +50,160 @@ class MetricPlugin:
         pass
 
 
-class ThreadedMetricPlugin(MetricPlugin):
+class _TimerWheel:
     """
-    This class defines the structure for plugins which need to collect data over a period of time
-    and perform aggregation. The plugin will execute the command in the background on a separate
-    thread.
+    This class implements a hashed timer wheel which runs all scheduled tasks on a single thread.
+    Each task is placed in the slot of the tick it is due at, with the number of full rotations
+    of the wheel left before it can be executed.
     """
-    __metaclass__ = ABCMeta
-
-    def __init__(self, interval):
-        MetricPlugin.__init__(self)
-        self.interval = interval
+    def __init__(self, tick, slots):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._current_tick = 0
+        self._lock = Lock()
         self._thread = None
         self._stop = False
-        self._lock = Lock()
-        self._run()
-
-    @abstractmethod
-    def _run(self):
-        pass
+        self._logger = logging.getLogger(__name__)
 
-    @property
-    def value(self):
+    def schedule(self, interval, callback):
+        """
+        Adds a task executed periodically at the given interval, the first execution happens
+        on the next tick.
+        :param interval: time between the executions in seconds.
+        :param callback: function without arguments to be executed.
+        :return: task handle that can be used to cancel the task.
+        """
+        task = {'ticks': max(int(ceil(interval / self.tick)), 1), 'callback': callback,
+                'rounds': 0, 'cancelled': False}
         with self._lock:
-            return self._value
+            self._slots[(self._current_tick + 1) % len(self._slots)].append(task)
+        return task
+
+    def cancel(self, task):
+        """
+        Stops any further executions of the task.
+        :param task: task handle returned by the schedule method.
+        :return: None
+        """
+        task['cancelled'] = True
+
+    def start(self):
+        """
+        Starts the scheduler thread.
+        :return: None
+        """
+        self._stop = False
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
 
     def stop(self):
         """
-        Stops processing of the background thread for the command execution
+        Stops the scheduler thread after the current tick.
         :return: None
         """
         self._stop = True
-        self._thread.join()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        deadline = monotonic()
+        while not self._stop:
+            deadline += self.tick
+            delay = deadline - monotonic()
+            if delay > 0:
+                sleep(delay)
+            self._advance()
+
+    def _advance(self):
+        with self._lock:
+            self._current_tick += 1
+            slot = self._slots[self._current_tick % len(self._slots)]
+            due = [task for task in slot if not task['cancelled'] and task['rounds'] == 0]
+            slot[:] = [task for task in slot if not task['cancelled'] and task['rounds'] > 0]
+            for task in slot:
+                task['rounds'] -= 1
+        for task in due:
+            try:
+                task['callback']()
+            except Exception as e:
+                self._logger.warning('Scheduled task failed, cause: ' + str(e))
+            self._reschedule(task)
+
+    def _reschedule(self, task):
+        with self._lock:
+            if not task['cancelled']:
+                task['rounds'] = (task['ticks'] - 1) // len(self._slots)
+                self._slots[(self._current_tick + task['ticks']) % len(self._slots)].append(task)
 
 
 class SystemMonitor:
     """
     The SystemMonitor is the plugin handler that allows gathering metrics from all
-    of the plugins at once.
+    of the plugins at once. A single scheduler thread collects every plugin at its own interval
+    and publishes the values into an immutable snapshot, which is read without locking.
     """
+    SCHEDULER_TICK = 0.1
+    SCHEDULER_SLOTS = 64
+    SLOW_COLLECTION_RATIO = 0.5
+
     def __init__(self):
         self._plugins = []
+        self._tasks = {}
+        self._snapshot = MappingProxyType({})
+        self._collection_stats = MappingProxyType({})
+        self._history = None
+        self._scheduler = _TimerWheel(self.SCHEDULER_TICK, self.SCHEDULER_SLOTS)
+        self._logger = logging.getLogger(__name__)
+
+    def start(self):
+        """
+        Starts collecting the metrics of all plugins in the background.
+        :return: None
+        """
+        self._scheduler.start()
+
+    def stop(self):
+        """
+        Stops collecting the metrics.
+        :return: None
+        """
+        self._scheduler.stop()
+
+    def enable_history(self, history, interval):
+        """
+        Starts recording the metrics from all plugins into the history at the given interval.
+        :param history: MetricHistory instance to record the metrics into.
+        :param interval: time between the recorded samples in seconds.
+        :return: None
+        """
+        self._history = history
+        self._scheduler.schedule(interval, self._record_history)
+
+    def get_history(self, since, step=None):
+        """
+        Returns the recorded metric points newer than the provided timestamp.
+        :param since: timestamp in seconds since the epoch.
+        :param step: the requested time between the points in seconds.
+        :return: dictionary as returned by MetricHistory.query, or None if the history
+            is not enabled.
+        """
+        if self._history:
+            return self._history.query(since, step)
+        return None
 
     def get_metrics(self):
         """
         Builds a dictionary with plugin name as a key and the metric value as a value.
         :return: dictionary of key-value pairs for all enabled plugins.
         """
-        metrics = {}
-        for plugin in self._plugins:
-            metrics[plugin.name] = plugin.value
-        return metrics
+        return dict(self._snapshot)
+
+    def get_collection_stats(self):
+        """
+        Provides the time spent collecting each of the plugins, so that slow plugins can be found.
+        :return: dictionary with plugin names as keys and collection statistics as values.
+        """
+        return dict(self._collection_stats)
 
     def add_plugin(self, plugin):
         """
@@ -93,6 +212,8 @@ class SystemMonitor:
         :return: None
         """
         self._plugins.append(plugin)
+        self._tasks[plugin] = self._scheduler.schedule(plugin.interval,
+                                                       lambda: self._collect(plugin))
 
     def remove_plugin(self, plugin):
         """
@@ -101,10 +222,46 @@ class SystemMonitor:
         :return: None
         """
         self._plugins.remove(plugin)
+        self._scheduler.cancel(self._tasks.pop(plugin))
+        self._snapshot = MappingProxyType({key: value for key, value in self._snapshot.items()
+                                           if key != plugin.name})
 
     def remove_all_plugins(self):
         """
         Removes all previously added plugins.
         :return: None
         """
-        self._plugins = self._plugins[:]
+        for plugin in self._plugins[:]:
+            self.remove_plugin(plugin)
+
+    def _collect(self, plugin):
+        start = perf_counter()
+        try:
+            value = plugin.collect()
+        except Exception:
+            self._update_collection_stats(plugin, perf_counter() - start, failed=True)
+            raise
+        self._update_collection_stats(plugin, perf_counter() - start)
+        snapshot = dict(self._snapshot)
+        snapshot[plugin.name] = value
+        self._snapshot = MappingProxyType(snapshot)
+
+    def _update_collection_stats(self, plugin, cost, failed=False):
+        stats = dict(self._collection_stats.get(plugin.name, {'runs': 0, 'errors': 0,
+                                                             'average_ms': 0.0, 'max_ms': 0.0}))
+        cost_ms = cost * 1000
+        stats['runs'] += 1
+        stats['errors'] += int(failed)
+        stats['last_ms'] = round(cost_ms, 3)
+        stats['average_ms'] = round(stats['average_ms'] + (cost_ms - stats['average_ms']) / stats['runs'], 3)
+        stats['max_ms'] = round(max(stats['max_ms'], cost_ms), 3)
+        stats['interval'] = plugin.interval
+        collection_stats = dict(self._collection_stats)
+        collection_stats[plugin.name] = stats
+        self._collection_stats = MappingProxyType(collection_stats)
+        if cost > plugin.interval * self.SLOW_COLLECTION_RATIO:
+            self._logger.warning('Collection of the ' + plugin.name + ' metric took ' +
+                                 str(stats['last_ms']) + 'ms, which delays the other metrics.')
+
+    def _record_history(self):
+        self._history.record(time(), self.get_metrics())
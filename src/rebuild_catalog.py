@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+
+Rebuilds the backup catalog of the node from the manifests stored in the backup directories,
+e.g. after the database was lost. The existing records of the imported backups are replaced.
+
+Usage: python3 src/rebuild_catalog.py [--path /backup/] [--workers 16]
+"""
+
+import argparse
+from time import monotonic
+
+from services.catalog import rebuild_catalog
+from services.config import ConfigHelper
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuilds the backup catalog from the backup manifests.')
+    parser.add_argument('--path', default=ConfigHelper.config['node']['backup_path'],
+                        help='directory containing the backups, the backup_path of the node by default')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of the threads reading the manifests')
+    args = parser.parse_args()
+    start = monotonic()
+    count = rebuild_catalog(args.path, args.workers)
+    print('Imported ' + str(count) + ' backups from ' + args.path + ' in ' +
+          '{:.2f}'.format(monotonic() - start) + ' s.')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,39 +7,121 @@ License:    GPL
 """
 
 import logging
+from threading import Thread
+from time import sleep
 
 from flask import Flask
 from flask_restful import Api
 
 import constants
+from services.config import ConfigHelper
 from services.database import DB
+from services.usage import NodeUsage
+from core.replication import Replicator
+from core.scrubber import Scrubber
+from api.resources.backup import BackupList, BackupVerify
+from api.resources.batch import JobBatch, JobGroup
 from api.resources.disk import Disk
+from api.resources.files import BackupFiles
 from api.resources.heartbeat import Heartbeat
 from api.resources.job import Job
 from api.resources.monitor import Monitor
 from api.resources.mount import Mount
+from api.resources.replica import Replica, ReplicaFile
+from api.resources.scrub import Scrub
+from api.resources.source import BackupSource
+from api.resources.stream import JobStream, MountStream
+from api.resources.trace import JobTrace, MountTrace
+from api.resources.usage import Usage
 
-logging .basicConfig(level=logging.DEBUG,
-                     format='%(asctime)s [%(name)s][%(levelname)s]: %(message)s',
-                     filename='/var/log/diskimage/node.log',
-                     filemode='w')
-log = logging.getLogger('werkzeug').setLevel(logging.WARNING)  # Suppress HTTP request logging
 _logger = logging.getLogger(__name__)
-_logger.info("Initialising Disk Image Node v " + constants.VERSION + ".")
-app = Flask(__name__)
-api = Api(app)
-DB.remove_zombie_backups()
 
 
-_logger.info("Adding endpoints.")
-api.add_resource(Heartbeat, '/api/heartbeat')
-api.add_resource(Monitor, '/api/metric')
-api.add_resource(Disk, '/api/disk', '/api/disk/<disk_id>')
-api.add_resource(Job, '/api/job', '/api/job/<job_id>')
-api.add_resource(Mount, '/api/mount', '/api/mount/<backup_id>')
+def create_app():
+    """
+    Creates the Flask application with all endpoints of the Imaging Node. The application can be
+    served by any WSGI server, see wsgi.py, the startup function has to be called first.
+    :return: Flask application object.
+    """
+    app = Flask(__name__)
+    api = Api(app)
+    _logger.info("Adding endpoints.")
+    api.add_resource(Heartbeat, '/api/heartbeat')
+    api.add_resource(Monitor, '/api/metric')
+    api.add_resource(Usage, '/api/usage')
+    api.add_resource(Disk, '/api/disk', '/api/disk/<disk_id>')
+    api.add_resource(Job, '/api/job', '/api/job/<job_id>')
+    api.add_resource(JobBatch, '/api/job/batch')
+    api.add_resource(JobGroup, '/api/job/group/<group_id>')
+    api.add_resource(JobStream, '/api/job/stream', '/api/job/<job_id>/stream')
+    api.add_resource(JobTrace, '/api/job/<job_id>/trace')
+    api.add_resource(Mount, '/api/mount', '/api/mount/<backup_id>')
+    api.add_resource(MountStream, '/api/mount/stream', '/api/mount/<backup_id>/stream')
+    api.add_resource(MountTrace, '/api/mount/<backup_id>/trace')
+    api.add_resource(BackupList, '/api/backup')
+    api.add_resource(BackupVerify, '/api/backup/<backup_id>/verify')
+    api.add_resource(Scrub, '/api/scrub')
+    api.add_resource(BackupSource, '/api/backup/<backup_id>/source', '/api/backup/<backup_id>/source/<file_name>')
+    api.add_resource(Replica, '/api/replica/<backup_id>')
+    api.add_resource(ReplicaFile, '/api/replica/<backup_id>/<file_name>')
+    api.add_resource(BackupFiles, '/api/backup/<backup_id>/files/', '/api/backup/<backup_id>/files/<path:file_path>')
+    app.after_request(after_request)
+    return app
+
+
+def prepare_node(log_mode='w'):
+    """
+    Initialises the logging and runs the tasks done once per node on startup: creates the database
+    indexes, cleans up the backups left running by a previous crash and recalculates the usage of
+    the node. Under gunicorn it is called by the master process before any worker is started, see
+    gunicorn.conf.py, so that no worker has started a backup which would be taken for a zombie.
+    :param log_mode: mode in which the log file is opened, 'w' to start a new log.
+    :return: None
+    """
+    _init_logging(log_mode)
+    _logger.info("Initialising Disk Image Node v " + constants.VERSION + ".")
+    DB.create_indexes()
+    DB.remove_zombie_backups()
+    NodeUsage.recalculate()
+
+
+def startup():
+    """
+    Initialises the logging, resumes the jobs interrupted by a restart of the node, starts
+    collecting the system metrics, replicating the backups to the peer nodes and scrubbing the
+    stored backups. It has to be called once in every process serving the API, before any
+    requests are handled, after prepare_node was called for the node.
+    :return: None
+    """
+    _init_logging('a')
+    resumed = Job.resume_interrupted()
+    if resumed:
+        _logger.info("Resumed the interrupted jobs: " + ', '.join(resumed) + ".")
+    Monitor.setup()
+    Replicator.start()
+    Scrubber.start(Monitor.MONITOR)
+    Thread(target=_synchronise_registry, daemon=True).start()
+    _logger.info("Initialisation finished.")
+
+
+def _init_logging(log_mode):
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s [%(name)s][%(levelname)s]: %(message)s',
+                        filename='/var/log/diskimage/node.log',
+                        filemode=log_mode)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # Suppress HTTP request logging
+
+
+def _synchronise_registry():
+    while True:
+        for resource in (Job, JobGroup, Mount):
+            try:
+                resource.synchronise()
+            except Exception as e:
+                _logger.warning('Cannot synchronise the ' + resource.STATUS_KIND + ' registry, cause: ' + str(e))
+        sleep(constants.REGISTRY_SYNC_INTERVAL)
+
 
-_logger.info("Initialisation finished.")
-@app.after_request
 def after_request(response):
     """
     Allow remote hosts to use the API.
@@ -52,4 +134,8 @@ def after_request(response):
     return response
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', threaded=True)
+    # Development server only, use the WSGI entry point in wsgi.py for the production.
+    prepare_node()
+    startup()
+    host, _, port = ConfigHelper.config.get('server', 'bind', fallback='0.0.0.0:5000').rpartition(':')
+    create_app().run(host=host or '0.0.0.0', port=int(port), threaded=True)
@@ -0,0 +1,123 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import cpu_count, path, scandir
+
+from pymongo.errors import PyMongoError
+
+import constants
+from core.backupset import Backupset
+from lib.exceptions import BackupsetException
+from .config import ConfigHelper
+from .database import DB
+from .usage import NodeUsage
+
+_logger = logging.getLogger(__name__)
+
+
+def scan_manifests(backup_path, workers=None):
+    """
+    Loads the manifests of all backups stored in the backup path. The backup directories are
+    listed with a single scandir call and their manifests are read by a pool of threads, the
+    directories without a readable manifest are skipped.
+    :param backup_path: the directory containing the backup directories.
+    :param workers: number of the threads reading the manifests, based on the CPU count if None.
+    :return: list of Backupset objects.
+    """
+    with scandir(backup_path) as entries:
+        manifests = [entry.path + '/' + constants.BACKUPSET_FILE
+                     for entry in entries if entry.is_dir(follow_symlinks=False)]
+    workers = workers or min(32, (cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [backupset for backupset in executor.map(_load_manifest, manifests,
+                                                        chunksize=64) if backupset]
+
+
+def _load_manifest(manifest_path):
+    if not path.exists(manifest_path):
+        return None  # Not a backup directory, e.g. the mount path
+    try:
+        return Backupset.from_manifest(manifest_path)
+    except BackupsetException as e:
+        _logger.warning(str(e))
+        return None
+
+
+def rebuild_catalog(backup_path, workers=None):
+    """
+    Imports the manifests of all backups stored in the backup path into the database, the
+    existing records of the imported backups are replaced and the usage counter of the node is
+    recalculated. The manifests of the replicas of the backups created by other nodes only
+    record this node as a holder of the replica.
+    :param backup_path: the directory containing the backup directories.
+    :param workers: number of the threads reading the manifests, based on the CPU count if None.
+    :return: number of the imported backups.
+    """
+    backupsets = scan_manifests(backup_path, workers)
+    node = ConfigHelper.config['node']['name']
+    DB.upsert_backups([backupset.to_dict(Backupset.STORED_FIELDS) for backupset in backupsets
+                       if backupset.node == node])
+    for backupset in backupsets:
+        if backupset.node != node:
+            DB.add_backup_replica(backupset.id, node)
+    NodeUsage.recalculate()
+    return len(backupsets)
+
+
+def list_backups():
+    """
+    Lists the backups of this node from the database, or from the manifests in the backup path
+    if the database is unreachable.
+    :return: list of Backupset objects.
+    """
+    try:
+        return [Backupset._from_json(data) for data in DB.get_node_backups()]
+    except PyMongoError as e:
+        _logger.warning('Cannot list the backups from the database, reading the manifests instead, cause: ' +
+                        str(e))
+        node = ConfigHelper.config['node']['name']
+        return [backupset for backupset in scan_manifests(ConfigHelper.config['node']['backup_path'])
+                if backupset.node == node]
+
+
+def find_backups(filters, fields=None, after=None, limit=100):
+    """
+    Retrieves a page of backups from the database, or from the manifests in the backup path if
+    the database is unreachable. The backups are ordered from the newest to the oldest.
+    :param filters: dictionary with the optional node, status, since and until keys.
+    :param fields: list of the Backupset members to be loaded, all members if None.
+    :param after: (creation_date, id) tuple of the last backup of the previous page, None for
+        the first page.
+    :param limit: maximum number of the backups to be retrieved.
+    :return: tuple with the list of Backupset objects and the source of the information
+        (database or manifest).
+    """
+    try:
+        return [Backupset._from_json(data) for data in DB.find_backups(filters, fields, after, limit)], 'database'
+    except PyMongoError as e:
+        _logger.warning('Cannot list the backups from the database, reading the manifests instead, cause: ' +
+                        str(e))
+    backupsets = [backupset for backupset in scan_manifests(ConfigHelper.config['node']['backup_path'])
+                  if _matches(backupset, filters, after)]
+    backupsets.sort(key=lambda backupset: backupset.id)
+    backupsets.sort(key=_creation_date, reverse=True)
+    return backupsets[:limit], 'manifest'
+
+
+def _creation_date(backupset):
+    return backupset.creation_date if isinstance(backupset.creation_date, datetime) else datetime.min
+
+
+def _matches(backupset, filters, after):
+    created = _creation_date(backupset)
+    return (not filters.get('node') or backupset.node == filters['node']) and \
+        (not filters.get('status') or backupset.status == filters['status']) and \
+        (not filters.get('since') or created >= filters['since']) and \
+        (not filters.get('until') or created < filters['until']) and \
+        (not after or created < after[0] or (created == after[0] and backupset.id > after[1]))
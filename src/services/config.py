@@ -5,17 +5,20 @@ License:    GPL
 """
 
 from configparser import ConfigParser
+from os import environ
 
 import constants
 
 
 class _ConfigHelper:
     """
-    This class encapsulates the reading and parsing logic for the config file.
+    This class encapsulates the reading and parsing logic for the config file. The location of
+    the file can be overridden with the DISKIMAGE_CONFIG environment variable, e.g. to run a few
+    nodes on a single host.
     """
     def __init__(self):
         self.config = ConfigParser()
-        self._read_config(constants.CONFIG_FILE)
+        self._read_config(environ.get('DISKIMAGE_CONFIG', constants.CONFIG_FILE))
 
     def _read_config(self, file):
         self.config.read(file)
@@ -7,9 +7,10 @@ License:    GPL
 from abc import ABCMeta, abstractclassmethod
 from threading import RLock
 
-from pymongo import ASCENDING
+from pymongo import ASCENDING, DESCENDING, UpdateOne
 
 import constants
+from lib.tracing import traced
 from .config import ConfigHelper
 from .mdbconnector import MongoConnector, to_list
 
@@ -35,6 +36,15 @@ class Database:
         """
         pass
 
+    @abstractclassmethod
+    def upsert_backups(self, backups):
+        """
+        Modifies or creates a number of backups at once.
+        :param backups: list of JSON objects of the backups, identified by their id fields.
+        :return: None
+        """
+        pass
+
     @abstractclassmethod
     def get_backup(self, backup_id):
         """
@@ -44,6 +54,47 @@ class Database:
         """
         pass
 
+    @abstractclassmethod
+    def get_backups(self, backup_ids):
+        """
+        Retrieves a number of backups from the database at once.
+        :param backup_ids: list of string identifiers of the backups to be retrieved.
+        :return: list of dictionaries containing the information of the existing backups.
+        """
+        pass
+
+    @abstractclassmethod
+    def get_node_backups(self):
+        """
+        Retrieves all backups of the specific imaging node.
+        :return: list of dictionaries containing the backup information.
+        """
+        pass
+
+    @abstractclassmethod
+    def find_backups(self, filters, fields=None, after=None, limit=100):
+        """
+        Retrieves a page of backups, ordered from the newest to the oldest and by the id for the
+        backups created at the same time.
+        :param filters: dictionary with the optional node, status, since and until keys, the
+            latter two limit the creation date.
+        :param fields: list of the fields to be retrieved, all fields if None, the id and
+            creation_date fields are always included.
+        :param after: (creation_date, id) tuple of the last backup of the previous page, None for
+            the first page.
+        :param limit: maximum number of the backups to be retrieved.
+        :return: list of dictionaries containing the backup information.
+        """
+        pass
+
+    @abstractclassmethod
+    def create_indexes(self):
+        """
+        Creates the indexes used by the queries, if they do not exist yet.
+        :return: None
+        """
+        pass
+
     @abstractclassmethod
     def remove_backup(self, backup_id):
         """
@@ -62,9 +113,148 @@ class Database:
         pass
 
     @abstractclassmethod
-    def remove_zombie_backups(self):
+    def get_filesystem_rates(self):
+        """
+        Calculates the average imaging throughput per file system from the recent backups
+        of the specific imaging node.
+        :return: dictionary with file systems as keys and throughput in bytes per second as values.
+        """
+        pass
+
+    @abstractclassmethod
+    def upsert_job_checkpoint(self, job_id, data):
         """
-        Removes "running" backups after Node restarts and crashes.
+        Modifies the existing checkpoint of a job or creates a new one if required.
+        :param job_id: string identifier of the job.
+        :param data: JSON object that should be written to the database under the job_id.
+        :return: None
+        """
+        pass
+
+    @abstractclassmethod
+    def get_job_checkpoints(self):
+        """
+        Retrieves the checkpoints of the jobs of the specific imaging node.
+        :return: list of dictionaries containing the checkpoints.
+        """
+        pass
+
+    @abstractclassmethod
+    def remove_job_checkpoint(self, job_id):
+        """
+        Removes the checkpoint of a specific job from the database.
+        :param job_id: string identifier of the job.
+        :return: None
+        """
+        pass
+
+    @abstractclassmethod
+    def add_node_usage(self, delta):
+        """
+        Changes the number of bytes used by the backups of the specific imaging node.
+        :param delta: number of bytes to be added, negative to be subtracted.
+        :return: None
+        """
+        pass
+
+    @abstractclassmethod
+    def get_node_usage(self):
+        """
+        Retrieves the number of bytes used by the backups of the specific imaging node.
+        :return: number of bytes.
+        """
+        pass
+
+    @abstractclassmethod
+    def reset_node_usage(self):
+        """
+        Recalculates the number of bytes used by the backups of the specific imaging node from
+        the sizes of its backups and of the replicas it holds, which were not purged.
+        :return: number of bytes.
+        """
+        pass
+
+    @abstractclassmethod
+    def add_backup_replica(self, backup_id, node):
+        """
+        Records that a node holds a verified copy of a backup.
+        :param backup_id: string identifier of the backup.
+        :param node: the name of the node holding the copy.
+        :return: None
+        """
+        pass
+
+    @abstractclassmethod
+    def get_backups_to_replicate(self, node):
+        """
+        Retrieves the finished backups of the specific imaging node which are not held by the
+        given node yet, sorted by the creation date.
+        :param node: the name of the node the backups are replicated to.
+        :return: list of dictionaries containing the backup information.
+        """
+        pass
+
+    @abstractclassmethod
+    def upsert_replication(self, backup_id, target, data):
+        """
+        Modifies the existing progress of the replication of a backup to a node or creates
+        a new one if required.
+        :param backup_id: string identifier of the backup.
+        :param target: the name of the node the backup is replicated to.
+        :param data: JSON object with the progress of the replication.
+        :return: None
+        """
+        pass
+
+    @abstractclassmethod
+    def get_replications(self, backup_id):
+        """
+        Retrieves the progress of the replications of a backup to all nodes.
+        :param backup_id: string identifier of the backup.
+        :return: list of dictionaries containing the progress of the replications.
+        """
+        pass
+
+    @abstractclassmethod
+    def get_backups_to_scrub(self, node, scrubbed_before):
+        """
+        Retrieves the finished backups held by the given node, which were not scrubbed on the
+        node since the given date, the backups never scrubbed first.
+        :param node: the name of the node scrubbing its copies of the backups.
+        :param scrubbed_before: datetime object, the backups scrubbed later are skipped.
+        :return: list of dictionaries containing the backup information.
+        """
+        pass
+
+    @abstractclassmethod
+    def set_backup_scrub(self, backup_id, node, result):
+        """
+        Records the result of the last scrub of the copy of a backup held by a node, the results
+        of the nodes are stored as a list, as the names of the nodes may contain dots.
+        :param backup_id: string identifier of the backup.
+        :param node: the name of the node holding the copy.
+        :param result: JSON object with the date and the result of the scrub.
+        :return: None
+        """
+        pass
+
+    @abstractclassmethod
+    def get_scrub_failures(self, node):
+        """
+        Retrieves the backups which were not deleted, whose copies held by the given node did not
+        pass their last scrub.
+        :param node: the name of the node holding the copies.
+        :return: list of dictionaries with the id and the list of the scrubs of the backups.
+        """
+        pass
+
+    @abstractclassmethod
+    def remove_zombie_backups(self, backup_id=None):
+        """
+        Removes "running" backups after Node restarts and crashes, the backups with a job
+        checkpoint are left running, as they are resumed.
+        :param backup_id: optional id of the single backup to be removed, even if it has a job
+            checkpoint, e.g. when its job cannot be resumed.
         :return: None
         """
         pass
@@ -73,21 +263,76 @@ class Database:
 class MongoDB(Database):
     """ The specific implementation of the Database interface for the MongoDB """
 
+    @traced('db.upsert_backup', 'db')
     def upsert_backup(self, backup_id, data):
         with self._lock:
             with MongoConnector(self.config) as db:
                 db.backup.update_one({"id": backup_id}, {'$set': data}, True)
 
+    @traced('db.upsert_backups', 'db')
+    def upsert_backups(self, backups):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                for start in range(0, len(backups), constants.DB_BULK_SIZE):
+                    db.backup.bulk_write([UpdateOne({'id': backup['id']}, {'$set': backup}, upsert=True)
+                                          for backup in backups[start:start + constants.DB_BULK_SIZE]],
+                                         ordered=False)
+
+    @traced('db.get_backup', 'db')
     def get_backup(self, backup_id):
         with self._lock:
             with MongoConnector(self.config) as db:
                 return db.backup.find_one({'id': backup_id})
 
+    @traced('db.get_backups', 'db')
+    def get_backups(self, backup_ids):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                return to_list(db.backup.find({'id': {'$in': list(backup_ids)}}))
+
+    @traced('db.get_node_backups', 'db')
+    def get_node_backups(self):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                return to_list(db.backup.find({'node': ConfigHelper.config['node']['name']}))
+
+    @traced('db.find_backups', 'db')
+    def find_backups(self, filters, fields=None, after=None, limit=100):
+        query = {key: filters[key] for key in ('node', 'status') if filters.get(key)}
+        if filters.get('since') or filters.get('until'):
+            query['creation_date'] = {}
+            if filters.get('since'):
+                query['creation_date']['$gte'] = filters['since']
+            if filters.get('until'):
+                query['creation_date']['$lt'] = filters['until']
+        if after:
+            query['$or'] = [{'creation_date': {'$lt': after[0]}},
+                            {'creation_date': after[0], 'id': {'$gt': after[1]}}]
+        projection = {'_id': False}
+        if fields:
+            projection.update({field: True for field in set(fields) | {'id', 'creation_date'}})
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                return to_list(db.backup.find(query, projection)
+                               .sort([('creation_date', DESCENDING), ('id', ASCENDING)])
+                               .limit(limit))
+
+    def create_indexes(self):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                db.backup.create_index([('id', ASCENDING)])
+                db.backup.create_index([('creation_date', DESCENDING), ('id', ASCENDING)])
+                db.backup.create_index([('node', ASCENDING), ('creation_date', DESCENDING), ('id', ASCENDING)])
+                db.job.create_index([('id', ASCENDING)])
+                db.replication.create_index([('backup_id', ASCENDING), ('target', ASCENDING)])
+
+    @traced('db.remove_backup', 'db')
     def remove_backup(self, backup_id):
         with self._lock:
             with MongoConnector(self.config) as db:
                 db.backup.remove({'id': backup_id})
 
+    @traced('db.get_backups_for_purging', 'db')
     def get_backups_for_purging(self):
         with self._lock:
             with MongoConnector(self.config) as db:
@@ -95,12 +340,137 @@ class MongoDB(Database):
                                                'deleted': True,
                                                'purged': False}).sort('creation_date', ASCENDING))
 
-    def remove_zombie_backups(self):
+    @traced('db.get_filesystem_rates', 'db')
+    def get_filesystem_rates(self):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                rates = db.backup.aggregate([
+                    {'$match': {'node': ConfigHelper.config['node']['name'],
+                                'status': constants.STATUS_FINISHED}},
+                    {'$sort': {'creation_date': DESCENDING}},
+                    {'$limit': constants.HISTORICAL_RATE_BACKUPS},
+                    {'$unwind': '$partitions'},
+                    {'$match': {'partitions.throughput': {'$gt': 0}}},
+                    {'$group': {'_id': '$partitions.fs',
+                                'throughput': {'$avg': '$partitions.throughput'}}},
+                ])
+                return {rate['_id']: rate['throughput'] for rate in rates}
+
+    @traced('db.upsert_job_checkpoint', 'db')
+    def upsert_job_checkpoint(self, job_id, data):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                db.job.update_one({'id': job_id}, {'$set': data}, True)
+
+    @traced('db.get_job_checkpoints', 'db')
+    def get_job_checkpoints(self):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                return to_list(db.job.find({'node': ConfigHelper.config['node']['name']}))
+
+    @traced('db.remove_job_checkpoint', 'db')
+    def remove_job_checkpoint(self, job_id):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                db.job.remove({'id': job_id})
+
+    @traced('db.add_node_usage', 'db')
+    def add_node_usage(self, delta):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                db.node.update_one({'name': ConfigHelper.config['node']['name']},
+                                   {'$inc': {'used_bytes': delta}}, True)
+
+    @traced('db.get_node_usage', 'db')
+    def get_node_usage(self):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                node = db.node.find_one({'name': ConfigHelper.config['node']['name']})
+                return node.get('used_bytes', 0) if node else 0
+
+    @traced('db.reset_node_usage', 'db')
+    def reset_node_usage(self):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                node = ConfigHelper.config['node']['name']
+                usage = list(db.backup.aggregate([
+                    {'$match': {'$or': [{'node': node}, {'replicas': node}], 'purged': {'$ne': True}}},
+                    {'$group': {'_id': None, 'used_bytes': {'$sum': '$backup_size'}}},
+                ]))
+                used_bytes = usage[0]['used_bytes'] if usage else 0
+                db.node.update_one({'name': node}, {'$set': {'used_bytes': used_bytes}}, True)
+                return used_bytes
+
+    @traced('db.add_backup_replica', 'db')
+    def add_backup_replica(self, backup_id, node):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                db.backup.update_one({'id': backup_id}, {'$addToSet': {'replicas': node}})
+
+    @traced('db.get_backups_to_replicate', 'db')
+    def get_backups_to_replicate(self, node):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                return to_list(db.backup.find({'node': ConfigHelper.config['node']['name'],
+                                               'status': constants.STATUS_FINISHED,
+                                               'deleted': {'$ne': True},
+                                               'replicas': {'$ne': node}}).sort('creation_date', ASCENDING))
+
+    @traced('db.upsert_replication', 'db')
+    def upsert_replication(self, backup_id, target, data):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                db.replication.update_one({'backup_id': backup_id, 'target': target}, {'$set': data}, True)
+
+    @traced('db.get_replications', 'db')
+    def get_replications(self, backup_id):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                return to_list(db.replication.find({'backup_id': backup_id}, {'_id': False}))
+
+    @traced('db.get_backups_to_scrub', 'db')
+    def get_backups_to_scrub(self, node, scrubbed_before):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                return to_list(db.backup.aggregate([
+                    {'$match': {'$or': [{'node': node}, {'replicas': node}],
+                                'scrubs': {'$not': {'$elemMatch': {'node': node,
+                                                                   'date': {'$gte': scrubbed_before}}}},
+                                'status': constants.STATUS_FINISHED,
+                                'deleted': {'$ne': True},
+                                'purged': {'$ne': True}}},
+                    {'$addFields': {'node_scrub': {'$filter': {'input': {'$ifNull': ['$scrubs', []]},
+                                                               'cond': {'$eq': ['$$this.node', node]}}}}},
+                    {'$sort': {'node_scrub.date': ASCENDING, 'creation_date': ASCENDING}},
+                    {'$project': {'node_scrub': False}},
+                ]))
+
+    @traced('db.set_backup_scrub', 'db')
+    def set_backup_scrub(self, backup_id, node, result):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                db.backup.update_one({'id': backup_id}, {'$pull': {'scrubs': {'node': node}}})
+                db.backup.update_one({'id': backup_id}, {'$push': {'scrubs': dict(result, node=node)}})
+
+    @traced('db.get_scrub_failures', 'db')
+    def get_scrub_failures(self, node):
+        with self._lock:
+            with MongoConnector(self.config) as db:
+                return to_list(db.backup.find({'scrubs': {'$elemMatch': {'node': node,
+                                                                         'status': constants.SCRUB_MISMATCH}},
+                                               'deleted': {'$ne': True}},
+                                              {'_id': False, 'id': True, 'scrubs': True}))
+
+    def remove_zombie_backups(self, backup_id=None):
         with self._lock:
             with MongoConnector(self.config) as db:
+                if backup_id is None:
+                    resumable = [job['id'] for job in db.job.find({'node': ConfigHelper.config['node']['name']})]
+                    backup_id = {'$nin': resumable}
                 db.backup.update({'node': ConfigHelper.config['node']['name'],
-                                  'status': constants.STATUS_RUNNING},
-                                 {'$set': {'status': constants.STATUS_ERROR}})
+                                  'status': constants.STATUS_RUNNING,
+                                  'id': backup_id},
+                                 {'$set': {'status': constants.STATUS_ERROR}}, multi=True)
 
 # Export a ready Database client as a singleton.
 DB = MongoDB(ConfigHelper.config['database'])
\ No newline at end of file
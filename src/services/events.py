@@ -0,0 +1,273 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+import logging
+from copy import deepcopy
+from threading import Condition, Event, Lock, Thread
+
+import constants
+
+
+class Subscription:
+    """
+    This class represents a single client of the status updates. The updates are not queued,
+    instead the changes are merged into a single pending update per status, so a slow client
+    only receives the latest state once it catches up, while the memory used per client is
+    bounded by the size of the statuses it follows.
+    """
+    def __init__(self, kind, key=None):
+        self.kind = kind
+        self.key = key
+        self._pending = {}
+        self._condition = Condition()
+
+    def accepts(self, kind, key):
+        """
+        Checks whether the subscription follows the given status.
+        :param kind: type of the status source (e.g. job, mount).
+        :param key: identifier of the status source.
+        :return: True if the updates of the status should be delivered, False otherwise.
+        """
+        return kind == self.kind and (self.key is None or key == self.key)
+
+    def push(self, key, delta):
+        """
+        Adds the changes of a status to the pending update.
+        :param key: identifier of the status source.
+        :param delta: dictionary of the changed fields, None if the status source was removed.
+        :return: None
+        """
+        with self._condition:
+            self._pending[key] = _merge(self._pending[key], delta) if key in self._pending else delta
+            self._condition.notify()
+
+    def get(self, timeout):
+        """
+        Waits for the pending changes and takes them out of the subscription.
+        :param timeout: maximum time to wait in seconds.
+        :return: dictionary of the changes per status source, None if nothing changed.
+        """
+        with self._condition:
+            if not self._pending:
+                self._condition.wait(timeout)
+            pending, self._pending = self._pending, {}
+            return pending or None
+
+
+class _StatusFeed:
+    """
+    This class polls a single status source on its own thread and publishes the changed
+    fields, it only runs while any subscription follows the status.
+    """
+    def __init__(self, broker, kind, key, source):
+        self.kind = kind
+        self.key = key
+        self._broker = broker
+        self._source = source
+        self._last = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._running = False
+        self._logger = logging.getLogger(__name__)
+
+    def start(self):
+        with self._lock:
+            self._stop.clear()
+            if not self._running:
+                self._running = True
+                Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def send_snapshot(self, subscription):
+        """
+        Delivers the last known state of the status to a new subscription, the state is sent
+        while no changes can be published, so that it never overrides a newer change.
+        :param subscription: Subscription object.
+        :return: None
+        """
+        with self._lock:
+            if self._last:
+                subscription.push(self.key, deepcopy(self._last))
+
+    def poll(self):
+        """
+        Reads the status from the source and publishes the fields changed since the last poll.
+        :return: None
+        """
+        status = deepcopy(self._source())
+        with self._lock:
+            delta = _diff(self._last, status)
+            if delta:
+                self._last = status
+                self._broker.dispatch(self.kind, self.key, delta)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stop.is_set():
+                    self._running = False
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                self._logger.warning('Cannot read the status of ' + self.kind + ' ' +
+                                     str(self.key) + ', cause: ' + str(e))
+            self._stop.wait(self._broker.interval)
+
+
+class _StatusBroker:
+    """
+    The StatusBroker delivers the changes of the job and mount statuses to any number of
+    subscribed clients. Each registered status source is polled by a single producer,
+    regardless of the number of the clients following it.
+    """
+    def __init__(self, interval=constants.STATUS_STREAM_INTERVAL,
+                 heartbeat=constants.STATUS_STREAM_HEARTBEAT):
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self._feeds = {}
+        self._subscriptions = set()
+        self._lock = Lock()
+
+    def register(self, kind, key, source):
+        """
+        Adds a source of status updates.
+        :param kind: type of the status source (e.g. job, mount).
+        :param key: identifier of the status source.
+        :param source: function without arguments returning the current status dictionary.
+        :return: None
+        """
+        feed = _StatusFeed(self, kind, key, source)
+        with self._lock:
+            self._feeds[(kind, key)] = feed
+            followed = any(subscription.accepts(kind, key) for subscription in self._subscriptions)
+        if followed:
+            feed.start()
+
+    def unregister(self, kind, key):
+        """
+        Removes a source of status updates and notifies the subscriptions about the removal.
+        :param kind: type of the status source.
+        :param key: identifier of the status source.
+        :return: None
+        """
+        with self._lock:
+            feed = self._feeds.pop((kind, key), None)
+        if feed:
+            feed.stop()
+            self.dispatch(kind, key, None)
+
+    def subscribe(self, kind, key=None):
+        """
+        Creates a subscription to the statuses of the given type, the current state of all
+        followed statuses is delivered as the first update.
+        :param kind: type of the status sources to be followed.
+        :param key: identifier of a single status source, all sources are followed if None.
+        :return: Subscription object.
+        """
+        subscription = Subscription(kind, key)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            feeds = [feed for feed in self._feeds.values() if subscription.accepts(feed.kind, feed.key)]
+        for feed in feeds:
+            feed.send_snapshot(subscription)
+            feed.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes the subscription and stops polling the statuses no longer followed by anyone.
+        :param subscription: Subscription object returned by the subscribe method.
+        :return: None
+        """
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            idle = [feed for feed in self._feeds.values()
+                    if not any(other.accepts(feed.kind, feed.key) for other in self._subscriptions)]
+        for feed in idle:
+            feed.stop()
+
+    def synchronise(self, kind, keys, source_factory):
+        """
+        Registers the sources missing from the given keys and unregisters the sources no longer
+        present, so that the statuses kept outside of this process can be followed as well.
+        :param kind: type of the status sources.
+        :param keys: identifiers of all existing status sources of the given type.
+        :param source_factory: function returning the status source for a key.
+        :return: None
+        """
+        with self._lock:
+            registered = {key for feed_kind, key in self._feeds if feed_kind == kind}
+        for key in set(keys) - registered:
+            self.register(kind, key, source_factory(key))
+        for key in registered - set(keys):
+            self.unregister(kind, key)
+
+    def is_registered(self, kind, key):
+        """
+        Checks whether the status source is registered.
+        :param kind: type of the status source.
+        :param key: identifier of the status source.
+        :return: True if the source is registered, False otherwise.
+        """
+        return (kind, key) in self._feeds
+
+    def dispatch(self, kind, key, delta):
+        """
+        Delivers the changes of a status to all subscriptions following it.
+        :param kind: type of the status source.
+        :param key: identifier of the status source.
+        :param delta: dictionary of the changed fields, None if the source was removed.
+        :return: None
+        """
+        with self._lock:
+            subscriptions = [subscription for subscription in self._subscriptions
+                             if subscription.accepts(kind, key)]
+        for subscription in subscriptions:
+            subscription.push(key, delta)
+
+
+def _diff(old, new):
+    """
+    Finds the fields which differ between two statuses, nested dictionaries are compared
+    recursively, while other values (including lists) are replaced as a whole.
+    :param old: previous status dictionary.
+    :param new: current status dictionary.
+    :return: dictionary of the changed fields, the removed fields are set to None.
+    """
+    delta = {key: None for key in old if key not in new}
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            nested = _diff(old[key], value)
+            if nested:
+                delta[key] = nested
+        elif key not in old or old[key] != value:
+            delta[key] = value
+    return delta
+
+
+def _merge(pending, delta):
+    """
+    Applies the changes on top of the pending update.
+    :param pending: pending update dictionary, None if the status was removed.
+    :param delta: dictionary of the changes, None if the status was removed.
+    :return: the merged update.
+    """
+    if pending is None or delta is None:
+        return delta
+    merged = dict(pending)
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+# Export a ready StatusBroker as a singleton.
+StatusBroker = _StatusBroker()
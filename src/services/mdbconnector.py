@@ -20,6 +20,7 @@ class MongoConnector:
             user - the mongodb username to use.
             password - the user's password.
             database - the name of the database to use.
+        The optional timeout key defines the number of seconds to wait for the server.
         """
         self.config = config
 
@@ -27,7 +28,8 @@ class MongoConnector:
         """Connect to database and create a DB cursor.
         Return the database cursor to the context manager.
         """
-        self.client = pymongo.MongoClient(self.config['host'])
+        self.client = pymongo.MongoClient(self.config['host'],
+                                          serverSelectionTimeoutMS=int(float(self.config.get('timeout', 30)) * 1000))
         if 'user' in self.config and 'password' in self.config:
             self.client[self.config['database']].authenticate(self.config['user'],
                                                               self.config['password'])
@@ -0,0 +1,257 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from abc import ABCMeta, abstractmethod
+from multiprocessing.managers import BaseManager
+from os import makedirs, path, remove
+from threading import Lock
+from time import time
+
+import constants
+from monitoring.plugins import create_node_monitor
+from .config import ConfigHelper
+
+
+class Registry:
+    """
+    This class provides a public interface for the registry of the jobs and mounts running on the
+    node. Each record is a dictionary identified by its kind (e.g. job, mount) and key, the
+    process running the job or holding the mount publishes its status into the record, so that
+    the record can be served by any process.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def add(self, kind, key, record):
+        """
+        Adds a new record, unless a record with the same key already exists.
+        :param kind: type of the record (e.g. job, mount).
+        :param key: string identifier of the record.
+        :param record: dictionary to be stored.
+        :return: True if the record was added, False if it already exists.
+        """
+        pass
+
+    @abstractmethod
+    def get(self, kind, key):
+        """
+        Retrieves a single record.
+        :param kind: type of the record.
+        :param key: string identifier of the record.
+        :return: copy of the record dictionary, None if it does not exist.
+        """
+        pass
+
+    @abstractmethod
+    def items(self, kind):
+        """
+        Retrieves all records of the given type.
+        :param kind: type of the records.
+        :return: dictionary of the records with their keys as keys.
+        """
+        pass
+
+    @abstractmethod
+    def update(self, kind, key, fields):
+        """
+        Modifies the fields of an existing record, the time of the update is stored in the
+        updated field of the record.
+        :param kind: type of the record.
+        :param key: string identifier of the record.
+        :param fields: dictionary of the fields to be modified.
+        :return: copy of the updated record, None if it does not exist.
+        """
+        pass
+
+    @abstractmethod
+    def remove(self, kind, key):
+        """
+        Removes a single record.
+        :param kind: type of the record.
+        :param key: string identifier of the record.
+        :return: the removed record, None if it does not exist.
+        """
+        pass
+
+    @abstractmethod
+    def evict(self, kind, max_age, stale_timeout):
+        """
+        Removes the records finished longer than max_age seconds ago. The unfinished records not
+        updated for stale_timeout seconds, e.g. after their owner process exited, are marked as
+        finished with an error instead.
+        :param kind: type of the records.
+        :param max_age: time in seconds for which the finished records are kept.
+        :param stale_timeout: time in seconds after which an unfinished record is treated as lost.
+        :return: list of the keys of the removed records.
+        """
+        pass
+
+
+class LocalRegistry(Registry):
+    """ The implementation of the Registry interface kept in the memory of a single process. """
+
+    def __init__(self):
+        self._records = {}
+        self._lock = Lock()
+
+    def add(self, kind, key, record):
+        with self._lock:
+            records = self._records.setdefault(kind, {})
+            if key in records:
+                return False
+            records[key] = dict(record, updated=time())
+            return True
+
+    def get(self, kind, key):
+        with self._lock:
+            record = self._records.get(kind, {}).get(key)
+            return dict(record) if record is not None else None
+
+    def items(self, kind):
+        with self._lock:
+            return {key: dict(record) for key, record in self._records.get(kind, {}).items()}
+
+    def update(self, kind, key, fields):
+        with self._lock:
+            record = self._records.get(kind, {}).get(key)
+            if record is None:
+                return None
+            record.update(fields)
+            record['updated'] = time()
+            return dict(record)
+
+    def remove(self, kind, key):
+        with self._lock:
+            return self._records.get(kind, {}).pop(key, None)
+
+    def evict(self, kind, max_age, stale_timeout):
+        now = time()
+        evicted = []
+        with self._lock:
+            records = self._records.get(kind, {})
+            for key, record in list(records.items()):
+                if record.get('finished'):
+                    if now - record['finished'] > max_age:
+                        evicted.append(key)
+                        del records[key]
+                elif now - record['updated'] > stale_timeout:
+                    record['finished'] = now
+                    record['status'] = dict(record.get('status', {}), status=constants.STATUS_ERROR,
+                                            error_msg='The process running the operation has exited.')
+        return evicted
+
+
+class _RegistryManager(BaseManager):
+    pass
+
+
+_store = None
+
+
+def _get_store():
+    global _store
+    if _store is None:
+        _store = LocalRegistry()
+    return _store
+
+_monitor = None
+_monitor_lock = Lock()
+
+
+def _get_monitor():
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = create_node_monitor()
+            _monitor.start()
+        return _monitor
+
+_RegistryManager.register('registry', callable=_get_store)
+_RegistryManager.register('monitor', callable=_get_monitor,
+                          exposed=('get_metrics', 'get_history', 'get_collection_stats'))
+
+
+class SharedRegistry(Registry):
+    """
+    The implementation of the Registry interface shared by all processes of the node. The records
+    are kept by the registry server process and accessed over a local unix socket, the server has
+    to be started with the start_registry_server function before the registry is used.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self._store = None
+        self._lock = Lock()
+
+    def add(self, kind, key, record):
+        return self._get_store().add(kind, key, record)
+
+    def get(self, kind, key):
+        return self._get_store().get(kind, key)
+
+    def items(self, kind):
+        return self._get_store().items(kind)
+
+    def update(self, kind, key, fields):
+        return self._get_store().update(kind, key, fields)
+
+    def remove(self, kind, key):
+        return self._get_store().remove(kind, key)
+
+    def evict(self, kind, max_age, stale_timeout):
+        return self._get_store().evict(kind, max_age, stale_timeout)
+
+    def get_monitor(self):
+        """
+        Connects to the SystemMonitor run by the registry server, so that the metrics of the node
+        are collected once rather than by every process, the monitor is started on first use.
+        :return: proxy of the SystemMonitor providing the get_metrics, get_history and
+            get_collection_stats methods.
+        """
+        manager = _RegistryManager(address=self.address)
+        manager.connect()
+        return manager.monitor()
+
+    def _get_store(self):
+        with self._lock:
+            if self._store is None:
+                manager = _RegistryManager(address=self.address)
+                manager.connect()
+                self._store = manager.registry()
+            return self._store
+
+
+def start_registry_server(address):
+    """
+    Starts the registry server process shared by all processes forked from the calling process.
+    :param address: path of the unix socket to listen on.
+    :return: the manager of the server, which has to be shut down on exit.
+    """
+    if path.exists(address):
+        remove(address)
+    makedirs(path.dirname(address), exist_ok=True)
+    manager = _RegistryManager(address=address)
+    manager.start()
+    return manager
+
+
+def _create_registry(config):
+    if config.get('server', 'registry', fallback='local') == 'shared':
+        return SharedRegistry(get_registry_address(config))
+    return LocalRegistry()
+
+
+def get_registry_address(config):
+    """
+    Reads the path of the registry socket from the configuration.
+    :param config: the node configuration.
+    :return: path of the unix socket.
+    """
+    return config.get('server', 'registry_socket', fallback=constants.REGISTRY_SOCKET)
+
+
+# Export the Registry selected in the configuration as a singleton.
+StatusRegistry = _create_registry(ConfigHelper.config)
@@ -0,0 +1,43 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+"""
+
+from .database import DB
+
+
+class _NodeUsage:
+    """
+    This class keeps the number of bytes used by the backups of the node as a counter in the
+    database. The counter is updated as the backups grow or are purged, so that the used space
+    can be checked without walking the backup directories.
+    """
+
+    def get_used_bytes(self):
+        """
+        Returns the number of bytes used by the backups of the node.
+        :return: number of bytes.
+        """
+        return DB.get_node_usage()
+
+    def add(self, delta):
+        """
+        Changes the number of bytes used by the backups of the node.
+        :param delta: number of bytes to be added, negative to be subtracted.
+        :return: None
+        """
+        if delta:
+            DB.add_node_usage(delta)
+
+    def recalculate(self):
+        """
+        Recalculates the counter from the sizes of the backups in the catalog, e.g. on startup
+        or after the catalog was rebuilt.
+        :return: number of bytes used by the backups of the node.
+        """
+        return DB.reset_node_usage()
+
+
+# Export as singleton.
+NodeUsage = _NodeUsage()
@@ -5,14 +5,16 @@ License:    GPL
 """
 
 import logging
-from os import mkdir
+from os import lstat, mkdir, scandir
 from shutil import rmtree
 from threading import Lock
 
 from humanize import naturalsize
 
+import constants
 from core.backupset import Backupset
 from lib.exceptions import BackupOperationException, IllegalOperationException
+from lib.tracing import traced
 from .config import ConfigHelper
 from .database import DB
 
@@ -24,16 +26,27 @@ def delete_backup(backupset):
     :param backupset: an object of the Backupset class that describes the
     :return: None
     """
-    if backupset.deleted:
-        if backupset.node == ConfigHelper.config['node']['name']:
-            _remove_backup_files(backupset)
-        else:
-            raise IllegalOperationException("The requested backup resides on a different node. " +
-                                            "Please use node: " + backupset.node + " for this backup overwrite.")
-    else:
+    check_backup_removable(backupset)
+    _remove_backup_files(backupset)
+
+
+def check_backup_removable(backupset):
+    """
+    Checks whether the backup files can be removed from the disk by this node, so that a job
+    overwriting the backup can be refused before anything is removed.
+    :param backupset: an object of the Backupset class that describes the backup.
+    :return: None
+    :exception: IllegalOperationException is raised if the backup is not marked for deletion or
+        resides on another node.
+    """
+    if not backupset.deleted:
         raise IllegalOperationException("A backup must be marked as ready for deletion before overwriting it.")
+    if backupset.node != ConfigHelper.config['node']['name']:
+        raise IllegalOperationException("The requested backup resides on a different node. " +
+                                        "Please use node: " + backupset.node + " for this backup overwrite.")
 
 
+@traced('remove_backup_files', 'purge')
 def _remove_backup_files(backupset):
     try:
         rmtree(backupset.backup_path)
@@ -42,6 +55,35 @@ def _remove_backup_files(backupset):
         raise BackupOperationException('Cannot remove backup, cause: ' + str(e))
 
 
+def get_allocated_size(file_path):
+    """
+    Returns the number of bytes allocated on the disk by the file, which differs from the size of
+    sparse files, symbolic links are not followed.
+    :param file_path: path of the file.
+    :return: number of bytes, 0 if the file does not exist.
+    """
+    try:
+        return lstat(file_path).st_blocks * constants.STAT_BLOCK_SIZE
+    except FileNotFoundError:
+        return 0
+
+
+def get_directory_allocated_size(directory):
+    """
+    Returns the number of bytes allocated on the disk by the directory and its contents,
+    symbolic links are not followed.
+    :param directory: path of the directory.
+    :return: number of bytes.
+    """
+    size = 0
+    with scandir(directory) as entries:
+        for entry in entries:
+            size += entry.stat(follow_symlinks=False).st_blocks * constants.STAT_BLOCK_SIZE
+            if entry.is_dir(follow_symlinks=False):
+                size += get_directory_allocated_size(entry.path)
+    return size
+
+
 def create_dir(dir):
     """
     Creates a directory if it doesn't exist.
@@ -112,6 +154,7 @@ class _BackupRemover:
         self._logger.warning('Cannot calculate space in bytes for the received input. Input: ' + str(space))
         raise ValueError('Invalid string format or unknown unit received.')
 
+    @traced('make_space', 'purge')
     def _make_space(self, space_required):
         self._logger.debug('creating purge list')
         with self._lock:
@@ -0,0 +1,15 @@
+"""
+Author:     Oktawiusz Wilk
+Date:       10/04/2016
+License:    GPL
+
+The WSGI entry point of the Imaging Node, e.g.:
+    gunicorn --chdir /opt/disk-image/src -c /opt/disk-image/src/gunicorn.conf.py wsgi:application
+The tasks done once per node are run by the on_starting hook of gunicorn.conf.py, other servers
+have to call server.prepare_node before the workers are started.
+"""
+
+from server import create_app, startup
+
+startup()
+application = create_app()
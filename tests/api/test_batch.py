@@ -0,0 +1,119 @@
+import unittest
+from unittest.mock import Mock, patch
+from src.api.resources.batch import JobBatch, JobGroup
+from src.api.resources.job import Job
+from src.services.registry import LocalRegistry
+
+
+def backup_entry(job_id, disk, **options):
+    return {'job_id': job_id, 'disk': disk, 'operation': 'Backup', 'options': options}
+
+
+def restoration_entry(job_id, disk, **options):
+    return {'job_id': job_id, 'disk': disk, 'operation': 'Restoration', 'options': options}
+
+
+class JobBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = LocalRegistry()
+        self.supervisor = Mock()
+        self.supervisor.submit_all.side_effect = lambda controllers: controllers
+        self.disks = {'sdb': {'name': 'sdb'}, 'sdc': {'name': 'sdc'}, 'sdd': {'name': 'sdd'}}
+        for target, value in (('src.api.resources.batch.Job', Job),
+                              ('src.api.resources.batch.StatusRegistry', self.registry),
+                              ('src.api.resources.job.StatusRegistry', self.registry),
+                              ('src.api.resources.job.StatusBroker', Mock()),
+                              ('src.api.resources.batch.JobSupervisor', self.supervisor),
+                              ('src.api.resources.job.Job._jobs', {})):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.batch = JobBatch()
+
+    def stored_backup(self, deleted=False):
+        return Mock(deleted=deleted, node='Localhost', is_stored_on=Mock(return_value=True))
+
+    def test_entries_with_missing_fields_or_unknown_options_are_rejected(self):
+        errors = self.batch._validate_entries([{'job_id': 'a'},
+                                               backup_entry('b', 'sdb', unknown=True),
+                                               {'job_id': 'c', 'disk': 'sdc', 'operation': 'Copy'}])
+        self.assertEqual('The job_id and disk fields are required.', errors['0'])
+        self.assertIn('The options can only contain', errors['b'])
+        self.assertEqual("Unknown operation 'Copy'.", errors['c'])
+
+    def test_duplicate_job_ids_and_disks_are_rejected(self):
+        errors = self.batch._validate_entries([backup_entry('a', 'sdb'),
+                                               backup_entry('a', 'sdc'),
+                                               backup_entry('b', 'sdb'),
+                                               restoration_entry('c', 'sdd', targets=['sdc'])])
+        self.assertEqual({'a': 'The job id is used more than once in the batch.',
+                          'b': "The disk 'sdb' is used more than once in the batch.",
+                          'c': "The disk 'sdc' is used more than once in the batch."}, errors)
+
+    def test_valid_entries_pass(self):
+        self.assertEqual({}, self.batch._validate_entries([backup_entry('a', 'sdb'),
+                                                           restoration_entry('b', 'sdc', targets=['sdd'])]))
+
+    def test_resources_are_checked_per_job(self):
+        Job._register_job('running', 'sdd')
+        entries = [backup_entry('running', 'sdb'), backup_entry('missing', 'sde'),
+                   backup_entry('busy', 'sdd'), backup_entry('exists', 'sdc'),
+                   restoration_entry('unknown', 'sdc')]
+        errors = self.batch._validate_resources(entries, self.disks, {'exists': self.stored_backup()})
+        self.assertEqual({'running': "A job with id 'running' is already running on this node.",
+                          'missing': 'Disk sde was not detected by the system.',
+                          'busy': "The disk 'sdd' is used by another job.",
+                          'exists': "Backup with the id 'exists' already exists and is not marked for deletion.",
+                          'unknown': 'Could not retrieve backup information.'}, errors)
+
+    def test_backup_marked_for_deletion_can_be_overwritten(self):
+        entries = [backup_entry('a', 'sdb', overwrite=True), restoration_entry('b', 'sdc')]
+        backups = {'a': self.stored_backup(deleted=True), 'b': self.stored_backup()}
+        self.assertEqual({}, self.batch._validate_resources(entries, self.disks, backups))
+
+    def test_all_jobs_are_submitted_at_once(self):
+        controllers = [Mock(**{'get_status.return_value': {'status': 'pending'}}) for _ in range(2)]
+        with patch.object(Job, '_get_controller', side_effect=controllers) as get_controller:
+            errors = self.batch._submit([backup_entry('a', 'sdb', compress=True), restoration_entry('b', 'sdc')],
+                                        self.disks, {'b': self.stored_backup()}, {'ext4': 1})
+        self.assertIsNone(errors)
+        self.supervisor.submit_all.assert_called_once_with(controllers)
+        self.assertEqual({'a', 'b'}, set(self.registry.items(Job.STATUS_KIND)))
+        operation, disk, job_id, config, prefetched = get_controller.call_args_list[0][0]
+        self.assertEqual(('Backup', 'sdb', 'a'), (operation, disk, job_id))
+        self.assertTrue(config['compress'])
+        self.assertEqual({'disk_details': {'name': 'sdb'}, 'backupset': None, 'rates': {'ext4': 1}}, prefetched)
+
+    def test_failed_job_rolls_back_the_batch(self):
+        prepared = Mock()
+        with patch.object(Job, '_get_controller', side_effect=[prepared, Exception('Cannot read the disk.')]):
+            errors = self.batch._submit([backup_entry('a', 'sdb'), backup_entry('b', 'sdc')],
+                                        self.disks, {}, {})
+        self.assertEqual({'b': 'Cannot read the disk.'}, errors)
+        prepared.discard.assert_called_once_with()
+        self.supervisor.submit_all.assert_not_called()
+        self.assertEqual({}, self.registry.items(Job.STATUS_KIND))
+
+    def test_job_registered_meanwhile_rolls_back_the_batch(self):
+        Job._register_job('b', 'sdc')
+        with patch.object(Job, '_get_controller', return_value=Mock()):
+            errors = self.batch._submit([backup_entry('a', 'sdb'), backup_entry('b', 'sdc')],
+                                        self.disks, {}, {})
+        self.assertEqual({'b': "A job with id 'b' is already running on this node."}, errors)
+        self.assertEqual({'b'}, set(self.registry.items(Job.STATUS_KIND)))
+
+
+class JobGroupTest(unittest.TestCase):
+
+    def test_completion_is_weighted_by_the_job_size(self):
+        statuses = {'a': {'id': 'a', 'status': 'running', 'size': 3000, 'completed': 50.0,
+                          'throughput': 10, 'remaining_seconds': 30},
+                    'b': {'id': 'b', 'status': 'finished', 'size': 1000, 'completed': 100.0}}
+        with patch('src.api.resources.batch.Job', Job), \
+                patch.object(Job, '_get_job_details', side_effect=statuses.get):
+            payload = JobGroup._aggregate({'members': ['a', 'b']})
+        self.assertEqual(62.5, payload['completed'])
+        self.assertEqual('running', payload['status'])
+        self.assertEqual({'running': 1, 'finished': 1}, payload['jobs'])
+        self.assertEqual(30, payload['remaining_seconds'])
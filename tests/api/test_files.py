@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+from flask import Flask
+from flask_restful import Api
+from src.api.resources.files import BackupFiles
+from src.api.resources.mount import Mount
+from src.services.registry import LocalRegistry
+
+
+class BackupFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.mount_path = os.path.join(self.directory.name, 'backup1')
+        os.makedirs(os.path.join(self.mount_path, 'part1', 'etc'))
+        with open(os.path.join(self.mount_path, 'part1', 'etc', 'hosts'), 'w') as hosts:
+            hosts.write('127.0.0.1 localhost\n')
+        with open(os.path.join(self.directory.name, 'secret'), 'w') as secret:
+            secret.write('top secret')
+        os.symlink(self.directory.name, os.path.join(self.mount_path, 'part1', 'escape'))
+        app = Flask(__name__)
+        Api(app).add_resource(BackupFiles, '/api/backup/<backup_id>/files/',
+                              '/api/backup/<backup_id>/files/<path:file_path>')
+        self.client = app.test_client()
+        self.controller = Mock(mount_path=self.mount_path)
+        self.controller.has_error_status.return_value = False
+        for target, value in (('src.api.resources.files.Mount', Mount),
+                              ('src.api.resources.mount.MountController', Mock(return_value=self.controller)),
+                              ('src.api.resources.mount.StatusRegistry', LocalRegistry()),
+                              ('src.api.resources.mount.StatusBroker', Mock()),
+                              ('src.api.resources.mount.Mount._mounts', {})):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_unmounted_backup_is_mounted_and_listed(self):
+        response = self.client.get('/api/backup/backup1/files/part1')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['escape', 'etc'], [entry['name'] for entry in response.get_json()['entries']])
+        self.assertEqual(['link', 'dir'], [entry['type'] for entry in response.get_json()['entries']])
+        self.controller.mount.assert_called_once_with()
+        self.assertIn('backup1', Mount._mounts)
+
+    def test_mount_is_reused_by_following_requests(self):
+        self.client.get('/api/backup/backup1/files/')
+        response = self.client.get('/api/backup/backup1/files/part1/etc/hosts')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(b'127.0.0.1 localhost\n', response.data)
+        self.controller.mount.assert_called_once_with()
+
+    def test_directory_listing_is_paginated(self):
+        response = self.client.get('/api/backup/backup1/files/part1?offset=1&limit=1')
+        self.assertEqual(2, response.get_json()['total'])
+        self.assertEqual(['etc'], [entry['name'] for entry in response.get_json()['entries']])
+
+    def test_parent_directory_traversal_is_rejected(self):
+        response = self.client.get('/api/backup/backup1/files/part1/../../secret')
+        self.assertEqual(400, response.status_code)
+        response = self.client.get('/api/backup/backup1/files/part1/%2E%2E/%2E%2E/secret')
+        self.assertEqual(400, response.status_code)
+
+    def test_symlink_leading_outside_is_rejected(self):
+        response = self.client.get('/api/backup/backup1/files/part1/escape/secret')
+        self.assertEqual(400, response.status_code)
+        self.assertNotIn(b'top secret', response.data)
+
+    def test_missing_file_is_reported(self):
+        response = self.client.get('/api/backup/backup1/files/part1/etc/passwd')
+        self.assertEqual(404, response.status_code)
+
+    def test_mount_failure_is_reported_and_unregistered(self):
+        self.controller.mount.side_effect = Exception('No free NBD device.')
+        response = self.client.get('/api/backup/backup1/files/part1')
+        self.assertEqual(400, response.status_code)
+        self.assertIn('No free NBD device.', response.get_json())
+        self.assertIsNone(Mount._get_status('backup1'))
+
+
+class MountPathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = LocalRegistry()
+        for target, value in (('src.api.resources.mount.StatusRegistry', self.registry),
+                              ('src.api.resources.mount.StatusBroker', Mock()),
+                              ('src.api.resources.mount.Mount._mounts', {})):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch('src.api.resources.mount.MountController')
+    def test_backup_mounted_by_another_process_is_not_mounted_again(self, controller_class):
+        self.registry.add(Mount.STATUS_KIND, 'backup1', {'mount_path': '/mnt/backup1'})
+        self.assertEqual('/mnt/backup1', Mount.get_mount_path('backup1'))
+        self.assertFalse(controller_class.called)
+
+    @patch('src.api.resources.mount.MountController')
+    def test_backup_being_mounted_by_another_process_is_reported(self, controller_class):
+        self.registry.add(Mount.STATUS_KIND, 'backup1', {'mount_path': None})
+        with self.assertRaisesRegex(Exception, 'being mounted by another process'):
+            Mount.get_mount_path('backup1')
+
+    @patch('src.api.resources.mount.MountController')
+    def test_mount_path_is_registered_only_once_mounted(self, controller_class):
+        controller_class.return_value.mount_path = '/mnt/backup1'
+        controller_class.return_value.has_error_status.return_value = False
+        controller_class.return_value.get_status.return_value = {'status': 'mounted'}
+        paths = []
+        controller_class.return_value.mount.side_effect = \
+            lambda: paths.append(self.registry.get(Mount.STATUS_KIND, 'backup1')['mount_path'])
+        self.assertEqual('/mnt/backup1', Mount.get_mount_path('backup1'))
+        self.assertEqual([None], paths)
+        self.assertEqual('/mnt/backup1', self.registry.get(Mount.STATUS_KIND, 'backup1')['mount_path'])
+
+    @patch('src.api.resources.mount.MountController')
+    def test_failed_mount_is_unregistered(self, controller_class):
+        controller_class.return_value.has_error_status.return_value = True
+        controller_class.return_value.get_status.return_value = {'error_msg': 'Cannot mount.'}
+        with self.assertRaisesRegex(Exception, 'Cannot mount.'):
+            Mount.get_mount_path('backup1')
+        self.assertIsNone(self.registry.get(Mount.STATUS_KIND, 'backup1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
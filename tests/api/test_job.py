@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import Mock, patch
+from src.api.resources.job import Job
+from src.services.registry import LocalRegistry
+
+
+class ResumeInterruptedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = LocalRegistry()
+        self.db = Mock()
+        self.checkpoints = []
+        for target, value in (('src.api.resources.job.StatusRegistry', self.registry),
+                              ('src.api.resources.job.StatusBroker', Mock()),
+                              ('src.api.resources.job.JobSupervisor', Mock(submit=lambda controller: controller)),
+                              ('src.api.resources.job.JobCheckpoint', Mock(load_interrupted=lambda: self.checkpoints)),
+                              ('src.api.resources.job.DB', self.db),
+                              ('src.api.resources.job.Job._jobs', {})):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_checkpoint(self, job_id, operation):
+        checkpoint = Mock(id=job_id, operation=operation, disk='sd' + job_id, config={}, resumed=0)
+        self.checkpoints.append(checkpoint)
+        return checkpoint
+
+    def test_jobs_are_resumed_from_their_checkpoints(self):
+        self.add_checkpoint('b', Job.BACKUP_OPERATION)
+        controller = Mock(**{'get_status.return_value': {'status': 'pending'}})
+        with patch.object(Job, '_get_controller', return_value=controller) as get_controller:
+            self.assertEqual(['b'], Job.resume_interrupted())
+        self.assertEqual(1, get_controller.call_args[1]['checkpoint'].resumed)
+        self.assertEqual({'b'}, set(self.registry.items(Job.STATUS_KIND)))
+
+    def test_backup_which_cannot_be_resumed_is_marked_as_failed(self):
+        backup = self.add_checkpoint('b', Job.BACKUP_OPERATION)
+        restoration = self.add_checkpoint('r', Job.RESTORATION_OPERATION)
+        with patch.object(Job, '_get_controller', side_effect=Exception('The disk has changed.')):
+            self.assertEqual([], Job.resume_interrupted())
+        self.db.remove_zombie_backups.assert_called_once_with('b')
+        backup.remove.assert_called_once_with()
+        restoration.remove.assert_called_once_with()
+        self.assertEqual({}, self.registry.items(Job.STATUS_KIND))
+
+    def test_checkpoint_is_kept_if_backup_cannot_be_marked(self):
+        backup = self.add_checkpoint('b', Job.BACKUP_OPERATION)
+        self.db.remove_zombie_backups.side_effect = ConnectionError('The database is not reachable.')
+        with patch.object(Job, '_get_controller', side_effect=Exception('The disk has changed.')):
+            self.assertEqual([], Job.resume_interrupted())
+        backup.remove.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+from src.core.backupset import Backupset, Partition
+import src.core.backupset as backupset_module
+
+
+class BackupsetManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.backupset = Backupset('backup1')
+        self.backupset.backup_path = self.directory.name + '/'
+        self.backupset.disk_layout = 'GPT'
+        self.backupset.creation_date = datetime(2016, 4, 10, 12, 30, 15)
+        self.backupset.partitions.append(Partition('1', 'ext4', 1024))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_manifest_round_trip(self):
+        self.backupset.write_manifest()
+        loaded = Backupset.from_manifest(self.backupset.get_manifest_path())
+        self.assertEqual(self.backupset.to_dict(), loaded.to_dict())
+
+    def test_manifest_is_replaced_without_temporary_files(self):
+        self.backupset.write_manifest()
+        self.backupset.status = 'finished'
+        self.backupset.write_manifest()
+        self.assertEqual(['backupset.cfg'], os.listdir(self.directory.name))
+        self.assertEqual('finished', Backupset.from_manifest(self.backupset.get_manifest_path()).status)
+
+    def test_manifest_is_not_written_without_backup_directory(self):
+        self.backupset.backup_path = self.directory.name + '/missing/'
+        self.backupset.write_manifest()
+        self.assertFalse(os.path.exists(self.backupset.backup_path))
+
+    @patch('src.core.backupset.DB')
+    def test_save_writes_manifest(self, db_mock):
+        self.backupset.save()
+        stored = self.backupset.to_dict()
+        del stored['replicas']  # Added by the nodes receiving the replicas only
+        del stored['scrubs']  # Recorded by the nodes scrubbing their copies only
+        db_mock.upsert_backup.assert_called_once_with('backup1', stored)
+        self.assertTrue(os.path.exists(self.backupset.get_manifest_path()))
+
+    @patch('src.core.backupset.DB')
+    def test_manifest_is_written_when_datastore_fails(self, db_mock):
+        db_mock.upsert_backup.side_effect = Exception('No connection.')
+        with self.assertRaisesRegex(Exception, 'No connection.'):
+            self.backupset.save()
+        self.assertTrue(os.path.exists(self.backupset.get_manifest_path()))
+
+    @patch('src.core.backupset.DB')
+    @patch('src.core.backupset.fsync')
+    def test_manifest_replacement_is_persisted(self, fsync_mock, db_mock):
+        self.backupset.write_manifest()
+        self.assertEqual(2, fsync_mock.call_count)
+
+    def test_partition_sizes_are_stored_as_numbers(self):
+        self.backupset.add_partitions([{'name': 'sda2', 'fs': 'vfat', 'size': '4051668992'}])
+        self.assertEqual(4051668992, self.backupset.partitions[1].size)
+        self.assertEqual(0, Partition.from_json({'partition': '3', 'fs': 'raw'}).size)
+
+    def test_unreadable_manifest_raises(self):
+        with open(self.backupset.get_manifest_path(), 'w') as manifest:
+            manifest.write('{"id": ')
+        with self.assertRaises(backupset_module.BackupsetException):
+            Backupset.from_manifest(self.backupset.get_manifest_path())
+
+
+class BackupsetUsageTest(unittest.TestCase):
+
+    @patch('src.core.backupset.NodeUsage')
+    def test_backup_size_changes_update_node_usage(self, usage_mock):
+        backupset = Backupset('backup1')
+        backupset.update_backup_size(4096)
+        backupset.update_backup_size(10240)
+        self.assertEqual([((4096,),), ((6144,),)], usage_mock.add.call_args_list)
+        self.assertEqual(10240, backupset.backup_size)
+
+    @patch('src.core.backupset.DB')
+    @patch('src.core.backupset.NodeUsage')
+    def test_purged_backup_is_subtracted_once(self, usage_mock, db_mock):
+        backupset = Backupset('backup1')
+        backupset.backup_path = '/nonexistent/'
+        backupset.backup_size = 4096
+        backupset.deleted = True
+        backupset.mark_as_purged()
+        backupset.mark_as_purged()
+        usage_mock.add.assert_called_once_with(-4096)
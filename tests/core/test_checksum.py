@@ -0,0 +1,146 @@
+import os
+import tempfile
+import unittest
+from threading import Thread
+from time import sleep
+from unittest.mock import Mock, patch
+from src.core.checksum import SegmentHasher, StreamHasher, find_first_mismatch, whole_checksum
+
+SEGMENT_SIZE = 4096
+
+
+class ChecksumTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.data = os.urandom(10 * SEGMENT_SIZE + 100)
+        self.image_path = self.directory.name + '/part1.img'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _checksum(self, data=None):
+        hasher = SegmentHasher(SEGMENT_SIZE)
+        hasher.update(data or self.data)
+        return hasher.result()
+
+    def _write_slowly(self, file_path, mode='wb'):
+        with open(file_path, mode) as file:
+            for offset in range(0, len(self.data), 3000):
+                file.write(self.data[offset:offset + 3000])
+                file.flush()
+                sleep(0.001)
+
+    def _write_fifo(self, fifo, size, errors):
+        try:
+            with open(fifo, 'wb') as file:
+                for _ in range(size // len(self.data)):
+                    file.write(self.data)
+        except OSError as e:
+            errors.append(e)
+
+    def test_segments_do_not_depend_on_chunks(self):
+        hasher = SegmentHasher(SEGMENT_SIZE)
+        for offset in range(0, len(self.data), 1000):
+            hasher.update(self.data[offset:offset + 1000])
+        checksum = hasher.result()
+        self.assertEqual(self._checksum(), checksum)
+        self.assertEqual(11, len(checksum['segments']))
+        self.assertEqual(len(self.data), checksum['size'])
+        self.assertEqual(whole_checksum(checksum['size'], checksum['segments']), checksum['checksum'])
+
+    def test_file_is_hashed_while_written(self):
+        hasher = StreamHasher(self.image_path, segment_size=SEGMENT_SIZE)
+        hasher.start()
+        self._write_slowly(self.image_path)
+        self.assertEqual(self._checksum(), hasher.finish(5))
+
+    def test_stream_is_hashed_from_fifo(self):
+        fifo = self.directory.name + '/.part1.img.fifo'
+        hasher = StreamHasher(fifo, fifo=True, segment_size=SEGMENT_SIZE)
+        hasher.start()
+        writer = Thread(target=self._write_slowly, args=(fifo,))
+        writer.start()
+        writer.join()
+        self.assertEqual(self._checksum(), hasher.finish(5))
+        self.assertFalse(os.path.exists(fifo))
+
+    def test_fifo_without_writer_is_released(self):
+        hasher = StreamHasher(self.directory.name + '/.fifo', fifo=True, segment_size=SEGMENT_SIZE)
+        hasher.start()
+        sleep(0.05)
+        self.assertEqual(0, hasher.finish(5)['size'])
+
+    def test_fifo_is_drained_after_hashing_fails(self):
+        fifo = self.directory.name + '/.part1.img.fifo'
+        hasher = StreamHasher(fifo, fifo=True, segment_size=SEGMENT_SIZE)
+        hasher.hasher.update = Mock(side_effect=MemoryError)
+        hasher.start()
+        errors = []
+        writer = Thread(target=self._write_fifo, args=(fifo, 100 * len(self.data), errors), daemon=True)
+        writer.start()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual([], errors)
+        self.assertIsNone(hasher.finish(5))
+        self.assertIsInstance(hasher.error, MemoryError)
+
+    def test_writer_is_released_when_reader_is_gone(self):
+        fifo = self.directory.name + '/.part1.img.fifo'
+        hasher = StreamHasher(fifo, fifo=True, segment_size=SEGMENT_SIZE)
+        hasher._thread = Thread(target=lambda: None)
+        hasher.start()
+        errors = []
+        writer = Thread(target=self._write_fifo, args=(fifo, len(self.data), errors), daemon=True)
+        writer.start()
+        sleep(0.05)
+        hasher.finish(5)
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertIsInstance(errors[0], BrokenPipeError)
+
+    @patch('src.core.checksum.constants.BUSY_WAIT_INTERVAL', 5)
+    def test_file_created_while_waiting_is_hashed(self):
+        hasher = StreamHasher(self.image_path, segment_size=SEGMENT_SIZE)
+        hasher.start()
+        sleep(0.1)
+        with open(self.image_path, 'wb') as file:
+            file.write(self.data)
+        self.assertEqual(self._checksum(), hasher.finish(5))
+
+    def test_missing_file_is_reported(self):
+        hasher = StreamHasher(self.image_path, segment_size=SEGMENT_SIZE)
+        hasher.start()
+        self.assertIsNone(hasher.finish(5))
+        self.assertIsNotNone(hasher.error)
+
+    def test_matching_image_is_verified(self):
+        with open(self.image_path, 'wb') as image:
+            image.write(self.data)
+        self.assertIsNone(find_first_mismatch(self.image_path, self._checksum(), workers=2))
+        chunks = (self.data[offset:offset + 5000] for offset in range(0, len(self.data), 5000))
+        self.assertIsNone(find_first_mismatch(chunks, self._checksum()))
+
+    def test_first_mismatching_segment_is_found(self):
+        checksum = self._checksum()
+        corrupted = bytearray(self.data)
+        corrupted[7 * SEGMENT_SIZE + 10] ^= 0xff
+        corrupted[9 * SEGMENT_SIZE] ^= 0xff
+        with open(self.image_path, 'wb') as image:
+            image.write(corrupted)
+        expected = {'segment': 7, 'offset': 7 * SEGMENT_SIZE}
+        self.assertEqual(expected, find_first_mismatch(self.image_path, checksum, workers=2))
+        self.assertEqual(expected, find_first_mismatch(iter([bytes(corrupted)]), checksum))
+
+    def test_size_difference_is_reported(self):
+        checksum = self._checksum()
+        with open(self.image_path, 'wb') as image:
+            image.write(self.data[:-1])
+        self.assertEqual({'size': len(self.data) - 1, 'expected_size': len(self.data)},
+                         find_first_mismatch(self.image_path, checksum))
+        self.assertEqual({'size': len(self.data) - 1, 'expected_size': len(self.data)},
+                         find_first_mismatch(iter([self.data[:-1]]), checksum))
+
+
+if __name__ == '__main__':
+    unittest.main()
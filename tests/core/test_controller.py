@@ -0,0 +1,161 @@
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+from src.core.backupset import Backupset
+from src.core.checkpoint import JobCheckpoint
+from src.core.controller import BackupController, FanOutRestorationController, RestorationController
+from src.core.image import PartitionImage
+import src.constants as constants
+
+
+class ResumedBackupTest(unittest.TestCase):
+    CONFIG = {
+        'overwrite': False,
+        'rescue': False,
+        'space_check': True,
+        'fs_check': True,
+        'crc_check': True,
+        'force': False,
+        'refresh_delay': 5,
+        'compress': False,
+        'trace': False,
+    }
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.backupset = Backupset._from_json({
+            'id': 'job1',
+            'disk_layout': 'MBR',
+            'disk_size': '4051697664',
+            'status': constants.STATUS_RUNNING,
+            'partitions': [{'partition': '1', 'fs': 'vfat', 'size': '1048576', 'image_size': 4096},
+                           {'partition': '2', 'fs': 'ext4', 'size': '4050649088'}],
+        })
+        self.backupset.backup_path = self.directory.name + '/'
+        self.checkpoint = JobCheckpoint('job1', 'Backup', 'sdb', self.CONFIG)
+        self.checkpoint.completed_partitions = ['1']
+        self.checkpoint.resumed = 1
+        self.disk_details = {'size': '4051697664'}
+        self.checkpoint_db = Mock()
+        layout = Mock()
+        layout.with_config.return_value.get_layout.return_value = 'MBR'
+        for target, value in (('src.core.controller.DiskLayout', layout),
+                              ('src.core.controller.DiskDetect', Mock(get_disk_details=lambda disk: self.disk_details)),
+                              ('src.core.controller.Backupset', Mock(load=Mock(return_value=self.backupset))),
+                              ('src.core.controller.PartitionImage', PartitionImage),
+                              ('src.core.backupset.DB', Mock()),
+                              ('src.core.backupset.NodeUsage', Mock()),
+                              ('src.core.checkpoint.DB', self.checkpoint_db)):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_controller(self):
+        controller = BackupController('sdb', 'job1', dict(self.CONFIG), {'rates': {}}, self.checkpoint)
+        controller.backup_dir = self.directory.name + '/'
+        return controller
+
+    def run_backup(self, controller, imaging):
+        controller._imager = Mock(backup=Mock(side_effect=imaging), get_status=Mock(return_value=[]))
+        controller._backup()
+
+    @patch('src.core.image.Execute')
+    def test_completed_partitions_are_not_imaged_again(self, exec_class):
+        exec_class.return_value.poll.return_value = 0
+        controller = self.create_controller()
+        self.assertEqual({'1'}, controller._imager.completed_partitions)
+        self.assertEqual(1, controller.get_status()['resumed'])
+        with patch('src.core.image.path') as path_mock:
+            path_mock.exists.return_value = True
+            controller._imager.backup()
+        self.assertEqual(1, exec_class.call_count)
+        self.assertIn('/dev/sdb2', exec_class.call_args[0][0])
+        self.assertEqual(['1', '2'], self.checkpoint.completed_partitions)
+        self.assertEqual(4096, self.backupset.partitions[0].image_size)
+
+    def test_changed_disk_is_not_resumed(self):
+        self.disk_details = {'size': '8103395328'}
+        with self.assertRaisesRegex(Exception, 'has changed since the backup'):
+            self.create_controller()
+        self.checkpoint_db.upsert_job_checkpoint.assert_not_called()
+
+    def test_cancelled_job_removes_its_checkpoint(self):
+        controller = self.create_controller()
+
+        def cancel():
+            controller.kill()
+            raise Exception('Killed.')
+        self.run_backup(controller, cancel)
+        self.assertEqual(constants.STATUS_ERROR, controller.get_status()['status'])
+        self.checkpoint_db.remove_job_checkpoint.assert_called_once_with('job1')
+
+    def test_interrupted_job_keeps_its_checkpoint(self):
+        controller = self.create_controller()
+
+        def interrupt():
+            controller.interrupt()
+            raise Exception('Killed.')
+        self.run_backup(controller, interrupt)
+        self.assertEqual(constants.STATUS_ERROR, controller.get_status()['status'])
+        self.checkpoint_db.remove_job_checkpoint.assert_not_called()
+        self.checkpoint_db.upsert_job_checkpoint.assert_called_with('job1', self.checkpoint.to_dict())
+
+
+class RestorationPreparationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backupset = Backupset._from_json({
+            'id': 'job1',
+            'node': 'node1',
+            'disk_layout': 'MBR',
+            'status': constants.STATUS_FINISHED,
+            'partitions': [{'partition': '1', 'fs': 'ext4', 'size': '1048576'}],
+        })
+        self.image_class = Mock(**{'with_config.side_effect': lambda *args: Mock()})
+        self.layout_class = Mock()
+        for target, value in (('src.core.controller.ConfigHelper.config', {'node': {'name': 'node1',
+                                                                                     'backup_path': '/backups/'}}),
+                              ('src.core.controller.DiskLayout', self.layout_class),
+                              ('src.core.controller.PartitionImage', self.image_class)):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create_controller(self, controller_class, **config):
+        return controller_class('sdb', 'job1', config, {'backupset': self.backupset, 'rates': {}})
+
+    def test_restoration_prepares_its_disk(self):
+        controller = self.create_controller(RestorationController)
+        self.assertEqual(['sdb'], controller.disks)
+        self.assertEqual('/backups/job1/', controller.layout_dir)
+        self.assertEqual(self.layout_class.with_config.return_value, controller._disk_layout)
+        self.assertEqual(controller._checkpoint_partition, controller._imager.partition_callback)
+        self.assertEqual(1048576, controller._status['size'])
+
+    def test_fanout_restoration_prepares_each_target(self):
+        controller = self.create_controller(FanOutRestorationController, targets=['sdc', 'sdb', 'sdd'],
+                                            failed_targets=['sdd'])
+        self.assertEqual(['sdb', 'sdc', 'sdd'], controller.disks)
+        self.assertIsNone(controller._imager)
+        self.assertEqual(['sdb', 'sdc', 'sdd'], [call[0][0] for call in self.image_class.with_config.call_args_list])
+        self.assertEqual({'sdb', 'sdc', 'sdd'}, set(controller._imagers))
+        self.assertEqual({'sdb', 'sdc', 'sdd'}, set(controller._target_progress))
+        self.assertEqual(3 * 1048576, controller._status['size'])
+        self.assertEqual(constants.STATUS_PENDING, controller._status['targets']['sdc']['status'])
+        self.assertEqual(constants.STATUS_ERROR, controller._status['targets']['sdd']['status'])
+
+    @patch('src.core.controller.PipeFanOut')
+    def test_fanout_restoration_spills_to_backup_volume(self, fanout_class):
+        controller = self.create_controller(FanOutRestorationController, targets=['sdc', 'sdb'])
+        controller._read_image = Mock()
+        controller.checkpoint = Mock(completed_partitions=[])
+        controller._restore_partition(self.backupset.partitions[0])
+        self.assertEqual('/backups/', fanout_class.call_args[1]['spill_dir'])
+        self.assertEqual(['sdb', 'sdc'], fanout_class.call_args[0][1])
+
+    def test_fanout_targets_have_to_be_disk_names(self):
+        with self.assertRaisesRegex(Exception, 'The targets option has to be a list'):
+            self.create_controller(FanOutRestorationController, targets='sdc')
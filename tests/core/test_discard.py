@@ -0,0 +1,110 @@
+import os
+import struct
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.core import discard
+from src.core.discard import BlockDevice, PartcloneBitmap
+
+
+def partclone_header(total_blocks, used_blocks, block_size=4096, bitmap_mode=1, magic=b'partclone-image',
+                     blocks_per_checksum=256):
+    return struct.pack('<16s14s4sH16sQQQQIIHHHHIBBI', magic, b'0.3.13', b'0002', 0xC0DE, b'EXTFS',
+                       total_blocks * block_size, total_blocks, used_blocks, used_blocks, block_size,
+                       0, 2, 64, 32, 4, blocks_per_checksum, 1, bitmap_mode, 0)
+
+
+class PartcloneBitmapTest(unittest.TestCase):
+
+    def test_header_is_parsed(self):
+        bitmap = PartcloneBitmap(partclone_header(100, 40))
+        self.assertEqual(110, PartcloneBitmap.HEADER_SIZE)
+        self.assertEqual(100, bitmap.total_blocks)
+        self.assertEqual(40, bitmap.used_blocks)
+        self.assertEqual(4096, bitmap.block_size)
+        self.assertEqual(13, bitmap.bitmap_size)
+
+    def test_unsupported_image_is_rejected(self):
+        with self.assertRaises(discard.ImageException):
+            PartcloneBitmap(partclone_header(100, 40, magic=b'not-an-image'))
+        with self.assertRaises(discard.ImageException):
+            PartcloneBitmap(partclone_header(100, 40, bitmap_mode=0))
+
+    def test_free_ranges_are_merged_across_bytes(self):
+        bitmap = PartcloneBitmap(partclone_header(36, 0, block_size=1))
+        # Blocks 0-2 used, 3-19 free, 20-27 used, 28-33 free, 34 used and 35 free
+        data = bytes([0b00000111, 0x00, 0b11110000, 0b00001111, 0b00000100])
+        self.assertEqual([(3, 17), (28, 6), (35, 1)], list(bitmap.free_ranges(data)))
+
+    def test_free_ranges_in_byte_mode(self):
+        bitmap = PartcloneBitmap(partclone_header(6, 3, block_size=512, bitmap_mode=8))
+        self.assertEqual([(512, 1024), (2560, 512)], list(bitmap.free_ranges(b'\x01\x00\x00\x01\x01\x00')))
+
+    def test_truncated_bitmap_is_rejected(self):
+        bitmap = PartcloneBitmap(partclone_header(100, 40))
+        with self.assertRaises(discard.ImageException):
+            list(bitmap.free_ranges(b'\x00'))
+
+
+    def test_groups_of_blocks_are_checked_across_chunks(self):
+        bitmap = PartcloneBitmap(partclone_header(10, 10, block_size=16, blocks_per_checksum=4))
+        groups = [os.urandom(64), os.urandom(64), os.urandom(32)]
+        for reseed in (True, False):
+            bitmap.reseed_checksum = reseed
+            data, crc = b'', 0
+            for group in groups:
+                crc = discard.zlib.crc32(group, 0 if reseed else crc)
+                data += group + struct.pack('<I', crc ^ 0xFFFFFFFF)
+            self.assertEqual(len(data), bitmap.image_size - bitmap.data_offset)
+            self.assertIsNone(bitmap.find_corrupted_group(data[offset:offset + 7] for offset in range(0, len(data), 7)))
+            corrupted = bytearray(data)
+            corrupted[140] ^= 1
+            self.assertEqual(2, bitmap.find_corrupted_group([bytes(corrupted)]))
+            self.assertEqual(2, bitmap.find_corrupted_group([data[:-1]]))
+
+
+class BlockDeviceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sysfs = tempfile.TemporaryDirectory()
+        os.makedirs(self.sysfs.name + '/sdx/queue')
+
+    def tearDown(self):
+        self.sysfs.cleanup()
+
+    def _set_discard_max_bytes(self, value):
+        with open(self.sysfs.name + '/sdx/queue/discard_max_bytes', 'w') as file:
+            file.write(str(value) + '\n')
+
+    def test_discard_support_is_detected(self):
+        with patch('src.core.discard.constants.SYSFS_BLOCK_PATH', self.sysfs.name + '/'):
+            self.assertEqual(0, discard.get_discard_max_bytes('sdx'))
+            self.assertEqual(discard.ZEROOUT_MODE, BlockDevice('/dev/sdx1', 'sdx').mode)
+            self._set_discard_max_bytes(2147450880)
+            self.assertEqual(discard.DISCARD_MODE, BlockDevice('/dev/sdx1', 'sdx').mode)
+
+    @patch('src.core.discard.close')
+    @patch('src.core.discard.open_device', return_value=7)
+    @patch('src.core.discard.fcntl')
+    def test_ranges_are_split_by_discard_limit(self, fcntl_mock, open_mock, close_mock):
+        self._set_discard_max_bytes(4096)
+        with patch('src.core.discard.constants.SYSFS_BLOCK_PATH', self.sysfs.name + '/'):
+            device = BlockDevice('/dev/sdx1', 'sdx')
+        self.assertEqual(12288, device.release([(0, 10240), (20480, 2048)]))
+        requests = [(call[0][1], struct.unpack('QQ', call[0][2])) for call in fcntl_mock.ioctl.call_args_list]
+        self.assertEqual([(discard.BLKDISCARD, (0, 4096)), (discard.BLKDISCARD, (4096, 4096)),
+                          (discard.BLKDISCARD, (8192, 2048)), (discard.BLKDISCARD, (20480, 2048))], requests)
+        close_mock.assert_called_once_with(7)
+
+    @patch('src.core.discard.close')
+    @patch('src.core.discard.open_device', return_value=7)
+    @patch('src.core.discard.fcntl')
+    def test_zeroout_is_used_without_discard_support(self, fcntl_mock, open_mock, close_mock):
+        with patch('src.core.discard.constants.SYSFS_BLOCK_PATH', self.sysfs.name + '/'):
+            device = BlockDevice('/dev/sdx1', 'sdx')
+        device.release([(0, 4096)])
+        self.assertEqual(discard.BLKZEROOUT, fcntl_mock.ioctl.call_args[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import unittest
+from threading import Thread
+from time import sleep
+from unittest.mock import Mock, patch
+from src.core.fanout import FanOutBranch, PipeFanOut
+
+
+def read_all(reader, result):
+    result.append(b''.join(iter(lambda: reader.read(65536), b'')))
+
+
+@patch('src.core.fanout.constants.REMOTE_CHUNK_SIZE', 4096)
+@patch('src.core.fanout.constants.FANOUT_POLL_INTERVAL', 0.01)
+class PipeFanOutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = os.urandom(1000000)
+        self.chunks = [self.data[offset:offset + 4096] for offset in range(0, len(self.data), 4096)]
+
+    def _read(self, fanout, names):
+        results = {name: [] for name in names}
+        threads = [Thread(target=read_all, args=(fanout.branches[name].reader, results[name])) for name in names]
+        for thread in threads:
+            thread.start()
+        return results, threads
+
+    def test_stream_is_read_once_for_all_targets(self):
+        chunks = iter(self.chunks)
+        fanout = PipeFanOut(chunks, ['sda', 'sdb', 'sdc'], buffer_size=65536)
+        results, threads = self._read(fanout, ['sda', 'sdb', 'sdc'])
+        fanout.start()
+        for thread in threads:
+            thread.join(10)
+        fanout.join(10)
+        self.assertIsNone(next(chunks, None))
+        self.assertEqual(len(self.data), fanout.read)
+        for name in ('sda', 'sdb', 'sdc'):
+            self.assertEqual([self.data], results[name])
+            self.assertEqual(len(self.data), fanout.branches[name].transferred)
+            self.assertIsNone(fanout.branches[name].error)
+
+    def test_exited_target_does_not_block_others(self):
+        fanout = PipeFanOut(iter(self.chunks), ['sda', 'sdb'], buffer_size=65536, stall_timeout=60)
+        fanout.branches['sdb'].reader.close()
+        results, threads = self._read(fanout, ['sda'])
+        fanout.start()
+        threads[0].join(10)
+        fanout.join(10)
+        self.assertEqual([self.data], results['sda'])
+        self.assertTrue(fanout.branches['sdb'].closed.is_set())
+        self.assertIsNone(fanout.branches['sdb'].error)
+
+    def test_stalled_target_is_dropped(self):
+        fanout = PipeFanOut(iter(self.chunks), ['sda', 'sdb'], buffer_size=65536, stall_timeout=0.2)
+        results, threads = self._read(fanout, ['sda'])
+        fanout.start()
+        threads[0].join(10)
+        fanout.join(10)
+        self.assertEqual([self.data], results['sda'])
+        self.assertRegex(str(fanout.branches['sdb'].error), 'fell behind')
+        # The stalled target sees the end of the stream rather than waiting for it forever
+        self.assertLess(len(b''.join(iter(lambda: fanout.branches['sdb'].reader.read(65536), b''))), len(self.data))
+        fanout.close()
+
+    def test_slow_target_does_not_hold_back_others(self):
+        fanout = PipeFanOut(iter(self.chunks), ['sda', 'sdb'], buffer_size=65536, stall_timeout=60)
+        results, threads = self._read(fanout, ['sda'])
+        fanout.start()
+        threads[0].join(10)
+        self.assertEqual([self.data], results['sda'])
+        # The backlog of the target which did not read yet was spilled rather than holding back sda
+        self.assertEqual(len(self.data), fanout.read)
+        slow = []
+        for data in iter(lambda: fanout.branches['sdb'].reader.read(4096), b''):
+            slow.append(data)
+            sleep(0.0001)
+        fanout.join(10)
+        self.assertEqual(self.data, b''.join(slow))
+        self.assertIsNone(fanout.branches['sdb'].error)
+
+    def test_target_falling_behind_beyond_spill_size_is_dropped(self):
+        fanout = PipeFanOut(iter(self.chunks), ['sda', 'sdb'], buffer_size=65536, stall_timeout=60,
+                            spill_size=200000)
+        results, threads = self._read(fanout, ['sda'])
+        fanout.start()
+        threads[0].join(10)
+        fanout.join(10)
+        self.assertEqual([self.data], results['sda'])
+        self.assertRegex(str(fanout.branches['sdb'].error), 'fell behind the other targets, its backlog would exceed the spill size of 200000 bytes')
+        fanout.close()
+
+    @patch('src.core.fanout.constants.FANOUT_SPILL_RESERVE', 1000000)
+    @patch('src.core.fanout.disk_usage', return_value=Mock(free=1002000))
+    def test_target_falling_behind_beyond_free_space_is_dropped(self, disk_usage):
+        branch = FanOutBranch('sdb', 2, 60, 200000, '/backups/')
+        for chunk in self.chunks[:3]:
+            branch.put(chunk)
+        branch.start()
+        branch.join(10)
+        branch.close()
+        disk_usage.assert_called_once_with('/backups/')
+        self.assertRegex(str(branch.error), 'fell behind the other targets, the free space of /backups/ is too low')
+
+    def test_read_error_is_reported_by_all_targets(self):
+        def failing_chunks():
+            yield self.chunks[0]
+            raise ConnectionError('Connection dropped by the test.')
+        fanout = PipeFanOut(failing_chunks(), ['sda', 'sdb'], buffer_size=65536)
+        results, threads = self._read(fanout, ['sda', 'sdb'])
+        fanout.start()
+        for thread in threads:
+            thread.join(10)
+        fanout.join(10)
+        for name in ('sda', 'sdb'):
+            self.assertIsInstance(fanout.branches[name].error, ConnectionError)
+            self.assertTrue(self.chunks[0].startswith(results[name][0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
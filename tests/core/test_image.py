@@ -1,7 +1,11 @@
+import os
+import shlex
+import tempfile
 import unittest
 from unittest.mock import Mock, patch
 from src.core.backupset import Backupset
 import src.core.image as image
+from src.core.runcommand import Execute
 import src.constants as constants
 
 
@@ -141,6 +145,53 @@ class ImageTest(unittest.TestCase):
         self.assertTrue('-c' in command)
         self.assertFalse('-r' in command)
 
+    def test_command_with_compression(self):
+        self.clone.config['compress'] = True
+        self.clone._current_image_file = '/tmp/img 1/part1.img'
+        command = self.clone._command_with_compression('/dev/sdxx1', self.clone._current_image_file, self.fs)
+        self.assertEqual(['mksquashfs', '/dev/null', '/tmp/img 1/part1.sqfs', '-noappend', '-no-progress', '-p'],
+                         command[:6])
+        definition, pseudo_command = command[6].split(' root root ', 1)
+        self.assertEqual('/part1.img f 444', definition)
+        self.assertEqual(['bash', '-o', 'pipefail', '-c',
+                          "partclone.ntfs -f 5 -s /dev/sdxx1 -o - -c | tee '/tmp/img 1/.part1.img.fifo'"],
+                         shlex.split(pseudo_command))
+
+    def test_failure_of_partclone_fails_the_pseudo_file_command(self):
+        with tempfile.TemporaryDirectory(suffix=' img') as directory:
+            self.clone.config['compress'] = True
+            self.clone._current_image_file = directory + '/part1.img'
+            for backup_command, exit_code in ((['false'], 1), (['echo', 'image'], 0)):
+                with patch.object(self.clone, '_backup_command', return_value=backup_command):
+                    command = self.clone._command_with_compression('/dev/sdxx1', self.clone._current_image_file,
+                                                                   self.fs)
+                pseudo_command = command[6].split(' root root ', 1)[1]
+                self.assertEqual(exit_code, Execute(['sh', '-c', pseudo_command]).run())
+            with open(directory + '/.part1.img.fifo') as teed:
+                self.assertEqual('image\n', teed.read())
+
+    @patch('src.core.image.cpu_count')
+    def test_command_with_decompression(self, cpu_mock):
+        cpu_mock.return_value = 4
+        command = self.clone._command_with_decompression('/tmp/img 1/part1.img', '/dev/sdxx1', self.fs)
+        self.assertEqual([['unsquashfs', '-cat', '-processors', '4', '/tmp/img 1/part1.sqfs', 'part1.img'],
+                          ['partclone.ntfs', '-f', '5', '-s', '-', '-o', '/dev/sdxx1', '-r']], command)
+
+    def test_failure_of_any_command_fails_the_pipeline(self):
+        self.assertNotEqual(0, Execute(image.shell_pipeline(['false'], ['cat'])).run())
+        self.assertEqual(0, Execute(image.shell_pipeline(['echo', "it's"], ['cat'])).run())
+
+    def test_compressed_file_replaces_the_suffix_only(self):
+        self.assertEqual('/backups/img1/part1.sqfs', image.get_compressed_file('/backups/img1/part1.img'))
+
+    def test_streams_compressed_images(self):
+        self.assertFalse(self.clone.streams_compressed_images())
+        backupset = Backupset._from_json(dict(self.BACKUPSET_MOCK_VALUES, compressed=True))
+        clone = image.PartitionImage('sdxx', '/tmp/', backupset, stream=True)
+        self.assertTrue(clone.streams_compressed_images())
+        clone.config['stream'] = False
+        self.assertFalse(clone.streams_compressed_images())
+
     def test_restore_command(self):
         command = self.clone._restore_command(self.source, self.target, self.fs)
         self.assertTrue('-r' in command)
@@ -164,6 +215,81 @@ class ImageTest(unittest.TestCase):
         self.assertEqual(1, exec_class.call_count)
         self.assertEqual(constants.STATUS_FINISHED, self.clone._get_partition_status('sdxx1')['status'])
 
+    @patch('src.core.image.path')
+    @patch('src.core.image.Execute')
+    def test_backup_checkpoints_each_partition(self, exec_class, path_mock):
+        exec_class.return_value.poll.return_value = 0
+        path_mock.exists.return_value = True
+        callback = Mock()
+        self.clone.partition_callback = callback
+        self.clone.backup()
+        callback.assert_called_once_with(self.BACKUPSET.partitions[0])
+        self.assertEqual({'1'}, self.clone.completed_partitions)
+
+    @patch('src.core.image.Execute')
+    def test_backup_stores_image_checksum(self, exec_class):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        open(directory.name + '/sdxx1', 'w').close()
+        data = os.urandom(100000)
+
+        def write_image():
+            with open(directory.name + '/part1.img', 'wb') as image_file:
+                image_file.write(data)
+        exec_class.return_value.run.side_effect = write_image
+        exec_class.return_value.poll.return_value = 0
+        backupset = Backupset._from_json(self.BACKUPSET_MOCK_VALUES)
+        clone = image.PartitionImage('sdxx', directory.name + '/', backupset)
+        with patch.object(image.PartitionImage, 'DEVICE_PATH', directory.name + '/'):
+            clone.backup()
+        checksum = backupset.partitions[0].checksum
+        self.assertEqual(len(data), checksum['size'])
+        self.assertEqual(checksum['checksum'], clone._get_partition_status('sdxx1')['checksum'])
+
+    @patch('src.core.image.Execute')
+    def test_overwritten_image_is_removed_before_hashing(self, exec_class):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        open(directory.name + '/sdxx1', 'w').close()
+        with open(directory.name + '/part1.img', 'wb') as image_file:
+            image_file.write(os.urandom(300000))
+        data = os.urandom(100000)
+        existed = []
+
+        def write_image():
+            existed.append(os.path.exists(directory.name + '/part1.img'))
+            with open(directory.name + '/part1.img', 'wb') as image_file:
+                image_file.write(data)
+        exec_class.return_value.run.side_effect = write_image
+        exec_class.return_value.poll.return_value = 0
+        backupset = Backupset._from_json(self.BACKUPSET_MOCK_VALUES)
+        clone = image.PartitionImage('sdxx', directory.name + '/', backupset, overwrite=True)
+        with patch.object(image.PartitionImage, 'DEVICE_PATH', directory.name + '/'):
+            clone.backup()
+        self.assertEqual([False], existed)
+        self.assertEqual(len(data), backupset.partitions[0].checksum['size'])
+
+    @patch('src.core.image.Execute')
+    def test_completed_partitions_are_skipped(self, exec_class):
+        self.clone.completed_partitions = {'1'}
+        self.clone.backup()
+        self.clone.restore()
+        self.assertEqual(0, exec_class.call_count)
+        self.assertEqual(constants.STATUS_FINISHED, self.clone._get_partition_status('sdxx1')['status'])
+        self.assertEqual('100', self.clone._get_partition_status('sdxx1')['completed'])
+
+    def test_incomplete_images_are_removed_with_their_compressed_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backupset = Backupset._from_json(dict(self.BACKUPSET_MOCK_VALUES, partitions=[
+                {'partition': '1', 'fs': 'vfat', 'size': '1048576'},
+                {'partition': '2', 'fs': 'ext4', 'size': '4050649088'}]))
+            clone = image.PartitionImage('sdxx', directory + '/', backupset)
+            clone.completed_partitions = {'1'}
+            for name in ('part1.img', 'part1.sqfs', 'part2.img', 'part2.sqfs', 'ptable.img'):
+                open(os.path.join(directory, name), 'w').close()
+            clone.remove_incomplete_images()
+            self.assertEqual(['part1.img', 'part1.sqfs', 'ptable.img'], sorted(os.listdir(directory)))
+
     @patch('src.core.image.Execute')
     def test_backup_raises_on_error(self, execute_mock):
         runner = Mock()
@@ -187,6 +313,48 @@ class ImageTest(unittest.TestCase):
             self.assertEqual('error', self.clone._status['sdxx1']['status'])
             self.assertFalse(self.clone._update_status.called)
 
+    @patch('src.core.image.path')
+    @patch('src.core.image.PipeFeeder')
+    @patch('src.core.image.Execute')
+    def test_remote_image_is_piped_into_partclone(self, exec_class, feeder_class, path_mock):
+        exec_class.return_value.poll.return_value = 0
+        path_mock.exists.return_value = True
+        path_mock.basename.return_value = 'part1.img'
+        feeder_class.return_value.error = None
+        self.clone.remote = Mock()
+        self.clone.restore()
+        feeder_class.assert_called_once_with(self.clone.remote, 'part1.img')
+        command = exec_class.call_args[0][0]
+        self.assertEqual('-', command[command.index('-s') + 1])
+        self.assertEqual(feeder_class.return_value.reader, exec_class.call_args[1]['stdin'])
+        feeder_class.return_value.start.assert_called_once_with()
+        feeder_class.return_value.close.assert_called_once_with()
+
+    @patch('src.core.image.path')
+    @patch('src.core.image.PipeFeeder')
+    @patch('src.core.image.Execute')
+    def test_remote_transfer_error_is_reported(self, exec_class, feeder_class, path_mock):
+        exec_class.return_value.poll.return_value = 1
+        path_mock.exists.return_value = True
+        feeder_class.return_value.error = Exception('Connection refused')
+        self.clone.remote = Mock()
+        with self.assertRaisesRegex(Exception, 'Connection refused'):
+            self.clone.restore()
+
+    @patch('src.core.image.path')
+    @patch('src.core.image.Execute')
+    def test_fanned_out_image_is_piped_into_partclone(self, exec_class, path_mock):
+        exec_class.return_value.poll.return_value = 0
+        path_mock.exists.return_value = True
+        feeder = Mock(error=None)
+        self.clone.restore_partition(self.BACKUPSET.partitions[0], feeder)
+        command = exec_class.call_args[0][0]
+        self.assertEqual('-', command[command.index('-s') + 1])
+        self.assertEqual('/dev/sdxx1', command[command.index('-o') + 1])
+        self.assertEqual(feeder.reader, exec_class.call_args[1]['stdin'])
+        feeder.close.assert_called_once_with()
+        self.assertEqual({'1'}, self.clone.completed_partitions)
+
     # TODO: Write new image restoration test.
     # def test_restore(self):
     #     with self.assertRaises(NotImplementedError):
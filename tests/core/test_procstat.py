@@ -0,0 +1,42 @@
+import subprocess
+import unittest
+from unittest.mock import mock_open, patch
+from src.core.procstat import ProcessTreeMonitor, _read_io, _read_peak_rss, _read_stat
+
+
+class ProcessTreeMonitorTest(unittest.TestCase):
+    STAT = '1234 (partclone.ext4 (x)) S 1000 1234 1234 0 -1 4194304 100 0 0 0 ' \
+           '250 50 0 0 20 0 1 0 987654 10485760 300 18446744073709551615'
+    IO = 'rchar: 4096\nwchar: 2048\nsyscr: 10\nsyscw: 5\nread_bytes: 1024\n' \
+         'write_bytes: 512\ncancelled_write_bytes: 0\n'
+
+    def test_read_stat(self):
+        with patch('src.core.procstat.open', mock_open(read_data=self.STAT), create=True):
+            stat = _read_stat('/proc/1234/stat')
+        self.assertEqual({'ppid': 1000, 'utime': 250, 'stime': 50, 'starttime': 987654,
+                          'rss': 300}, stat)
+
+    def test_read_io(self):
+        with patch('src.core.procstat.open', mock_open(read_data=self.IO), create=True):
+            self.assertEqual({'read_bytes': 1024, 'write_bytes': 512}, _read_io('/proc/1234/io'))
+
+    def test_read_peak_rss(self):
+        data = 'Name:\tpartclone\nVmPeak:\t  2048 kB\nVmHWM:\t  1024 kB\n'
+        with patch('src.core.procstat.open', mock_open(read_data=data), create=True):
+            self.assertEqual(1048576, _read_peak_rss('/proc/1234/status'))
+
+    def test_counters_of_exited_processes_are_kept(self):
+        monitor = ProcessTreeMonitor(1, 1)
+        monitor._find_process_tree = lambda: []
+        monitor._processes = {(5, 1): {'read_bytes': 10, 'write_bytes': 20, 'cpu_seconds': 1.5}}
+        monitor.sample()
+        self.assertEqual(10, monitor.get_resources()['read_bytes'])
+        self.assertEqual(1.5, monitor.get_resources()['cpu_seconds'])
+
+    def test_monitor_follows_child_processes(self):
+        process = subprocess.Popen('sleep 1 & sleep 1; wait', shell=True)
+        monitor = ProcessTreeMonitor(process.pid, 0.1)
+        monitor.start()
+        process.wait()
+        monitor.stop()
+        self.assertTrue(monitor.get_resources()['processes'] >= 2)
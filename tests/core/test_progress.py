@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import Mock
+from src.core.backupset import Partition
+from src.core.controller import RestorationController
+from src.core.progress import JobProgress, _to_seconds
+
+GB = 1000000000
+
+
+def status(name, state, completed='0', elapsed='00:00:00'):
+    return {'name': name, 'status': state, 'completed': completed, 'elapsed': elapsed}
+
+
+class JobProgressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.progress = JobProgress([('sda1', GB, 'ntfs'), ('sda2', 3 * GB, 'ext4')],
+                                    {'ext4': GB / 100}, smoothing_time=30)
+
+    def test_completion_is_weighted_by_partition_size(self):
+        result = self.progress.update([status('sda1', 'finished', '100', '00:01:40'),
+                                       status('sda2', 'running', '50', '00:02:30')])
+        self.assertEqual(62.5, result['completed'])
+
+    def test_pending_partitions_use_historical_rates(self):
+        result = self.progress.update([status('sda1', 'running', '50', '00:00:50'),
+                                       status('sda2', 'pending')])
+        self.assertEqual(12.5, result['completed'])
+        self.assertEqual(50 + 300, result['remaining_seconds'])
+
+    def test_sizes_reported_as_strings_are_accepted(self):
+        progress = JobProgress([('sda1', '4051668992', 'vfat'), ('sda2', None, 'raw')])
+        result = progress.update([status('sda1', 'running', '25', '00:00:10'), status('sda2', 'pending')])
+        self.assertEqual(25.0, result['completed'])
+
+    def test_job_progress_is_built_from_backupset_with_string_sizes(self):
+        controller = RestorationController.__new__(RestorationController)
+        controller.disk = 'sda'
+        controller.backupset = Mock(partitions=[Partition.from_json({'partition': '1', 'fs': 'vfat',
+                                                                          'size': '4051668992'})])
+        controller.prefetched = {'rates': {}}
+        controller._status = {}
+        controller._init_progress()
+        self.assertEqual(4051668992, controller._status['size'])
+        self.assertEqual(50.0, controller._progress.update([status('sda1', 'running', '50')])['completed'])
+
+    def test_unknown_throughput_gives_no_estimate(self):
+        progress = JobProgress([('sda1', GB, 'ntfs')])
+        result = progress.update([status('sda1', 'running')])
+        self.assertEqual(0.0, result['completed'])
+        self.assertIsNone(result['remaining_seconds'])
+
+    def test_throughput_is_smoothed(self):
+        self.progress.update([status('sda1', 'running', '10', '00:00:10')])
+        self.progress.update([status('sda1', 'running', '40', '00:00:20')])
+        rate = self.progress.get_rates()['sda1']
+        self.assertGreater(rate, GB / 100)
+        self.assertLess(rate, 3 * GB / 100)
+
+    def test_finished_partition_records_average_rate(self):
+        self.progress.update([status('sda1', 'running', '10', '00:00:10')])
+        self.progress.update([status('sda1', 'finished', '100', '00:00:50')])
+        self.assertEqual(GB / 50, self.progress.get_rates()['sda1'])
+
+    def test_to_seconds(self):
+        self.assertEqual(3723, _to_seconds('01:02:03'))
+        self.assertEqual(0, _to_seconds('n/a'))
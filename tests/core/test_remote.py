@@ -0,0 +1,146 @@
+import os
+import tempfile
+import unittest
+import zlib
+from threading import Thread
+from unittest.mock import Mock, patch
+from flask import Flask
+from flask_restful import Api
+from werkzeug.serving import make_server
+from src.api.resources.source import BackupSource
+from src.core.remote import ImageSource, PipeFeeder, RemoteBackup, connect_to_node, parse_node_url
+
+
+class _BreakingMiddleware:
+    """Drops the connection of the first image response after the given number of bytes."""
+    def __init__(self, app, limit):
+        self.app = app
+        self.limit = limit
+        self.requests = []
+
+    def __call__(self, environ, start_response):
+        self.requests.append(environ.get('HTTP_RANGE'))
+        body = self.app(environ, start_response)
+        if len(self.requests) > 1 or not environ['PATH_INFO'].endswith('.img'):
+            return body
+        return self._break(body)
+
+    def _break(self, body):
+        sent = 0
+        for chunk in body:
+            yield chunk
+            sent += len(chunk)
+            if sent >= self.limit:
+                raise ConnectionError('Connection dropped by the test.')
+
+
+@patch('src.core.remote.constants.REMOTE_CHUNK_SIZE', 4096)
+@patch('src.core.remote.constants.REMOTE_RETRY_DELAY', 0)
+class RemoteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.backup_path = self.directory.name + '/backup1/'
+        os.mkdir(self.backup_path)
+        self.data = os.urandom(100000)
+        with open(self.backup_path + 'part1.img', 'wb') as image:
+            image.write(self.data)
+        with open(self.backup_path + 'ptable.bak', 'wb') as table:
+            table.write(b'table')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _serve(self, limit=None):
+        app = Flask(__name__)
+        Api(app).add_resource(BackupSource, '/api/backup/<backup_id>/source',
+                              '/api/backup/<backup_id>/source/<file_name>')
+        wsgi_app = _BreakingMiddleware(app.wsgi_app, limit) if limit else app.wsgi_app
+        server = make_server('127.0.0.1', 0, wsgi_app, threaded=True)
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        backupset = Mock(id='backup1', node='node1')
+        backupset.is_stored_on.return_value = True
+        config = {'node': {'name': 'node1', 'backup_path': self.directory.name + '/'}}
+        for target, value in (('Backupset.load', Mock(return_value=backupset)),
+                              ('ConfigHelper.config', config)):
+            patcher = patch('src.api.resources.source.' + target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return 'http://127.0.0.1:' + str(server.server_port), wsgi_app
+
+    def test_range_is_read_from_image(self):
+        source = ImageSource(self.backup_path)
+        self.assertEqual(self.data[5000:9000], b''.join(source.read('part1.img', 5000, 9000)))
+        self.assertEqual(self.data[99000:], b''.join(source.read('part1.img', 99000)))
+
+    def test_range_is_compressed_on_the_fly(self):
+        source = ImageSource(self.backup_path)
+        compressed = b''.join(source.read('part1.img', 1000, compression='gzip'))
+        self.assertEqual(self.data[1000:], zlib.decompress(compressed, 16 + zlib.MAX_WBITS))
+
+    def test_files_outside_of_backup_are_rejected(self):
+        source = ImageSource(self.backup_path)
+        with self.assertRaises(Exception):
+            source.get_size('../part1.img')
+
+    def test_files_are_listed(self):
+        url, _ = self._serve()
+        files = RemoteBackup(url, 'backup1').list_files()
+        self.assertEqual([{'name': 'part1.img', 'size': 100000}, {'name': 'ptable.bak', 'size': 5}], files)
+
+    def test_broken_transfer_is_resumed_with_range(self):
+        url, app = self._serve(limit=20000)
+        content = b''.join(RemoteBackup(url, 'backup1').iter_content('part1.img'))
+        self.assertEqual(self.data, content)
+        self.assertEqual(2, len(app.requests))
+        self.assertTrue(app.requests[1].startswith('bytes='))
+        self.assertNotEqual('bytes=0-', app.requests[1])
+
+    def test_broken_compressed_transfer_is_resumed(self):
+        url, app = self._serve(limit=20000)
+        content = b''.join(RemoteBackup(url, 'backup1', compression=True).iter_content('part1.img'))
+        self.assertEqual(self.data, content)
+        self.assertEqual(2, len(app.requests))
+
+    def test_missing_file_is_not_retried(self):
+        url, _ = self._serve()
+        with self.assertRaises(Exception):
+            list(RemoteBackup(url, 'backup1').iter_content('part9.img'))
+
+    def test_image_is_fed_into_pipe(self):
+        url, _ = self._serve(limit=20000)
+        feeder = PipeFeeder(RemoteBackup(url, 'backup1'), 'part1.img')
+        feeder.start()
+        content = feeder.reader.read(len(self.data) + 1)
+        while len(content) < len(self.data):
+            chunk = feeder.reader.read(len(self.data))
+            if not chunk:
+                break
+            content += chunk
+        feeder.close()
+        feeder.join()
+        self.assertEqual(self.data, content)
+        self.assertIsNone(feeder.error)
+        self.assertEqual(len(self.data), feeder.transferred)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class NodeUrlTest(unittest.TestCase):
+
+    def test_connection_class_follows_the_scheme(self):
+        connection = connect_to_node(parse_node_url('https://node2.example.com'), 5)
+        self.assertEqual('HTTPSConnection', type(connection).__name__)
+        self.assertEqual(443, connection.port)
+        connection = connect_to_node(parse_node_url('http://10.0.0.2:5000'), 5)
+        self.assertEqual('HTTPConnection', type(connection).__name__)
+        self.assertEqual(5000, connection.port)
+
+    def test_other_schemes_are_rejected(self):
+        with self.assertRaisesRegex(Exception, 'is not a valid http or https URL'):
+            RemoteBackup('ftp://10.0.0.2', 'backup1')
+        with self.assertRaisesRegex(Exception, 'is not a valid http or https URL'):
+            parse_node_url('10.0.0.2:5000')
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from threading import Thread
+from unittest.mock import Mock, patch
+from flask import Flask
+from flask_restful import Api
+from werkzeug.serving import make_server
+from src.api.resources.replica import Replica, ReplicaFile
+from src.core.backupset import Backupset
+from src.core.replication import ReplicationLink, Replicator, file_checksum
+
+
+@patch('src.core.replication.constants.REMOTE_CHUNK_SIZE', 4096)
+@patch('src.core.replication.constants.REMOTE_RETRY_DELAY', 0)
+@patch('src.core.replication.DB')
+class ReplicationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.source = tempfile.TemporaryDirectory()
+        self.target = tempfile.TemporaryDirectory()
+        self.backupset = Backupset('backup1')
+        self.backupset.node = 'node1'
+        self.backupset.backup_size = 4096
+        self.backupset.backup_path = self.source.name + '/backup1/'
+        os.mkdir(self.backupset.backup_path)
+        self.files = {'part1.img': os.urandom(50000), 'part2.img': os.urandom(30000), 'ptable.bak': b'table'}
+        for name, content in self.files.items():
+            with open(self.backupset.backup_path + name, 'wb') as file:
+                file.write(content)
+        self.backupset.write_manifest()
+        self.receiver_db = Mock()
+        self.receiver_db.get_backup.return_value = self.backupset.to_dict()
+        self.usage = Mock()
+        self.url = self._serve()
+
+    def tearDown(self):
+        self.source.cleanup()
+        self.target.cleanup()
+
+    def _serve(self):
+        app = Flask(__name__)
+        api = Api(app)
+        api.add_resource(Replica, '/api/replica/<backup_id>')
+        api.add_resource(ReplicaFile, '/api/replica/<backup_id>/<file_name>')
+        server = make_server('127.0.0.1', 0, app.wsgi_app, threaded=True)
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        config = {'node': {'name': 'node2', 'backup_path': self.target.name + '/'}}
+        for target, value in (('DB', self.receiver_db), ('NodeUsage', self.usage),
+                              ('ConfigHelper.config', config),
+                              ('Backupset.load', Mock(return_value=self.backupset))):
+            patcher = patch('src.api.resources.replica.' + target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return 'http://127.0.0.1:' + str(server.server_port)
+
+    def test_backup_is_replicated_and_committed(self, db_mock):
+        link = ReplicationLink('node2', self.url, streams=2)
+        Replicator.replicate(self.backupset, link)
+        for name, content in self.files.items():
+            with open(self.target.name + '/backup1/' + name, 'rb') as file:
+                self.assertEqual(content, file.read())
+        self.assertTrue(os.path.exists(self.target.name + '/backup1/backupset.cfg'))
+        self.receiver_db.add_backup_replica.assert_called_once_with('backup1', 'node2')
+        self.usage.add.assert_called_once_with(4096)
+        progress = db_mock.upsert_replication.call_args[0][2]
+        self.assertEqual('finished', progress['status'])
+        self.assertEqual(sum(os.path.getsize(self.backupset.backup_path + name)
+                             for name in os.listdir(self.backupset.backup_path)), progress['transferred'])
+        self.assertEqual('backupset.cfg', progress['files'][-1])
+
+    def test_corrupted_file_is_rejected_by_receiver(self, db_mock):
+        link = ReplicationLink('node2', self.url)
+        with patch('src.core.replication.file_checksum', return_value='0' * 128), \
+                patch('src.core.replication.constants.REMOTE_RETRIES', 1):
+            with self.assertRaises(Exception):
+                Replicator.replicate(self.backupset, link)
+        self.assertEqual([], os.listdir(self.target.name + '/backup1/'))
+        self.receiver_db.add_backup_replica.assert_not_called()
+        self.assertEqual('error', db_mock.upsert_replication.call_args[0][2]['status'])
+
+    def test_original_backup_is_not_overwritten(self, db_mock):
+        self.receiver_db.get_backup.return_value = dict(self.backupset.to_dict(), node='node2')
+        link = ReplicationLink('node2', self.url)
+        with self.assertRaises(Exception):
+            Replicator.replicate(self.backupset, link)
+        self.assertFalse(os.path.exists(self.target.name + '/backup1'))
+
+    def test_checksum(self, db_mock):
+        self.assertEqual(128, len(file_checksum(self.backupset.backup_path + 'part1.img')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import os
 import unittest
 from errno import EIO
 from unittest.mock import Mock, patch, mock_open
@@ -57,6 +58,17 @@ class RunCommandTest(unittest.TestCase):
         execute.run()
         parser.parse.assert_called_with('test\n')
 
+    def test_resources_are_tracked(self):
+        execute = Execute(['echo', 'test'], use_pty=True, track_resources=True)
+        self.assertEqual(None, execute.resources())
+        execute.run()
+        self.assertEqual(1, execute.resources()['processes'])
+
+    def test_resources_are_not_tracked_by_default(self):
+        execute = Execute(['echo', 'test'])
+        execute.run()
+        self.assertEqual(None, execute.resources())
+
     def test_poll_process(self):
         execute = Execute(['echo'])
         self.assertEqual(-1, execute.poll())  # process never started
@@ -80,6 +92,20 @@ class RunCommandTest(unittest.TestCase):
         with self.assertRaises(IOError):
             execute.run()
 
+    @patch('src.core.runcommand.ProcessTreeMonitor')
+    @patch('src.core.runcommand.os')
+    def test_parser_error_releases_pty_and_monitor(self, mock_os, monitor_class):
+        mock_os.read.return_value = b'error'
+        parser = Mock()
+        parser.parse.side_effect = Exception('An unknown error was caused by imaging software.')
+        execute = Execute(['sleep', '10'], parser, use_pty=True, track_resources=True)
+        with self.assertRaises(Exception):
+            execute.run()
+        master_fd = mock_os.read.call_args[0][0]
+        mock_os.close.assert_any_call(master_fd)
+        monitor_class.return_value.stop.assert_called_once_with()
+        self.assertNotEqual(None, execute.poll())
+
     @patch('src.core.runcommand.os')
     def test_exit_process_when_no_more_output_is_generated(self, mock_os):
         mock_os.read.return_value = ""
@@ -88,6 +114,27 @@ class RunCommandTest(unittest.TestCase):
         self.assertTrue(mock_os.close.called)
         self.assertNotEqual(None, execute.poll())
 
+    def test_pipeline_fails_with_the_last_failed_command(self):
+        self.assertEqual(1, Execute([['false'], ['cat']]).run())
+        self.assertEqual(2, Execute([['sh', '-c', 'exit 3'], ['sh', '-c', 'exit 2'], ['cat']]).run())
+        execute = Execute([['echo', 'helpers'], ['cat']], use_pty=True)
+        self.assertEqual(0, execute.run())
+        self.assertIn('helpers', execute.output())
+
+    def test_killed_pipeline_leaves_no_command_running(self):
+        execute = Execute([['sleep', '47'], ['cat']], use_pty=True, track_resources=True)
+        t = Thread(target=execute.run)
+        t.start()
+        while len(execute.processes) < 2:
+            sleep(0.01)
+        self.assertEqual(Execute.PROCESS_KILLED, execute.kill())
+        t.join(5)
+        self.assertFalse(t.is_alive())
+        for process in execute.processes:
+            self.assertIsNotNone(process.poll())
+            with self.assertRaises(ProcessLookupError):
+                os.kill(process.pid, 0)
+
 
 class OutputParserTest(unittest.TestCase):
 
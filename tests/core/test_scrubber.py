@@ -0,0 +1,133 @@
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+from unittest.mock import Mock, patch
+from src.core.backupset import Partition
+from src.core.checksum import SegmentHasher
+from src.core.scrubber import ScrubBudget, Scrubber, check_backup
+import src.constants as constants
+from tests.core.test_discard import partclone_header
+
+
+def partclone_image(total_blocks=64, block_size=512, blocks_per_checksum=16):
+    """Builds a partclone image with all blocks used and the crc32 of its header, its bitmap and
+    each group of blocks calculated the way partclone does."""
+    header = partclone_header(total_blocks, total_blocks, block_size=block_size,
+                              blocks_per_checksum=blocks_per_checksum)[:-4]
+    header += struct.pack('<I', zlib.crc32(header) ^ 0xFFFFFFFF)
+    bitmap = b'\xff' * (total_blocks // 8)
+    image = header + bitmap + struct.pack('<I', zlib.crc32(bitmap) ^ 0xFFFFFFFF)
+    for block in range(0, total_blocks, blocks_per_checksum):
+        blocks = os.urandom(min(blocks_per_checksum, total_blocks - block) * block_size)
+        image += blocks + struct.pack('<I', zlib.crc32(blocks) ^ 0xFFFFFFFF)
+    return image
+
+
+class ScrubberTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.backup_path = self.directory.name + '/'
+        self.image = partclone_image()
+        self._write(self.image)
+        self.partition = Partition('1', 'ext4', 0)
+        self.backupset = Mock(id='backup1', partitions=[self.partition])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write(self, data):
+        with open(self.backup_path + 'part1.img', 'wb') as image:
+            image.write(data)
+
+    def _corrupt(self, offset):
+        corrupted = bytearray(self.image)
+        corrupted[offset] ^= 0xff
+        self._write(bytes(corrupted))
+
+    def _add_checksum(self):
+        hasher = SegmentHasher(4096)
+        hasher.update(self.image)
+        self.partition.checksum = hasher.result()
+
+    def test_image_matches_checksum(self):
+        self._add_checksum()
+        result = check_backup(self.backupset, self.backup_path)
+        self.assertEqual(constants.SCRUB_OK, result['status'])
+        self.assertEqual('checksum', result['partitions'][0]['method'])
+
+    def test_corrupted_image_does_not_match_checksum(self):
+        self._add_checksum()
+        self._corrupt(len(self.image) - 1)
+        result = check_backup(self.backupset, self.backup_path)
+        self.assertEqual(constants.SCRUB_MISMATCH, result['status'])
+        self.assertEqual({'segment': 8, 'offset': 8 * 4096}, result['partitions'][0]['mismatch'])
+
+    def test_image_without_checksum_is_checked_by_crc(self):
+        result = check_backup(self.backupset, self.backup_path)
+        self.assertEqual(constants.SCRUB_OK, result['status'])
+        self.assertEqual('header', result['partitions'][0]['method'])
+
+    def test_corrupted_header_and_bitmap_are_found(self):
+        for offset in (40, 110):
+            self._corrupt(offset)
+            result = check_backup(self.backupset, self.backup_path)
+            self.assertEqual(constants.SCRUB_MISMATCH, result['status'])
+            self.assertIn('crc32', result['partitions'][0]['mismatch']['reason'])
+
+    def test_corrupted_blocks_are_found_by_crc(self):
+        group_size = 16 * 512 + 4
+        data_offset = 110 + 8 + 4
+        for group in (0, 2, 3):
+            self._corrupt(data_offset + group * group_size + 100)
+            result = check_backup(self.backupset, self.backup_path)
+            self.assertEqual(constants.SCRUB_MISMATCH, result['status'])
+            self.assertEqual({'offset': data_offset + group * group_size,
+                              'reason': 'The crc32 of the image blocks does not match.'},
+                             result['partitions'][0]['mismatch'])
+
+    def test_data_of_image_without_checksum_is_read_within_budget(self):
+        budget = Mock()
+        self.assertEqual(constants.SCRUB_OK, check_backup(self.backupset, self.backup_path, budget)['status'])
+        self.assertEqual(len(self.image), sum(call[0][0] for call in budget.consume.call_args_list))
+
+    def test_truncated_and_missing_images_are_found(self):
+        self._write(self.image[:-1])
+        self.assertIn('expected_size', check_backup(self.backupset, self.backup_path)['partitions'][0]['mismatch'])
+        os.remove(self.backup_path + 'part1.img')
+        self.assertEqual(constants.SCRUB_MISMATCH, check_backup(self.backupset, self.backup_path)['status'])
+
+    @patch('src.core.scrubber.constants.SCRUB_IDLE_CHECK_INTERVAL', 0.01)
+    def test_budget_waits_for_idle_node(self):
+        is_idle = Mock(side_effect=[False, False, True])
+        ScrubBudget(0, is_idle).consume(100)
+        self.assertEqual(3, is_idle.call_count)
+        busy = Mock(return_value=False)
+        ScrubBudget(0, busy, max_wait=0.05).consume(100)
+        self.assertLess(busy.call_count, 10)
+
+    @patch('src.core.scrubber.DB')
+    def test_scrub_result_is_recorded(self, db_mock):
+        self._add_checksum()
+        config = {'node': {'name': 'node1', 'backup_path': self.directory.name + '/backups/'}}
+        os.makedirs(config['node']['backup_path'] + 'backup1')
+        os.rename(self.backup_path + 'part1.img', config['node']['backup_path'] + 'backup1/part1.img')
+        with patch('src.core.scrubber.ConfigHelper.config', config):
+            result = Scrubber.scrub(self.backupset)
+        self.assertEqual(constants.SCRUB_OK, result['status'])
+        db_mock.set_backup_scrub.assert_called_once_with('backup1', 'node1', result)
+        self.assertIn('date', result)
+
+    def test_idle_state_follows_metrics(self):
+        Scrubber.monitor = Mock()
+        self.addCleanup(setattr, Scrubber, 'monitor', None)
+        Scrubber.monitor.get_metrics.return_value = {'CPU_Utilisation': 5.0, 'Disk_IO_Utilisation': 10.0}
+        self.assertTrue(Scrubber.is_idle())
+        Scrubber.monitor.get_metrics.return_value = {'CPU_Utilisation': 5.0, 'Disk_IO_Utilisation': 90.0}
+        self.assertFalse(Scrubber.is_idle())
+
+
+if __name__ == '__main__':
+    unittest.main()
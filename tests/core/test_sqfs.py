@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import Mock, patch
+from src.core.backupset import Backupset
+from src.core.sqfs import SquashfsWrapper, MountException
+
+
+@patch('src.core.sqfs.rmtree')
+@patch('src.core.sqfs.rmdir')
+@patch('src.core.sqfs.remove')
+@patch('src.core.sqfs.symlink')
+@patch('src.core.sqfs.create_dir')
+@patch('src.core.sqfs.path')
+@patch('src.core.sqfs.Execute')
+class SquashfsWrapperTest(unittest.TestCase):
+    BACKUPSET = Backupset._from_json({
+        'id': 'sdxx',
+        'compressed': True,
+        'partitions': [{'partition': '1', 'fs': 'vfat', 'size': '4051668992'},
+                       {'partition': '2', 'fs': 'ext4', 'size': '4051668992'}],
+    })
+
+    def setUp(self):
+        self.wrapper = SquashfsWrapper(self.BACKUPSET)
+
+    def test_partition_is_mounted_only_once(self, exec_class, path_mock, *mocks):
+        exec_class.return_value.run.return_value = 0
+        partition = self.BACKUPSET.partitions[0]
+        self.wrapper.mount_partition(partition)
+        self.wrapper.mount_partition(partition)
+        self.assertEqual(1, exec_class.call_count)
+        self.assertTrue(self.wrapper.is_mounted(partition))
+        self.assertFalse(self.wrapper.is_mounted(self.BACKUPSET.partitions[1]))
+        self.assertTrue('1' in self.wrapper.mount_latency)
+
+    def test_mount_only_mounts_pending_partitions(self, exec_class, path_mock, *mocks):
+        exec_class.return_value.run.return_value = 0
+        self.wrapper.mount_partition(self.BACKUPSET.partitions[0])
+        self.wrapper.mount()
+        self.assertEqual(2, exec_class.call_count)
+        self.assertTrue(self.wrapper.mounted)
+
+    def test_symlink_is_created_natively(self, exec_class, path_mock, create_dir, symlink_mock, *mocks):
+        exec_class.return_value.run.return_value = 0
+        path_mock.islink.return_value = False
+        self.wrapper.mount_partition(self.BACKUPSET.partitions[0])
+        symlink_mock.assert_called_with('/backup/sdxx/sqfs_mnt/part1/part1.img', '/backup/sdxx/part1.img')
+
+    def test_mount_raises_on_missing_backup_dir(self, exec_class, path_mock, *mocks):
+        path_mock.exists.return_value = False
+        with self.assertRaises(MountException):
+            self.wrapper.mount_partition(self.BACKUPSET.partitions[0])
+        self.assertFalse(self.wrapper.mounted)
+
+    def test_mount_raises_on_failed_mount(self, exec_class, path_mock, *mocks):
+        exec_class.return_value.run.return_value = 32
+        with self.assertRaises(MountException):
+            self.wrapper.mount_partition(self.BACKUPSET.partitions[0])
+        self.assertFalse(self.wrapper.mounted)
+
+    def test_umount_releases_each_mount(self, exec_class, path_mock, *mocks):
+        exec_class.return_value.run.return_value = 0
+        self.wrapper.mount()
+        exec_class.reset_mock()
+        self.wrapper.umount()
+        commands = [call[0][0] for call in exec_class.call_args_list]
+        self.assertEqual([['umount', '/backup/sdxx/sqfs_mnt/part1'],
+                          ['umount', '/backup/sdxx/sqfs_mnt/part2']], sorted(commands))
+        self.assertFalse(self.wrapper.mounted)
@@ -0,0 +1,148 @@
+import os
+import signal
+import time
+import unittest
+from threading import Event, Lock, Thread
+from unittest.mock import patch
+from src.core.supervisor import _JobSupervisor
+
+
+class FakeController:
+    """
+    Controller running the given function on a thread, the way ProcessController does. It is pickled
+    into the worker process, so the function has to be defined at the module level.
+    """
+
+    def __init__(self, backup_id, target):
+        self.backup_id = backup_id
+        self.target = target
+        self._status = {'id': backup_id, 'status': ''}
+        self._thread = None
+        self._killed = Event()
+
+    def run(self):
+        self._status['status'] = 'running'
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        self.target(self)
+        self._status['status'] = 'error' if self._killed.is_set() else 'finished'
+
+    def __getstate__(self):
+        return {'backup_id': self.backup_id, 'target': self.target, '_status': self._status}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _thread=None, _killed=Event())
+
+    def get_status(self):
+        return dict(self._status, pid=os.getpid())
+
+    def get_trace(self):
+        return {'traceEvents': []}
+
+    def kill(self):
+        self._killed.set()
+
+    def interrupt(self):
+        self._status['interrupted'] = True
+        self._killed.set()
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+def sleep_briefly(controller):
+    time.sleep(0.1)
+
+
+def sleep_long(controller):
+    time.sleep(30)
+
+
+def wait_for_kill(controller):
+    controller._killed.wait(10)
+
+
+def do_nothing(controller):
+    pass
+
+
+def crash(controller):
+    os._exit(3)
+
+
+_held_lock = Lock()
+
+
+def take_held_lock(controller):
+    if not _held_lock.acquire(timeout=1):
+        os._exit(4)
+
+
+def wait_for_status(worker, status, timeout=10):
+    deadline = time.monotonic() + timeout
+    while worker.get_status()['status'] != status and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return worker.get_status()
+
+
+@patch('src.core.supervisor.constants.JOB_STATUS_INTERVAL', 0.05)
+class JobSupervisorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = _JobSupervisor(max_workers=1)
+
+    def test_job_runs_in_worker_process(self):
+        worker = self.supervisor.submit(FakeController('job1', sleep_briefly))
+        status = wait_for_status(worker, 'finished')
+        self.assertEqual('finished', status['status'])
+        self.assertNotEqual(os.getpid(), status['pid'])
+        self.assertEqual({'traceEvents': []}, worker.get_trace())
+
+    def test_worker_does_not_inherit_locks_held_by_other_threads(self):
+        with _held_lock:
+            worker = self.supervisor.submit(FakeController('job1', take_held_lock))
+            self.assertEqual('finished', wait_for_status(worker, 'finished')['status'])
+
+    def test_jobs_above_limit_are_queued_and_cancelled(self):
+        blocker = self.supervisor.submit(FakeController('job1', wait_for_kill))
+        queued = self.supervisor.submit(FakeController('job2', do_nothing))
+        self.assertEqual('running', wait_for_status(blocker, 'running')['status'])
+        self.assertEqual('pending', queued.get_status()['status'])
+        queued.kill()
+        self.assertEqual('Job cancelled by the user.', queued.get_status()['error_msg'])
+        blocker.kill()
+        self.assertEqual('error', wait_for_status(blocker, 'error')['status'])
+        blocker.process.join(10)
+        self.assertIsNotNone(blocker.process.exitcode)
+
+    @patch('src.core.supervisor.constants.JOB_KILL_TIMEOUT', 0.1)
+    def test_stuck_job_is_killed(self):
+        worker = self.supervisor.submit(FakeController('job1', sleep_long))
+        wait_for_status(worker, 'running')
+        worker.kill()
+        status = wait_for_status(worker, 'error')
+        self.assertEqual('Job cancelled by the user.', status['error_msg'])
+
+    def test_terminated_worker_interrupts_job(self):
+        worker = self.supervisor.submit(FakeController('job1', wait_for_kill))
+        wait_for_status(worker, 'running')
+        os.kill(worker.process.pid, signal.SIGTERM)
+        status = wait_for_status(worker, 'error')
+        self.assertTrue(status['interrupted'])
+
+    def test_crashed_worker_reports_error(self):
+        worker = self.supervisor.submit(FakeController('job1', crash))
+        status = wait_for_status(worker, 'error')
+        self.assertIn('exited unexpectedly (code: 3)', status['error_msg'])
+
+    def test_batch_is_run_in_submission_order(self):
+        workers = self.supervisor.submit_all([FakeController('job' + str(i), sleep_briefly)
+                                              for i in range(3)])
+        self.assertEqual(['job0', 'job1', 'job2'], [worker.backup_id for worker in workers])
+        self.assertEqual('running', wait_for_status(workers[0], 'running')['status'])
+        self.assertEqual(['pending', 'pending'], [worker.get_status()['status'] for worker in workers[1:]])
+        for worker in workers:
+            self.assertEqual('finished', wait_for_status(worker, 'finished')['status'])
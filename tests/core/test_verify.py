@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.core.discard import PartcloneBitmap
+from src.core.verify import BlockVerifier, FileImage, SequentialImage, UsedBlocks, get_confidence, get_sample_size
+from tests.core.test_discard import partclone_header
+
+BLOCK_SIZE = 512
+# Blocks 0-5 and 10-15 used, 6-9 free
+BITMAP = bytes([0b00111111, 0b11111100])
+
+
+def build_image(device_blocks):
+    """Builds a partclone image of the used blocks of the device with a 4 byte checksum after
+    every 4 blocks, as partclone stores them."""
+    image = partclone_header(16, 12, block_size=BLOCK_SIZE, blocks_per_checksum=4) + BITMAP + b'CRC!'
+    used = [block for block in range(16) if block < 6 or block >= 10]
+    for rank, block in enumerate(used):
+        image += device_blocks[block]
+        if rank % 4 == 3:
+            image += b'SUM!'
+    return image
+
+
+class VerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.blocks = [os.urandom(BLOCK_SIZE) for _ in range(16)]
+        self.device = self.directory.name + '/device'
+        with open(self.device, 'wb') as device:
+            device.write(b''.join(self.blocks))
+        self.image_path = self.directory.name + '/part1.img'
+        with open(self.image_path, 'wb') as image:
+            image.write(build_image(self.blocks))
+        self.bitmap = PartcloneBitmap(partclone_header(16, 12, block_size=BLOCK_SIZE, blocks_per_checksum=4))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _corrupt(self, block):
+        with open(self.device, 'r+b') as device:
+            device.seek(block * BLOCK_SIZE)
+            device.write(b'\x00' * BLOCK_SIZE)
+
+    def test_sample_size_reaches_confidence(self):
+        self.assertEqual(4603, get_sample_size(10 ** 9, 0.99, 0.001))
+        self.assertEqual(100, get_sample_size(100, 0.99, 0.001))
+        self.assertEqual(0, get_sample_size(0, 0.99))
+        self.assertGreaterEqual(get_confidence(4603, 10 ** 9, 0.001), 0.99)
+        self.assertEqual(1.0, get_confidence(100, 100))
+
+    def test_used_blocks_are_located_in_image(self):
+        used_blocks = UsedBlocks(self.bitmap, BITMAP)
+        self.assertEqual(12, used_blocks.count)
+        self.assertEqual([5, 10, 15], [used_blocks.block(rank) for rank in (5, 6, 11)])
+        self.assertEqual(self.bitmap.data_offset + 6 * BLOCK_SIZE + 4, self.bitmap.image_offset(6))
+        with open(self.image_path, 'rb') as image:
+            image.seek(self.bitmap.image_offset(6))
+            self.assertEqual(self.blocks[10], image.read(BLOCK_SIZE))
+
+    def test_segments_do_not_cross_checksums(self):
+        segments = list(UsedBlocks(self.bitmap, BITMAP).segments(3))
+        self.assertEqual([(0, 0, 3), (3, 3, 1), (4, 4, 2), (6, 10, 2), (8, 12, 3), (11, 15, 1)], segments)
+
+    def test_sequential_image_skips_to_offsets(self):
+        data = os.urandom(10000)
+        image = SequentialImage(iter([data[i:i + 1000] for i in range(0, 10000, 1000)]))
+        self.assertEqual(data[1500:1700], image.read(1500, 200))
+        self.assertEqual(data[1600:4100], image.read(1600, 2500))
+        self.assertEqual(data[9900:], image.read(9900, 500))
+
+    @patch('src.core.verify.constants.VERIFY_READ_SIZE', 4 * BLOCK_SIZE)
+    @patch('src.core.verify.constants.VERIFY_BATCH_SIZE', 2)
+    def test_full_verification_finds_mismatches(self):
+        self._corrupt(12)
+        image = FileImage(self.image_path)
+        report = BlockVerifier(self.device, UsedBlocks(self.bitmap, BITMAP), image, workers=2).verify('full')
+        image.close()
+        self.assertEqual(12, report['checked_blocks'])
+        self.assertEqual(1, report['mismatched_blocks'])
+        self.assertEqual([{'block': 12, 'offset': 12 * BLOCK_SIZE}], report['mismatches'])
+        self.assertEqual(1.0, report['confidence'])
+
+    def test_sampled_verification_of_stream(self):
+        with open(self.image_path, 'rb') as file:
+            image = SequentialImage(iter(lambda: file.read(700), b''))
+            report = BlockVerifier(self.device, UsedBlocks(self.bitmap, BITMAP), image).verify('sample', 0.5)
+        self.assertEqual('sample', report['mode'])
+        self.assertEqual(12, report['used_blocks'])
+        self.assertEqual(get_sample_size(12, 0.5), report['checked_blocks'])
+        self.assertEqual(0, report['mismatched_blocks'])
+
+
+if __name__ == '__main__':
+    unittest.main()
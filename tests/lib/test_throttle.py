@@ -0,0 +1,29 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from src.lib.throttle import TokenBucket
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_unlimited_bucket_does_not_wait(self):
+        bucket = TokenBucket(0)
+        self.assertEqual(0, bucket.consume(1 << 30))
+
+    def test_burst_is_allowed_up_to_capacity(self):
+        bucket = TokenBucket(1000, 5000)
+        start = monotonic()
+        bucket.consume(5000)
+        self.assertLess(monotonic() - start, 0.1)
+
+    def test_rate_is_shared_by_consumers(self):
+        bucket = TokenBucket(1000000, 10000)
+        start = monotonic()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: [bucket.consume(10000) for _ in range(10)], range(4)))
+        # 400 kB at 1 MB/s with 10 kB of burst
+        self.assertGreaterEqual(monotonic() - start, 0.38)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import pickle
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from src.lib import tracing
+
+
+class TracingTest(unittest.TestCase):
+
+    def test_spans_are_recorded_only_when_active(self):
+        trace = tracing.Trace('job')
+        with tracing.span('ignored'):
+            pass
+        with tracing.activate(trace):
+            with tracing.span('outer', 'controller', disk='sda'):
+                with tracing.span('inner'):
+                    pass
+        events = trace.to_chrome_trace()['traceEvents']
+        self.assertEqual(['inner', 'outer'], [event['name'] for event in events])
+        self.assertEqual({'disk': 'sda'}, events[1]['args'])
+        self.assertEqual('X', events[1]['ph'])
+        self.assertIsNone(tracing.current_trace())
+
+    def test_failed_span_records_error(self):
+        trace = tracing.Trace('job')
+
+        @tracing.traced('failing', 'db')
+        def failing():
+            raise ValueError('broken')
+
+        with tracing.activate(trace):
+            self.assertRaises(ValueError, failing)
+        event = trace.to_chrome_trace()['traceEvents'][0]
+        self.assertEqual(('failing', 'db', 'broken'), (event['name'], event['cat'], event['args']['error']))
+
+    def test_bound_function_records_on_other_thread(self):
+        trace = tracing.Trace('job')
+
+        @tracing.traced()
+        def work():
+            return 1
+
+        with tracing.activate(trace), ThreadPoolExecutor(2) as executor:
+            bound = tracing.bind(work)
+            self.assertEqual([1, 1], [executor.submit(bound).result() for _ in range(2)])
+            self.assertEqual(1, executor.submit(work).result())
+        self.assertEqual(2, len(trace.to_chrome_trace()['traceEvents']))
+
+    def test_trace_is_recorded_after_pickling(self):
+        trace = tracing.Trace('job')
+        with tracing.activate(trace), tracing.span('prepare'):
+            pass
+        trace = pickle.loads(pickle.dumps(trace))
+        with tracing.activate(trace), tracing.span('run'):
+            pass
+        self.assertEqual(['prepare', 'run'], [event['name'] for event in trace.to_chrome_trace()['traceEvents']])
@@ -0,0 +1,66 @@
+import unittest
+from src.monitoring.history import MetricHistory, _RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_samples_within_step_are_averaged(self):
+        buffer = _RingBuffer(10, 5)
+        for timestamp, value in [(100, 1), (105, 3), (110, 10)]:
+            buffer.add(timestamp, value)
+        self.assertEqual([[100.0, 2.0]], buffer.query(0))
+
+    def test_buffer_keeps_only_latest_points(self):
+        buffer = _RingBuffer(1, 3)
+        for timestamp in range(10):
+            buffer.add(timestamp, timestamp)
+        self.assertEqual([[6.0, 6.0], [7.0, 7.0], [8.0, 8.0]], buffer.query(0))
+        self.assertEqual([[8.0, 8.0]], buffer.query(7))
+        self.assertFalse(buffer.covers(5))
+        self.assertTrue(buffer.covers(6))
+
+
+class MetricHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.history = MetricHistory([(10, 6), (1, 5)])
+
+    def test_nested_metrics_are_flattened(self):
+        self.history.record(0, {'CPU': 5, 'Disk_IO': {'sda': {'iops': 2}}, 'flag': True})
+        self.history.record(1, {'CPU': 7, 'Disk_IO': {'sda': {'iops': 4}}})
+        self.history.record(10, {'CPU': 7, 'Disk_IO': {'sda': {'iops': 4}}})
+        result = self.history.query(-1)
+        self.assertEqual({'CPU', 'Disk_IO.sda.iops'}, set(result['metrics'].keys()))
+        self.assertEqual([[0.0, 3.0]], self.history.query(-1, 10)['metrics']['Disk_IO.sda.iops'])
+
+    def test_query_selects_resolution(self):
+        for timestamp in range(30):
+            self.history.record(timestamp, {'CPU': timestamp})
+        self.assertEqual(1, self.history.query(25)['step'])
+        self.assertEqual([[26.0, 26.0], [27.0, 27.0], [28.0, 28.0]],
+                         self.history.query(25)['metrics']['CPU'])
+        self.assertEqual(10, self.history.query(5)['step'])
+        self.assertEqual(10, self.history.query(25, 5)['step'])
+
+    def test_single_resolution_is_used_for_all_metrics(self):
+        for timestamp in range(30):
+            self.history.record(timestamp, {'CPU': timestamp})
+        self.history.record(30, {'CPU': 30, 'Memory': 1})
+        result = self.history.query(19)
+        self.assertEqual(10, result['step'])
+        self.assertEqual([[20.0, 24.5]], result['metrics']['CPU'])
+
+    def test_idle_metrics_are_evicted(self):
+        history = MetricHistory([(1, 5)], idle_timeout=10)
+        history.record(0, {'Disk_IO': {'loop0': {'iops': 1}, 'sda': {'iops': 1}}})
+        history.record(5, {'Disk_IO': {'sda': {'iops': 1}}})
+        self.assertIn('Disk_IO.loop0.iops', history.query(-1)['metrics'])
+        history.record(11, {'Disk_IO': {'sda': {'iops': 1}}})
+        self.assertEqual({'Disk_IO.sda.iops'}, set(history.query(-1)['metrics'].keys()))
+
+    def test_number_of_metrics_is_limited(self):
+        history = MetricHistory([(1, 5)], idle_timeout=10, max_keys=2)
+        history.record(0, {'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(2, len(history.query(-1)['metrics']))
+        history.record(20, {'c': 3})
+        self.assertEqual({'c'}, set(history.query(-1)['metrics'].keys()))
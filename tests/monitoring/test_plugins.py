@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import Mock, patch
+from src.monitoring.plugins import DiskIOStatsPlugin, DiskIOUtilisationPlugin, _parse_diskstats
+
+
+class DiskIOStatsPluginTest(unittest.TestCase):
+    SAMPLE = ('   8       0 sda 100 0 2048 50 200 0 4096 150 0 400 200 0 0 0 0\n'
+              '   8       1 sda1 10 0 20 5 20 0 40 15 0 40 20 0 0 0 0\n')
+    NEXT_SAMPLE = ('   8       0 sda 200 0 4096 150 300 0 8192 250 1 900 300 0 0 0 0\n'
+                   '   8      16 sdb 5 0 10 5 0 0 0 0 0 5 5 0 0 0 0\n'
+                   '   8       1 sda1 10 0 20 5 20 0 40 15 0 40 20 0 0 0 0\n')
+
+    def setUp(self):
+        self.plugin = DiskIOStatsPlugin.__new__(DiskIOStatsPlugin)
+
+    def test_parse_diskstats(self):
+        names, counters = _parse_diskstats(self.SAMPLE + 'invalid line\n')
+        self.assertEqual(['sda', 'sda1'], names)
+        self.assertEqual([100, 2048, 50, 200, 4096, 150, 400], counters[0].tolist())
+
+    @patch('src.monitoring.plugins.open', create=True)
+    def test_first_collection_has_no_rates(self, open_mock):
+        open_mock.return_value.__enter__.return_value.read.return_value = self.SAMPLE
+        plugin = DiskIOStatsPlugin()
+        self.assertEqual({}, plugin.collect())
+        open_mock.return_value.__enter__.return_value.read.return_value = self.NEXT_SAMPLE
+        self.assertEqual({'sda', 'sda1'}, set(plugin.collect().keys()))
+
+    def test_compute_rates(self):
+        metrics = self.plugin._compute_rates(_parse_diskstats(self.SAMPLE),
+                                             _parse_diskstats(self.NEXT_SAMPLE), 1.0)
+        self.assertEqual({'sda', 'sda1'}, set(metrics.keys()))
+        self.assertEqual({'utilisation': 50.0, 'read_mbps': 1.0, 'write_mbps': 2.0,
+                          'iops': 200.0, 'latency': 1.0}, metrics['sda'])
+        self.assertEqual(0.0, metrics['sda1']['latency'])
+        self.assertEqual(0.0, metrics['sda1']['iops'])
+
+    def test_device_with_reset_counters_is_skipped(self):
+        reset = self.NEXT_SAMPLE.replace('sda1 10 0 20 5 20 0 40 15 0 40 20', 'sda1 1 0 2 1 2 0 4 1 0 4 2')
+        metrics = self.plugin._compute_rates(_parse_diskstats(self.SAMPLE), _parse_diskstats(reset), 1.0)
+        self.assertEqual({'sda'}, set(metrics.keys()))
+        self.assertEqual(1.0, metrics['sda']['read_mbps'])
+
+    def test_utilisation_is_capped(self):
+        metrics = self.plugin._compute_rates(_parse_diskstats(self.SAMPLE),
+                                             _parse_diskstats(self.NEXT_SAMPLE), 0.1)
+        self.assertEqual(100.0, metrics['sda']['utilisation'])
+
+    def test_utilisation_plugin_reads_backup_disk(self):
+        stats = Mock()
+        stats.value = {'sda': {'utilisation': 12.5}}
+        stats.interval = 1
+        plugin = DiskIOUtilisationPlugin(stats)
+        plugin.disk = 'sda'
+        self.assertEqual(12.5, plugin.collect())
+        plugin.disk = 'sdz'
+        self.assertEqual(0.0, plugin.collect())
+        self.assertEqual(0.0, plugin.value)
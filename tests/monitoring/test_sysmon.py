@@ -0,0 +1,80 @@
+import unittest
+from unittest.mock import Mock
+from src.monitoring.sysmon import MetricPlugin, SystemMonitor, _TimerWheel
+
+
+class _CounterPlugin(MetricPlugin):
+    NAME = 'Counter'
+
+    def _collect_metric(self):
+        return self._value + 1
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wheel = _TimerWheel(1, 4)
+
+    def advance(self, ticks):
+        for _ in range(ticks):
+            self.wheel._advance()
+
+    def test_task_runs_at_its_interval(self):
+        callback = Mock()
+        self.wheel.schedule(3, callback)
+        self.advance(1)
+        self.assertEqual(1, callback.call_count)
+        self.advance(3)
+        self.assertEqual(2, callback.call_count)
+        self.advance(2)
+        self.assertEqual(2, callback.call_count)
+
+    def test_task_longer_than_wheel_rotation(self):
+        callback = Mock()
+        self.wheel.schedule(10, callback)
+        self.advance(10)
+        self.assertEqual(1, callback.call_count)
+        self.advance(1)
+        self.assertEqual(2, callback.call_count)
+
+    def test_cancelled_task_does_not_run(self):
+        callback = Mock()
+        task = self.wheel.schedule(1, callback)
+        self.advance(1)
+        self.wheel.cancel(task)
+        self.advance(5)
+        self.assertEqual(1, callback.call_count)
+
+    def test_failing_task_is_rescheduled(self):
+        callback = Mock(side_effect=Exception('failure'))
+        self.wheel.schedule(1, callback)
+        self.advance(2)
+        self.assertEqual(2, callback.call_count)
+
+
+class SystemMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor = SystemMonitor()
+        self.plugin = _CounterPlugin(interval=SystemMonitor.SCHEDULER_TICK)
+        self.monitor.add_plugin(self.plugin)
+
+    def test_metrics_are_published_by_scheduler(self):
+        self.assertEqual({}, self.monitor.get_metrics())
+        self.monitor._scheduler._advance()
+        self.assertEqual({'Counter': 1}, self.monitor.get_metrics())
+        self.monitor._scheduler._advance()
+        self.assertEqual({'Counter': 2}, self.monitor.get_metrics())
+
+    def test_collection_cost_is_recorded(self):
+        self.monitor._scheduler._advance()
+        stats = self.monitor.get_collection_stats()['Counter']
+        self.assertEqual(1, stats['runs'])
+        self.assertEqual(0, stats['errors'])
+        self.assertTrue('average_ms' in stats)
+
+    def test_removed_plugin_is_not_published(self):
+        self.monitor._scheduler._advance()
+        self.monitor.remove_plugin(self.plugin)
+        self.monitor._scheduler._advance()
+        self.assertEqual({}, self.monitor.get_metrics())
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from pymongo.errors import ServerSelectionTimeoutError
+from src.core.backupset import Backupset
+import src.services.catalog as catalog
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for index in range(20):
+            backupset = Backupset('backup' + str(index))
+            backupset.backup_path = self.directory.name + '/' + backupset.id + '/'
+            os.mkdir(backupset.backup_path)
+            backupset.write_manifest()
+        os.mkdir(self.directory.name + '/without_manifest')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_scan_manifests(self):
+        backupsets = catalog.scan_manifests(self.directory.name, workers=4)
+        self.assertEqual(sorted('backup' + str(index) for index in range(20)),
+                         sorted(backupset.id for backupset in backupsets))
+
+    @patch('src.services.catalog.NodeUsage')
+    @patch('src.services.catalog.DB')
+    def test_rebuild_catalog(self, db_mock, usage_mock):
+        self.assertEqual(20, catalog.rebuild_catalog(self.directory.name))
+        usage_mock.recalculate.assert_called_once_with()
+        imported = db_mock.upsert_backups.call_args[0][0]
+        self.assertEqual(20, len(imported))
+        self.assertIn('partitions', imported[0])
+
+    @patch('src.services.catalog.ConfigHelper')
+    @patch('src.services.catalog.DB')
+    def test_list_backups_without_database(self, db_mock, config_mock):
+        db_mock.get_node_backups.side_effect = ServerSelectionTimeoutError('unreachable')
+        node = Backupset('backup0').node
+        config_mock.config = {'node': {'name': node, 'backup_path': self.directory.name}}
+        self.assertEqual(20, len(catalog.list_backups()))
+
+    @patch('src.services.catalog.ConfigHelper')
+    @patch('src.services.catalog.DB')
+    def test_find_backups_pages_manifests_without_database(self, db_mock, config_mock):
+        db_mock.find_backups.side_effect = ServerSelectionTimeoutError('unreachable')
+        config_mock.config = {'node': {'backup_path': self.directory.name}}
+        listed = []
+        after = None
+        while True:
+            page, source = catalog.find_backups({}, after=after, limit=8)
+            self.assertEqual('manifest', source)
+            listed.extend(backupset.id for backupset in page)
+            if len(page) < 8:
+                break
+            after = (page[-1].creation_date, page[-1].id)
+        self.assertEqual(sorted('backup' + str(index) for index in range(20)), sorted(listed))
+
+    @patch('src.services.catalog.DB')
+    def test_find_backups_from_database(self, db_mock):
+        db_mock.find_backups.return_value = [{'id': 'backup1', 'status': 'finished'}]
+        page, source = catalog.find_backups({'status': 'finished'}, ['status'], None, 10)
+        self.assertEqual('database', source)
+        self.assertEqual({'id': 'backup1', 'status': 'finished'}, page[0].to_dict(['id', 'status']))
+        db_mock.find_backups.assert_called_once_with({'status': 'finished'}, ['status'], None, 10)
@@ -0,0 +1,41 @@
+import unittest
+from unittest.mock import MagicMock, call, patch
+from src.services.database import MongoDB
+
+
+class MongoDBTest(unittest.TestCase):
+
+    @patch('src.services.database.MongoConnector')
+    def test_zombie_backups_with_checkpoint_are_left_running(self, connector_class):
+        db = connector_class.return_value.__enter__.return_value
+        db.job.find.return_value = [{'id': 'interrupted'}]
+        MongoDB(MagicMock()).remove_zombie_backups()
+        query, update = db.backup.update.call_args[0]
+        self.assertEqual({'$nin': ['interrupted']}, query['id'])
+        self.assertEqual('running', query['status'])
+        self.assertEqual({'$set': {'status': 'error'}}, update)
+
+    @patch('src.services.database.MongoConnector')
+    def test_single_zombie_backup_is_failed_despite_its_checkpoint(self, connector_class):
+        db = connector_class.return_value.__enter__.return_value
+        MongoDB(MagicMock()).remove_zombie_backups('interrupted')
+        query, update = db.backup.update.call_args[0]
+        self.assertEqual('interrupted', query['id'])
+        self.assertEqual('running', query['status'])
+        db.job.find.assert_not_called()
+
+    @patch('src.services.database.MongoConnector')
+    def test_scrubs_are_matched_by_node_name_with_dots(self, connector_class):
+        db = connector_class.return_value.__enter__.return_value
+        database = MongoDB(MagicMock())
+        database.set_backup_scrub('backup1', 'node.example.com', {'status': 'ok'})
+        self.assertEqual([call({'id': 'backup1'}, {'$pull': {'scrubs': {'node': 'node.example.com'}}}),
+                          call({'id': 'backup1'}, {'$push': {'scrubs': {'status': 'ok', 'node': 'node.example.com'}}})],
+                         db.backup.update_one.call_args_list)
+        database.get_scrub_failures('node.example.com')
+        query = db.backup.find.call_args[0][0]
+        self.assertEqual({'$elemMatch': {'node': 'node.example.com', 'status': 'mismatch'}}, query['scrubs'])
+        database.get_backups_to_scrub('node.example.com', 'date')
+        match = db.backup.aggregate.call_args[0][0][0]['$match']
+        self.assertEqual({'$not': {'$elemMatch': {'node': 'node.example.com', 'date': {'$gte': 'date'}}}},
+                         match['scrubs'])
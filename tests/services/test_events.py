@@ -0,0 +1,53 @@
+import unittest
+from src.services.events import Subscription, _StatusBroker, _diff, _merge
+
+
+class DiffTest(unittest.TestCase):
+
+    def test_only_changed_fields_are_reported(self):
+        old = {'status': 'running', 'partitions': [1], 'resources': {'cpu': 1, 'rss': 2}, 'gone': 1}
+        new = {'status': 'running', 'partitions': [1, 2], 'resources': {'cpu': 1, 'rss': 3}}
+        self.assertEqual({'partitions': [1, 2], 'resources': {'rss': 3}, 'gone': None}, _diff(old, new))
+        self.assertEqual({}, _diff(new, new))
+
+    def test_merge_keeps_latest_values(self):
+        self.assertEqual({'a': {'b': 2, 'c': 3}, 'd': 4},
+                         _merge({'a': {'b': 1, 'c': 3}}, {'a': {'b': 2}, 'd': 4}))
+        self.assertIsNone(_merge({'a': 1}, None))
+        self.assertEqual({'a': 1}, _merge(None, {'a': 1}))
+
+
+class StatusBrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = _StatusBroker(interval=60, heartbeat=1)
+        self.status = {'status': 'running', 'completed': 1.0}
+        self.broker.register('job', 'job1', lambda: self.status)
+
+    def test_slow_subscriber_receives_merged_changes(self):
+        subscription = self.broker.subscribe('job')
+        feed = self.broker._feeds[('job', 'job1')]
+        feed.poll()
+        self.status = {'status': 'running', 'completed': 2.0}
+        feed.poll()
+        self.status = {'status': 'finished', 'completed': 3.0}
+        feed.poll()
+        self.assertEqual({'job1': {'status': 'finished', 'completed': 3.0}}, subscription.get(0))
+        self.assertIsNone(subscription.get(0))
+        self.broker.unsubscribe(subscription)
+
+    def test_new_subscriber_receives_current_state(self):
+        first = self.broker.subscribe('job', 'job1')
+        self.broker._feeds[('job', 'job1')].poll()
+        second = self.broker.subscribe('job', 'job1')
+        self.assertEqual({'job1': self.status}, second.get(0))
+        self.broker.unregister('job', 'job1')
+        self.assertEqual({'job1': None}, second.get(0))
+        self.broker.unsubscribe(first)
+        self.broker.unsubscribe(second)
+
+    def test_subscription_filters_statuses(self):
+        subscription = Subscription('job', 'job1')
+        self.assertTrue(subscription.accepts('job', 'job1'))
+        self.assertFalse(subscription.accepts('job', 'job2'))
+        self.assertFalse(subscription.accepts('mount', 'job1'))
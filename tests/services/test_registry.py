@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from src.services.registry import LocalRegistry, SharedRegistry, start_registry_server
+
+
+class LocalRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = LocalRegistry()
+
+    def test_records_are_unique_per_kind(self):
+        self.assertTrue(self.registry.add('job', 'a', {'status': {}}))
+        self.assertFalse(self.registry.add('job', 'a', {'status': {}}))
+        self.assertTrue(self.registry.add('mount', 'a', {'status': {}}))
+        self.assertEqual(['a'], list(self.registry.items('job').keys()))
+
+    def test_update_returns_copy_of_record(self):
+        self.registry.add('job', 'a', {'cancel': False})
+        record = self.registry.update('job', 'a', {'cancel': True})
+        record['cancel'] = False
+        self.assertTrue(self.registry.get('job', 'a')['cancel'])
+        self.assertIsNone(self.registry.update('job', 'b', {'cancel': True}))
+
+    def test_old_finished_records_are_evicted(self):
+        with patch('src.services.registry.time', return_value=1000):
+            self.registry.add('job', 'old', {'finished': 100})
+            self.registry.add('job', 'new', {'finished': 950})
+            self.registry.add('job', 'running', {'finished': None})
+            self.assertEqual(['old'], self.registry.evict('job', 100, 30))
+        self.assertEqual({'new', 'running'}, set(self.registry.items('job').keys()))
+
+    def test_stale_records_are_marked_as_failed(self):
+        with patch('src.services.registry.time', return_value=1000):
+            self.registry.add('job', 'lost', {'finished': None, 'status': {'status': 'running'}})
+        with patch('src.services.registry.time', return_value=1100):
+            self.assertEqual([], self.registry.evict('job', 100, 30))
+        record = self.registry.get('job', 'lost')
+        self.assertEqual(1100, record['finished'])
+        self.assertEqual('error', record['status']['status'])
+
+
+class SharedRegistryTest(unittest.TestCase):
+
+    def test_records_are_shared_between_clients(self):
+        address = os.path.join(tempfile.mkdtemp(), 'registry.sock')
+        manager = start_registry_server(address)
+        try:
+            first, second = SharedRegistry(address), SharedRegistry(address)
+            self.assertTrue(first.add('job', 'a', {'status': {'status': 'running'}}))
+            self.assertFalse(second.add('job', 'a', {}))
+            second.update('job', 'a', {'cancel': True})
+            self.assertTrue(first.get('job', 'a')['cancel'])
+            self.assertIsNotNone(first.remove('job', 'a'))
+            self.assertEqual({}, second.items('job'))
+        finally:
+            manager.shutdown()
+
+    def test_monitor_is_shared_between_clients(self):
+        address = os.path.join(tempfile.mkdtemp(), 'registry.sock')
+        with patch('src.services.registry.create_node_monitor', _StubMonitor):
+            manager = start_registry_server(address)
+        try:
+            first, second = SharedRegistry(address).get_monitor(), SharedRegistry(address).get_monitor()
+            self.assertEqual({'CPU_Utilisation': 12.5}, first.get_metrics())
+            self.assertEqual({'monitors': 1, 'started': True}, second.get_collection_stats())
+        finally:
+            manager.shutdown()
+
+
+class _StubMonitor:
+    created = 0
+
+    def __init__(self):
+        _StubMonitor.created += 1
+        self.started = False
+
+    def start(self):
+        self.started = True
+
+    def get_metrics(self):
+        return {'CPU_Utilisation': 12.5}
+
+    def get_history(self, since, step=None):
+        return None
+
+    def get_collection_stats(self):
+        return {'monitors': _StubMonitor.created, 'started': self.started}
@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+from src.services.utils import check_backup_removable, get_allocated_size, get_directory_allocated_size
+
+
+class AllocatedSizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sparse_file = os.path.join(self.directory.name, 'sparse.img')
+        with open(self.sparse_file, 'wb') as sparse:
+            sparse.truncate(64 * 1048576)
+            sparse.write(b'x' * 4096)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_sparse_file_counts_allocated_blocks(self):
+        self.assertLess(get_allocated_size(self.sparse_file), os.path.getsize(self.sparse_file))
+
+    def test_missing_file_has_no_size(self):
+        self.assertEqual(0, get_allocated_size(os.path.join(self.directory.name, 'missing.img')))
+
+    def test_directory_does_not_follow_symlinks(self):
+        os.symlink(self.sparse_file, os.path.join(self.directory.name, 'link.img'))
+        os.mkdir(os.path.join(self.directory.name, 'nested'))
+        self.assertLess(get_directory_allocated_size(self.directory.name), 2 * 1048576)
+        self.assertGreaterEqual(get_directory_allocated_size(self.directory.name),
+                                get_allocated_size(self.sparse_file))
+
+
+class BackupRemovalTest(unittest.TestCase):
+
+    def test_only_deleted_backups_of_this_node_can_be_removed(self):
+        check_backup_removable(Mock(deleted=True, node='Localhost'))
+        with self.assertRaisesRegex(Exception, 'must be marked as ready for deletion'):
+            check_backup_removable(Mock(deleted=False, node='Localhost'))
+        with self.assertRaisesRegex(Exception, 'Please use node: node2'):
+            check_backup_removable(Mock(deleted=True, node='node2'))